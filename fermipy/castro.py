@@ -12,6 +12,7 @@ index, or the mass and cross-section of a putative dark matter
 particle.
 """
 from __future__ import absolute_import, division, print_function
+import itertools
 import numpy as np
 import scipy
 from scipy import stats
@@ -27,6 +28,7 @@ from fermipy.spectrum import SpectralFunction, SEDFunctor
 from fermipy.utils import onesided_cl_to_dlnl
 from fermipy.utils import twosided_cl_to_dlnl
 from fermipy.utils import load_yaml
+from fermipy.worker_pool import WorkerPool
 
 PAR_NAMES = {
     "PowerLaw": ["Prefactor", "Index"],
@@ -145,6 +147,165 @@ class Interpolator(object):
         return y
 
 
+class InterpolatorArray(object):
+    """Vectorized version of `Interpolator` for a set of 1-D
+    functions that are tabulated on an N x M grid where N is the
+    number of functions and M is the number of tabulated values.
+
+    The tables of all functions are stored in contiguous 2-D arrays
+    such that all functions can be evaluated with a single call.
+    Interpolation and extrapolation are linear and identical to
+    `Interpolator`.
+    """
+
+    def __init__(self, x, y):
+        """C'tor, takes N x M arrays of x and y values.  Non-finite y
+        values are dropped from each table."""
+
+        x = np.array(x, ndmin=2, dtype=float)
+        y = np.array(y, ndmin=2, dtype=float)
+
+        msk = np.isfinite(y)
+        npts = np.sum(msk, axis=1)
+        if np.any(npts == 0):
+            raise ValueError("Failed to build interpolate, empty axis.")
+
+        # Move valid values to the front of each row and pad the rows
+        # with the last valid value
+        idx = np.argsort(~msk, axis=1, kind='stable')
+        idx = np.where(np.arange(x.shape[1])[None, :] < npts[:, None], idx,
+                       np.take_along_axis(idx, npts[:, None] - 1, axis=1))
+        self._x = np.ascontiguousarray(np.take_along_axis(x, idx, axis=1))
+        self._y = np.ascontiguousarray(np.take_along_axis(y, idx, axis=1))
+        self._npts = npts
+
+        # Slopes of the linear segments.  Padding segments are never
+        # used in the evaluation.
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self._dydx = np.diff(self._y, axis=1) / np.diff(self._x, axis=1)
+
+    @classmethod
+    def create_from_interpolators(cls, interps):
+        """Create an object from a sequence of `Interpolator`
+        objects."""
+        nx = max([len(t.x) for t in interps])
+        x = np.array([np.pad(t.x, (0, nx - len(t.x)), mode='edge')
+                      for t in interps])
+        y = np.array([np.pad(t.y, (0, nx - len(t.y)), mode='edge')
+                      for t in interps])
+        o = cls(x, y)
+        o._npts = np.array([len(t.x) for t in interps])
+        return o
+
+    @property
+    def nfn(self):
+        """ return the number of functions """
+        return self._x.shape[0]
+
+    @property
+    def npts(self):
+        """ return the number of tabulated values of each function """
+        return self._npts
+
+    @property
+    def x(self):
+        """ return the N x M array of x values (rows are padded with
+        their last valid value) """
+        return self._x
+
+    @property
+    def y(self):
+        """ return the N x M array of y values (rows are padded with
+        their last valid value) """
+        return self._y
+
+    @property
+    def xmin(self):
+        return self._x[:, 0]
+
+    @property
+    def xmax(self):
+        return np.take_along_axis(self._x, self._npts[:, None] - 1,
+                                  axis=1)[:, 0]
+
+    def _table(self, v, idx, ndim):
+        if idx is not None:
+            v = v[idx]
+        return v.reshape(v.shape + (1,) * (ndim - 1))
+
+    def _segment(self, x, idx=None):
+        """Return the index of the linear segment of every function
+        used to evaluate the values ``x`` (an array with the function
+        index along the first dimension).  This follows the interval
+        convention of `scipy.interpolate.splev`.  Padding values are
+        equal to the last valid value of each row and only affect
+        indices that are clipped to the last segment."""
+        xt = self._table(self._x, idx, x.ndim)
+        npts = self._table(self._npts, idx, x.ndim)
+        iseg = np.sum(xt <= x[:, None], axis=1) - 1
+        return np.clip(iseg, 0, np.maximum(npts - 2, 0))
+
+    def _broadcast(self, x, idx=None):
+        x = np.array(x, dtype=float)
+        nfn = self.nfn if idx is None else len(idx)
+        if x.ndim == 0 or x.shape[0] != nfn:
+            x = x * np.ones((nfn,) + x.shape)
+        return x
+
+    def __call__(self, x, idx=None):
+        """Return the interpolated values of all functions.
+
+        Parameters
+        ----------
+        x : `~numpy.ndarray`
+           Array of input values.  The first dimension runs over the
+           functions.
+
+        idx : `~numpy.ndarray`
+           Indices of the functions to evaluate.  If None all
+           functions are evaluated.
+
+        Returns
+        -------
+        y : `~numpy.ndarray`
+           Array of interpolated values with the same shape as ``x``.
+        """
+        x = self._broadcast(x, idx)
+        iseg = self._segment(x, idx)
+        x0 = np.take_along_axis(self._table(self._x, idx, x.ndim),
+                                iseg[:, None], axis=1)[:, 0]
+        y0 = np.take_along_axis(self._table(self._y, idx, x.ndim),
+                                iseg[:, None], axis=1)[:, 0]
+        return y0 + (x - x0) * self._slopes(iseg, idx)
+
+    def _slopes(self, iseg, idx=None):
+        dydx = self._table(self._dydx, idx, iseg.ndim)
+        return np.take_along_axis(dydx, iseg[:, None], axis=1)[:, 0]
+
+    def derivative(self, x, der=1, idx=None):
+        """Return the derivatives of all functions.
+
+        Parameters
+        ----------
+        x : `~numpy.ndarray`
+           Array of input values.  The first dimension runs over the
+           functions.
+
+        der : int
+           Order of the derivative.
+
+        idx : `~numpy.ndarray`
+           Indices of the functions to evaluate.  If None all
+           functions are evaluated.
+        """
+        if der < 0 or der > 1:
+            raise ValueError("0<=der=%i<=k=1 must hold" % der)
+        x = self._broadcast(x, idx)
+        if der == 0:
+            return self(x, idx)
+        return self._slopes(self._segment(x, idx), idx)
+
+
 class LnLFn(object):
     """Helper class for interpolating a 1-D log-likelihood function from a
     set of tabulated values.
@@ -673,17 +834,35 @@ class CastroData_Base(object):
         self._norm_vals = norm_vals
         self._nll_vals = nll_vals
         self._nll_offsets = nll_offsets
-        self._loglikes = []
-        self._nll_null = 0.0
+        self._loglikes = None
+        self._nll_null = np.sum(self._nll_vals[:, 0])
         self._norm_type = norm_type
         self._nx = self._norm_vals.shape[0]
         self._ny = self._norm_vals.shape[1]
 
-        for i, (normv, nllv) in enumerate(zip(self._norm_vals,
-                                              self._nll_vals)):
-            nllfunc = self.build_lnl_fn(normv, nllv)
-            self._nll_null += self._nll_vals[i][0]
-            self._loglikes.append(nllfunc)
+        # The likelihood of all bins is evaluated with a single
+        # InterpolatorArray.  The LnLFn objects of the individual bins
+        # are only created when needed unless a sub-class modifies
+        # the likelihood functions.
+        if type(self).build_lnl_fn is CastroData_Base.build_lnl_fn:
+            self._interp = InterpolatorArray(self._norm_vals, self._nll_vals)
+        else:
+            self._interp = InterpolatorArray.create_from_interpolators(
+                [t.interp for t in self.loglikes])
+
+    @property
+    def loglikes(self):
+        """ Return the list of `LnLFn` objects for all bins """
+        if self._loglikes is None:
+            self._loglikes = [self.build_lnl_fn(normv, nllv) for normv, nllv
+                              in zip(self._norm_vals, self._nll_vals)]
+        return self._loglikes
+
+    @property
+    def interp(self):
+        """ Return the `InterpolatorArray` of the log-likelihood functions
+        of all bins """
+        return self._interp
 
     @property
     def nx(self):
@@ -713,7 +892,7 @@ class CastroData_Base(object):
     def __getitem__(self, i):
         """ return the LnLFn object for the ith energy bin
         """
-        return self._loglikes[i]
+        return self.loglikes[i]
 
     def __call__(self, x):
         """Return the negative log-likelihood for an array of values,
@@ -722,24 +901,21 @@ class CastroData_Base(object):
         Parameters
         ----------
         x  : `~numpy.ndarray`
-           Array of N x M values
+           Array of N x M values.  The second dimension can be used
+           to evaluate a batch of M trial spectra.
 
         Returns
         -------
         nll_val : `~numpy.ndarray`
            Array of negative log-likelihood values.
         """
-        if len(x.shape) == 1:
-            nll_val = np.zeros((1))
-        else:
-            nll_val = np.zeros((x.shape[1:]))
         # crude hack to force the fitter away from unphysical values
         if (x < 0).any():
             return 1000.
 
-        for i, xv in enumerate(x):
-            nll_val += self._loglikes[i].interp(xv)
-
+        nll_val = np.sum(self._interp(x), axis=0)
+        if len(x.shape) == 1:
+            nll_val = nll_val.reshape((1))
         return nll_val
 
     def build_lnl_fn(self, normv, nllv):
@@ -748,18 +924,26 @@ class CastroData_Base(object):
         return LnLFn(normv, nllv, self._norm_type)
 
     def norm_derivative(self, spec, norm):
+        """Return the derivative of the negative log-likelihood summed
+        over the bins with respect to the normalization of a spectrum.
+
+        Parameters
+        ----------
+        spec : `~numpy.ndarray`
+           Array of spectral values in each bin.
+
+        norm : float or `~numpy.ndarray`
+           Normalization or array of normalizations.
         """
-        """
+        spec = np.array(spec, dtype=float)
+        norm_arr = np.array(norm, dtype=float)
+        sv = spec.reshape(spec.shape + (1,) * norm_arr.ndim)
+        der_val = np.sum(self._interp.derivative(norm_arr * sv, der=1) * sv,
+                         axis=0)
         if isinstance(norm, float):
-            der_val = 0.
-        elif len(norm.shape) == 1:
-            der_val = np.zeros((1))
-        else:
-            der_val = np.zeros((norm.shape[1:]))
-
-        for i, sv in enumerate(spec):
-            der_val += self._loglikes[
-                i].interp.derivative(norm * sv, der=1) * sv
+            return float(der_val)
+        elif norm_arr.ndim == 1 and norm_arr.shape[0] == 1:
+            return der_val.reshape((1))
         return der_val
 
     def derivative(self, x, der=1):
@@ -779,13 +963,9 @@ class CastroData_Base(object):
         der_val : `~numpy.ndarray`
            Array of negative log-likelihood values.
         """
+        der_val = np.sum(self._interp.derivative(x, der=der), axis=0)
         if len(x.shape) == 1:
-            der_val = np.zeros((1))
-        else:
-            der_val = np.zeros((x.shape[1:]))
-
-        for i, xv in enumerate(x):
-            der_val += self._loglikes[i].interp.derivative(xv, der=der)
+            der_val = der_val.reshape((1))
         return der_val
 
     def mles(self):
@@ -793,7 +973,7 @@ class CastroData_Base(object):
         """
         mle_vals = np.ndarray((self._nx))
         for i in range(self._nx):
-            mle_vals[i] = self._loglikes[i].mle()
+            mle_vals[i] = self.loglikes[i].mle()
         return mle_vals
 
     def fn_mles(self):
@@ -810,7 +990,7 @@ class CastroData_Base(object):
         """
         ts_vals = np.ndarray((self._nx))
         for i in range(self._nx):
-            ts_vals[i] = self._loglikes[i].TS()
+            ts_vals[i] = self.loglikes[i].TS()
 
         return ts_vals
 
@@ -835,9 +1015,9 @@ class CastroData_Base(object):
         chi2_vals = np.ndarray((self._nx))
         for i in range(self._nx):
 
-            mle = self._loglikes[i].mle()
-            nll0 = self._loglikes[i].interp(mle)
-            nll1 = self._loglikes[i].interp(x[i])
+            mle = self.loglikes[i].mle()
+            nll0 = self.loglikes[i].interp(mle)
+            nll1 = self.loglikes[i].interp(x[i])
             chi2_vals[i] = 2.0 * np.abs(nll0 - nll1)
 
         return chi2_vals
@@ -857,7 +1037,7 @@ class CastroData_Base(object):
         limit_vals = np.ndarray((self._nx))
 
         for i in range(self._nx):
-            limit_vals[i] = self._loglikes[i].getLimit(alpha, upper)
+            limit_vals[i] = self.loglikes[i].getLimit(alpha, upper)
 
         return limit_vals
 
@@ -882,7 +1062,7 @@ class CastroData_Base(object):
         limit_vals_hi = np.ndarray((self._nx))
 
         for i in range(self._nx):
-            lo_lim, hi_lim = self._loglikes[i].getInterval(alpha)
+            lo_lim, hi_lim = self.loglikes[i].getInterval(alpha)
             limit_vals_lo[i] = lo_lim
             limit_vals_hi[i] = hi_lim
 
@@ -1035,12 +1215,18 @@ class CastroData_Base(object):
     def stack_nll(shape, components, ylims, weights=None):
         """Combine the log-likelihoods from a number of components.
 
+        The likelihood of each component is evaluated on the common
+        grid of normalization values for all bins at once and
+        accumulated in place.  Components are consumed one at a time,
+        so ``components`` can be a generator that loads them from
+        disk on demand.
+
         Parameters
         ----------
         shape    :  tuple
            The shape of the return array
 
-        components : `~fermipy.castro.CastroData_Base`
+        components : iterable of `~fermipy.castro.CastroData_Base`
            The components to be stacked
 
         weights : array-like
@@ -1061,24 +1247,27 @@ class CastroData_Base(object):
         n_vals = shape[1]
 
         if weights is None:
-            weights = np.ones((len(components)))
+            weights = itertools.repeat(1.0)
 
+        log_min = np.log10(ylims[0])
+        log_max = np.log10(ylims[1])
         norm_vals = np.zeros(shape)
+        norm_vals[:, 1:] = np.logspace(log_min, log_max, n_vals - 1)
         nll_vals = np.zeros(shape)
         nll_offsets = np.zeros((n_bins))
-        for i in range(n_bins):
-            log_min = np.log10(ylims[0])
-            log_max = np.log10(ylims[1])
-            norm_vals[i, 1:] = np.logspace(log_min, log_max, n_vals - 1)
-            for c, w in zip(components, weights):
-                nll_vals[i] += w * c[i].interp(norm_vals[i]) - c.nll_offsets[i]
 
-            # Reset the offsets
+        for c, w in zip(components, weights):
+            nll_c = c.interp(norm_vals)
+            nll_c *= w
+            nll_c -= c.nll_offsets[:, np.newaxis]
+            nll_vals += nll_c
+
+        # Reset the offsets
+        for i in range(n_bins):
             nll_obj = LnLFn(norm_vals[i], nll_vals[i])
             ll_offset = nll_obj.fn_mle()
             nll_vals[i] -= ll_offset
             nll_offsets[i] = -ll_offset
-            pass
 
         return norm_vals, nll_vals, nll_offsets
 
@@ -1342,7 +1531,7 @@ class CastroData(CastroData_Base):
         shape    :  tuple
            The shape of the return array
 
-        components : [~fermipy.castro.CastroData_Base]
+        components : iterable of `~fermipy.castro.CastroData_Base`
            The components to be stacked
 
         weights : array-like
@@ -1351,15 +1540,18 @@ class CastroData(CastroData_Base):
         -------
         castro : `~fermipy.castro.CastroData`
         """
-        if len(components) == 0:
+        components = iter(components)
+        first = next(components, None)
+        if first is None:
             return None
+        components = itertools.chain([first], components)
         norm_vals, nll_vals, nll_offsets = CastroData_Base.stack_nll(shape,
                                                                      components,
                                                                      ylims,
                                                                      weights)
         return cls(norm_vals, nll_vals,
-                   components[0].refSpec,
-                   components[0].norm_type)
+                   first.refSpec,
+                   first.norm_type)
 
     def spectrum_loglike(self, specType, params, scale=1E3):
         """ return the log-likelihood for a particular spectrum
@@ -1449,6 +1641,186 @@ class CastroData(CastroData_Base):
     
 
 
+def _nelder_mead_batch(func, x0, xtol=1e-6, ftol=1e-4, maxiter=None,
+                       maxfun=None):
+    """Minimize a batch of independent functions with the Nelder-Mead
+    algorithm.  The steps of the algorithm and its convergence
+    criteria are the same as in `scipy.optimize.fmin` but all
+    functions in the batch are advanced together such that each
+    function evaluation is vectorized over the batch.
+
+    Parameters
+    ----------
+    func : callable
+        Function with signature ``func(idx, x)`` that returns the
+        values of the functions with indices ``idx`` (K array) at the
+        points ``x`` (K x N array).
+
+    x0 : `~numpy.ndarray`
+        P x N array of initial parameter values for P functions.
+
+    Returns
+    -------
+    x : `~numpy.ndarray`
+        P x N array of best-fit parameter values.
+
+    fval : `~numpy.ndarray`
+        P array of function values at the minimum.
+
+    status : `~numpy.ndarray`
+        P array of fit status codes.  These are the same as the
+        ``warnflag`` of `scipy.optimize.fmin`: 0 if the fit converged,
+        1 if the maximum number of function evaluations and 2 if the
+        maximum number of iterations was reached.
+    """
+    rho, chi, psi, sigma = 1.0, 2.0, 0.5, 0.5
+
+    x0 = np.array(x0, ndmin=2, dtype=float)
+    npts, ndim = x0.shape
+    if maxiter is None:
+        maxiter = ndim * 200
+    if maxfun is None:
+        maxfun = ndim * 200
+
+    sim = np.empty((npts, ndim + 1, ndim))
+    sim[:, 0] = x0
+    for k in range(ndim):
+        y = np.array(x0, copy=True)
+        y[:, k] = np.where(y[:, k] != 0, (1 + 0.05) * y[:, k], 0.00025)
+        sim[:, k + 1] = y
+
+    idx = np.arange(npts)
+    fsim = np.empty((npts, ndim + 1))
+    for k in range(ndim + 1):
+        fsim[:, k] = func(idx, sim[:, k])
+
+    def sort_simplex(s, fs):
+        isort = np.argsort(fs, axis=1)
+        return (np.take_along_axis(s, isort[:, :, None], axis=1),
+                np.take_along_axis(fs, isort, axis=1))
+
+    sim, fsim = sort_simplex(sim, fsim)
+    fcalls = np.full(npts, ndim + 1)
+    iterations = np.ones(npts, dtype=int)
+    active = np.ones(npts, dtype=bool)
+
+    while True:
+
+        dx = np.max(np.abs(sim[:, 1:] - sim[:, :1]).reshape(npts, -1), axis=1)
+        df = np.max(np.abs(fsim[:, :1] - fsim[:, 1:]), axis=1)
+        active &= ~((dx <= xtol) & (df <= ftol))
+        active &= (fcalls < maxfun) & (iterations < maxiter)
+        idx = np.flatnonzero(active)
+        if len(idx) == 0:
+            break
+
+        s, fs = sim[idx], fsim[idx]
+        xbar = np.add.reduce(s[:, :-1], 1) / ndim
+        xr = (1 + rho) * xbar - rho * s[:, -1]
+        fxr = func(idx, xr)
+        ncalls = np.ones(len(idx), dtype=int)
+        xnew, fnew = xr.copy(), fxr.copy()
+        shrink = np.zeros(len(idx), dtype=bool)
+
+        # Expansion
+        m = fxr < fs[:, 0]
+        j = np.flatnonzero(m)
+        if len(j):
+            xe = (1 + rho * chi) * xbar[j] - rho * chi * s[j, -1]
+            fxe = func(idx[j], xe)
+            ok = fxe < fxr[j]
+            xnew[j[ok]], fnew[j[ok]] = xe[ok], fxe[ok]
+            ncalls[j] += 1
+
+        # Outside contraction
+        mc = ~m & (fxr >= fs[:, -2])
+        j = np.flatnonzero(mc & (fxr < fs[:, -1]))
+        if len(j):
+            xc = (1 + psi * rho) * xbar[j] - psi * rho * s[j, -1]
+            fxc = func(idx[j], xc)
+            ok = fxc <= fxr[j]
+            xnew[j[ok]], fnew[j[ok]] = xc[ok], fxc[ok]
+            shrink[j[~ok]] = True
+            ncalls[j] += 1
+
+        # Inside contraction
+        j = np.flatnonzero(mc & (fxr >= fs[:, -1]))
+        if len(j):
+            xcc = (1 - psi) * xbar[j] + psi * s[j, -1]
+            fxcc = func(idx[j], xcc)
+            ok = fxcc < fs[j, -1]
+            xnew[j[ok]], fnew[j[ok]] = xcc[ok], fxcc[ok]
+            shrink[j[~ok]] = True
+            ncalls[j] += 1
+
+        s[~shrink, -1] = xnew[~shrink]
+        fs[~shrink, -1] = fnew[~shrink]
+
+        # Shrink
+        j = np.flatnonzero(shrink)
+        if len(j):
+            for k in range(1, ndim + 1):
+                s[j, k] = s[j, 0] + sigma * (s[j, k] - s[j, 0])
+                fs[j, k] = func(idx[j], s[j, k])
+            ncalls[j] += ndim
+
+        sim[idx], fsim[idx] = sort_simplex(s, fs)
+        fcalls[idx] += ncalls
+        iterations[idx] += 1
+
+    status = np.zeros(npts, dtype=int)
+    status[iterations >= maxiter] = 2
+    status[fcalls >= maxfun] = 1
+    return sim[:, 0], fsim[:, 0], status
+
+
+def _fit_spectra_chunk(ipix, norm_vals, nll_vals, ref_spec, norm_type,
+                       spec_type, init_pars, free_pars, scale):
+    """Fit a spectral model to the likelihood profiles of a set of
+    pixels of a TSCube.  See `TSCube.fit_spectra`."""
+
+    norm_vals = norm_vals[ipix]
+    nll_vals = nll_vals[ipix]
+    npix, nebin, nval = norm_vals.shape
+
+    # Sort the profiles by normalization as in CastroData_Base
+    isort = norm_vals.argsort(2)
+    norm_vals = np.take_along_axis(norm_vals, isort, axis=2)
+    nll_vals = np.take_along_axis(nll_vals, isort, axis=2)
+    interp = InterpolatorArray(norm_vals.reshape((-1, nval)),
+                               nll_vals.reshape((-1, nval)))
+    nll_null = np.sum(nll_vals[:, :, 0], axis=1)
+
+    fn = ref_spec.create_functor(spec_type, norm_type, init_pars, scale)
+    init_pars = np.array(fn.params, dtype=float)
+    if free_pars is None:
+        free_pars = np.ones(len(init_pars), dtype=bool)
+    free_pars = np.array(free_pars, dtype=bool)
+
+    def spec_vals(pars):
+        return np.array(fn(pars.T)).reshape((nebin, -1)).T
+
+    def nll(idx, spec):
+        rows = (idx[:, None] * nebin + np.arange(nebin)[None, :]).ravel()
+        v = np.sum(interp(spec.ravel(), idx=rows).reshape(spec.shape),
+                   axis=1)
+        # crude hack to force the fitter away from unphysical values
+        return np.where(np.any(spec < 0, axis=1), 1000., v)
+
+    def fn_nll(idx, x):
+        pars = np.tile(init_pars, (len(idx), 1))
+        pars[:, free_pars] = x
+        return nll(idx, spec_vals(pars))
+
+    x0 = np.tile(init_pars[free_pars], (npix, 1))
+    x, fval, status = _nelder_mead_batch(fn_nll, x0)
+
+    params = np.tile(init_pars, (npix, 1))
+    params[:, free_pars] = x
+    ts = 2. * (nll_null - nll(np.arange(npix), spec_vals(params)))
+    return dict(params=params, nll=fval, ts=ts, fit_status=status)
+
+
 class TSCube(object):
     """A class wrapping a TSCube, which is a collection of CastroData
     objects for a set of directions.
@@ -1734,6 +2106,128 @@ class TSCube(object):
         test_dict = castro.test_spectra(spec_types)
         return (castro, test_dict)
 
+    def fit_spectra(self, spec_type='PowerLaw', init_pars=None,
+                    free_pars=None, scale=1E3, mask=None, nthread=1,
+                    chunk_size=4096):
+        """Fit a spectral model to the likelihood profiles of all pixels
+        of this TSCube.  The fits of all pixels in a block of pixels
+        are performed simultaneously and give the same results as
+        `~fermipy.castro.CastroData.fit_spectrum` applied to the
+        CastroData of every pixel.
+
+        Parameters
+        ----------
+        spec_type : str
+           Spectral model (e.g. PowerLaw, LogParabola or PLExpCutoff).
+
+        init_pars : `~numpy.ndarray`
+           Initial parameter values.  If None the default values of
+           `~fermipy.castro.ReferenceSpec.create_functor` are used.
+
+        free_pars : `~numpy.ndarray`
+           Boolean array indicating which parameters are free.  If
+           None all parameters are free.
+
+        scale : float
+           The 'pivot energy' of the spectral model.
+
+        mask : `~numpy.ndarray`
+           Boolean array with the shape of the TS map selecting the
+           pixels to fit.  If None all pixels are fit.
+
+        nthread : int
+           Number of processes over which blocks of pixels are
+           distributed.  If None one process is created for each
+           available core.
+
+        chunk_size : int
+           Number of pixels in each block.
+
+        Returns
+        -------
+        o : dict
+           Dictionary with the list of parameter names (``param_names``)
+           and maps of the best-fit parameter values (``params``), the
+           TS of the best-fit spectrum (``ts``), the negative
+           log-likelihood (``nll``) and the status code of the fit
+           (``fit_status``).  The status code is 0 if the fit
+           converged and -1 for pixels that were not fit.
+        """
+        shape = self._tsmap.data.shape
+        npix = self._norm_vals.shape[0]
+        if mask is None:
+            ipix = np.arange(npix)
+        else:
+            ipix = np.flatnonzero(np.ravel(mask))
+
+        chunks = [ipix[i:i + chunk_size]
+                  for i in range(0, len(ipix), chunk_size)]
+        kwargs = dict(ref_spec=self._refSpec, norm_type=self._norm_type,
+                      spec_type=spec_type, init_pars=init_pars,
+                      free_pars=free_pars, scale=scale)
+
+        pool = WorkerPool(nthread)
+        if pool.nthread > 1:
+            kwargs['norm_vals'] = pool.share(self._norm_vals)
+            kwargs['nll_vals'] = pool.share(self._nll_vals)
+        else:
+            kwargs['norm_vals'] = self._norm_vals
+            kwargs['nll_vals'] = self._nll_vals
+        try:
+            results = pool.map(_fit_spectra_chunk, chunks, **kwargs)
+        finally:
+            pool.close()
+
+        fn = self._refSpec.create_functor(spec_type, self._norm_type,
+                                          init_pars, scale)
+        npar = len(fn.params)
+        params = np.full((npix, npar), np.nan)
+        ts = np.full(npix, np.nan)
+        nll = np.full(npix, np.nan)
+        status = np.full(npix, -1, dtype=int)
+        for chunk, r in zip(chunks, results):
+            params[chunk] = r['params']
+            ts[chunk] = r['ts']
+            nll[chunk] = r['nll']
+            status[chunk] = r['fit_status']
+
+        def make_map(data):
+            return self._tsmap.__class__(self._tsmap.geom,
+                                         data.reshape(shape))
+
+        param_names = PAR_NAMES.get(spec_type,
+                                    ['par%i' % i for i in range(npar)])
+        return {'spec_type': spec_type,
+                'param_names': param_names,
+                'params': [make_map(params[:, i]) for i in range(npar)],
+                'ts': make_map(ts),
+                'nll': make_map(nll),
+                'fit_status': make_map(status)}
+
+    def test_spectra(self, spec_types=None, **kwargs):
+        """Fit different spectral types to all pixels of this TSCube.
+        This is the equivalent of `~fermipy.castro.CastroData.test_spectra`
+        for the whole cube.
+
+        Parameters
+        ----------
+        spec_types : [str,...]
+           List of spectral types to try
+
+        kwargs : dict
+           Keyword arguments passed to `fit_spectra`.
+
+        Returns
+        -------
+        o : dict
+           Dictionary keyed by spectral type with the output of
+           `fit_spectra`.
+        """
+        if spec_types is None:
+            spec_types = ["PowerLaw", "LogParabola", "PLExpCutoff"]
+
+        return {t: self.fit_spectra(t, **kwargs) for t in spec_types}
+
     def find_sources(self, threshold,
                      min_separation=1.0,
                      use_cumul=False,
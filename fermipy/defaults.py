@@ -162,8 +162,28 @@ gtlike = {
     'srcmap_base': (None, 'Set the baseline source maps file.  This will be used to generate a scaled source map.', str),
     'bexpmap_base': (None, 'Set the basline all-sky expoure map file.  This will be used to generate a scaled source map.', str),
     'bexpmap_roi_base': (None, 'Set the basline ROI expoure map file.  This will be used to generate a scaled source map.', str),
+    'ltcube_base': (None, 'Set the baseline livetime cube file.  If defined together with use_scaled_srcmap the '
+                    'binned exposure map and source maps are generated by scaling bexpmap_base and srcmap_base '
+                    'with the ratio of the exposures computed from the livetime cubes.  The ratio is evaluated '
+                    'in every pixel for the exposure map and diffuse sources and at the source position for '
+                    'all other sources.  In this case no exposure maps are computed with gtexpcube2.', str),
     'use_external_srcmap': (False, 'Use an external precomputed source map file.', bool),
     'use_scaled_srcmap': (False, 'Generate source map by scaling an external srcmap file.', bool),
+    'srcmap_cache_dir': (None, 'Directory of a persistent cache of source maps.  Source maps generated with '
+                         'gtsrcmaps or fermipy are stored in this directory keyed by a hash of the spatial '
+                         'model, geometry, energy binning, IRFs and exposure and are reused by analyses '
+                         'with identical inputs.  If None the cache is disabled.', str),
+    'srcmap_cache_size': (20.0, 'Maximum size in GB of the source map cache.  The least recently used entries '
+                          'are deleted when the cache exceeds this size.', float),
+    'kernel_bank_size': (0.5, 'Maximum size in GB of the PSF-convolved source kernels that are kept in memory.  '
+                         'Kernels are reused by methods that repeatedly add sources with the same spatial model '
+                         'and sub-pixel offset (e.g. residmap, tsmap or extension).  Source positions are snapped '
+                         'to a grid of 1/10 of a pixel.  Kernels are also stored in the '
+                         'source map cache if srcmap_cache_dir is set.  If 0 kernels are not kept and if None '
+                         'the size is not limited.', float),
+    'kernel_bank_widths': (None, 'Grid of spatial widths in degrees on which kernels of extended sources are '
+                           'evaluated.  Kernels for widths between two grid points are interpolated in the '
+                           'logarithm of the width.  If None kernels are evaluated at every requested width.', list),
     'wmap': (None, 'Likelihood weights map.', str),
     'llscan_npts': (20, 'Number of evaluation points to use when performing a likelihood scan.', int),
     'src_expscale': (None, 'Dictionary of exposure corrections for individual sources keyed to source name.  The exposure '
@@ -289,6 +309,8 @@ residmap = {
     'model': common['model'],
     'exclude': (None, 'List of sources that will be removed from the model when '
                 'computing the residual map.', list),
+    'multithread': common['multithread'],
+    'nthread': common['nthread'],
     'loge_bounds': common['loge_bounds'],
     'make_plots': common['make_plots'],
     'use_weights': common['use_weights'],
@@ -306,6 +328,18 @@ tsmap = {
     'max_kernel_radius': (3.0, 'Set the maximum radius of the test source kernel.  Using a '
                           'smaller value will speed up the TS calculation at the loss of '
                           'accuracy.', float),
+    'engine': ('batch', 'Set the engine used to fit the test source amplitude.  Valid options are '
+               'batch (vectorized newton fit of blocks of pixels) or scalar (separate newton fit '
+               'for each pixel).', str),
+    'tile_size': (None, 'Compute the TS map in square tiles of this width in pixels.  Every finished tile '
+                  'is written to a separate file in checkpoint_dir and a restarted calculation '
+                  'skips completed tiles.  Several processes or batch jobs running the same calculation '
+                  'share the tiles through the checkpoint directory.  Only supported by the batch '
+                  'engine.  If None the map is computed in a single pass.', int),
+    'checkpoint_dir': (None, 'Directory for the tile checkpoints of a tiled TS map.  If None a directory '
+                       'named after the TS map in the analysis output directory will be used and '
+                       'removed once the map is complete.  Set this to a shared directory to split '
+                       'the calculation between several processes or batch jobs.', str),
     'loge_bounds': common['loge_bounds'],
     'make_plots': common['make_plots'],
     'write_fits': common['write_fits'],
@@ -355,6 +389,9 @@ psmap = {
     'prob_epsilon':(1e-7, 'LL computation: precision parameter.', float),
     'nbinpdf':(50, 'LL computation: number of bins.', int),
     'scaleaxis':(20,'LL computation: scale axis.', float),
+    'llgrid':(0, 'LL computation: number of points per decade of the logarithmic grid on which the model counts of the LL histograms of the Poissonian bins are quantized so that the histograms are shared by bins with similar model counts. Quantizing reduces the precision on large PS values. If 0, the model counts are not quantized.', int),
+    'multithread': common['multithread'],
+    'nthread': common['nthread'],
     'make_plots': common['make_plots'],
     'write_fits': common['write_fits'],
 }
@@ -390,8 +427,28 @@ lightcurve = {
     'use_local_ltcube': (True, 'Generate a fast LT cube.', bool),
     'use_scaled_srcmap': (False, 'Generate approximate source maps for each time bin by scaling '
                           'the current source maps by the exposure ratio with respect to that time bin.', bool),
+    'reuse_parent_srcmap': (False, 'Reuse the source maps and exposure map of the baseline analysis in every '
+                            'time bin.  The maps are scaled pixel by pixel (and for each source at its position) by the '
+                            'ratio of the exposures computed from the livetime cubes of the baseline analysis and '
+                            'of each time bin.  No exposure maps or source maps are computed for the time bins '
+                            'such that only the counts cube and livetime cube are generated for each time bin.  '
+                            'This is an approximation: changes of the PSF and energy dispersion between the time '
+                            'bins and the baseline analysis are neglected.  This option implies '
+                            'use_scaled_srcmap.', bool),
     'save_bin_data': (True, 'Save analysis directories for individual time bins.  If False then only '
                       'the analysis results table will be saved.', bool),
+    'unordered': (False, 'Process time bins in the order in which worker processes become available when '
+                  'multithread is True.  Results of each bin are collected as soon as the bin is '
+                  'finished such that a slow bin does not delay the collection of later bins.', bool),
+    'resume': (False, 'Resume a lightcurve calculation that was interrupted.  The results of every '
+               'time bin are appended to a stream file (lightcurve_<source>_bins.pkl in the working '
+               'directory) as soon as the bin is finished.  The lightcurve FITS and npy files are only '
+               'written once all bins are finished, after which the stream file is deleted.  If this '
+               'option is True then bins already present in the stream file will not be processed again.  '
+               'The stream file is ignored if it was created with a different configuration.', bool),
+    'retry_failed': (True, 'Process again the time bins whose fit failed in a previous run when resuming '
+                     'a lightcurve calculation with resume.  If False then failed bins are kept as '
+                     'they are.', bool),
     'binsz': (86400.0, 'Set the lightcurve bin size in seconds.', float),
     'shape_ts_threshold': (16.0, 'Set the TS threshold at which shape parameters of '
                            'sources will be freed.  If a source is detected with TS less than this '
@@ -424,6 +481,11 @@ lightcurve_output = OrderedDict((
     ('tmax', (None, 'Upper edge of time bin in MET.', np.ndarray)),
     ('fit_success', (None, 'Did the likelihood fit converge? True if yes.',
                      np.ndarray)),
+    ('wall_time', (None, 'Wall clock time in seconds spent on each time bin.', np.ndarray)),
+    ('cpu_time', (None, 'CPU time in seconds spent on each time bin.', np.ndarray)),
+    ('max_rss', (None, 'Peak resident memory in MB of the process that analyzed each time bin '
+                 'measured from the start of the bin.  NaN on systems where the peak memory of a '
+                 'process can not be reset (only supported on linux).', np.ndarray)),
     ('config', ({}, 'Copy of the input configuration to this method.', dict)),
     ('ts_var', (None, r'TS of variability. Should be distributed as :math:`\chi^2` with '
                 ':math:`n-1` degrees of freedom, where :math:`n` is the number of time bins.', float)),
@@ -584,6 +646,8 @@ extension = {
                      tuple),
     'make_tsmap': (True, 'Make a TS map for the source of interest.', bool),
     'tsmap_fitter': ('tsmap', 'Set the method for generating the TS map.  Valid options are tsmap or tscube.', str),
+    'multithread': common['multithread'],
+    'nthread': common['nthread'],
     'make_plots': common['make_plots'],
     'write_fits': common['write_fits'],
     'write_npy': common['write_npy'],
@@ -603,6 +667,8 @@ localize = {
     'free_radius': common['free_radius'],
     'update': (True, 'Update the source model with the best-fit position.', bool),
     'tsmap_fitter': ('tsmap', 'Set the method for generating the TS map.  Valid options are tsmap or tscube.', str),
+    'multithread': common['multithread'],
+    'nthread': common['nthread'],
     'make_plots': common['make_plots'],
     'write_fits': common['write_fits'],
     'write_npy': common['write_npy'],
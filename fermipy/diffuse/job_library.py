@@ -203,7 +203,8 @@ class Link_FermipyCoadd(AppLink):
     description = "Link to run %s" % (appname)
 
     default_options = dict(args=([], "List of input files", list),
-                           output=(None, "Output file", str))
+                           output=(None, "Output file", str),
+                           nthread=(1, "Number of processes used to merge the files", int))
     default_file_args = dict(args=FileFlags.input_mask,
                              output=FileFlags.output_mask)
 
@@ -122,6 +122,8 @@ class ExtensionFit(object):
         fix_shape = kwargs.get('fix_shape', False)
         make_tsmap = kwargs.get('make_tsmap', False)
         tsmap_fitter = kwargs.get('tsmap_fitter', 'tsmap')
+        multithread = kwargs.get('multithread', False)
+        nthread = kwargs.get('nthread', None)
         update = kwargs['update']
         sqrt_ts_threshold = kwargs['sqrt_ts_threshold']
         log_energies = np.array( kwargs.get('loge_bins', self.log_energies) )
@@ -201,7 +203,8 @@ class ExtensionFit(object):
             ext_fit = self._fit_extension_full(name,
                                                spatial_model=spatial_model,
                                                optimizer=kwargs['optimizer'], width_max=width_max,
-					       width_min=width_min, width_nstep=width_nstep)
+					       width_min=width_min, width_nstep=width_nstep,
+                                               multithread=multithread, nthread=nthread)
         else:
             ext_fit = self._fit_extension(name,
                                           spatial_model=spatial_model,
@@ -267,6 +270,8 @@ class ExtensionFit(object):
                                    write_npy=False,
                                    use_pylike=False,
                                    make_plots=False,
+                                   multithread=multithread,
+                                   nthread=nthread,
                                    loglevel=logging.DEBUG)
                 o.tsmap = tsmap['ts']
             elif tsmap_fitter == 'tscube':
@@ -701,7 +706,9 @@ class ExtensionFit(object):
 
             fit_pos0, fit_pos1 = self._fit_position(name, nstep=nstep,
                                                     dtheta_max=dtheta_max,
-                                                    zmin=-3.0, use_pylike=False)
+                                                    zmin=-3.0, use_pylike=False,
+                                                    multithread=kwargs.get('multithread', False),
+                                                    nthread=kwargs.get('nthread', None))
             o.update(fit_pos0)
             t1.stop()
 
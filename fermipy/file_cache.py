@@ -0,0 +1,183 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Persistent content-addressed cache of analysis products (e.g. source
+maps) stored in a directory on disk.
+"""
+from __future__ import absolute_import, division, print_function
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+# Checksums of files keyed by (path, size, mtime)
+_CHECKSUMS = {}
+
+
+def file_checksum(path, blocksize=2**22):
+    """Compute the SHA1 checksum of a file.  Checksums are memoized
+    for files that have not been modified since they were last
+    read."""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memo_key in _CHECKSUMS:
+        return _CHECKSUMS[memo_key]
+
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    _CHECKSUMS[memo_key] = h.hexdigest()
+    return _CHECKSUMS[memo_key]
+
+
+def _update_hash(h, item):
+    if isinstance(item, np.ndarray):
+        h.update(str((item.shape, item.dtype.str)).encode())
+        h.update(np.ascontiguousarray(item).tobytes())
+    elif isinstance(item, dict):
+        for k in sorted(item.keys()):
+            _update_hash(h, k)
+            _update_hash(h, item[k])
+    elif isinstance(item, (list, tuple)):
+        h.update(b'(')
+        for t in item:
+            _update_hash(h, t)
+        h.update(b')')
+    else:
+        h.update(json.dumps(item, default=str).encode())
+
+
+def make_cache_key(*items):
+    """Compute a cache key from a sequence of objects.  Items can be
+    scalars, strings, numpy arrays or nested lists and dictionaries
+    of these types."""
+    h = hashlib.sha1()
+    for item in items:
+        _update_hash(h, item)
+    return h.hexdigest()
+
+
+class FileCache(object):
+    """Content-addressed cache of files in a directory.  Every entry
+    is a file named after its key.  The modification time of an entry
+    is updated whenever it is accessed and the least recently used
+    entries are deleted when the total size of the cache exceeds
+    ``max_size``.  Entries are written atomically such that several
+    processes can share the same cache directory.
+
+    Parameters
+    ----------
+    path : str
+        Cache directory.
+    max_size : float
+        Maximum size of the cache in bytes.  If None the size of the
+        cache is not limited.
+    """
+
+    def __init__(self, path, max_size=None):
+        self._path = os.path.abspath(os.path.expandvars(path))
+        self._max_size = max_size
+        if not os.path.isdir(self._path):
+            os.makedirs(self._path, exist_ok=True)
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    def entry_path(self, key, ext=''):
+        return os.path.join(self._path, key + ext)
+
+    def contains(self, key, ext=''):
+        return os.path.isfile(self.entry_path(key, ext))
+
+    def get(self, key, outfile, ext=''):
+        """Copy a cache entry to ``outfile``.  Returns False if there
+        is no entry for ``key``."""
+        path = self.entry_path(key, ext)
+        try:
+            shutil.copyfile(path, outfile)
+        except FileNotFoundError:
+            return False
+        self._touch(path)
+        return True
+
+    def put(self, key, infile, ext=''):
+        """Copy ``infile`` into the cache."""
+        path = self.entry_path(key, ext)
+        tmpfile = '%s.%i.tmp' % (path, os.getpid())
+        shutil.copyfile(infile, tmpfile)
+        os.replace(tmpfile, path)
+        self.evict()
+
+    def load_array(self, key):
+        """Load an array from the cache.  Returns None if there is no
+        entry for ``key``."""
+        path = self.entry_path(key, '.npy')
+        try:
+            data = np.load(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        self._touch(path)
+        return data
+
+    def save_array(self, key, data):
+        """Save an array to the cache."""
+        path = self.entry_path(key, '.npy')
+        tmpfile = '%s.%i.tmp' % (path, os.getpid())
+        with open(tmpfile, 'wb') as f:
+            np.save(f, data)
+        os.replace(tmpfile, path)
+        self.evict()
+
+    def _touch(self, path):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def size(self):
+        """Return the total size of the cache in bytes."""
+        return sum([e[2] for e in self._entries()])
+
+    def _entries(self):
+        entries = []
+        for f in os.listdir(self._path):
+            if f.endswith('.tmp'):
+                continue
+            path = os.path.join(self._path, f)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries += [(st.st_mtime, path, st.st_size)]
+        return entries
+
+    def evict(self):
+        """Delete the least recently used entries until the size of
+        the cache is below the size limit."""
+        if self._max_size is None:
+            return
+
+        entries = sorted(self._entries())
+        size = sum([e[2] for e in entries])
+        for mtime, path, nbytes in entries:
+            if size <= self._max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= nbytes
+
+    def clear(self):
+        """Delete all entries."""
+        for e in self._entries():
+            try:
+                os.remove(e[1])
+            except FileNotFoundError:
+                pass
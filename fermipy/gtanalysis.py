@@ -11,6 +11,7 @@ import time
 import json
 import numpy as np
 from astropy.io import fits
+from astropy.coordinates import SkyCoord
 from astropy.table import Table, Column, vstack
 from gammapy.maps import Map, HpxGeom, WcsGeom, MapAxis, WcsNDMap, HpxNDMap
 import fermipy
@@ -41,6 +42,9 @@ from fermipy.config import ConfigSchema
 from fermipy.timing import Timer
 from fermipy.docstring_utils import DocstringMeta
 from fermipy.fitcache import FitCache
+from fermipy.worker_pool import WorkerPool
+from fermipy.file_cache import FileCache, file_checksum, make_cache_key
+from fermipy.kernel_bank import KernelBank
 from fermipy.data_struct import MutableNamedTuple
 # pylikelihood
 import GtApp
@@ -150,6 +154,125 @@ def make_scaled_srcmap(roi, srcmap0,
     hdulist.close()
 
 
+def calc_exposure_ratio(skydir, ltc0, ltc1, event_class, event_types,
+                        egy):
+    """Compute the ratio of the exposures of two livetime cubes at an
+    array of sky directions.  The ratio is set to zero where the
+    exposure of the first livetime cube is zero.
+
+    Returns
+    -------
+    ratio : `~numpy.ndarray`
+        Array of exposure ratios with the dimensions of energy and the
+        dimensions of ``skydir``.
+    """
+    exp0 = irfs.calc_exp_skydirs(skydir, ltc0, event_class, event_types,
+                                 egy)
+    exp1 = irfs.calc_exp_skydirs(skydir, ltc1, event_class, event_types,
+                                 egy)
+    ratio = np.zeros_like(exp0)
+    m = exp0 > 0
+    ratio[m] = exp1[m] / exp0[m]
+    return ratio
+
+
+def make_exposure_scaled_srcmap(roi, srcmap0, bexp_file0, ltc0, ltc1,
+                                event_class, event_types, egy,
+                                ccubefile1, outfile, bexp_outfile):
+    """Generate the source map and binned exposure map files of an
+    analysis by scaling the files of a baseline analysis with the
+    ratio of the exposures computed from the livetime cubes of the two
+    analyses.  As in `make_scaled_srcmap` the binned exposure map and
+    the maps of diffuse sources are scaled pixel by pixel and the maps
+    of the other sources are scaled with the ratio at the source
+    position.  Contrary to `make_scaled_srcmap` the ratio is computed
+    directly from the livetime cubes such that no exposure maps need
+    to be generated for the new analysis.
+
+    Parameters
+    ----------
+    roi : `~fermipy.roi_model.ROIModel`
+
+    srcmap0 : str
+        Source map file of the baseline analysis.
+
+    bexp_file0 : str
+        Binned exposure map file of the baseline analysis.
+
+    ltc0 : `~fermipy.ltcube.LTCube`
+        Livetime cube of the baseline analysis.
+
+    ltc1 : `~fermipy.ltcube.LTCube`
+        Livetime cube of the new analysis.
+
+    event_class : str
+        Event class string.
+
+    event_types : list
+        List of event types.
+
+    egy : `~numpy.ndarray`
+        Energies in MeV of the planes of the source maps and the
+        binned exposure map.
+
+    ccubefile1 : str
+        Counts cube of the new analysis.
+
+    outfile : str
+        Output source map file.
+
+    bexp_outfile : str
+        Output binned exposure map file.
+
+    Returns
+    -------
+    ratio : `~numpy.ndarray`
+        Exposure ratio at the pixels of the counts cube.
+    """
+    srcs = [src for src in roi.sources if not src.diffuse]
+    skydirs = [Map.read(bexp_file0).geom.to_image().get_coord().skycoord,
+               Map.read(ccubefile1).geom.to_image().get_coord().skycoord]
+    shapes = [c.shape for c in skydirs] + [(len(srcs),)]
+    ra = [np.ravel(c.icrs.ra.deg) for c in skydirs]
+    dec = [np.ravel(c.icrs.dec.deg) for c in skydirs]
+    ra += [np.array([src.skydir.icrs.ra.deg for src in srcs])]
+    dec += [np.array([src.skydir.icrs.dec.deg for src in srcs])]
+
+    # Evaluate the exposure ratio for all directions at once
+    ratio = calc_exposure_ratio(SkyCoord(np.concatenate(ra),
+                                         np.concatenate(dec),
+                                         unit='deg', frame='icrs'),
+                                ltc0, ltc1, event_class, event_types, egy)
+    idx = np.cumsum([np.prod(shape, dtype=int) for shape in shapes])[:-1]
+    bexp_ratio, roi_ratio, src_ratio = [
+        r.reshape((len(egy),) + shape) for r, shape in
+        zip(np.split(ratio, idx, axis=1), shapes)]
+
+    with fits.open(bexp_file0) as hdulist:
+        hdulist[0].data = hdulist[0].data * bexp_ratio
+        hdulist.writeto(bexp_outfile, overwrite=True)
+
+    isrc = {src.name: i for i, src in enumerate(srcs)}
+    hdulist = fits.open(srcmap0)
+    for src in roi.sources:
+        data = hdulist[src.name].data
+        if src.diffuse:
+            ratio = roi_ratio.reshape((len(egy),) + data.shape[1:])
+        else:
+            ratio = src_ratio[:, isrc[src.name]]
+            ratio = ratio.reshape((-1,) + (1,) * (data.ndim - 1))
+        hdulist[src.name].data = data * ratio
+
+    hdulist_ccube = fits.open(ccubefile1)
+    hdulist['PRIMARY'] = hdulist_ccube['PRIMARY']
+    hdulist['EBOUNDS'] = hdulist_ccube['EBOUNDS']
+    hdulist['GTI'] = hdulist_ccube['GTI']
+    hdulist.writeto(outfile, overwrite=True)
+    hdulist_ccube.close()
+    hdulist.close()
+    return roi_ratio
+
+
 def create_sc_table(scfile, colnames=None):
     """Load an FT2 file from a file or list of files."""
 
@@ -298,6 +421,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         self._tmin = self.config['selection']['tmin']
         self._tmax = self.config['selection']['tmax']
         self._lck_params = {}
+        self._worker_pool = None
 
         # Set random seed
         np.random.seed(self.config['mc']['seed'])
@@ -449,6 +573,7 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
     def __del__(self):
         self.stage_output()
         self.cleanup()
+        self.close_worker_pool()
 
     @property
     def logger(self):
@@ -1184,6 +1309,43 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
                          self.workdir)
         shutil.rmtree(self.workdir)
 
+    def get_worker_pool(self, nthread=None):
+        """Return the persistent worker pool of this analysis.  The
+        pool is created on the first call and reused by subsequent
+        calls to the parallelized analysis methods (e.g.
+        `~fermipy.gtanalysis.GTAnalysis.tsmap`,
+        `~fermipy.gtanalysis.GTAnalysis.residmap`).
+
+        Parameters
+        ----------
+        nthread : int
+            Number of worker processes.  If None one process will be
+            created for each available core.  The pool is recreated
+            if the number of processes changes.
+
+        Returns
+        -------
+        pool : `~fermipy.worker_pool.WorkerPool`
+        """
+        pool = getattr(self, '_worker_pool', None)
+        if pool is not None and nthread is not None and \
+                pool.nthread != nthread:
+            self.close_worker_pool()
+            pool = None
+
+        if pool is None:
+            pool = WorkerPool(nthread)
+            self._worker_pool = pool
+        return pool
+
+    def close_worker_pool(self):
+        """Shut down the worker pool created by `get_worker_pool` and
+        free its shared memory."""
+        pool = getattr(self, '_worker_pool', None)
+        if pool is not None:
+            pool.close()
+        self._worker_pool = None
+
     def generate_model(self, model_name=None):
         """Generate model maps for all components.  model_name should
         be a unique identifier for the model.  If model_name is None
@@ -4462,6 +4624,15 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         self._srcmap_cache = {}
         self._srcmap = {}
 
+        # Persistent cache of source maps
+        self._srcmap_file_cache = None
+        if self.config['gtlike']['srcmap_cache_dir'] is not None:
+            max_size = self.config['gtlike']['srcmap_cache_size']
+            self._srcmap_file_cache = FileCache(
+                self.config['gtlike']['srcmap_cache_dir'],
+                max_size=max_size * 1E9 if max_size is not None else None)
+        self._kernel_bank = None
+
         # Fill dictionary of exposure corrections
         self._src_expscale = {}
         if self.config['gtlike']['expscale'] is not None:
@@ -4646,6 +4817,23 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         """Return the MET time for the end of the observation."""
         return self._tmax
 
+    @property
+    def kernel_bank(self):
+        """Return the bank of PSF-convolved kernels for the PSF model
+        of this component.  The bank is recreated when the PSF model
+        changes.  Returns None if kernel_bank_size is 0 and there is
+        no source map cache in which kernels could be stored."""
+        max_size = self.config['gtlike']['kernel_bank_size']
+        if max_size == 0 and self._srcmap_file_cache is None:
+            return None
+        if self._kernel_bank is None or self._kernel_bank.psf is not self._psf:
+            self._kernel_bank = KernelBank(
+                self._psf,
+                max_size=max_size * 1E9 if max_size is not None else None,
+                file_cache=self._srcmap_file_cache,
+                widths=self.config['gtlike']['kernel_bank_widths'])
+        return self._kernel_bank
+
     @property
     def geom(self):
         return self._geom
@@ -5173,6 +5361,8 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
                         self.name)
 
         use_external_srcmap = self.config['gtlike']['use_external_srcmap']
+        scale_exposure = (self.config['gtlike']['use_scaled_srcmap'] and
+                          self.config['gtlike']['ltcube_base'] is not None)
 
         # Run data selection
         if not use_external_srcmap:
@@ -5200,7 +5390,11 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         # Bin data and create exposure cube
         if not use_external_srcmap:
             self._bin_data(overwrite=overwrite, **kwargs)
-            self._create_expcube(overwrite=overwrite, **kwargs)
+            if scale_exposure:
+                self._create_exposure_scaled_maps(overwrite=overwrite,
+                                                  **kwargs)
+            else:
+                self._create_expcube(overwrite=overwrite, **kwargs)
 
         # This is needed in case the exposure map is in HEALPix
         hpxhduname = "HPXEXPOSURES"
@@ -5213,7 +5407,7 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         self.roi.write_xml(self.files['srcmdl'], self.config['model'])
 
         # Create source maps file
-        if not use_external_srcmap:
+        if not use_external_srcmap and not scale_exposure:
             self._create_srcmaps(overwrite=overwrite)
 
         if not self.config['data']['cacheft1'] and os.path.isfile(self.files['ft1']):
@@ -5426,6 +5620,37 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
             raise Exception(
                 "Did not recognize projection type %s", self.projtype)
 
+    def _create_exposure_scaled_maps(self, overwrite=False, **kwargs):
+        """Create the binned exposure map and the source maps by
+        scaling the maps of the baseline analysis with the ratio of
+        the exposures computed from the livetime cube of this
+        component and the baseline livetime cube.  The ratio is
+        evaluated for every pixel of the maps and at the position of
+        every source (see `make_exposure_scaled_srcmap`)."""
+
+        loglevel = kwargs.get('loglevel', self.loglevel)
+
+        if (os.path.isfile(self.files['bexpmap']) and
+                os.path.isfile(self.files['srcmap']) and not overwrite):
+            self.logger.log(loglevel, 'Skipping scaled source maps.')
+            return
+
+        evtype = self.config['selection']['evtype']
+        if isinstance(evtype, int):
+            evtype = irfs.bitmask_to_bits(evtype)
+        ltc0 = LTCube.create(self.config['gtlike']['ltcube_base'])
+        ratio = make_exposure_scaled_srcmap(self.roi,
+                                            self.config['gtlike']['srcmap_base'],
+                                            self.config['gtlike']['bexpmap_base'],
+                                            ltc0, self._ltc,
+                                            self.config['gtlike']['irfs'],
+                                            evtype, self.energies,
+                                            self.files['ccube'],
+                                            self.files['srcmap'],
+                                            self.files['bexpmap'])
+        self.logger.log(loglevel, 'Scaled source maps by exposure ratio '
+                        '%.4f to %.4f.', np.min(ratio), np.max(ratio))
+
     def _create_srcmaps(self, overwrite=False, **kwargs):
 
         loglevel = kwargs.get('loglevel', self.loglevel)
@@ -5449,6 +5674,7 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
 
         set_edisp_kwargs('gtsrcmaps', self.config, kw)
 
+        cache = self._srcmap_file_cache
         if os.path.isfile(self.files['srcmap']) and not overwrite:
             self.logger.log(loglevel, 'Skipping gtsrcmaps.')
         elif use_scaled_srcmap:
@@ -5460,9 +5686,39 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
                                self.files['bexpmap_roi'],
                                self.files['ccube'],
                                self.files['srcmap'])
+        elif cache is not None:
+            key = self._get_srcmaps_cache_key(kw)
+            if cache.get(key, self.files['srcmap'], ext='.fits'):
+                self.logger.log(loglevel, 'Loaded source maps from cache %s.',
+                                cache.path)
+                cmap = Map.read(self.files['ccube'])
+                srcmap_utils.update_source_maps(self.files['srcmap'],
+                                                {'PRIMARY': cmap.data},
+                                                logger=self.logger)
+            else:
+                run_gtapp('gtsrcmaps', self.logger, kw, loglevel=loglevel)
+                cache.put(key, self.files['srcmap'], ext='.fits')
         else:
             run_gtapp('gtsrcmaps', self.logger, kw, loglevel=loglevel)
 
+    def _get_srcmaps_cache_key(self, kw):
+        """Compute the key of the source map file in the source map
+        cache from the gtsrcmaps parameters.  Input files are
+        identified by their checksums.  The counts cube only enters
+        through the binning of the analysis since its contents are
+        restored after loading a cached source map file."""
+
+        kw = {k: v for k, v in kw.items()
+              if k not in ['scfile', 'cmap', 'outfile', 'chatter']}
+        for k in ['expcube', 'srcmdl', 'bexpmap', 'wmap']:
+            if kw.get(k, None) is not None and os.path.isfile(kw[k]):
+                kw[k] = file_checksum(kw[k])
+
+        return make_cache_key('gtsrcmaps', kw, self.config['binning'],
+                              [self.roi.skydir.ra.deg,
+                               self.roi.skydir.dec.deg],
+                              self.energies)
+
     def _create_binned_analysis(self, xmlfile=None, **kwargs):
 
         loglevel = kwargs.get('loglevel', self.loglevel)
@@ -5736,7 +5992,8 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         cache = SourceMapCache.create(self._psf, exp, spatial_model,
                                       spatial_width, shape_out,
                                       self.config['binning']['binsz'],
-                                      rebin=rebin)
+                                      rebin=rebin,
+                                      kernel_bank=self.kernel_bank)
         self._srcmap_cache[name] = cache
 
     def _create_srcmap(self, name, src, **kwargs):
@@ -5751,15 +6008,15 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
             (skydir, self._bexp.geom.axes[0].center))
         cache = self._srcmap_cache.get(name, None)
         if cache is not None:
-            k = cache.create_map([ypix, xpix])
-        else:
-            k = srcmap_utils.make_srcmap(self._psf, exp, spatial_model,
-                                         spatial_width,
-                                         npix=self.npix, xpix=xpix, ypix=ypix,
-                                         cdelt=self.config['binning']['binsz'],
-                                         psf_scale_fn=psf_scale_fn,
-                                         sparse=True)
-
+            return cache.create_map([ypix, xpix])
+
+        k = srcmap_utils.make_srcmap(self._psf, exp, spatial_model,
+                                     spatial_width,
+                                     npix=self.npix, xpix=xpix, ypix=ypix,
+                                     cdelt=self.config['binning']['binsz'],
+                                     psf_scale_fn=psf_scale_fn,
+                                     sparse=True,
+                                     kernel_bank=self.kernel_bank)
         return k
 
     def _update_srcmap(self, name, src, **kwargs):
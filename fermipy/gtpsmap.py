@@ -41,11 +41,16 @@
 #   it is advised to set psfpar3 to about the size of the extension (e.g. 0.5 or 1 deg).
 # --psfpar0lst: in the case of multiple components, the user can set psfpar0 independently for each component, e.g. --psfpar0lst 2.0:3.0:4.0:5.0
 # --chatter <output verbosity; 1>
+# --multithread: split the PS computation across several processes
+# --nthread <number of processes used with --multithread; one per core>
 # --prob_epsilon <precision parameter; 1e-7>
 #   This parameter defines the k-interval over which the Poisson probability of each spectral bin is considered
 #   when computing the log-likelihood distribution (the k-interval is such that ΣPoisson(k,model_i) = 1-prob_epsilon).
 #   The default value 1e-7 provides a 1% precision on PS up to PS=20. If you want a better precision for larger PS values,
 #   you need a smaller prob_epsilon (1e-11 provides a 5% precision up to 250) but that makes the script slower.
+# --llgrid <number of points per decade of the model count grid; 0>
+#   If llgrid>0, the model counts of the LL histograms of the Poissonian bins are rounded to a logarithmic grid so that
+#   the histograms are computed once and shared by bins with similar model counts. This reduces the precision on large PS values.
 #
 ###################################################################
 
@@ -56,15 +61,23 @@ from astropy.wcs import WCS
 from astropy.io import fits
 from astropy.coordinates import SkyCoord
 import scipy.signal
+import scipy.fft
 from scipy.stats import poisson
 from scipy.special import gammainc
 from scipy.special import gammaincc
 from scipy.special import erfcinv
+from scipy.special import gammaln
+from scipy.special import xlogy
+from fermipy.worker_pool import WorkerPool
 
-def getDeviationProbability(datcts, modcts, weights, maxpoissoncount, prob_epsilon, nbinpdf, scaleaxis):
+def getDeviationProbability(datcts, modcts, weights, maxpoissoncount, prob_epsilon, nbinpdf, scaleaxis, llcache=None, llgrid=0):
     # datcts = array of data counts
     # modcts = array of model counts
     # weights = array of weights
+    # llcache = optional dictionary in which the LL histograms of the Poissonian bins are stored
+    #           so that they are computed only once for each (model counts, weight) value
+    # llgrid = number of points per decade of the logarithmic grid on which the model counts and weights
+    #          of the LL histograms are quantized (0 = no quantization)
     # for simplicty's sake, LL (LogLikelihood) stands for -LL
     
     datcts=np.rint(datcts)
@@ -107,29 +120,16 @@ def getDeviationProbability(datcts, modcts, weights, maxpoissoncount, prob_epsil
     dat_LL = np.sum(-pweights*np.log(dat_PP))
     dat_LL += gdat_LL
     
-    # for each bin, get [k_min,k_max] interval such that sum_{k_min,k_max}(poisson(k,model_counts)) = 1-prob_epsilon
-    kmin = np.zeros(len(pmodcts),dtype=int)
-    kmax = np.zeros(len(pmodcts),dtype=int)
-    msk = pmodcts < 5
-    kmin[msk] = 0
-    kmax[msk] = np.rint(0.715029+0.049825*np.log10(prob_epsilon)+0.011768*pow(np.log10(prob_epsilon),2) + (-0.308206+-1.309547*np.log10(prob_epsilon)+-0.028455*pow(np.log10(prob_epsilon),2)) * np.exp((1.881824+0.117058*np.log10(prob_epsilon)+0.004208*pow(np.log10(prob_epsilon),2))*np.maximum(np.log10(pmodcts[msk]),-4))+1);
-    #
-    offsetlo = np.rint(-0.523564-0.75129*np.log10(prob_epsilon))
-    offsetup = np.rint(-1.09374-0.716202*np.log10(prob_epsilon))
-    kmin[~msk] = np.rint(pmodcts[~msk]-np.sqrt(pmodcts[~msk])*erfcinv(prob_epsilon)*np.sqrt(2)+offsetlo)
-    kmax[~msk] = np.rint(pmodcts[~msk]+np.sqrt(pmodcts[~msk])*erfcinv(prob_epsilon)*np.sqrt(2)+offsetup)
-    msk = kmin<0
-    kmin[msk] = 0
-    
     # prepare the binning of the LL histogram
     hnbin = nbinpdf*len(smodcts)
     hxmax = scaleaxis*(ngaus+np.sum(pweights))
     hstep = hxmax/hnbin
 
-    result = np.zeros(hnbin,dtype=float)
     hbinedge = np.linspace(0,hxmax+hstep,num=hnbin+1,endpoint=False)
     hbincen = 0.5*(hbinedge[1:] + hbinedge[:-1])
 
+    # list of the LL histograms that are convolved to get the LL distribution
+    hists = []
     if ngaus>0:
         # compute the histogram of LL values with the incomplete gamma function
         # setting the incomplete gamma parameters so that it corresponds to the chi2 distribution with ngaus degrees of freedom
@@ -138,50 +138,166 @@ def getDeviationProbability(datcts, modcts, weights, maxpoissoncount, prob_epsil
         resultc = np.cumsum(result)
         msk = resultc>1-prob_epsilon
         result[msk] = 0
+        hists.append(trimLLHistogram(result))
     else:
         # prepare the histogram of LL values corresponding to the first bin with model counts = pmodcts[0]
-        vecdat0 = np.arange(kmin[0],kmax[0]+1)
-        vecPP0 = poisson.pmf(vecdat0,pmodcts[0])
-        vecLL0 = -pweights[0]*np.log(vecPP0)
-        result, hbinedge = np.histogram(vecLL0,bins=hnbin,range=(0,hxmax),weights=vecPP0)
+        hists.append(getFirstLLHistogram(pmodcts[0],pweights[0],prob_epsilon,hnbin,hxmax,llgrid,llcache))
 
-    # build the LL distribution iteratively, starting from the first Poissonian bin (if ngaus>0) or the second bin (if ngaus==0)
+    # LL histograms of the other Poissonian bins, starting from the first Poissonian bin (if ngaus>0) or the second bin (if ngaus==0)
     istart = int(0)
     if ngaus==0:
         istart = 1
-    for i in np.arange(istart,len(pmodcts)):
-        vecdat = np.arange(kmin[i],kmax[i]+1)
-        # get prob and LL values for [kmin,kmax]
-        vecLLw = poisson.logpmf(vecdat,pmodcts[i])
-        vecPP = np.exp(vecLLw)
-        vecLLw *= (-pweights[i]/hstep)
-        # get shift = bin # of LL value along the x-axis
-        binshift = np.rint(vecLLw,out=vecdat,casting='unsafe')
-
-        # shift the current LL histogram by binshift to fill the 2d array
-        # accumulate the 2d array as we go so we never have to actually
-        # allocate it
-        comp_binshift = len(result)-binshift
-        tmp = np.zeros_like(result)
-        for j in range(0,len(vecPP)):
-            tmp[binshift[j]:] += vecPP[j]*result[:comp_binshift[j]]
-
-        # project onto the x-axis to get the new LL histogram
-        result = tmp
-
-    # get the largest LL value of the LL histogram
-    mskhist = result > 0
-    xnz = hbincen[mskhist]
-    LLmax = xnz[-1]
+    hists += getLLKernels(pmodcts[istart:],pweights[istart:],prob_epsilon,hstep,hnbin,llgrid,llcache)
+
+    # get the largest LL value of the LL distribution, given by the sum of the largest LL values of all the bins
+    imax = min(hnbin-1,int(np.sum([len(h)-1 for h in hists])))
+    LLmax = hbincen[imax]
     # set data LL to the maximum one if needed
     if dat_LL > LLmax:
         dat_LL = LLmax
     ibin = int(dat_LL/hstep)
-    pdat = np.sum(result[ibin:])
+    pdat = convolveLLHistograms(hists,ibin,hnbin)
     #print('pdat %f PS %f' % (pdat,-np.log10(pdat)))
 
     return pdat, np.sum(allres)
 
+def getPoissonKRange(modcts, prob_epsilon):
+    # for each bin, get [k_min,k_max] interval such that sum_{k_min,k_max}(poisson(k,model_counts)) = 1-prob_epsilon
+    kmin = np.zeros(len(modcts),dtype=int)
+    kmax = np.zeros(len(modcts),dtype=int)
+    msk = modcts < 5
+    kmin[msk] = 0
+    kmax[msk] = np.rint(0.715029+0.049825*np.log10(prob_epsilon)+0.011768*pow(np.log10(prob_epsilon),2) + (-0.308206+-1.309547*np.log10(prob_epsilon)+-0.028455*pow(np.log10(prob_epsilon),2)) * np.exp((1.881824+0.117058*np.log10(prob_epsilon)+0.004208*pow(np.log10(prob_epsilon),2))*np.maximum(np.log10(modcts[msk]),-4))+1);
+    #
+    offsetlo = np.rint(-0.523564-0.75129*np.log10(prob_epsilon))
+    offsetup = np.rint(-1.09374-0.716202*np.log10(prob_epsilon))
+    kmin[~msk] = np.rint(modcts[~msk]-np.sqrt(modcts[~msk])*erfcinv(prob_epsilon)*np.sqrt(2)+offsetlo)
+    kmax[~msk] = np.rint(modcts[~msk]+np.sqrt(modcts[~msk])*erfcinv(prob_epsilon)*np.sqrt(2)+offsetup)
+    msk = kmin<0
+    kmin[msk] = 0
+    return kmin, kmax
+
+def trimLLHistogram(hist):
+    # remove the trailing empty bins of a histogram
+    nz = np.flatnonzero(hist)
+    if len(nz)==0:
+        return hist[:0]
+    return hist[:nz[-1]+1]
+
+def quantizeLLGrid(value, llgrid):
+    # round a positive value to the closest point of a logarithmic grid with llgrid points per decade
+    if llgrid<=0:
+        return value
+    return np.power(10.,np.rint(np.log10(value)*llgrid)/llgrid)
+
+def getFirstLLHistogram(modcts, weight, prob_epsilon, hnbin, hxmax, llgrid=0, llcache=None):
+    # histogram of the LL values of a Poissonian bin with model counts modcts on the LL axis [0,hxmax]
+    modcts = float(quantizeLLGrid(modcts,llgrid))
+    weight = float(quantizeLLGrid(weight,llgrid))
+    key = ('hist',modcts,weight,hnbin,hxmax)
+    if llcache is not None and key in llcache:
+        return llcache[key]
+    kmin, kmax = getPoissonKRange(np.array([modcts]),prob_epsilon)
+    vecdat0 = np.arange(kmin[0],kmax[0]+1)
+    vecPP0 = poisson.pmf(vecdat0,modcts)
+    vecLL0 = -weight*np.log(vecPP0)
+    result, hbinedge = np.histogram(vecLL0,bins=hnbin,range=(0,hxmax),weights=vecPP0)
+    result = trimLLHistogram(result)
+    if llcache is not None:
+        llcache[key] = result
+    return result
+
+def getLLKernels(modcts, weights, prob_epsilon, hstep, hnbin, llgrid=0, llcache=None):
+    # distributions of the LL values of Poissonian bins with model counts modcts in units of the LL bin width hstep
+    # (element n of each kernel is the probability of the LL values that shift the LL histogram by n bins)
+    # with llgrid>0, the model counts and weights are rounded to a logarithmic grid with llgrid points per decade
+    # so that the kernels are shared by the bins with similar model counts
+    # the kernels that are not found in llcache are computed together
+    qmodcts = quantizeLLGrid(np.asarray(modcts,dtype=float),llgrid).tolist()
+    qweights = quantizeLLGrid(np.asarray(weights,dtype=float),llgrid).tolist()
+    keys = [('kernel',m,w,hstep,hnbin) for m, w in zip(qmodcts,qweights)]
+    if llcache is None:
+        llcache = {}
+    newkeys = list(set([key for key in keys if key not in llcache]))
+    if len(newkeys)>0:
+        qmodcts = np.array([key[1] for key in newkeys])
+        qweights = np.array([key[2] for key in newkeys])
+        kmin, kmax = getPoissonKRange(qmodcts,prob_epsilon)
+        # get prob and LL values for [kmin,kmax] of all the kernels
+        nk = kmax-kmin+1
+        ikernel = np.repeat(np.arange(len(newkeys)),nk)
+        vecdat = np.arange(np.sum(nk))-np.repeat(np.cumsum(nk)-nk,nk)+np.repeat(kmin,nk)
+        vecLL = xlogy(vecdat,qmodcts[ikernel])-qmodcts[ikernel]-gammaln(vecdat+1)
+        vecPP = np.exp(vecLL)
+        # get shift = bin # of LL value along the x-axis
+        binshift = np.rint(vecLL*(-qweights[ikernel]/hstep)).astype(int)
+        msk = (binshift>=0) & (binshift<hnbin)
+        kernels = np.bincount(ikernel[msk]*hnbin+binshift[msk],weights=vecPP[msk],minlength=len(newkeys)*hnbin)
+        kernels = kernels.reshape(len(newkeys),hnbin)
+        # remove the trailing empty bins of each kernel
+        nz = kernels>0
+        nlen = np.where(np.any(nz,axis=1),hnbin-np.argmax(nz[:,::-1],axis=1),0)
+        for key, kernel, n in zip(newkeys,kernels,nlen):
+            llcache[key] = kernel[:n]
+    return [llcache[key] for key in keys]
+
+def convolveLLHistograms(hists, ibin, hnbin):
+    #
+    # return the sum over the bins >= ibin of the first hnbin bins of the convolution of the LL histograms
+    #
+    # The convolution is computed with FFTs of exponentially tilted histograms: each histogram h(n) is replaced
+    # by h(n)*exp(theta*n)/Z with theta chosen such that the mean of the convolution is close to ibin (saddle point).
+    # This keeps the relative precision of the FFT on the tail of the distribution, which is needed for large PS values.
+    nhist = len(hists)
+    width = max([len(h) for h in hists])
+    if width==0:
+        return 0.
+    loghist = np.full((nhist,width),-np.inf)
+    with np.errstate(divide='ignore'):
+        for i, h in enumerate(hists):
+            loghist[i,:len(h)] = np.log(h)
+    n = np.arange(width)
+
+    def tilt(theta):
+        a = loghist + theta*n
+        amax = np.max(a,axis=1,keepdims=True)
+        w = np.exp(a-amax)
+        wsum = np.sum(w,axis=1,keepdims=True)
+        p = w/wsum
+        mean = np.sum(p*n,axis=1)
+        var = np.sum(p*n*n,axis=1)-mean*mean
+        return p, np.sum(amax[:,0]+np.log(wsum[:,0])), np.sum(mean), np.sum(var)
+
+    # solve mean(theta) = ibin within one standard deviation with Newton steps safeguarded by bisection
+    # the distribution is not tilted if its mean is already above ibin
+    theta = 0.
+    p, logz, mean, var = tilt(theta)
+    thetalo = 0.
+    thetahi = np.inf
+    for it in range(100):
+        tol = max(0.5,np.sqrt(max(var,0)))
+        if mean>=ibin-tol and (theta==0 or mean<=ibin+tol):
+            break
+        if var<=0 or thetahi-thetalo<1e-6:
+            break
+        if mean<ibin:
+            thetalo = theta
+        else:
+            thetahi = theta
+        theta = theta + (ibin-mean)/var
+        if theta<=thetalo or theta>=thetahi:
+            theta = 0.5*(thetalo+thetahi) if np.isfinite(thetahi) else 2*thetalo+1.
+        p, logz, mean, var = tilt(theta)
+
+    nfft = scipy.fft.next_fast_len(int(np.sum([len(h)-1 for h in hists]))+1)
+    conv = scipy.fft.irfft(np.prod(scipy.fft.rfft(p,nfft,axis=1),axis=0),nfft)
+    nmax = min(hnbin,nfft)
+    if ibin>=nmax:
+        return 0.
+    k = np.arange(ibin,nmax)
+    conv = np.maximum(conv[ibin:nmax],0)
+    return float(np.sum(conv*np.exp(logz-theta*k)))
+
 def convolve_map(m, k, cpix, threshold=0.001):
     # piece of code copied from fermipy residmap (see https://fermipy.readthedocs.io/en/latest/)
     o = np.zeros(m.shape,dtype=np.float64)
@@ -379,15 +495,56 @@ def prepPSFintegmap(componentname, cmapfilename, mmapfilename, wmapfilename, psf
     return C0mod_summed_map, C0dat_summed_map, C0weight_ave_map, C0logselenergycenter
 
 def rebin_spectrum(C0logselenergycenter,C0datcounts,C0modcounts,C0weights,hlogebin):
+    # project the spectra on hlogebin
+    # the count and weight arrays can have additional (pixel) dimensions after the energy dimension
+    C0proj = np.zeros((len(hlogebin)-1,len(C0logselenergycenter)),dtype=float)
+    for k in range(len(C0logselenergycenter)):
+        C0proj[:,k], hbinedge = np.histogram(C0logselenergycenter[k:k+1],bins=hlogebin)
     C0aveinvwgt = C0datcounts/C0weights
-    C0datres, hbinedge = np.histogram(C0logselenergycenter,bins=hlogebin,weights=C0datcounts)
-    C0modres, hbinedge = np.histogram(C0logselenergycenter,bins=hlogebin,weights=C0modcounts)
-    C0aveinvwgtres, hbinedge = np.histogram(C0logselenergycenter,bins=hlogebin,weights=C0aveinvwgt)
+    C0datres = np.tensordot(C0proj,C0datcounts,axes=1)
+    C0modres = np.tensordot(C0proj,C0modcounts,axes=1)
+    C0aveinvwgtres = np.tensordot(C0proj,C0aveinvwgt,axes=1)
     mskdat = C0datres>0
     C0aveinvwgtres[mskdat] = C0aveinvwgtres[mskdat]/C0datres[mskdat]
     C0aveinvwgtres[~mskdat] = 1
     return C0datres,C0modres,C0aveinvwgtres
 
+def combine_spectra(components, hlogebin, jpix, ipix):
+    #
+    # sum the PSF-like integrated spectra of all components projected on hlogebin in pixels (jpix,ipix)
+    # jpix and ipix can be integers or arrays of pixel indices
+    # returns the data and model counts and weights (with the energy dimension first)
+    # and the list of the projected spectra of each component
+    datcounts = 0
+    modcounts = 0
+    aveinvwgt = 0
+    compres = []
+    for mod_summed_map, dat_summed_map, weight_ave_map, logselenergycenter in components:
+        datres,modres,aveinvwgtres = rebin_spectrum(logselenergycenter,dat_summed_map[:,jpix,ipix],mod_summed_map[:,jpix,ipix],weight_ave_map[:,jpix,ipix],hlogebin)
+        datcounts = datcounts + datres
+        modcounts = modcounts + modres
+        aveinvwgt = aveinvwgt + datres*aveinvwgtres # equivalent to dat/(1/invwgt)
+        compres.append((datres,modres,aveinvwgtres))
+    mskdat = datcounts>0
+    aveinvwgt[mskdat] = aveinvwgt[mskdat]/datcounts[mskdat]
+    aveinvwgt[~mskdat] = 1
+    weights = 1/aveinvwgt
+    return datcounts, modcounts, weights, compres
+
+def getDeviationProbabilityBlock(block, maxpoissoncount, prob_epsilon, nbinpdf, scaleaxis, llgrid=0):
+    #
+    # compute the deviation probability of a block of pixels
+    # block = (datcounts, modcounts, weights) with the energy dimension first and the pixel dimension second
+    # the LL histograms of the Poissonian bins are shared by all the pixels of the block
+    datcounts, modcounts, weights = block
+    npix = datcounts.shape[1]
+    prob = np.zeros(npix,dtype=float)
+    totres = np.zeros(npix,dtype=float)
+    llcache = {}
+    for k in range(npix):
+        prob[k], totres[k] = getDeviationProbability(datcounts[:,k],modcounts[:,k],weights[:,k],maxpoissoncount,prob_epsilon,nbinpdf,scaleaxis,llcache=llcache,llgrid=llgrid)
+    return prob, totres
+
 def run(args):
 
     o = {} # this sintax is to respect matt syntax where all the output are saved in the dictionary called "o"
@@ -434,9 +591,13 @@ def run(args):
     prob_epsilon = np.maximum(args['prob_epsilon'],1e-15)
     nbinpdf = args['nbinpdf']
     scaleaxis = args['scaleaxis']
+    llgrid = args.get('llgrid',0)
     ipix = args['ipix']
     jpix = args['jpix']
     dpix = args['dpix']
+    nthread = 1
+    if args.get('multithread',False):
+        nthread = args.get('nthread',None)
     #write_fits = args['write_fits']
 
     # Remove the components that are outside the energy range [emin,emax]
@@ -461,18 +622,15 @@ def run(args):
     if optweight and len(cmaplst0)!=len(wmaplst0):
         print('The numbers of data and weight components after energy range verification are not the same. Exiting.')
         return o
-    if len(cmaplst)>4:
-        print('Considering only the first 4 components.')
 
-    psfpar0c = np.zeros(4,dtype=float)
-    for i in range(0,len(cmaplst)):
+    ncomponent = len(cmaplst)
+    psfpar0c = np.zeros(ncomponent,dtype=float)
+    for i in range(0,ncomponent):
         psfpar0c[i] = psfpar0
         if(len(par0lst)>0):
             psfpar0c[i] = float(par0lst[i])
-    
-    optcomponent = np.zeros(4,dtype=int)
-    for i in range(0,len(cmaplst)):
-        optcomponent[i] = 1
+
+    for i in range(0,ncomponent):
         if optweight==False:
             wmaplst.append('')
         if chatter>0:
@@ -520,7 +678,7 @@ def run(args):
     C0dat_hdulist.close()
 
     if fixedradius>0:
-        for i in range(0,len(cmaplst)):
+        for i in range(0,ncomponent):
             psfpar0c[i] = 0
         psfpar3 = fixedradius
         if chatter>0:
@@ -528,31 +686,15 @@ def run(args):
     else:
         if chatter>0:
             print ('Computing PSF-like summed maps with energy dependent selection:')
-            print ('Component0: (%f deg, %f MeV, %f, %f deg)' % (psfpar0c[0],psfpar1,psfpar2,psfpar3))
-            if optcomponent[1]:
-                print ('Component1: (%f deg, %f MeV, %f, %f deg)' % (psfpar0c[1],psfpar1,psfpar2,psfpar3))
-            if optcomponent[2]:
-                print ('Component2: (%f deg, %f MeV, %f, %f deg)' % (psfpar0c[2],psfpar1,psfpar2,psfpar3))
-            if optcomponent[3]:
-                print ('Component3: (%f deg, %f MeV, %f, %f deg)' % (psfpar0c[3],psfpar1,psfpar2,psfpar3))
-
-
-    psfpar = np.zeros(4,dtype=float)
-
-    psfpar[0] = psfpar0c[0]; psfpar[1] = psfpar1; psfpar[2] = psfpar2; psfpar[3] = psfpar3
-    C0mod_summed_map, C0dat_summed_map, C0weight_ave_map, C0logselenergycenter = prepPSFintegmap('Component0',cmaplst[0],mmaplst[0],wmaplst[0],psfpar,emin,emax,chatter)
-
-    if optcomponent[1]:
-        psfpar[0] = psfpar0c[1]; psfpar[1] = psfpar1; psfpar[2] = psfpar2; psfpar[3] = psfpar3
-        C1mod_summed_map, C1dat_summed_map, C1weight_ave_map, C1logselenergycenter = prepPSFintegmap('Component1',cmaplst[1],mmaplst[1],wmaplst[1],psfpar,emin,emax,chatter)
+            for i in range(0,ncomponent):
+                print ('Component%d: (%f deg, %f MeV, %f, %f deg)' % (i,psfpar0c[i],psfpar1,psfpar2,psfpar3))
 
-    if optcomponent[2]:
-        psfpar[0] = psfpar0c[2]; psfpar[1] = psfpar1; psfpar[2] = psfpar2; psfpar[3] = psfpar3
-        C2mod_summed_map, C2dat_summed_map, C2weight_ave_map, C2logselenergycenter = prepPSFintegmap('Component2',cmaplst[2],mmaplst[2],wmaplst[2],psfpar,emin,emax,chatter)
 
-    if optcomponent[3]:
-        psfpar[0] = psfpar0c[3]; psfpar[1] = psfpar1; psfpar[2] = psfpar2; psfpar[3] = psfpar3
-        C3mod_summed_map, C3dat_summed_map, C3weight_ave_map, C3logselenergycenter = prepPSFintegmap('Component3',cmaplst[3],mmaplst[3],wmaplst[3],psfpar,emin,emax,chatter)
+    # PSF-like integrated maps of all components: list of (model map, data map, weight map, log10 energy of the selected bins)
+    components = []
+    for i in range(0,ncomponent):
+        psfpar = np.array([psfpar0c[i],psfpar1,psfpar2,psfpar3],dtype=float)
+        components.append(prepPSFintegmap('Component%d' % (i),cmaplst[i],mmaplst[i],wmaplst[i],psfpar,emin,emax,chatter))
 
     if chatter>0:
         print('Computing the PS map (nbinpdf=%d, scaleaxis=%3.2f, maxpoissoncount=%3.2f, prob_epsilon=%g) between %f MeV and %f MeV with %d bins (log10(E) bin width=%.2f):\n(for each column of the map, the integer part of the maximum value of abs(PS) in sigma is given as one character [1,..,9,A=10,B=11,..,Y=34,Z>=35])' %(nbinpdf,scaleaxis,maxpoissoncount,prob_epsilon,emin,emax,nbinloge,logebinwidth))
@@ -571,81 +713,64 @@ def run(args):
     psvalstr.extend(['K','L','M','N','O','P','Q','R','S','T'])
     psvalstr.extend(['U','V','W','X','Y','Z'])
 
-    nbnan = int(0)
-    psmaxcol = 0
     axisrange1 = range(naxis1)
     axisrange2 = range(naxis2)
     # change range if ipix and jpix are provided
     if ipix>0 and jpix>0 and dpix>=0:
         axisrange1 = range(np.maximum(0,ipix-1-dpix),np.minimum(naxis1,ipix+dpix))
         axisrange2 = range(np.maximum(0,jpix-1-dpix),np.minimum(naxis2,jpix+dpix))
-    
-    # loop over the pixels and compute PS
-    for i in axisrange1:
-        psmaxcol = 0;
-        for j in axisrange2:
-            #
-            # project C0 on hlogebin
-            C0datres,C0modres,C0aveinvwgtres = rebin_spectrum(C0logselenergycenter,C0dat_summed_map[:,j,i],C0mod_summed_map[:,j,i],C0weight_ave_map[:,j,i],hlogebin)
-            datcounts = C0datres
-            modcounts = C0modres
-            aveinvwgt = C0datres*C0aveinvwgtres # equivalent to dat/(1/invwgt)
-            #
-            # project C1 on hlogebin
-            if optcomponent[1]:
-                C1datres,C1modres,C1aveinvwgtres = rebin_spectrum(C1logselenergycenter,C1dat_summed_map[:,j,i],C1mod_summed_map[:,j,i],C1weight_ave_map[:,j,i],hlogebin)
-                datcounts = datcounts + C1datres
-                modcounts = modcounts + C1modres
-                aveinvwgt = aveinvwgt + C1datres*C1aveinvwgtres
-            #
-            # project C2 on hlogebin
-            if optcomponent[2]:
-                C2datres,C2modres,C2aveinvwgtres = rebin_spectrum(C2logselenergycenter,C2dat_summed_map[:,j,i],C2mod_summed_map[:,j,i],C2weight_ave_map[:,j,i],hlogebin)
-                datcounts = datcounts + C2datres
-                modcounts = modcounts + C2modres
-                aveinvwgt = aveinvwgt + C2datres*C2aveinvwgtres
-            #
-            # project C3 on hlogebin
-            if optcomponent[3]:
-                C3datres,C3modres,C3aveinvwgtres = rebin_spectrum(C3logselenergycenter,C3dat_summed_map[:,j,i],C3mod_summed_map[:,j,i],C3weight_ave_map[:,j,i],hlogebin)
-                datcounts = datcounts + C3datres
-                modcounts = modcounts + C3modres
-                aveinvwgt = aveinvwgt + C3datres*C3aveinvwgtres
-            #
-            mskdat = datcounts>0
-            aveinvwgt[mskdat] = aveinvwgt[mskdat]/datcounts[mskdat]
-            aveinvwgt[~mskdat] = 1
-            weights = 1/aveinvwgt
-            #
-            prob, totres = getDeviationProbability(datcounts,modcounts,weights,maxpoissoncount,prob_epsilon,nbinpdf,scaleaxis)
-            if np.isnan(prob):
-                nbnan = nbnan+1
-            if prob<1e-311:
-                prob = 1e-311
-            ps = -np.log10(prob)
-            #
-            if ps>psmaxcol:
-                psmaxcol = ps
-            if totres<0:
-                ps = -ps
-            totresmap[j,i] = totres
-            psmap[j,i] = ps
-            if ps<psmin:
-                psmin = ps
-                imin = i
-                jmin = j
-            if ps>psmax:
-                psmax = ps
-                imax = i
-                jmax = j
+
+    # pixels in the order of the columns of the map
+    ivec, jvec = np.meshgrid(np.array(axisrange1,dtype=int),np.array(axisrange2,dtype=int),indexing='ij')
+    ivec = np.ravel(ivec)
+    jvec = np.ravel(jvec)
+
+    # project all the components on hlogebin for all the pixels at once
+    datcounts, modcounts, weights, compres = combine_spectra(components,hlogebin,jvec,ivec)
+
+    # compute PS in blocks of columns of the map that are distributed over the worker processes
+    ncol = len(axisrange1)
+    nrow = len(axisrange2)
+    blocksize = nrow*max(1,int(2048/max(nrow,1)))
+    blocks = [(datcounts[:,k:k+blocksize],modcounts[:,k:k+blocksize],weights[:,k:k+blocksize]) for k in range(0,len(ivec),blocksize)]
+    pool = WorkerPool(nthread)
+    try:
+        results = pool.map(getDeviationProbabilityBlock,blocks,maxpoissoncount=maxpoissoncount,prob_epsilon=prob_epsilon,nbinpdf=nbinpdf,scaleaxis=scaleaxis,llgrid=llgrid)
+    finally:
+        pool.close()
+    prob = np.concatenate([np.zeros(0)]+[r[0] for r in results])
+    totres = np.concatenate([np.zeros(0)]+[r[1] for r in results])
+
+    nbnan = int(np.sum(np.isnan(prob)))
+    prob[prob<1e-311] = 1e-311
+    ps = -np.log10(prob)
+
+    # for each column, the maximum value of abs(PS) in sigma
+    if chatter>0 and len(ps)>0:
+        psmaxcol = np.max(np.where(ps.reshape(ncol,nrow)>0,ps.reshape(ncol,nrow),0),axis=1)
         psmaxcol = np.sqrt(2) * erfcinv(np.power(10., -np.abs(psmaxcol)))
-        ipsvalstr = int(psmaxcol)
-        if ipsvalstr>35:
-            ipsvalstr = 35
-        mycom = '%s' % (psvalstr[ipsvalstr])
-        if chatter>0:
-            sys.stdout.write(mycom)
-            sys.stdout.flush()
+        for ipsvalstr in np.minimum(psmaxcol.astype(int),35):
+            sys.stdout.write(psvalstr[ipsvalstr])
+        sys.stdout.flush()
+
+    ps[totres<0] = -ps[totres<0]
+    totresmap[jvec,ivec] = totres
+    psmap[jvec,ivec] = ps
+
+    # first pixel with the minimum and maximum PS
+    mskvalid = ~np.isnan(ps)
+    if np.any(mskvalid):
+        validindex = np.flatnonzero(mskvalid)
+        k = validindex[np.argmin(ps[mskvalid])]
+        if ps[k]<psmin:
+            psmin = ps[k]
+            imin = ivec[k]
+            jmin = jvec[k]
+        k = validindex[np.argmax(ps[mskvalid])]
+        if ps[k]>psmax:
+            psmax = ps[k]
+            imax = ivec[k]
+            jmax = jvec[k]
 
     if chatter>0:
         print ('')
@@ -688,50 +813,17 @@ def run(args):
     o['ipix'] = imax + 1
     o['jpix'] = jmax + 1
 
-    # project C0 on hlogebin
-    C0datres,C0modres,C0aveinvwgtres = rebin_spectrum(C0logselenergycenter,C0dat_summed_map[:,jmax,imax],C0mod_summed_map[:,jmax,imax],C0weight_ave_map[:,jmax,imax],hlogebin)
-    datcounts = C0datres
-    modcounts = C0modres
-    aveinvwgt = C0datres*C0aveinvwgtres # equivalent to dat/(1/invwgt)
-    #
-    # project C1 on hlogebin
-    if optcomponent[1]:
-        C1datres,C1modres,C1aveinvwgtres = rebin_spectrum(C1logselenergycenter,C1dat_summed_map[:,jmax,imax],C1mod_summed_map[:,jmax,imax],C1weight_ave_map[:,jmax,imax],hlogebin)
-        datcounts = datcounts + C1datres
-        modcounts = modcounts + C1modres
-        aveinvwgt = aveinvwgt + C1datres*C1aveinvwgtres
-        #
-    # project C2 on hlogebin
-    if optcomponent[2]:
-        C2datres,C2modres,C2aveinvwgtres = rebin_spectrum(C2logselenergycenter,C2dat_summed_map[:,jmax,imax],C2mod_summed_map[:,jmax,imax],C2weight_ave_map[:,jmax,imax],hlogebin)
-        datcounts = datcounts + C2datres
-        modcounts = modcounts + C2modres
-        aveinvwgt = aveinvwgt + C2datres*C2aveinvwgtres
-        #
-    # project C3 on hlogebin
-    if optcomponent[3]:
-        C3datres,C3modres,C3aveinvwgtres = rebin_spectrum(C3logselenergycenter,C3dat_summed_map[:,jmax,imax],C3mod_summed_map[:,jmax,imax],C3weight_ave_map[:,jmax,imax],hlogebin)
-        datcounts = datcounts + C3datres
-        modcounts = modcounts + C3modres
-        aveinvwgt = aveinvwgt + C3datres*C3aveinvwgtres
-    #
-    mskdat = datcounts>0
-    aveinvwgt[mskdat] = aveinvwgt[mskdat]/datcounts[mskdat]
-    aveinvwgt[~mskdat] = 1
-    weights = 1/aveinvwgt
+    # project all the components on hlogebin in the pixel with the maximum PS
+    datcounts, modcounts, weights, compres = combine_spectra(components,hlogebin,jmax,imax)
 
     if chatter>1:
         print ('PSF-like integrated count spectra in pixel (%d,%d):' %(imax+1,jmax+1))
         for i in range(len(datcounts)):
             mystr = ('bin %02d [%10.3f,%10.3f] dat %7.0f mod %10.3f wgt %3.2f' % (i,np.power(10,hlogebin[i]),np.power(10,hlogebin[i+1]),datcounts[i],modcounts[i],weights[i]))
             if chatter>2:
-                mystr = ('%s   C0 %7.0f %10.3f %3.2f' %(mystr,C0datres[i],C0modres[i],1/C0aveinvwgtres[i]))
-                if optcomponent[1]:
-                    mystr = ('%s C1 %7.0f %10.3f %3.2f' %(mystr,C1datres[i],C1modres[i],1/C1aveinvwgtres[i]))
-                if optcomponent[2]:
-                    mystr = ('%s C2 %7.0f %10.3f %3.2f' %(mystr,C2datres[i],C2modres[i],1/C2aveinvwgtres[i]))
-                if optcomponent[3]:
-                    mystr = ('%s C3 %7.0f %10.3f %3.2f' %(mystr,C3datres[i],C3modres[i],1/C3aveinvwgtres[i]))
+                mystr = ('%s  ' %(mystr))
+                for c, (Cdatres,Cmodres,Caveinvwgtres) in enumerate(compres):
+                    mystr = ('%s C%d %7.0f %10.3f %3.2f' %(mystr,c,Cdatres[i],Cmodres[i],1/Caveinvwgtres[i]))
             print ('%s' %(mystr))
 
     psmapsigma = np.sign(psmap) * np.sqrt(2) * erfcinv(np.power(10., -np.abs(psmap)))
@@ -794,6 +886,9 @@ if __name__ == "__main__":
     parser.add_argument("-pe", "--prob_epsilon", required=False, type=float, default=1e-7, help="LL computation: precision parameter")
     parser.add_argument("-nb", "--nbinpdf", required=False, type=int, default=50, help="LL computation: number of bins")
     parser.add_argument("-sa", "--scaleaxis", required=False, type=float, default=20, help="LL computation: scale axis")
+    parser.add_argument("-lg", "--llgrid", required=False, type=int, default=0, help="LL computation: number of points per decade of the grid on which the model counts of the LL histograms are quantized (0: no quantization)")
+    parser.add_argument("-mt", "--multithread", required=False, action='store_true', help="PS computation: split the pixels across the number of processes set by nthread")
+    parser.add_argument("-nt", "--nthread", required=False, type=int, default=None, help="PS computation: number of processes (default: one per core)")
 
     args = vars(parser.parse_args())
     o=run(args)
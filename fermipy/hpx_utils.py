@@ -3,7 +3,9 @@
 Utilities for dealing with HEALPix projections and mappings
 """
 from __future__ import absolute_import, division, print_function
+import os
 import re
+from collections import OrderedDict
 import healpy as hp
 import numpy as np
 from astropy.io import fits
@@ -12,6 +14,7 @@ from astropy.coordinates import SkyCoord
 from astropy.coordinates import Galactic, ICRS
 
 from fermipy.wcs_utils import WCSProj
+from fermipy.file_cache import make_cache_key
 
 # This is an approximation of the size of HEALPix pixels (in degrees)
 # for a particular order.   It is used to convert from HEALPix to WCS-based
@@ -20,6 +23,13 @@ HPX_ORDER_TO_PIXSIZE = [32.0, 16.0, 8.0, 4.0, 2.0, 1.0,
                         0.50, 0.25, 0.1, 0.05, 0.025, 0.01,
                         0.005, 0.002]
 
+# Mappings between HEALPix and WCS pixelizations created with
+# HpxToWcsMapping.create, keyed by make_hpx_to_wcs_mapping_key.  Only
+# the most recently used mappings are kept in memory, up to a total of
+# HPX_TO_WCS_MAPPINGS_MAXSIZE bytes.  Set it to 0 to disable the cache.
+HPX_TO_WCS_MAPPINGS = OrderedDict()
+HPX_TO_WCS_MAPPINGS_MAXSIZE = 2.5E8
+
 
 class HPX_Conv(object):
     """ Data structure to define how a HEALPix map is stored to FITS """
@@ -142,20 +152,34 @@ def make_hpx_to_wcs_mapping_centers(hpx, wcs):
     npix = (int(wcs.wcs.crpix[0] * 2), int(wcs.wcs.crpix[1] * 2))
     mult_val = np.ones(npix).T.flatten()
     sky_crds = hpx.get_sky_coords()
-    pix_crds = wcs.wcs_world2pix(sky_crds, 0).astype(int)
+    pix_crds = wcs.wcs_world2pix(sky_crds, 0)
     ipixs = -1 * np.ones(npix, int).T.flatten()
-    pix_index = npix[1] * pix_crds[0:, 0] + pix_crds[0:, 1]
     if hpx._ipix is None:
-        for ipix, pix_crd in enumerate(pix_index):
-            ipixs[pix_crd] = ipix
+        ipix_vals = np.arange(len(pix_crds))
     else:
-        for pix_crd, ipix in zip(pix_index, hpx._ipix):
-            ipixs[pix_crd] = ipix
+        ipix_vals = np.asarray(hpx._ipix).flatten()
+
+    mask = np.all(np.isfinite(pix_crds), axis=1)
+    pix_crds = pix_crds[mask].astype(int)
+    ipix_vals = ipix_vals[mask]
+    pix_index = npix[1] * pix_crds[:, 0] + pix_crds[:, 1]
+
+    # Pixels just beyond the first column of an all-sky map wrap
+    # around to the last column
+    nwcs = npix[0] * npix[1]
+    mask = (pix_index >= -nwcs) & (pix_index < nwcs)
+    pix_index = pix_index[mask] % nwcs
+    ipix_vals = ipix_vals[mask]
+
+    # If several HEALPix pixel centers fall in the same WCS pixel
+    # the last one is used
+    pix_index, idx = np.unique(pix_index[::-1], return_index=True)
+    ipixs[pix_index] = ipix_vals[::-1][idx]
     ipixs = ipixs.reshape(npix).T.flatten()
     return ipixs, mult_val, npix
 
 
-def make_hpx_to_wcs_mapping(hpx, wcs):
+def make_hpx_to_wcs_mapping(hpx, wcs, chunk_size=2**20):
     """Make the mapping data needed to from from HPX pixelization to a
     WCS-based array
 
@@ -167,6 +191,9 @@ def make_hpx_to_wcs_mapping(hpx, wcs):
     wcs     : `~astropy.wcs.WCS`
        The wcs mapping (a pywcs.wcs object)
 
+    chunk_size : int
+       Approximate number of WCS pixels that are processed at once
+
     Returns
     -------
       ipixs    :  array(nx,ny) of HEALPix pixel indices for each wcs pixel
@@ -175,45 +202,63 @@ def make_hpx_to_wcs_mapping(hpx, wcs):
 
     """
     npix = (int(wcs.wcs.crpix[0] * 2), int(wcs.wcs.crpix[1] * 2))
-    pix_crds = np.dstack(np.meshgrid(np.arange(npix[0]),
-                                     np.arange(npix[1]))).swapaxes(0, 1).reshape((npix[0] * npix[1], 2))
     if wcs.wcs.naxis == 2:
-        sky_crds = wcs.wcs_pix2world(pix_crds, 0)
+        use_wcs = wcs
     else:
         use_wcs = wcs.dropaxis(2)
-        sky_crds = use_wcs.wcs_pix2world(pix_crds, 0)
-        
-    sky_crds *= np.radians(1.)
-    sky_crds[0:, 1] = (np.pi / 2) - sky_crds[0:, 1]
 
-    fullmask = np.isnan(sky_crds)
-    mask = (fullmask[0:, 0] + fullmask[0:, 1]) == 0
-    ipixs = -1 * np.ones(npix, int).T.flatten()
-    ipixs[mask] = hp.pixelfunc.ang2pix(hpx.nside, sky_crds[0:, 1][mask],
-                                       sky_crds[0:, 0][mask], hpx.nest)
-
-    # Here we are counting the number of HEALPix pixels each WCS pixel points to;
-    # this could probably be vectorized by filling a histogram.
-    d_count = {}
-    for ipix in ipixs:
-        if ipix in d_count:
-            d_count[ipix] += 1
-        else:
-            d_count[ipix] = 1
-
-    # Here we are getting a multiplicative factor that tells use how to split up
-    # the counts in each HEALPix pixel (by dividing the corresponding WCS pixels
-    # by the number of associated HEALPix pixels).
-    # This could also likely be vectorized.
-    mult_val = np.ones(ipixs.shape)
-    for i, ipix in enumerate(ipixs):
-        mult_val[i] /= d_count[ipix]
-
-    ipixs = ipixs.reshape(npix).flatten()
-    mult_val = mult_val.reshape(npix).flatten()
+    # The WCS pixels are processed in blocks of columns to limit the
+    # size of the temporary arrays
+    ipixs = -1 * np.ones(npix[0] * npix[1], int)
+    ncol = max(1, chunk_size // npix[1])
+    for xmin in range(0, npix[0], ncol):
+        xmax = min(xmin + ncol, npix[0])
+        pix_crds = np.column_stack((np.repeat(np.arange(xmin, xmax), npix[1]),
+                                    np.tile(np.arange(npix[1]), xmax - xmin)))
+        sky_crds = use_wcs.wcs_pix2world(pix_crds, 0)
+        sky_crds *= np.radians(1.)
+        sky_crds[0:, 1] = (np.pi / 2) - sky_crds[0:, 1]
+
+        mask = np.all(np.isfinite(sky_crds), axis=1)
+        ipixs_chunk = ipixs[xmin * npix[1]:xmax * npix[1]]
+        ipixs_chunk[mask] = hp.pixelfunc.ang2pix(hpx.nside,
+                                                 sky_crds[0:, 1][mask],
+                                                 sky_crds[0:, 0][mask],
+                                                 hpx.nest)
+
+    # Count the number of WCS pixels pointing at each HEALPix pixel
+    # and split the counts in each HEALPix pixel between them.  The
+    # WCS pixels outside the projection (ipixs = -1) are counted in
+    # the first bin.
+    ibin = ipixs + 1
+    with np.errstate(divide='ignore'):
+        mult_val = (1. / np.bincount(ibin))[ibin]
     return ipixs, mult_val, npix
 
 
+def make_hpx_to_wcs_mapping_key(hpx, wcs):
+    """ Make the key used to cache the mapping between a HEALPix and a
+    WCS pixelization
+
+    Parameters
+    ----------
+    hpx     : `~fermipy.hpx_utils.HPX`
+       The healpix mapping (an HPX object)
+
+    wcs     : `~fermipy.wcs_utils.WCSProj`
+       The wcs mapping
+
+    Returns
+    -------
+      key      :  str
+    """
+    pixels = None
+    if hpx.region is None and hpx._ipix is not None:
+        pixels = np.asarray(hpx._ipix)
+    return make_cache_key('hpx2wcs', hpx.nside, bool(hpx.nest), hpx.region,
+                          pixels, wcs.wcs.to_header_string())
+
+
 def match_hpx_pixel(nside, nest, nside_pix, ipix_ring):
     """
     """
@@ -950,37 +995,109 @@ class HpxToWcsMapping(object):
         HEALPix region"""
         return self._valid
 
+    @property
+    def nbytes(self):
+        """Memory in bytes used by the arrays of this mapping"""
+        return (self._ipixs.nbytes + self._mult_val.nbytes +
+                self._lmap.nbytes + self._valid.nbytes)
+
+    @classmethod
+    def create(cls, hpx, wcs, file_cache=None, use_cache=True):
+        """Return the mapping between a HEALPix and a WCS pixelization.
+
+        Mappings are identified by the HEALPix nside, ordering and
+        region and by the WCS header.  The most recently used
+        mappings are kept in memory up to a total size of
+        ``HPX_TO_WCS_MAPPINGS_MAXSIZE`` bytes and mappings can
+        optionally be stored on disk, such that they are only computed
+        once.
+
+        Parameters
+        ----------
+        hpx : `~fermipy.hpx_utils.HPX`
+            The HEALPix projection
+
+        wcs : `~fermipy.wcs_utils.WCSProj`
+            The WCS projection
+
+        file_cache : `~fermipy.file_cache.FileCache`
+            Persistent cache in which mappings are stored.  If None
+            mappings are only kept in memory.
+
+        use_cache : bool
+            Look up and store the mapping in the in-memory cache.
+        """
+        key = make_hpx_to_wcs_mapping_key(hpx, wcs)
+        mapping = HPX_TO_WCS_MAPPINGS.get(key, None) if use_cache else None
+        if mapping is not None:
+            HPX_TO_WCS_MAPPINGS.move_to_end(key)
+            return mapping
+
+        if file_cache is not None:
+            fitsfile = file_cache.entry_path(key, '.fits')
+            try:
+                mapping = cls.create_from_fitsfile(fitsfile, hpx, wcs)
+            except (IOError, OSError, KeyError, ValueError):
+                mapping = None
+
+        if mapping is None:
+            mapping = cls(hpx, wcs)
+            if file_cache is not None:
+                tmpfile = '%s.%i.tmp' % (fitsfile, os.getpid())
+                mapping.write_to_fitsfile(tmpfile)
+                os.replace(tmpfile, fitsfile)
+                file_cache.evict()
+
+        if use_cache and mapping.nbytes <= HPX_TO_WCS_MAPPINGS_MAXSIZE:
+            HPX_TO_WCS_MAPPINGS[key] = mapping
+            nbytes = sum(m.nbytes for m in HPX_TO_WCS_MAPPINGS.values())
+            while nbytes > HPX_TO_WCS_MAPPINGS_MAXSIZE:
+                nbytes -= HPX_TO_WCS_MAPPINGS.popitem(last=False)[1].nbytes
+        return mapping
+
     def write_to_fitsfile(self, fitsfile, clobber=True):
         """Write this mapping to a FITS file, to avoid having to recompute it
         """
-        from fermipy.skymap import Map
-        hpx_header = self._hpx.make_header()
-        index_map = Map(self.ipixs, self.wcs)
-        mult_map = Map(self.mult_val, self.wcs)
-        prim_hdu = index_map.create_primary_hdu()
-        mult_hdu = index_map.create_image_hdu()
-        for key in ['COORDSYS', 'ORDERING', 'PIXTYPE',
-                    'ORDERING', 'ORDER', 'NSIDE',
-                    'FIRSTPIX', 'LASTPIX']:
-            prim_hdu.header[key] = hpx_header[key]
-            mult_hdu.header[key] = hpx_header[key]
-
-        hdulist = fits.HDUList([prim_hdu, mult_hdu])
-        hdulist.writeto(fitsfile, overwrite=clobber)
+        header = self.wcs.wcs.to_header()
+        header.update(self._hpx.make_header())
+        npix = tuple(self.npix)
+        if self._hpx._maxpix < 2**31:
+            dtype = np.int32
+        else:
+            dtype = np.int64
+        prim_hdu = fits.PrimaryHDU(self.ipixs.reshape(npix).T.astype(dtype),
+                                   header=header)
+        mult_hdu = fits.ImageHDU(self.mult_val.reshape(npix).T,
+                                 header=header, name='MULT_VAL')
+        hdulist = [prim_hdu, mult_hdu]
+        if self._hpx.region is None and self._hpx._ipix is not None:
+            col = fits.Column('PIX', 'K', array=self._hpx._ipix)
+            hdulist += [fits.BinTableHDU.from_columns([col], name='PIXELS')]
+
+        fits.HDUList(hdulist).writeto(fitsfile, overwrite=clobber)
 
     @classmethod
-    def create_from_fitsfile(cls, fitsfile):
+    def create_from_fitsfile(cls, fitsfile, hpx=None, wcs=None):
         """ Read a fits file and use it to make a mapping
+
+        fitsfile : the file written by `write_to_fitsfile`
+        hpx      : the HEALPix projection, if None it is read from the file
+        wcs      : the WCS projection, if None it is read from the file
         """
-        from fermipy.skymap import Map
-        index_map = Map.create_from_fits(fitsfile)
-        mult_map = Map.create_from_fits(fitsfile, hdu=1)
-        ff = fits.open(fitsfile)
-        hpx = HPX.create_from_hdu(ff[0])
-        mapping_data = dict(ipixs=index_map.counts,
-                            mult_val=mult_map.counts,
-                            npix=mult_map.counts.shape)
-        return cls(hpx, index_map.wcs, mapping_data)
+        with fits.open(fitsfile) as hdulist:
+            header = hdulist[0].header
+            npix = (header['NAXIS1'], header['NAXIS2'])
+            mapping_data = dict(ipixs=hdulist[0].data.T.flatten().astype(int),
+                                mult_val=hdulist['MULT_VAL'].data.T.flatten(),
+                                npix=npix)
+            if hpx is None:
+                pixels = None
+                if 'PIXELS' in hdulist:
+                    pixels = np.array(hdulist['PIXELS'].data.field('PIX'))
+                hpx = HPX.create_from_header(header, pixels=pixels)
+            if wcs is None:
+                wcs = WCSProj(WCS(header, naxis=2), npix)
+        return cls(hpx, wcs, mapping_data)
 
     def fill_wcs_map_from_hpx_data(self, hpx_data, wcs_data, normalize=True):
         """Fills the wcs map from the hpx data using the pre-calculated
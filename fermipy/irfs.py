@@ -244,24 +244,40 @@ def compute_norm(sig, bkg, ts_thresh, min_counts, sum_axes=None, bkg_fit=None,
 
 def _solve_norm(sig, bkg, ts_thresh, min_counts, sig_scale, sum_axes,
                 bkg_fit=None):
+    """Find the signal scale at which the TS crosses ``ts_thresh`` by
+    linear interpolation on the grid ``sig_scale``.  The TS of every
+    element of the output array is evaluated on the last axis and all
+    elements are solved simultaneously.  The TS is interpolated on the
+    part of the grid above the scale with the smallest TS."""
 
     ts = np.apply_over_axes(np.sum, poisson_ts_fast(sig * sig_scale,
                                                     bkg, bkg_fit),
                             sum_axes)
-
-    vals = np.ones(ts.shape[:-1])
-    for idx, v in np.ndenumerate(ts[..., 0]):
-
-        if ts[idx][0] >= ts_thresh:
-            vals[idx] = sig_scale[idx][0]
-            continue
-
-        m = slice(np.argmin(ts[idx]), None)
-        vals[idx] = np.interp(ts_thresh, ts[idx][m], sig_scale[idx][m])
-        #fn = UnivariateSpline(ts[idx][m], sig_scale[idx][m], k=2, s=0)
-        #vals[idx] = fn(ts_thresh)
-
-    return vals
+    sig_scale = np.broadcast_to(sig_scale, ts.shape)
+    shape = ts.shape[:-1]
+    ts = ts.reshape(-1, ts.shape[-1])
+    sig_scale = sig_scale.reshape(ts.shape)
+    nstep = ts.shape[-1]
+    rows = np.arange(ts.shape[0])
+
+    # First grid point at or above the threshold after the TS minimum
+    steps = np.arange(nstep)[None, :]
+    imin = np.argmin(ts, axis=-1)
+    above = (ts >= ts_thresh) & (steps >= imin[:, None])
+    icross = np.where(np.any(above, axis=-1),
+                      np.argmax(above, axis=-1), nstep - 1)
+    i0 = np.maximum(icross - 1, imin)
+
+    ts0, ts1 = ts[rows, i0], ts[rows, icross]
+    s0, s1 = sig_scale[rows, i0], sig_scale[rows, icross]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vals = s0 + (ts_thresh - ts0) * (s1 - s0) / (ts1 - ts0)
+
+    # Threshold outside of the interpolation range
+    vals = np.where(icross == i0, s1, vals)
+    vals = np.where(ts[rows, icross] < ts_thresh, s1, vals)
+    vals = np.where(ts[:, 0] >= ts_thresh, sig_scale[:, 0], vals)
+    return vals.reshape(shape)
 
 
 class ExposureMap(HpxMap):
@@ -708,6 +724,54 @@ def calc_exp(skydir, ltc, event_class, event_types,
     return exp
 
 
+def calc_exp_skydirs(skydir, ltc, event_class, event_types, egy):
+    """Calculate the exposure versus energy at an array of sky
+    directions.  The exposure at each direction is computed from the
+    livetime distribution of the livetime cube pixel that contains
+    it.  The effective area is evaluated once and the exposures of
+    all livetime cube pixels are computed with a single matrix
+    product.
+
+    Parameters
+    ----------
+    skydir : `~astropy.coordinates.SkyCoord`
+        Array of sky coordinates.  Directions with undefined
+        coordinates are assigned zero exposure.
+
+    ltc : `~fermipy.irfs.LTCube`
+        Livetime cube object.
+
+    event_class : str
+        Event class string.
+
+    event_types : list
+        List of event type strings, e.g. ['FRONT','BACK'].
+
+    egy : `~numpy.ndarray`
+        Evaluation points in energy (MeV).
+
+    Returns
+    -------
+    exp : `~numpy.ndarray`
+        Array of exposures with the dimensions of energy and the
+        dimensions of ``skydir``.
+    """
+    skydir = skydir.transform_to('icrs')
+    ra = np.ravel(skydir.ra.deg)
+    dec = np.ravel(skydir.dec.deg)
+    m = np.isfinite(ra) & np.isfinite(dec)
+    ipix = hp.ang2pix(ltc.hpx.nside, np.pi / 2. - np.radians(dec[m]),
+                      np.radians(ra[m]), nest=ltc.hpx.nest)
+    upix, inv = np.unique(ipix, return_inverse=True)
+
+    exp = np.zeros((len(egy), len(ra)))
+    for et in event_types:
+        aeff = create_aeff(event_class, et, egy, ltc.costh_center)
+        exp[:, m] += np.dot(aeff, ltc.data[:, upix])[:, inv]
+
+    return exp.reshape((len(egy),) + skydir.shape)
+
+
 def create_avg_rsp(rsp_fn, skydir, ltc, event_class, event_types, x,
                    egy, cth_bins, npts=None):
     """Calculate the weighted response function.
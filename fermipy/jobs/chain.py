@@ -17,6 +17,8 @@ from fermipy.jobs.link import Link, extract_arguments
 from fermipy.jobs.file_archive import FileStageManager
 from fermipy.jobs.job_archive import JobStatus, JobStatusVector,\
     JobDetails, JOB_STATUS_STRINGS
+from fermipy.jobs.job_graph import JobNode, JobGraph
+from fermipy.jobs import defaults
 
 
 def purge_dict(idict):
@@ -40,9 +42,20 @@ class Chain(Link):
     to write a python module that implements a chain and also has a
     __main__ function to allow it to be called from the shell.
 
+    If the ``dag`` option is set the jobs of all the links are run as
+    a `JobGraph`: each job is started as soon as the jobs that produce
+    its input files are done, instead of waiting for the whole
+    previous link to finish.  The limit on the number of concurrent
+    jobs of an interface type (e.g. the number of cores for
+    `NativeInterface`) applies to the jobs of all the links together.
+
     """
+    default_options_base = dict(dag=defaults.jobs['dag'])
+
     def __init__(self, **kwargs):
         """C'tor """
+        self.default_options = dict(self.default_options,
+                                    **self.default_options_base)
         super(Chain, self).__init__(**kwargs)
         self._links = OrderedDict()
 
@@ -140,7 +153,8 @@ class Chain(Link):
                    dry_run=False,
                    stage_files=True,
                    force_run=False,
-                   resubmit_failed=False):
+                   resubmit_failed=False,
+                   dag=None):
         """Run all the links in the chain
 
         Parameters
@@ -161,7 +175,13 @@ class Chain(Link):
         resubmit_failed : bool
             Resubmit failed jobs
 
+        dag : bool
+            Run the jobs as a dependency graph instead of one link
+            after the other.  If None the ``dag`` option is used.
+
         """
+        if dag is None:
+            dag = self.args.get('dag', False)
         self._set_links_job_archive()
         failed = False
 
@@ -174,51 +194,54 @@ class Chain(Link):
                     output_file_mapping, dry_run)
                 self._stage_input_files(input_file_mapping, dry_run)
 
-        for link in self._links.values():
-            logfile = os.path.join('logs', "%s.log" % link.full_linkname)
-            link._archive_self(logfile, status=JobStatus.unknown)
-            key = JobDetails.make_fullkey(link.full_linkname)
-            if hasattr(link, 'check_status'):
-                link.check_status(stream, no_wait=True,
-                                  check_once=True, do_print=False)
-            else:
-                pass
-            link_status = link.check_job_status(key)
-            if link_status in [JobStatus.done]:
-                if not force_run:
-                    print ("Skipping done link", link.full_linkname)
-                    continue
-            elif link_status in [JobStatus.running]:
-                if not force_run and not resubmit_failed:
-                    print ("Skipping running link", link.full_linkname)
-                    continue
-            elif link_status in [JobStatus.failed,
-                                 JobStatus.partial_failed]:
-                if not resubmit_failed:
-                    print ("Skipping failed link", link.full_linkname)
-                    continue
-            print ("Running link ", link.full_linkname)
-            link.run_with_log(dry_run=dry_run, stage_files=False,
-                              resubmit_failed=resubmit_failed)
-            link_status = link.check_jobs_status()
-            link._set_status_self(status=link_status)
-            if link_status in [JobStatus.failed, JobStatus.partial_failed]:
-                print ("Stoping chain execution at failed link %s" %
-                       link.full_linkname)
-                failed = True
-                break
-#            elif link_status in [JobStatus.partial_failed]:
-#                print ("Resubmitting partially failed link %s" %
-#                       link.full_linkname)
-#                link.run_with_log(dry_run=dry_run, stage_files=False,
-#                                  resubmit_failed=resubmit_failed)
-#                link_status = link.check_jobs_status()
-#                link._set_status_self(status=link_status)
-#                if link_status in [JobStatus.partial_failed]:
-#                    print ("Stoping chain execution: resubmission failed %s" %
-#                           link.full_linkname)
-#                    failed = True
-#                    break
+        if dag:
+            failed = self._run_dag(stream, dry_run, force_run, resubmit_failed)
+        else:
+            for link in self._links.values():
+                logfile = os.path.join('logs', "%s.log" % link.full_linkname)
+                link._archive_self(logfile, status=JobStatus.unknown)
+                key = JobDetails.make_fullkey(link.full_linkname)
+                if hasattr(link, 'check_status'):
+                    link.check_status(stream, no_wait=True,
+                                      check_once=True, do_print=False)
+                else:
+                    pass
+                link_status = link.check_job_status(key)
+                if link_status in [JobStatus.done]:
+                    if not force_run:
+                        print ("Skipping done link", link.full_linkname)
+                        continue
+                elif link_status in [JobStatus.running]:
+                    if not force_run and not resubmit_failed:
+                        print ("Skipping running link", link.full_linkname)
+                        continue
+                elif link_status in [JobStatus.failed,
+                                     JobStatus.partial_failed]:
+                    if not resubmit_failed:
+                        print ("Skipping failed link", link.full_linkname)
+                        continue
+                print ("Running link ", link.full_linkname)
+                link.run_with_log(dry_run=dry_run, stage_files=False,
+                                  resubmit_failed=resubmit_failed)
+                link_status = link.check_jobs_status()
+                link._set_status_self(status=link_status)
+                if link_status in [JobStatus.failed, JobStatus.partial_failed]:
+                    print ("Stoping chain execution at failed link %s" %
+                           link.full_linkname)
+                    failed = True
+                    break
+    #            elif link_status in [JobStatus.partial_failed]:
+    #                print ("Resubmitting partially failed link %s" %
+    #                       link.full_linkname)
+    #                link.run_with_log(dry_run=dry_run, stage_files=False,
+    #                                  resubmit_failed=resubmit_failed)
+    #                link_status = link.check_jobs_status()
+    #                link._set_status_self(status=link_status)
+    #                if link_status in [JobStatus.partial_failed]:
+    #                    print ("Stoping chain execution: resubmission failed %s" %
+    #                           link.full_linkname)
+    #                    failed = True
+    #                    break
 
         if self._file_stage is not None and stage_files and not failed:
             self._stage_output_files(output_file_mapping, dry_run)
@@ -236,6 +259,61 @@ class Chain(Link):
             self._job_archive.file_archive.update_file_status()
             self._job_archive.write_table_file()
 
+    def _job_graph_nodes(self):
+        """Return a list of `JobNode` objects for all the jobs run by
+        the links in this `Chain`, in the order in which the links
+        are run"""
+        nodes = []
+        for link in self._links.values():
+            if isinstance(link, Chain):
+                nodes += link._job_graph_nodes()
+            elif hasattr(link, 'scatter_link'):
+                scatter_link = link.scatter_link
+                for key in scatter_link.jobs.keys():
+                    if key.find(JobDetails.topkey) >= 0:
+                        continue
+                    nodes.append(JobNode(scatter_link, key, link._interface))
+            else:
+                key = JobDetails.make_fullkey(link.full_linkname)
+                nodes.append(JobNode(link, key, file_dict=link.files))
+        return nodes
+
+    def _update_links_status(self, stream=sys.stdout):
+        """Set the status of the links in this `Chain` from the status
+        of their jobs"""
+        for link in self._links.values():
+            if isinstance(link, Chain):
+                link._update_links_status(stream)
+                link._set_status_self(status=link.check_links_status())
+            elif hasattr(link, 'check_status'):
+                link.check_status(stream, check_once=True, do_print=False)
+
+    def _run_dag(self,
+                 stream=sys.stdout,
+                 dry_run=False,
+                 force_run=False,
+                 resubmit_failed=False):
+        """Run the jobs of all the links in the chain as a `JobGraph`
+
+        Returns True if any job failed or was not run.
+        """
+        for link in self._links.values():
+            logfile = os.path.join('logs', "%s.log" % link.full_linkname)
+            link._archive_self(logfile, status=JobStatus.unknown)
+
+        graph = JobGraph(self._job_graph_nodes())
+        print ("Running %i jobs of chain %s as a dependency graph" %
+               (len(graph), self.full_linkname))
+        njobs = graph.run(stream, dry_run=dry_run, force_run=force_run,
+                          resubmit_failed=resubmit_failed,
+                          job_archive=self._job_archive)
+        self._update_links_status(stream)
+        if njobs[JobStatus.failed] or njobs[JobStatus.not_ready]:
+            print ("%i jobs failed, %i jobs were not run" %
+                   (njobs[JobStatus.failed], njobs[JobStatus.not_ready]))
+            return True
+        return False
+
     def clear_jobs(self, recursive=True):
         """Clear a dictionary with all the jobs
 
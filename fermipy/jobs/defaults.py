@@ -57,4 +57,6 @@ jobs = {
     'job_check_sleep': (300, 'Sleep time between checking on job status (s)', int),
     'print_update': (False, 'Print summary of job status', bool),
     'check_status_once': (False, 'Check status only once before proceeding', bool),
+    'incremental': (False, 'Skip jobs whose configuration and input files are unchanged since their last successful run', bool),
+    'dag': (False, 'Start each job of a chain as soon as the jobs producing its input files are done', bool),
 }
@@ -624,10 +624,34 @@ class FileArchive(object):
         row = self._table[row_idx]
         return FileHandle.create_from_row(row)
 
+    def _lookup_handle(self, localpath):
+        """Look up a `FileHandle` that is not in the cache.
+
+        All the files are cached when the table is read, so this
+        raises a `KeyError`.  Sub-classes that load files on demand
+        override this.
+        """
+        raise KeyError(localpath)
+
+    def _next_key(self):
+        """Return the key of the next file to be registered """
+        return len(self._table) + 1
+
+    def _append_handle(self, file_handle):
+        """Persist a newly registered `FileHandle` """
+        file_handle.append_to_table(self._table)
+
+    def _update_handle(self, file_handle):
+        """Persist the updated values of a `FileHandle` """
+        file_handle.update_table_row(self._table, file_handle.key - 1)
+
     def get_handle(self, filepath):
         """Get the `FileHandle` object associated to a particular file """
         localpath = self._get_localpath(filepath)
-        return self._cache[localpath]
+        try:
+            return self._cache[localpath]
+        except KeyError:
+            return self._lookup_handle(localpath)
 
     def register_file(self, filepath, creator, status=FileStatus.no_file, flags=FileFlags.no_flags):
         """Register a file in the archive.
@@ -666,14 +690,14 @@ class FileArchive(object):
                 timestamp = int(os.stat(fullpath).st_mtime)
         else:
             timestamp = 0
-        key = len(self._table) + 1
+        key = self._next_key()
         file_handle = FileHandle(path=localpath,
                                  key=key,
                                  creator=creator,
                                  timestamp=timestamp,
                                  status=status,
                                  flags=flags)
-        file_handle.append_to_table(self._table)
+        self._append_handle(file_handle)
         self._cache[localpath] = file_handle
         return file_handle
 
@@ -697,7 +721,7 @@ class FileArchive(object):
         file_handle = self.get_handle(filepath)
         if status in [FileStatus.exists, FileStatus.superseded]:
             # Make sure the file really exists
-            fullpath = file_handle.fullpath
+            fullpath = self._get_fullpath(file_handle.path)
             if not os.path.exists(fullpath):
                 raise ValueError("File %s does not exist" % fullpath)
             timestamp = int(os.stat(fullpath).st_mtime)
@@ -706,7 +730,7 @@ class FileArchive(object):
         file_handle.creator = creator
         file_handle.timestamp = timestamp
         file_handle.status = status
-        file_handle.update_table_row(self._table, file_handle.key - 1)
+        self._update_handle(file_handle)
         return file_handle
 
     def get_file_ids(self, file_list, creator=None,
@@ -786,7 +810,7 @@ class FileArchive(object):
                 sys.stdout.flush()
             fhandle = self.cache[key]
             fhandle.check_status(self._base_path)
-            fhandle.update_table_row(self._table, fhandle.key - 1)
+            self._update_handle(fhandle)
             status_vect[fhandle.status] += 1
 
         sys.stdout.write("!\n")
@@ -22,9 +22,20 @@ import numpy as np
 from astropy.table import Table, Column
 
 from fermipy.fits_utils import write_tables_to_fits
+from fermipy.file_cache import file_checksum, make_cache_key
 from fermipy.jobs.file_archive import get_timestamp, FileStatus, FileDict, FileArchive
 
 
+def _input_file_checksum(filepath):
+    """Return the checksum of a file or None if it does not exist.
+    File paths are registered without the .gz suffix, so the
+    compressed file is used if it exists."""
+    for path in [filepath, filepath + '.gz']:
+        if os.path.exists(path):
+            return file_checksum(path)
+    return None
+
+
 # @unique
 # class JobStatus(Enum):
 class JobStatus(object):
@@ -182,6 +193,10 @@ class JobDetails(object):
 
     status : int
         Current job status, one of the enums above
+
+    fingerprint : str
+        Hash of the configuration and input files of the last
+        successful run of this job, empty if it is not known
     """
     topkey = '__top__'
 
@@ -209,6 +224,7 @@ class JobDetails(object):
         self.rmfile_ids = kwargs.get('rmfile_ids', None)
         self.intfile_ids = kwargs.get('intfile_ids', None)
         self.status = kwargs.get('status', JobStatus.unknown)
+        self.fingerprint = kwargs.get('fingerprint', '')
 
     @staticmethod
     def make_fullkey(jobname, jobkey=topkey):
@@ -239,11 +255,12 @@ class JobDetails(object):
         col_rmfile_refs = Column(name='rmfile_refs', dtype=int, shape=(2,))
         col_intfile_refs = Column(name='intfile_refs', dtype=int, shape=(2,))
         col_status = Column(name='status', dtype=int)
+        col_fingerprint = Column(name='fingerprint', dtype='S40')
         columns = [col_dbkey, col_jobname, col_jobkey, col_appname,
                    col_logfile, col_job_config, col_timestamp,
                    col_infile_refs, col_outfile_refs,
                    col_rmfile_refs, col_intfile_refs,
-                   col_status]
+                   col_status, col_fingerprint]
 
         table = Table(data=columns)
 
@@ -261,6 +278,22 @@ class JobDetails(object):
         """
         return JobDetails.make_fullkey(self.jobname, self.jobkey)
 
+    def make_fingerprint(self):
+        """Compute a fingerprint of this job
+
+        The fingerprint is a hash of the job configuration, without
+        the logfile, and of the checksums of the input files.  Two runs
+        of a job with the same fingerprint produce the same output.
+        Input files that do not exist contribute None to the hash.
+        """
+        job_config = dict([(key, val) for key, val in self.job_config.items()
+                           if key != 'logfile'])
+        checksums = []
+        if self.file_dict is not None:
+            for filepath in sorted(self.file_dict.input_files):
+                checksums.append((filepath, _input_file_checksum(filepath)))
+        return make_cache_key(job_config, checksums)
+
     def get_file_ids(self, file_archive, creator=None, status=FileStatus.no_file):
         """Fill the file id arrays from the file lists
 
@@ -383,6 +416,9 @@ class JobDetails(object):
         kwargs['outfile_ids'] = np.arange(outfile_refs[0], outfile_refs[1])
         kwargs['rmfile_ids'] = np.arange(rmfile_refs[0], rmfile_refs[1])
         kwargs['intfile_ids'] = np.arange(intfile_refs[0], intfile_refs[1])
+        # Empty strings are read back from FITS as masked values
+        if np.ma.is_masked(kwargs.get('fingerprint')):
+            kwargs['fingerprint'] = ''
         return cls(**kwargs)
 
     def append_to_tables(self, table, table_ids):
@@ -428,13 +464,15 @@ class JobDetails(object):
                            outfile_refs=outfile_refs,
                            rmfile_refs=rmfile_refs,
                            intfile_refs=intfile_refs,
-                           status=self.status))
+                           status=self.status,
+                           fingerprint=str(self.fingerprint)))
 
     def update_table_row(self, table, row_idx):
         """Add this instance as a row on a `astropy.table.Table` """
         try:
             table[row_idx]['timestamp'] = self.timestamp
             table[row_idx]['status'] = self.status
+            table[row_idx]['fingerprint'] = self.fingerprint
         except IndexError:
             print("Index error", len(table), row_idx)
 
@@ -472,6 +510,8 @@ class JobArchive(object):
 
     # Singleton instance
     _archive = None
+    # Class of the associated `FileArchive`
+    file_archive_class = FileArchive
 
     def __init__(self, **kwargs):
         """C'tor
@@ -483,7 +523,7 @@ class JobArchive(object):
         self._table_ids = None
         self._table_id_array = None
         self._cache = OrderedDict()
-        self._file_archive = FileArchive.build_archive(**kwargs)
+        self._file_archive = self.file_archive_class.build_archive(**kwargs)
         self._read_table_file(kwargs['job_archive_table'])
 
     def __getitem__(self, fullkey):
@@ -528,6 +568,10 @@ class JobArchive(object):
         if os.path.exists(self._table_file):
             self._table = Table.read(self._table_file, hdu='JOB_ARCHIVE')
             self._table_ids = Table.read(self._table_file, hdu='FILE_IDS')
+            # Archives written before fingerprints were added
+            if 'fingerprint' not in self._table.colnames:
+                self._table.add_column(Column(name='fingerprint', dtype='S40',
+                                              length=len(self._table)))
         else:
             self._table, self._table_ids = JobDetails.make_tables({})
         self._table_id_array = self._table_ids['file_id'].data
@@ -541,10 +585,35 @@ class JobArchive(object):
         self._cache[job_details.fullkey] = job_details
         return job_details
 
+    def _lookup_job(self, fullkey):
+        """Look up a `JobDetails` that is not in the cache.
+
+        All the jobs are cached when the table is read, so this
+        raises a `KeyError`.  Sub-classes that load jobs on demand
+        override this.
+        """
+        raise KeyError(fullkey)
+
+    def _next_dbkey(self):
+        """Return the key of the next job to be registered """
+        return len(self._table) + 1
+
+    def _append_job(self, job_details):
+        """Persist a newly registered `JobDetails` """
+        job_details.append_to_tables(self._table, self._table_ids)
+        self._table_id_array = self._table_ids['file_id'].data
+
+    def _update_job(self, job_details):
+        """Persist the updated status and timestamp of a `JobDetails` """
+        job_details.update_table_row(self._table, job_details.dbkey - 1)
+
     def get_details(self, jobname, jobkey):
         """Get the `JobDetails` associated to a particular job instance"""
         fullkey = JobDetails.make_fullkey(jobname, jobkey)
-        return self._cache[fullkey]
+        try:
+            return self._cache[fullkey]
+        except KeyError:
+            return self._lookup_job(fullkey)
 
     def register_job(self, job_details):
         """Register a job in this `JobArchive` """
@@ -552,20 +621,68 @@ class JobArchive(object):
         try:
             job_details_old = self.get_details(job_details.jobname,
                                                job_details.jobkey)
-            if job_details_old.status <= JobStatus.running:
-                job_details_old.status = job_details.status
-                job_details_old.update_table_row(
-                    self._table, job_details_old.dbkey - 1)
+            self._update_registered_job(job_details_old, job_details)
             job_details = job_details_old
         except KeyError:
-            job_details.dbkey = len(self._table) + 1
+            job_details.dbkey = self._next_dbkey()
             job_details.get_file_ids(
                 self._file_archive, creator=job_details.dbkey)
-            job_details.append_to_tables(self._table, self._table_ids)
-        self._table_id_array = self._table_ids['file_id'].data
+            self._append_job(job_details)
         self._cache[job_details.fullkey] = job_details
         return job_details
 
+    def _update_registered_job(self, job_details_old, job_details):
+        """Update a job that is already in the archive with the
+        details of a new registration
+
+        The fingerprint is only recorded for successful runs, and the
+        fingerprint of a job that failed is cleared.
+        """
+        update = False
+        if job_details_old.status <= JobStatus.running:
+            job_details_old.status = job_details.status
+            update = True
+        if job_details.status == JobStatus.done:
+            if job_details.fingerprint and\
+                    job_details.fingerprint != job_details_old.fingerprint:
+                job_details_old.status = JobStatus.done
+                job_details_old.fingerprint = job_details.fingerprint
+                update = True
+        elif job_details.status in [JobStatus.failed, JobStatus.partial_failed]:
+            if job_details_old.fingerprint:
+                job_details_old.fingerprint = ''
+                update = True
+        if update:
+            self._update_job(job_details_old)
+
+    def is_up_to_date(self, job_details, fingerprint):
+        """Check if a job has already been run successfully with the
+        given fingerprint and all its output files exist
+
+        Parameters
+        ----------
+
+        job_details : `JobDetails`
+            The job in question
+
+        fingerprint : str
+            Current fingerprint of the job, see `JobDetails.make_fingerprint`
+        """
+        try:
+            archived = self.get_details(job_details.jobname,
+                                        job_details.jobkey)
+        except KeyError:
+            return False
+        if archived.status != JobStatus.done or\
+                not archived.fingerprint or archived.fingerprint != fingerprint:
+            return False
+        if job_details.file_dict is not None:
+            for filepath in job_details.file_dict.output_files:
+                if not (os.path.exists(filepath) or
+                        os.path.exists(filepath + '.gz')):
+                    return False
+        return True
+
     def register_jobs(self, job_dict):
         """Register a bunch of jobs in this archive"""
         njobs = len(job_dict)
@@ -601,7 +718,8 @@ class JobArchive(object):
                                  job_details.jobkey)
         other.timestamp = job_details.timestamp
         other.status = job_details.status
-        other.update_table_row(self._table, other.dbkey - 1)
+        other.fingerprint = job_details.fingerprint
+        self._update_job(other)
         return other
 
     def remove_jobs(self, mask):
@@ -656,12 +774,19 @@ class JobArchive(object):
             job_details = self.cache[key]
             if job_details.status in [JobStatus.pending, JobStatus.running]:
                 if checker_func:
+                    old_status = job_details.status
                     job_details.check_status_logfile(checker_func)
-            job_details.update_table_row(self._table, job_details.dbkey - 1)
+                    if job_details.status != old_status:
+                        self._update_job(job_details)
             status_vect[job_details.status] += 1
 
         sys.stdout.write("!\n")
         sys.stdout.flush()
+        self._write_status_summary(status_vect)
+
+    @staticmethod
+    def _write_status_summary(status_vect):
+        """Print the number of jobs in each state"""
         sys.stdout.write("Summary:\n")
         sys.stdout.write("  Unknown:   %i\n" % status_vect[JobStatus.unknown])
         sys.stdout.write("  Not Ready: %i\n" %
@@ -0,0 +1,270 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Dependency graph of the jobs of a `Chain`.
+
+The `JobGraph` class derives the dependencies between jobs from the
+input and output files they register in their `FileDict` and runs
+each job as soon as the jobs that produce its inputs are done.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import time
+
+from fermipy.jobs.job_archive import JobStatus
+from fermipy.jobs.sys_interface import clean_job
+
+
+class JobNode(object):
+    """A single job in a `JobGraph`
+
+    Parameters
+    ----------
+
+    link : `fermipy.jobs.link.Link`
+        The link that runs the job
+
+    key : str
+        Key of the job in ``link.jobs``
+
+    interface : `fermipy.jobs.sys_interface.SysInterface`
+        Interface used to dispatch the job.  If None the job is run
+        in the current process with `Link.run_with_log`.
+
+    file_dict : `fermipy.jobs.file_archive.FileDict`
+        The input and output files of the job.  If None the files
+        registered with the `JobDetails` of the job are used.
+    """
+
+    def __init__(self, link, key, interface=None, file_dict=None):
+        self.link = link
+        self.key = key
+        self.interface = interface
+        if file_dict is None:
+            file_dict = self.job_details.file_dict
+        self.input_files = set([os.path.normpath(f)
+                                for f in file_dict.input_files])
+        self.output_files = set([os.path.normpath(f)
+                                 for f in file_dict.output_files])
+        self.depends = set()
+        self.dependents = set()
+
+    @property
+    def job_details(self):
+        """Return the `JobDetails` of this job"""
+        return self.link.jobs[self.key]
+
+    @property
+    def status(self):
+        """Return the current status of this job"""
+        return self.job_details.status
+
+    @property
+    def name(self):
+        """Return a name that identifies this job"""
+        return self.key
+
+    def check_status(self):
+        """Check the status of this job and update it in ``link.jobs``"""
+        if self.interface is None:
+            return self.link.check_job_status(self.key)
+        job_details = self.job_details
+        job_details.status = self.interface.check_job(job_details)
+        return job_details.status
+
+
+class JobGraph(object):
+    """Directed acyclic graph of jobs
+
+    A job depends on every job that appears before it in the list of
+    nodes and writes one of its input files.  Jobs are run in the
+    order in which their dependencies are satisfied.  The number of
+    jobs running at the same time on the system of an interface type
+    is bounded by `SysInterface.max_concurrent_jobs`, summed over all
+    the interfaces of that type.
+
+    Parameters
+    ----------
+
+    nodes : list of `JobNode`
+        The jobs, in the order in which they would be run sequentially
+    """
+
+    def __init__(self, nodes):
+        self._nodes = list(nodes)
+        producers = {}
+        for idx, node in enumerate(self._nodes):
+            for filepath in node.input_files:
+                for jdx in producers.get(filepath, []):
+                    node.depends.add(jdx)
+                    self._nodes[jdx].dependents.add(idx)
+            for filepath in node.output_files:
+                producers.setdefault(filepath, []).append(idx)
+
+    @property
+    def nodes(self):
+        """Return the list of `JobNode` objects"""
+        return self._nodes
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def _initial_state(self, force_run, resubmit_failed):
+        """Sort the jobs into those that are done, failed, running or
+        still have to run"""
+        done = set()
+        failed = set()
+        running = set()
+        waiting = set()
+        for idx, node in enumerate(self._nodes):
+            status = node.check_status()
+            if force_run:
+                waiting.add(idx)
+            elif status == JobStatus.done:
+                done.add(idx)
+            elif status in [JobStatus.failed, JobStatus.partial_failed]:
+                if resubmit_failed:
+                    waiting.add(idx)
+                else:
+                    failed.add(idx)
+            elif status in [JobStatus.pending, JobStatus.running] and\
+                    node.interface is not None:
+                running.add(idx)
+            else:
+                waiting.add(idx)
+        return done, failed, running, waiting
+
+    def _dispatch(self, node, job_archive, stream, dry_run):
+        """Start a single job.  Returns the status of the job."""
+        link = node.link
+        job_details = node.job_details
+        if node.interface is None:
+            link.run_with_log(dry_run=dry_run, stage_files=False)
+            if dry_run:
+                return JobStatus.done
+            return link.check_jobs_status()
+
+        node.interface._dry_run = dry_run
+        if job_details.status == JobStatus.failed:
+            clean_job(job_details.logfile, {}, dry_run)
+        job_details.job_config['logfile'] = job_details.logfile
+        new_job_details = node.interface.dispatch_job(link, node.key,
+                                                      job_archive, stream)
+        link.jobs[node.key] = new_job_details
+        if dry_run and new_job_details.status != JobStatus.failed:
+            return JobStatus.done
+        return new_job_details.status
+
+    def run(self, stream=sys.stdout, dry_run=False, force_run=False,
+            resubmit_failed=False, job_archive=None, poll_interval=None):
+        """Run the jobs in the graph
+
+        Each job is started as soon as all the jobs it depends on are
+        done.  Jobs that depend on a failed job are not run.
+
+        Parameters
+        ----------
+
+        stream : `file`
+            Stream to print to, must have 'write' function
+
+        dry_run : bool
+            Print commands but do not run them
+
+        force_run : bool
+            Run jobs, even if they are marked as done
+
+        resubmit_failed : bool
+            Resubmit failed jobs
+
+        job_archive : `fermipy.jobs.job_archive.JobArchive`
+            Archive used to keep track of jobs
+
+        poll_interval : float
+            Time in seconds between checks of the running jobs.  If
+            None the shortest poll interval of the interfaces is used.
+
+        Returns
+        -------
+        status : dict
+            Dictionary mapping `JobStatus` to the number of jobs in
+            each state.  Jobs that were not run because a job they
+            depend on failed are counted as `JobStatus.not_ready`.
+        """
+        done, failed, running, waiting = self._initial_state(
+            force_run, resubmit_failed)
+        blocked = set()
+
+        if poll_interval is None:
+            intervals = [node.interface.poll_interval for node in self._nodes
+                         if node.interface is not None]
+            poll_interval = min(intervals) if intervals else 0.
+
+        while waiting or running:
+
+            changed = False
+            for idx in sorted(running):
+                node = self._nodes[idx]
+                old_status = node.status
+                status = node.check_status()
+                if status == JobStatus.done:
+                    running.discard(idx)
+                    done.add(idx)
+                elif status in [JobStatus.failed, JobStatus.partial_failed]:
+                    running.discard(idx)
+                    failed.add(idx)
+                if status != old_status:
+                    changed = True
+                    if job_archive is not None:
+                        job_archive.register_job(node.job_details)
+
+            for idx in sorted(waiting):
+                node = self._nodes[idx]
+                if node.depends & (failed | blocked):
+                    waiting.discard(idx)
+                    blocked.add(idx)
+                    stream.write("Not running %s, it depends on a failed job\n" %
+                                 node.name)
+                    changed = True
+                    continue
+                if not node.depends <= done:
+                    continue
+                if not dry_run and not self._can_dispatch(node, running):
+                    continue
+                waiting.discard(idx)
+                changed = True
+                status = self._dispatch(node, job_archive, stream, dry_run)
+                if status == JobStatus.done:
+                    done.add(idx)
+                elif status in [JobStatus.failed, JobStatus.partial_failed]:
+                    failed.add(idx)
+                else:
+                    running.add(idx)
+
+            if running and not changed:
+                time.sleep(poll_interval)
+
+        return {JobStatus.done: len(done),
+                JobStatus.failed: len(failed),
+                JobStatus.not_ready: len(blocked)}
+
+    def _can_dispatch(self, node, running):
+        """Check if the system a job is dispatched to has room for
+        another job.  The links of a `Chain` each have their own
+        interface, but interfaces of the same type dispatch to the
+        same system (e.g. the local machine for `NativeInterface`).
+        The running jobs of all of them therefore count against the
+        limit of the interface of the job."""
+        if node.interface is None:
+            return True
+        max_jobs = node.interface.max_concurrent_jobs()
+        if max_jobs is None:
+            return True
+        nrunning = 0
+        for idx in running:
+            interface = self._nodes[idx].interface
+            if interface is not None and \
+                    type(interface) is type(node.interface):
+                nrunning += 1
+        return nrunning < max_jobs
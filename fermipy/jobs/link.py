@@ -18,7 +18,8 @@ from fermipy.jobs.utils import is_null, is_not_null
 from fermipy.jobs.file_archive import FileDict, FileStageManager
 from fermipy.jobs.job_archive import get_timestamp, JobStatus, JobDetails
 from fermipy.jobs.factory import LinkFactory
-from fermipy.jobs.sys_interface import SysInterface
+from fermipy.jobs.sys_interface import SysInterface, remove_file,\
+    status_marker_path, write_status_marker
 
 
 def extract_arguments(args, defaults):
@@ -606,13 +607,21 @@ class Link(object):
 
     def _write_status_to_log(self, return_code, stream=sys.stdout):
         """Write the status of this job to a log stream.
-        This is used to check on job completion."""
+        This is used to check on job completion.
+
+        If the stream is a logfile a status marker is also written
+        next to it, so that the status can be checked without reading
+        the logfile."""
         stream.write("Timestamp: %i\n" % get_timestamp())
         if return_code == 0:
             stream.write("%s\n" % self._interface.string_successful)
         else:
             stream.write("%s %i\n" %
                          (self._interface.string_exited, return_code))
+        logfile = getattr(stream, 'name', None)
+        if isinstance(logfile, str) and os.path.isfile(logfile):
+            stream.flush()
+            write_status_marker(logfile, return_code)
 
     def _finalize(self, dry_run=False):
         """Remove / compress files as requested """
@@ -978,6 +987,7 @@ class Link(object):
             os.makedirs(odir)
         except OSError:
             pass
+        remove_file(status_marker_path(job_details.logfile))
         ostream = open(job_details.logfile, 'w')
         self.run(ostream, dry_run, stage_files, resubmit_failed)
 
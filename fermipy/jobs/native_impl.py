@@ -1,19 +1,78 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 """
-Implementation of `ScatterGather` class for dealing with LSF batch jobs
+Implementation of `ScatterGather` class for running jobs as local
+subprocesses on the native system
 """
 from __future__ import absolute_import, division, print_function
 
 import sys
 import os
 import time
+import subprocess
 
 from fermipy.jobs.job_archive import JobStatus
-from fermipy.jobs.sys_interface import clean_job, SysInterface
+from fermipy.jobs.sys_interface import clean_job, write_status_marker,\
+    SysInterface
+
+
+def get_available_memory():
+    """Return the available physical memory in bytes or None if it
+    can not be determined on this system."""
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class NativeJob(object):
+    """A job running in a local subprocess"""
+
+    def __init__(self, key, command, logfile, ntry=0):
+        self.key = key
+        self.command = command
+        self.logfile = logfile
+        self.ntry = ntry
+        self._fout = open(logfile, 'w')
+        self.start_time = time.time()
+        self.timed_out = False
+        self.proc = subprocess.Popen(command, shell=True,
+                                     stdout=self._fout,
+                                     stderr=subprocess.STDOUT)
+
+    @property
+    def elapsed(self):
+        """Wall time since the job was started (s)"""
+        return time.time() - self.start_time
+
+    def poll(self, timeout=None):
+        """Return the exit code of the job or None if it is still
+        running.  Jobs that run longer than ``timeout`` seconds are
+        killed."""
+        returncode = self.proc.poll()
+        if returncode is None and timeout is not None and self.elapsed > timeout:
+            self.proc.kill()
+            returncode = self.proc.wait()
+            self.timed_out = True
+        if returncode is not None:
+            self._fout.close()
+        return returncode
+
+    def kill(self):
+        """Kill the job"""
+        if self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        self._fout.close()
 
 
 class NativeInterface(SysInterface):
-    """Implmentation of ScatterGather that uses the native system"""
+    """Implmentation of ScatterGather that runs jobs as subprocesses
+    of the current process.
+
+    A bounded number of jobs run concurrently.  The status of each job
+    is taken from the exit code of its process, failed jobs can be
+    retried and jobs that exceed a time limit are killed.
+    """
     string_exited = 'Exited with exit code'
     string_successful = 'Successfully completed'
 
@@ -23,21 +82,79 @@ class NativeInterface(SysInterface):
         Keyword arguements
         ------------------
 
-        jobs_per_cycle : int [20]
-            Maximum number of jobs to submit in each cycle
+        max_jobs : int [None]
+            Maximum number of jobs running at the same time.  If None
+            this is the number of cores.
+
+        job_memory : float [None]
+            Expected memory usage of a job in MB.  If set, the number
+            of concurrent jobs is limited such that all jobs fit in the
+            available memory.
+
+        job_timeout : float [None]
+            Jobs that run longer than this time in seconds are killed
+            and count as failed.  If None jobs are not timed out.
 
-        time_per_cycle : int [15]
-            Time per submission cycle in seconds
+        max_retries : int [0]
+            Number of times a failed job is restarted.
 
-        max_job_age : int [90]
-            Max job age in minutes
+        poll_interval : float [1.0]
+            Time in seconds between checks of the running jobs.
         """
         super(NativeInterface, self).__init__(**kwargs)
-        self._time_per_cycle = kwargs.pop('time_per_cycle', 15)
-        self._jobs_per_cycle = kwargs.pop('jobs_per_cycle', 20)
+        self._max_jobs = kwargs.pop('max_jobs', None)
+        self._job_memory = kwargs.pop('job_memory', None)
+        self._job_timeout = kwargs.pop('job_timeout', None)
+        self._max_retries = kwargs.pop('max_retries', 0)
+        self._poll_interval = kwargs.pop('poll_interval', 1.0)
+        self._running = {}
+        self._exit_codes = {}
+
+    @property
+    def poll_interval(self):
+        """Time in seconds between checks of the running jobs"""
+        return self._poll_interval
+
+    @property
+    def exit_codes(self):
+        """Dictionary of the exit codes of finished jobs keyed by logfile"""
+        return self._exit_codes
+
+    def max_concurrent_jobs(self):
+        """Return the maximum number of jobs that can run at the same
+        time given the number of cores and the available memory."""
+        njob = self._max_jobs
+        if njob is None:
+            njob = os.cpu_count() or 1
+        if self._job_memory:
+            mem = get_available_memory()
+            if mem is not None:
+                njob = min(njob, int(mem / (self._job_memory * 2**20)))
+        return max(1, njob)
+
+    def check_job(self, job_details):
+        """ Check the status of a specfic job
+
+        The status of jobs that were run by this interface is
+        determined by their exit code, running jobs are polled without
+        waiting for them.  For other jobs the logfile is checked.
+        """
+        logfile = job_details.logfile
+        for key, job in list(self._running.items()):
+            if job.logfile == logfile:
+                self._poll_job(key, job)
+                break
+        if logfile in self._exit_codes:
+            if self._exit_codes[logfile] == 0:
+                return JobStatus.done
+            return JobStatus.failed
+        for job in self._running.values():
+            if job.logfile == logfile:
+                return JobStatus.running
+        return super(NativeInterface, self).check_job(job_details)
 
     def dispatch_job_hook(self, link, key, job_config, logfile, stream=sys.stdout):
-        """Send a single job to be executed
+        """Start a single job in a subprocess
 
         Parameters
         ----------
@@ -53,26 +170,82 @@ class NativeInterface(SysInterface):
             the self._command_template job template
 
         logfile : str
-            The logfile for this job, may be used to check for success/ failure
+            The logfile for this job, the output of the job is written there
         """
         full_sub_dict = job_config.copy()
+        command = link.command_template().format(**full_sub_dict)
 
-        full_command = "%s >& %s" % (
-            link.command_template().format(**full_sub_dict), logfile)
+        if self._dry_run:
+            sys.stdout.write("%s >& %s\n" % (command, logfile))
+            return
 
         logdir = os.path.dirname(logfile)
-
-        if self._dry_run:
-            sys.stdout.write("%s\n" % full_command)
-        else:
+        if logdir:
             try:
                 os.makedirs(logdir)
             except OSError:
                 pass
-            os.system(full_command)
+        self._exit_codes.pop(logfile, None)
+        self._running[key] = NativeJob(key, command, logfile)
+
+    def _poll_job(self, key, job, stream=sys.stdout):
+        """Check a running job and restart it if it failed and has
+        retries left.
+
+        Returns the exit code of the job, or None if it is still
+        running or was restarted.
+        """
+        returncode = job.poll(self._job_timeout)
+        if returncode is None:
+            return None
+
+        del self._running[key]
+        if job.timed_out:
+            stream.write('Job %s timed out after %.0f seconds\n' %
+                         (key, job.elapsed))
+
+        if returncode != 0 and job.ntry < self._max_retries:
+            stream.write('Retrying job %s (exit code %i)\n' %
+                         (key, returncode))
+            self._running[key] = NativeJob(key, job.command, job.logfile,
+                                           job.ntry + 1)
+            return None
+
+        self._exit_codes[job.logfile] = returncode
+        write_status_marker(job.logfile, returncode)
+        return returncode
+
+    def _finish_jobs(self, link, job_archive=None, stream=sys.stdout):
+        """Check the running jobs, restart failed jobs that have retries
+        left and update the status of finished jobs.
+
+        Returns the number of jobs that finished.
+        """
+        nfinished = 0
+        for key, job in list(self._running.items()):
+            returncode = self._poll_job(key, job, stream)
+            if returncode is None:
+                continue
+
+            nfinished += 1
+            job_details = link.jobs[key]
+            if returncode == 0:
+                job_details.status = JobStatus.done
+            else:
+                job_details.status = JobStatus.failed
+            link.jobs[key] = job_details
+            if job_archive is not None:
+                job_archive.register_job(job_details)
+
+        return nfinished
 
     def submit_jobs(self, link, job_dict=None, job_archive=None, stream=sys.stdout):
-        """Submit all the jobs in job_dict """
+        """Run all the jobs in job_dict and wait for them to finish
+
+        Returns a `JobStatus` enum.  This is `JobStatus.failed` if
+        any job could not be started.  The status of the individual
+        jobs is set from their exit codes.
+        """
         if link is None:
             return JobStatus.no_job
         if job_dict is None:
@@ -82,50 +255,53 @@ class NativeInterface(SysInterface):
 
         # copy & reverse the keys b/c we will be popping item off the back of
         # the list
-        unsubmitted_jobs = job_keys
-        unsubmitted_jobs.reverse()
+        unsubmitted_jobs = list(job_keys)[::-1]
+        max_jobs = self.max_concurrent_jobs()
 
         failed = False
-        while unsubmitted_jobs:
-            njob_to_submit = min(self._jobs_per_cycle,
-                                 len(unsubmitted_jobs))
-
-            if self._dry_run:
-                njob_to_submit = len(unsubmitted_jobs)
+        try:
+            while unsubmitted_jobs or self._running:
 
-            for i in range(njob_to_submit):
-                job_key = unsubmitted_jobs.pop()
+                while unsubmitted_jobs and (self._dry_run or
+                                            len(self._running) < max_jobs):
+                    job_key = unsubmitted_jobs.pop()
 
-                # job_details = job_dict[job_key]
-                job_details = link.jobs[job_key]
-                job_config = job_details.job_config
-                if job_details.status == JobStatus.failed:
-                    clean_job(job_details.logfile, {}, self._dry_run)
-                    # clean_job(job_details.logfile,
-                    #          job_details.outfiles, self.args['dry_run'])
+                    job_details = link.jobs[job_key]
+                    job_config = job_details.job_config
+                    if job_details.status == JobStatus.failed:
+                        clean_job(job_details.logfile, {}, self._dry_run)
 
-                job_config['logfile'] = job_details.logfile
-                new_job_details = self.dispatch_job(link, job_key, job_archive)
-                if new_job_details.status == JobStatus.failed:
-                    failed = True
-                    clean_job(new_job_details.logfile,
-                              new_job_details.outfiles, self._dry_run)
-                link.jobs[job_key] = new_job_details
+                    job_config['logfile'] = job_details.logfile
+                    new_job_details = self.dispatch_job(
+                        link, job_key, job_archive, stream)
+                    if new_job_details.status == JobStatus.failed:
+                        failed = True
+                        clean_job(new_job_details.logfile,
+                                  new_job_details.outfiles, self._dry_run)
+                    link.jobs[job_key] = new_job_details
 
-            if unsubmitted_jobs:
-                print('Sleeping %.0f seconds between submission cycles' %
-                      self._time_per_cycle)
-                time.sleep(self._time_per_cycle)
+                nfinished = self._finish_jobs(link, job_archive, stream)
+                if self._running and not nfinished:
+                    time.sleep(self._poll_interval)
+        except KeyboardInterrupt:
+            for job in self._running.values():
+                job.kill()
+            self._running.clear()
+            raise
 
-        return failed
+        if failed:
+            return JobStatus.failed
+        return JobStatus.done
 
 
 def get_native_default_args():
     """ Get the correct set of batch jobs arguments.
     """
-    native_default_args = dict(max_jobs=500,
-                               time_per_cycle=15,
-                               jobs_per_cycle=20,
+    native_default_args = dict(max_jobs=None,
+                               job_memory=None,
+                               job_timeout=None,
+                               max_retries=0,
+                               poll_interval=1.0,
                                max_job_age=90,
                                no_batch=False)
     return native_default_args.copy()
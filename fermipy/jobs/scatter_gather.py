@@ -7,6 +7,7 @@ of a job with different configurations.
 """
 from __future__ import absolute_import, division, print_function
 
+import os
 import sys
 import time
 
@@ -16,6 +17,7 @@ from fermipy.jobs.batch import get_batch_job_interface
 from fermipy.jobs.job_archive import JobStatus,\
     JobStatusVector, JobDetails, JobArchive, JOB_STATUS_STRINGS
 from fermipy.jobs.link import extract_arguments, Link
+from fermipy.jobs.sys_interface import write_status_marker
 
 from fermipy.jobs import defaults
 
@@ -40,6 +42,11 @@ class ScatterGather(Link):
         This is used to manage batch farm scheduling and
         checking for completion.
 
+    With the ``incremental`` option each job is fingerprinted with
+    its configuration and the checksums of its input files.  Jobs
+    whose fingerprint matches the last successful run recorded in the
+    `JobArchive` are not run again.
+
     """
     appname = 'dummy-sg'
     usage = "%s [options]" % (appname)
@@ -54,7 +61,8 @@ class ScatterGather(Link):
                                 dry_run=defaults.jobs['dry_run'],
                                 job_check_sleep=defaults.jobs['job_check_sleep'],
                                 print_update=defaults.jobs['print_update'],
-                                check_status_once=defaults.jobs['check_status_once'])
+                                check_status_once=defaults.jobs['check_status_once'],
+                                incremental=defaults.jobs['incremental'])
 
     def __init__(self, link, **kwargs):
         """C'tor
@@ -163,6 +171,7 @@ class ScatterGather(Link):
             #    continue
             if job_key.find(JobDetails.topkey) >= 0:
                 continue
+            old_status = job_details.status
             job_details.status = self._interface.check_job(job_details)
             if job_details.status == JobStatus.pending:
                 if fail_pending:
@@ -172,7 +181,12 @@ class ScatterGather(Link):
                     job_details.status = JobStatus.failed
             status_vect[job_details.status] += 1
             link.jobs[job_key] = job_details
-            link._set_status_self(job_details.jobkey, job_details.status)
+            if self.args.get('incremental') and not job_details.fingerprint and\
+                    job_details.status == JobStatus.done:
+                job_details.fingerprint = job_details.make_fingerprint()
+            # Only jobs whose state changed are written to the archive
+            if job_details.status != old_status:
+                link._set_status_self(job_details.jobkey, job_details.status)
 
         return status_vect
 
@@ -436,8 +450,13 @@ class ScatterGather(Link):
         """
         self._build_job_dict()
 
+        job_dict = None
+        if self.args.get('incremental'):
+            job_dict = self._skip_up_to_date_jobs(stream)
+
         self._interface._dry_run = self.args['dry_run']
         scatter_status = self._interface.submit_jobs(self.scatter_link,
+                                                     job_dict=job_dict,
                                                      job_archive=self._job_archive,
                                                      stream=stream)
         if scatter_status == JobStatus.failed:
@@ -456,6 +475,45 @@ class ScatterGather(Link):
                                  self.full_linkname)
         return status_vect
 
+    def _skip_up_to_date_jobs(self, stream=sys.stdout):
+        """Fingerprint the jobs and mark those that are up to date as done
+
+        A job is up to date if the `JobArchive` has a successful run
+        of it with the same fingerprint and its output files exist.
+        A status marker is written for these jobs so that checking
+        their status does not depend on the old logfile.
+
+        Returns
+        -------
+        job_dict : dict
+            Dictionary with the `JobDetails` of the jobs that have to run
+        """
+        job_dict = {}
+        njob = 0
+        nskip = 0
+        for job_key, job_details in self._scatter_link.jobs.items():
+            if job_key.find(JobDetails.topkey) >= 0:
+                job_dict[job_key] = job_details
+                continue
+            njob += 1
+            fingerprint = job_details.make_fingerprint()
+            up_to_date = self._job_archive is not None and\
+                self._job_archive.is_up_to_date(job_details, fingerprint)
+            job_details.fingerprint = fingerprint
+            if not up_to_date:
+                job_dict[job_key] = job_details
+                continue
+            nskip += 1
+            job_details.status = JobStatus.done
+            if not self.args['dry_run']:
+                logdir = os.path.dirname(job_details.logfile)
+                if logdir and not os.path.isdir(logdir):
+                    os.makedirs(logdir)
+                write_status_marker(job_details.logfile, 0)
+        stream.write("Skipping %i of %i jobs that are up to date\n" %
+                     (nskip, njob))
+        return job_dict
+
     def resubmit(self, stream=sys.stdout, fail_running=False, resubmit_failed=False):
         """Function to resubmit failed jobs and collect results
 
@@ -125,6 +125,10 @@ class SlacInterface(SysInterface):
         self._max_job_age = kwargs.pop('max_job_age', 90)
         self._no_batch = kwargs.pop('no_batch', False)
 
+    def max_concurrent_jobs(self):
+        """Return the maximum number of running or queued jobs"""
+        return self._max_jobs
+
     def dispatch_job_hook(self, link, key, job_config, logfile, stream=sys.stdout):
         """Send a single job to the LSF batch
 
@@ -0,0 +1,492 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+`JobArchive` and `FileArchive` backends that persist the archives in an
+SQLite database.
+
+Unlike the FITS backend, which rewrites the complete tables every time
+the archive is saved, every change is written to the database in its
+own transaction.  Jobs and files are looked up with indices on their
+keys and status, and are only loaded into memory when they are used.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import argparse
+import sqlite3
+from contextlib import contextmanager
+
+import numpy as np
+from astropy.table import Table
+
+from fermipy.jobs.file_archive import FileHandle, FileArchive
+from fermipy.jobs.job_archive import JobStatus, JobDetails, JobArchive
+
+FILE_COLUMNS = ['key', 'path', 'creator', 'timestamp', 'status', 'flags']
+
+JOB_COLUMNS = ['dbkey', 'jobname', 'jobkey', 'appname', 'logfile',
+               'job_config', 'timestamp', 'status', 'fingerprint']
+
+# Roles of the files associated to a job
+FILE_ROLES = ['infile_ids', 'outfile_ids', 'rmfile_ids', 'intfile_ids']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    key INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    creator INTEGER,
+    timestamp INTEGER,
+    status INTEGER,
+    flags INTEGER);
+CREATE INDEX IF NOT EXISTS files_status ON files (status);
+CREATE TABLE IF NOT EXISTS jobs (
+    dbkey INTEGER PRIMARY KEY,
+    fullkey TEXT UNIQUE NOT NULL,
+    jobname TEXT,
+    jobkey TEXT,
+    appname TEXT,
+    logfile TEXT,
+    job_config TEXT,
+    timestamp INTEGER,
+    status INTEGER,
+    fingerprint TEXT DEFAULT '');
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE TABLE IF NOT EXISTS job_files (
+    dbkey INTEGER NOT NULL,
+    role INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    file_key INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS job_files_dbkey ON job_files (dbkey);
+"""
+
+
+def _to_str(value):
+    """Convert values read from FITS tables to str"""
+    if isinstance(value, bytes):
+        return value.decode()
+    return str(value)
+
+
+class ArchiveDB(object):
+    """Connection to an SQLite archive database.
+
+    A single connection is shared by all the archives that use the
+    same database file.  Transactions can be nested, changes are
+    committed when the outermost transaction ends and rolled back if
+    it raises an exception.
+
+    Parameters
+    ----------
+
+    path : str
+        Path to the database file
+    """
+    _connections = {}
+
+    def __init__(self, path):
+        self._path = os.path.abspath(path)
+        self._conn = sqlite3.connect(self._path, timeout=60.)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        # Databases written before fingerprints were added
+        columns = [row[1] for row in
+                   self._conn.execute('PRAGMA table_info(jobs)')]
+        if 'fingerprint' not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN fingerprint TEXT DEFAULT ''")
+            self._conn.commit()
+        self._depth = 0
+
+    @classmethod
+    def get(cls, path):
+        """Return the `ArchiveDB` for a database file, opening it if needed"""
+        path = os.path.abspath(path)
+        if path not in cls._connections:
+            cls._connections[path] = cls(path)
+        return cls._connections[path]
+
+    @property
+    def path(self):
+        """Return the path to the database file"""
+        return self._path
+
+    @contextmanager
+    def transaction(self):
+        """Context manager for a transaction"""
+        self._depth += 1
+        try:
+            yield self._conn
+        except BaseException:
+            self._depth -= 1
+            if self._depth == 0:
+                self._conn.rollback()
+            raise
+        self._depth -= 1
+        if self._depth == 0:
+            self._conn.commit()
+
+    def execute(self, sql, params=()):
+        """Execute a query and return the cursor"""
+        return self._conn.execute(sql, params)
+
+
+class SQLiteFileArchive(FileArchive):
+    """`FileArchive` persisted in an SQLite database.
+
+    The `FileHandle` objects are loaded from the database when they
+    are first used, so ``cache`` only holds the files used so far.
+    """
+    # Singleton instance
+    _archive = None
+
+    def _read_table_file(self, table_file):
+        """Open the database used to persist the archive"""
+        self._table_file = table_file
+        self._db = ArchiveDB.get(table_file)
+
+    @property
+    def db(self):
+        """Return the `ArchiveDB` used to persist this archive"""
+        return self._db
+
+    @property
+    def table(self):
+        """Return an `astropy.table.Table` with the content of the archive """
+        rows = self._db.execute('SELECT %s FROM files ORDER BY key' %
+                                ', '.join(FILE_COLUMNS)).fetchall()
+        return FileHandle.make_table({row[0]: self._make_handle(row)
+                                      for row in rows})
+
+    def _make_handle(self, row):
+        """Build a `FileHandle` from a database row"""
+        return FileHandle(**dict(zip(FILE_COLUMNS, row)))
+
+    def _lookup_handle(self, localpath):
+        row = self._db.execute('SELECT %s FROM files WHERE path=?' %
+                               ', '.join(FILE_COLUMNS),
+                               (localpath,)).fetchone()
+        if row is None:
+            raise KeyError(localpath)
+        file_handle = self._make_handle(row)
+        self._cache[file_handle.path] = file_handle
+        return file_handle
+
+    def _next_key(self):
+        # The key is assigned by the database when the file is inserted
+        return None
+
+    def _append_handle(self, file_handle):
+        with self._db.transaction() as conn:
+            cursor = conn.execute(
+                'INSERT INTO files (path, creator, timestamp, status, flags) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (file_handle.path, int(file_handle.creator),
+                 int(file_handle.timestamp), int(file_handle.status),
+                 int(file_handle.flags)))
+            file_handle.key = cursor.lastrowid
+
+    def _update_handle(self, file_handle):
+        with self._db.transaction() as conn:
+            conn.execute('UPDATE files SET path=?, creator=?, timestamp=?, '
+                         'status=?, flags=? WHERE key=?',
+                         (file_handle.path, int(file_handle.creator),
+                          int(file_handle.timestamp), int(file_handle.status),
+                          int(file_handle.flags), int(file_handle.key)))
+
+    def get_file_paths(self, id_list):
+        """Get a list of file paths based of a set of ids
+
+        Parameters
+        ----------
+
+        id_list : list
+            List of integer file keys
+
+        Returns list of file paths
+        """
+        if id_list is None:
+            return []
+        keys = [int(key) for key in id_list]
+        path_dict = {}
+        # Stay below the limit on the number of parameters of a query
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self._db.execute('SELECT key, path FROM files WHERE key IN (%s)' %
+                                    ', '.join(['?'] * len(chunk)), chunk)
+            path_dict.update(rows.fetchall())
+        return [path_dict[key] for key in keys if key in path_dict]
+
+    def get_files_by_status(self, status):
+        """Return the `FileHandle` of all the files with a given status"""
+        rows = self._db.execute('SELECT %s FROM files WHERE status=?' %
+                                ', '.join(FILE_COLUMNS), (int(status),))
+        return [self.get_handle(row[1]) for row in rows.fetchall()]
+
+    def write_table_file(self, table_file=None):
+        """Commit all the pending changes to the database"""
+        with self._db.transaction():
+            for file_handle in self._cache.values():
+                self._update_handle(file_handle)
+
+    def update_file_status(self):
+        """Update the status of all the files in the archive"""
+        rows = self._db.execute('SELECT path FROM files').fetchall()
+        for row in rows:
+            self.get_handle(row[0])
+        with self._db.transaction():
+            super(SQLiteFileArchive, self).update_file_status()
+
+
+class SQLiteJobArchive(JobArchive):
+    """`JobArchive` persisted in an SQLite database.
+
+    The jobs and the files are stored in the same database, by default
+    the file given by ``job_archive_table``.  The `JobDetails` objects
+    are loaded from the database when they are first used, so ``cache``
+    only holds the jobs used so far.
+    """
+    # Singleton instance
+    _archive = None
+    # Class of the associated `FileArchive`
+    file_archive_class = SQLiteFileArchive
+
+    def __init__(self, **kwargs):
+        """C'tor
+
+        Reads kwargs['job_archive_table'] and passes remain kwargs to self.file_archive
+        """
+        kwargs.setdefault('file_archive_table', kwargs['job_archive_table'])
+        super(SQLiteJobArchive, self).__init__(**kwargs)
+
+    def _read_table_file(self, table_file):
+        """Open the database used to persist the archive"""
+        self._table_file = table_file
+        self._db = ArchiveDB.get(table_file)
+
+    @property
+    def db(self):
+        """Return the `ArchiveDB` used to persist this archive"""
+        return self._db
+
+    @property
+    def table(self):
+        """Return an `astropy.table.Table` with the jobs in the archive """
+        rows = self._db.execute('SELECT %s FROM jobs ORDER BY dbkey' %
+                                ', '.join(JOB_COLUMNS)).fetchall()
+        cols = list(zip(*rows)) if rows else [[] for _ in JOB_COLUMNS]
+        dtypes = [int, str, str, str, str, str, int, int, str]
+        return Table(data=[np.array(c, dtype=d) for c, d in zip(cols, dtypes)],
+                     names=JOB_COLUMNS)
+
+    @property
+    def table_ids(self):
+        """Not used by this backend, the files of each job are stored in
+        the job_files table of the database """
+        return None
+
+    def _make_job_details(self, row):
+        """Build a `JobDetails` from a database row"""
+        kwargs = dict(zip(JOB_COLUMNS, row))
+        file_rows = self._db.execute('SELECT role, file_key FROM job_files '
+                                     'WHERE dbkey=? ORDER BY role, idx',
+                                     (kwargs['dbkey'],)).fetchall()
+        # Use the same layout as the FILE_IDS table of the FITS backend
+        file_ids = np.array([r[1] for r in file_rows], dtype=int)
+        roles = np.array([r[0] for r in file_rows], dtype=int)
+        for i, role in enumerate(FILE_ROLES):
+            kwargs[role] = np.flatnonzero(roles == i)
+        job_details = JobDetails(**kwargs)
+        job_details.get_file_paths(self._file_archive, file_ids)
+        self._cache[job_details.fullkey] = job_details
+        return job_details
+
+    def _lookup_job(self, fullkey):
+        row = self._db.execute('SELECT %s FROM jobs WHERE fullkey=?' %
+                               ', '.join(JOB_COLUMNS), (fullkey,)).fetchone()
+        if row is None:
+            raise KeyError(fullkey)
+        return self._make_job_details(row)
+
+    def _update_job(self, job_details):
+        with self._db.transaction() as conn:
+            conn.execute('UPDATE jobs SET timestamp=?, status=?, fingerprint=? '
+                         'WHERE dbkey=?',
+                         (int(job_details.timestamp), int(job_details.status),
+                          str(job_details.fingerprint), int(job_details.dbkey)))
+
+    def register_job(self, job_details):
+        """Register a job in this `JobArchive`
+
+        The job, its files and the references to them are written in a
+        single transaction.
+        """
+        try:
+            job_details_old = self.get_details(job_details.jobname,
+                                               job_details.jobkey)
+            self._update_registered_job(job_details_old, job_details)
+            job_details = job_details_old
+        except KeyError:
+            with self._db.transaction() as conn:
+                cursor = conn.execute(
+                    'INSERT INTO jobs (fullkey, jobname, jobkey, appname, logfile, '
+                    'job_config, timestamp, status, fingerprint) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (job_details.fullkey, str(job_details.jobname),
+                     str(job_details.jobkey), str(job_details.appname),
+                     str(job_details.logfile), str(job_details.job_config),
+                     int(job_details.timestamp), int(job_details.status),
+                     str(job_details.fingerprint)))
+                job_details.dbkey = cursor.lastrowid
+                job_details.get_file_ids(
+                    self._file_archive, creator=job_details.dbkey)
+                rows = []
+                for i, role in enumerate(FILE_ROLES):
+                    file_ids = getattr(job_details, role)
+                    if file_ids is None:
+                        continue
+                    rows += [(job_details.dbkey, i, j, int(fid))
+                             for j, fid in enumerate(file_ids)]
+                conn.executemany('INSERT INTO job_files (dbkey, role, idx, file_key) '
+                                 'VALUES (?, ?, ?, ?)', rows)
+        self._cache[job_details.fullkey] = job_details
+        return job_details
+
+    def get_jobs_by_status(self, status_list):
+        """Return the `JobDetails` of all the jobs whose status is in status_list"""
+        status_list = [int(s) for s in np.array(status_list, ndmin=1)]
+        rows = self._db.execute('SELECT %s FROM jobs WHERE status IN (%s)' %
+                                (', '.join(JOB_COLUMNS),
+                                 ', '.join(['?'] * len(status_list))),
+                                status_list).fetchall()
+        jobs = []
+        for row in rows:
+            fullkey = JobDetails.make_fullkey(row[1], row[2])
+            if fullkey in self._cache:
+                jobs.append(self._cache[fullkey])
+            else:
+                jobs.append(self._make_job_details(row))
+        return jobs
+
+    def count_jobs_by_status(self):
+        """Return an array with the number of jobs in each state"""
+        status_vect = np.zeros((8), int)
+        rows = self._db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status')
+        for status, njob in rows.fetchall():
+            if 0 <= status < len(status_vect):
+                status_vect[status] = njob
+        return status_vect
+
+    def remove_jobs(self, mask):
+        """Mark all jobs that match a mask as 'removed' """
+        table = self.table
+        with self._db.transaction() as conn:
+            for dbkey, jobname, jobkey in zip(table[mask]['dbkey'],
+                                              table[mask]['jobname'],
+                                              table[mask]['jobkey']):
+                conn.execute('UPDATE jobs SET status=? WHERE dbkey=?',
+                             (JobStatus.removed, int(dbkey)))
+                fullkey = JobDetails.make_fullkey(jobname, jobkey)
+                job_details = self._cache.pop(fullkey, None)
+                if job_details is not None:
+                    job_details.status = JobStatus.removed
+
+    def write_table_file(self, job_table_file=None, file_table_file=None):
+        """Commit the status of all the jobs in memory to the database"""
+        with self._db.transaction():
+            for job_details in self._cache.values():
+                self._update_job(job_details)
+            self._file_archive.write_table_file(file_table_file)
+
+    def update_job_status(self, checker_func):
+        """Update the status of all the pending and running jobs in the archive"""
+        jobs = self.get_jobs_by_status([JobStatus.pending, JobStatus.running])
+        sys.stdout.write("Updating status of %i jobs: " % len(jobs))
+        sys.stdout.flush()
+        with self._db.transaction():
+            for i, job_details in enumerate(jobs):
+                if i % 200 == 0:
+                    sys.stdout.write('.')
+                    sys.stdout.flush()
+                if checker_func:
+                    job_details.check_status_logfile(checker_func)
+                self._update_job(job_details)
+
+        sys.stdout.write("!\n")
+        sys.stdout.flush()
+        self._write_status_summary(self.count_jobs_by_status())
+
+
+def convert_fits_archive(job_archive_table, file_archive_table, outfile):
+    """Copy the content of FITS job and file archives to an SQLite database
+
+    Parameters
+    ----------
+
+    job_archive_table : str
+        Path to the FITS file of the `JobArchive`
+
+    file_archive_table : str
+        Path to the FITS file of the `FileArchive`
+
+    outfile : str
+        Path to the output database.  It should not contain any jobs
+        or files yet.
+    """
+    file_table = Table.read(file_archive_table)
+    job_table = Table.read(job_archive_table, hdu='JOB_ARCHIVE')
+    file_ids = Table.read(job_archive_table, hdu='FILE_IDS')['file_id'].data
+
+    db = ArchiveDB.get(outfile)
+    with db.transaction() as conn:
+        conn.executemany('INSERT INTO files (%s) VALUES (?, ?, ?, ?, ?, ?)' %
+                         ', '.join(FILE_COLUMNS),
+                         [(int(row['key']), _to_str(row['path']), int(row['creator']),
+                           int(row['timestamp']), int(row['status']), int(row['flags']))
+                          for row in file_table])
+
+        job_rows = []
+        file_rows = []
+        for row in job_table:
+            dbkey = int(row['dbkey'])
+            jobname = _to_str(row['jobname'])
+            jobkey = _to_str(row['jobkey'])
+            if 'fingerprint' in job_table.colnames:
+                fingerprint = _to_str(row['fingerprint'])
+            else:
+                fingerprint = ''
+            job_rows.append((dbkey, JobDetails.make_fullkey(jobname, jobkey),
+                             jobname, jobkey, _to_str(row['appname']),
+                             _to_str(row['logfile']), _to_str(row['job_config']),
+                             int(row['timestamp']), int(row['status']),
+                             fingerprint))
+            for i, role in enumerate(['infile_refs', 'outfile_refs',
+                                      'rmfile_refs', 'intfile_refs']):
+                refs = row[role]
+                file_rows += [(dbkey, i, j, int(file_ids[k]))
+                              for j, k in enumerate(range(refs[0], refs[1]))]
+
+        conn.executemany('INSERT INTO jobs (dbkey, fullkey, jobname, jobkey, appname, '
+                         'logfile, job_config, timestamp, status, fingerprint) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', job_rows)
+        conn.executemany('INSERT INTO job_files (dbkey, role, idx, file_key) '
+                         'VALUES (?, ?, ?, ?)', file_rows)
+
+
+def main_convert():
+    """Entry point for command line use for converting FITS archives to SQLite """
+    parser = argparse.ArgumentParser(usage="sqlite_archive.py [options]",
+                                     description="Convert a FITS job archive to SQLite")
+
+    parser.add_argument('--jobs', action='store', dest='job_archive_table',
+                        type=str, default='job_archive_temp.fits', help="Job archive file")
+    parser.add_argument('--files', action='store', dest='file_archive_table',
+                        type=str, default='file_archive_temp.fits', help="File archive file")
+    parser.add_argument('--output', action='store', dest='outfile',
+                        type=str, default='archive.db', help="Output database file")
+
+    args = parser.parse_args(sys.argv[1:])
+    convert_fits_archive(args.job_archive_table, args.file_archive_table,
+                         args.outfile)
+
+
+if __name__ == '__main__':
+    main_convert()
@@ -7,7 +7,7 @@ from __future__ import absolute_import, division, print_function
 import os
 import sys
 
-from fermipy.jobs.job_archive import JobStatus
+from fermipy.jobs.job_archive import get_timestamp, JobStatus
 
 
 def remove_file(filepath, dry_run=False):
@@ -32,10 +32,75 @@ def clean_job(logfile, outfiles, dry_run=False):
     If dry_run is True, print name of files to be removed, but do not remove them.
     """
     remove_file(logfile, dry_run)
+    remove_file(status_marker_path(logfile), dry_run)
+    # The next logfile may reuse the inode of the removed one
+    _LOG_STATES.pop(logfile, None)
     for outfile in outfiles.values():
         remove_file(outfile, dry_run)
 
 
+def status_marker_path(logfile):
+    """Return the path of the status marker of the job writing to logfile"""
+    return logfile + '.status'
+
+
+def write_status_marker(logfile, return_code):
+    """Write a status marker for a finished job
+
+    The marker is a small file next to the logfile with the return
+    code of the job and the time it finished.  It is written to a
+    temporary file that is then renamed, so readers never see a
+    partial marker.
+
+    Parameters
+    ----------
+
+    logfile : str
+        Path to the logfile of the job
+
+    return_code : int
+        Return code of the job, 0 for success
+    """
+    marker = status_marker_path(logfile)
+    tmpfile = '%s.%i.tmp' % (marker, os.getpid())
+    with open(tmpfile, 'w') as fout:
+        fout.write("%i %i\n" % (return_code, get_timestamp()))
+    os.rename(tmpfile, marker)
+
+
+def read_status_marker(logfile):
+    """Read the status marker of a job
+
+    Returns `JobStatus.done` or `JobStatus.failed` depending on the
+    return code in the marker, or None if there is no valid marker.
+    """
+    try:
+        with open(status_marker_path(logfile)) as fin:
+            tokens = fin.read().split()
+        return_code = int(tokens[0])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    if return_code == 0:
+        return JobStatus.done
+    return JobStatus.failed
+
+
+class _LogState(object):
+    """Scan state of a single logfile"""
+
+    def __init__(self, stat, exited, successful):
+        self.ino = stat.st_ino
+        self.mtime = None
+        self.size = 0
+        self.exited = exited
+        self.successful = successful
+        self.status = JobStatus.running
+
+
+# Scan state of the logfiles checked by `check_log`, keyed by path
+_LOG_STATES = {}
+
+
 def check_log(logfile, exited='Exited with exit code',
               successful='Successfully completed'):
     """Check a log file to determine status of LSF job
@@ -43,6 +108,12 @@ def check_log(logfile, exited='Exited with exit code',
     Often logfile doesn't exist because the job hasn't begun
     to run. It is unclear what you want to do in that case...
 
+    If the job wrote a status marker (see `write_status_marker`) the
+    status is taken from the marker and the logfile is not read.
+    Otherwise the logfile is scanned incrementally: only the part
+    written since the last call is read, and a logfile whose size and
+    modification time have not changed is not opened at all.
+
     Parameters
     ----------
 
@@ -57,13 +128,39 @@ def check_log(logfile, exited='Exited with exit code',
 
     Returns str, one of 'Pending', 'Running', 'Done', 'Failed'
     """
-    if not os.path.exists(logfile):
+    status = read_status_marker(logfile)
+    if status is not None:
+        _LOG_STATES.pop(logfile, None)
+        return status
+    try:
+        stat = os.stat(logfile)
+    except OSError:
+        _LOG_STATES.pop(logfile, None)
         return JobStatus.ready
-    if exited in open(logfile).read():
-        return JobStatus.failed
-    elif successful in open(logfile).read():
-        return JobStatus.done
-    return JobStatus.running
+
+    state = _LOG_STATES.get(logfile)
+    if (state is None or state.ino != stat.st_ino or stat.st_size < state.size or
+            state.exited != exited or state.successful != successful):
+        # New or rewritten logfile, scan it from the start
+        state = _LOG_STATES[logfile] = _LogState(stat, exited, successful)
+    elif state.mtime == stat.st_mtime and state.size == stat.st_size:
+        return state.status
+
+    # Re-read the end of the previous chunk to catch strings that
+    # were split between two scans
+    overlap = max(len(exited), len(successful))
+    offset = max(0, state.size - overlap)
+    with open(logfile, 'rb') as fin:
+        fin.seek(offset)
+        chunk = fin.read(stat.st_size - offset)
+
+    if exited.encode() in chunk:
+        state.status = JobStatus.failed
+    elif successful.encode() in chunk and state.status != JobStatus.failed:
+        state.status = JobStatus.done
+    state.size = offset + len(chunk)
+    state.mtime = stat.st_mtime
+    return state.status
 
 
 class SysInterface(object):
@@ -78,6 +175,18 @@ class SysInterface(object):
         self._dry_run = kwargs.get('dry_run', False)
         self._job_check_sleep = kwargs.get('job_check_sleep', None)
 
+    @property
+    def poll_interval(self):
+        """Time in seconds between checks of the status of dispatched jobs"""
+        if self._job_check_sleep is None:
+            return 60
+        return self._job_check_sleep
+
+    def max_concurrent_jobs(self):
+        """Return the maximum number of jobs that can be dispatched at
+        the same time, or None if there is no limit"""
+        return None
+
     @classmethod
     def check_job(cls, job_details):
         """ Check the status of a specfic job """
@@ -111,6 +220,11 @@ class SysInterface(object):
         job_config = job_details.job_config
         link.update_args(job_config)
         logfile = job_config['logfile']
+        # A marker or scan state left by an earlier run of the job
+        # would hide the status of this one
+        if not self._dry_run:
+            remove_file(status_marker_path(logfile))
+            _LOG_STATES.pop(logfile, None)
         try:
             self.dispatch_job_hook(link, key, job_config, logfile, stream)
             job_details.status = JobStatus.running
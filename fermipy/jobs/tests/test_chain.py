@@ -1,10 +1,16 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from __future__ import absolute_import, division, print_function
 
-from fermipy.jobs.file_archive import FileFlags
+import os
+import sys
+
+from fermipy.jobs.file_archive import FileFlags, FileArchive
+from fermipy.jobs.job_archive import JobStatus, JobDetails, JobArchive
 from fermipy.jobs.link import Link
 from fermipy.jobs.chain import Chain
 from fermipy.jobs.app_link import AppLink
+from fermipy.jobs.scatter_gather import ScatterGather
+from fermipy.jobs.native_impl import NativeInterface
 from fermipy.jobs import defaults
 
 def test_applink():
@@ -78,6 +84,190 @@ def test_chain():
 
     chain = TestChain()
     assert chain
+    assert chain.args['dag'] is False
+
+
+class Link_Copy(Link):
+    """Small test class that copies a file, or creates it if there is
+    no input file"""
+
+    appname = 'test-copy'
+    linkname_default = 'copy'
+    usage = '%s [options]' % (appname)
+    description = "Link to run %s" % (appname)
+
+    default_options = dict(infile=(None, "Input file", str),
+                           outfile=(None, "Output file", str))
+    default_file_args = dict(infile=FileFlags.input_mask,
+                             outfile=FileFlags.output_mask)
+
+    def run_command(self, stream=sys.stdout, dry_run=False):
+        text = 'start\n'
+        if self.args['infile'] is not None:
+            text = open(self.args['infile']).read() + self.linkname + '\n'
+        with open(self.args['outfile'], 'w') as fout:
+            fout.write(text)
+        return 0
+
+
+def test_chain_dag(tmpdir, monkeypatch, capsys):
+    """ Test running the jobs of a `Chain` as a dependency graph """
+
+    # Use a new file archive instead of the singleton
+    monkeypatch.setattr(FileArchive, '_archive', None)
+    monkeypatch.chdir(str(tmpdir))
+
+    class TestChain(Chain):
+        """Small test class """
+        appname = 'test-chain-dag'
+        linkname_default = 'chain-dag'
+        usage = '%s [options]' % (appname)
+        description = 'Test pipeline'
+
+        default_options = dict(dry_run=defaults.common['dry_run'])
+
+        def _map_arguments(self, args):
+            self._set_link('make', Link_Copy, outfile='make.txt')
+            self._set_link('copy', Link_Copy,
+                           infile='make.txt', outfile='copy.txt')
+
+    job_archive = JobArchive(file_archive_table=str(tmpdir.join('files.fits')),
+                             job_archive_table=str(tmpdir.join('jobs.fits')),
+                             base_path=str(tmpdir))
+    chain = TestChain(job_archive=job_archive)
+    chain.update_args(dict(dag=True))
+    assert chain.args['dag'] is True
+
+    nodes = chain._job_graph_nodes()
+    assert [node.link for node in nodes] == [chain['make'], chain['copy']]
+    assert nodes[0].output_files == set(['make.txt'])
+    assert nodes[1].input_files == set(['make.txt'])
+
+    chain._run_chain()
+    assert 'Running 2 jobs of chain chain-dag as a dependency graph' in \
+        capsys.readouterr().out
+    assert open('copy.txt').read() == 'start\ncopy\n'
+
+    key = JobDetails.make_fullkey(chain.full_linkname)
+    assert chain.jobs[key].status == JobStatus.done
+    assert chain.check_links_status() == JobStatus.done
+    for link in chain.links.values():
+        job_details = job_archive.get_details(link.full_linkname,
+                                              JobDetails.topkey)
+        assert job_details.status == JobStatus.done
+        assert os.path.exists(job_details.logfile)
+    assert os.path.exists(str(tmpdir.join('jobs.fits')))
+
+
+
+# Job run in a subprocess by `Link_Script`: copies the input file and
+# flags jobs that run at the same time as another job
+COPY_SCRIPT = """
+import os, sys, time
+args = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+try:
+    os.close(os.open('running.lock', os.O_CREAT | os.O_EXCL))
+except OSError:
+    open('overlap', 'w').close()
+time.sleep(0.2)
+text = open(args['--infile']).read()
+with open(args['--outfile'], 'w') as fout:
+    fout.write(text + os.path.basename(args['--outfile']) + '\\n')
+os.remove('running.lock')
+"""
+
+
+class Link_Script(Link):
+    """Small test class that copies a file in a subprocess"""
+
+    appname = 'test-copy-script'
+    linkname_default = 'copy-script'
+    usage = '%s [options]' % (appname)
+    description = "Link to run %s" % (appname)
+
+    default_options = dict(infile=(None, "Input file", str),
+                           outfile=(None, "Output file", str))
+    default_file_args = dict(infile=FileFlags.input_mask,
+                             outfile=FileFlags.output_mask)
+
+
+class Copy_SG(ScatterGather):
+    """Small test class that copies a set of files"""
+
+    appname = 'test-copy-sg'
+    usage = "%s [options]" % (appname)
+    description = "Copy files"
+    clientclass = Link_Script
+
+    job_time = 60
+
+    default_options = dict(infile=(None, "Input file name format", str),
+                           outfile=(None, "Output file name format", str))
+
+    def build_job_configs(self, args):
+        job_configs = {}
+        if args['outfile'] is None:
+            return job_configs
+        for i in range(2):
+            job_configs['job%i' % i] = dict(
+                infile=args['infile'].format(i=i),
+                outfile=args['outfile'].format(i=i),
+                logfile=os.path.join('logs', args['outfile'].format(i=i) + '.log'))
+        return job_configs
+
+
+def test_chain_dag_scatter_gather(tmpdir, monkeypatch, capsys):
+    """ Test running a `Chain` with `ScatterGather` links as a
+    dependency graph """
+
+    monkeypatch.setattr(FileArchive, '_archive', None)
+    monkeypatch.chdir(str(tmpdir))
+    tmpdir.join('copy_script.py').write(COPY_SCRIPT)
+    monkeypatch.setattr(Link_Script, 'appname', '%s %s' % (
+        sys.executable, str(tmpdir.join('copy_script.py'))))
+
+    class TestChain(Chain):
+        """Small test class """
+        appname = 'test-chain-dag-sg'
+        linkname_default = 'chain-dag-sg'
+        usage = '%s [options]' % (appname)
+        description = 'Test pipeline'
+
+        default_options = dict(dry_run=defaults.common['dry_run'])
+
+        def _map_arguments(self, args):
+            self._set_link('make', Link_Copy, outfile='make.txt')
+            self._set_link('copy-a', Copy_SG,
+                           infile='make.txt', outfile='a{i}.txt')
+            self._set_link('copy-b', Copy_SG,
+                           infile='a{i}.txt', outfile='b{i}.txt')
+
+    job_archive = JobArchive(file_archive_table=str(tmpdir.join('files.fits')),
+                             job_archive_table=str(tmpdir.join('jobs.fits')),
+                             base_path=str(tmpdir))
+    chain = TestChain(job_archive=job_archive)
+    chain.update_args(dict(dag=True))
+
+    # Each link dispatches through its own interface, at most one job
+    # may run at a time on this machine
+    for linkname in ['copy-a', 'copy-b']:
+        chain[linkname]._interface = NativeInterface(max_jobs=1,
+                                                     poll_interval=0.05)
+
+    nodes = chain._job_graph_nodes()
+    assert len(nodes) == 5
+    assert nodes[1].interface is chain['copy-a']._interface
+    assert nodes[3].interface is chain['copy-b']._interface
+    assert nodes[3].input_files == set(['a0.txt'])
+
+    chain._run_chain()
+    assert 'Running 5 jobs of chain chain-dag-sg as a dependency graph' in \
+        capsys.readouterr().out
+    for i in range(2):
+        assert open('b%i.txt' % i).read() == 'start\na%i.txt\nb%i.txt\n' % (i, i)
+    # The limit of one job holds across the interfaces of the links
+    assert not os.path.exists('overlap')
+    assert chain.check_links_status() == JobStatus.done
 
 
 if __name__ == '__main__':
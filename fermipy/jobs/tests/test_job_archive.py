@@ -4,7 +4,8 @@ from __future__ import absolute_import, division, print_function
 import os
 
 from fermipy.jobs.job_archive import JobStatus, JobDetails, JobArchive
-from fermipy.jobs.file_archive import FileFlags
+from fermipy.jobs.file_archive import FileFlags, FileDict, FileArchive
+from fermipy.jobs.sqlite_archive import SQLiteJobArchive, SQLiteFileArchive
 from fermipy.jobs.chain import Link
 
 
@@ -96,6 +97,60 @@ def test_job_archive():
     assert job2
 
 
+def test_job_fingerprint(tmpdir, monkeypatch):
+    """ Test skipping jobs whose fingerprint matches a successful run """
+
+    # Use new file archives instead of the singletons
+    monkeypatch.setattr(FileArchive, '_archive', None)
+    monkeypatch.setattr(SQLiteFileArchive, '_archive', None)
+
+    infile = str(tmpdir.join('input.txt'))
+    outfile = str(tmpdir.join('output.txt'))
+    with open(infile, 'w') as fout:
+        fout.write('1')
+    open(outfile, 'w').close()
+
+    def make_job(**kwargs):
+        file_dict = FileDict()
+        file_dict.file_dict[infile] = FileFlags.input_mask
+        file_dict.file_dict[outfile] = FileFlags.output_mask
+        return JobDetails(jobname='test', jobkey='dummy', appname='test',
+                          logfile=str(tmpdir.join('dummy.log')),
+                          job_config=dict(infile=infile, opt=1),
+                          file_dict=file_dict, **kwargs)
+
+    archives = [(JobArchive, dict(job_archive_table=str(tmpdir.join('jobs.fits')),
+                                  file_archive_table=str(tmpdir.join('files.fits')))),
+                (SQLiteJobArchive, dict(job_archive_table=str(tmpdir.join('jobs.db'))))]
+
+    for archive_class, kwargs in archives:
+        kwargs['base_path'] = str(tmpdir)
+        job = make_job()
+        fingerprint = job.make_fingerprint()
+        assert fingerprint == make_job().make_fingerprint()
+
+        job_archive = archive_class(**kwargs)
+        assert not job_archive.is_up_to_date(job, fingerprint)
+        job_archive.register_job(make_job(status=JobStatus.done,
+                                          fingerprint=fingerprint))
+        if archive_class is JobArchive:
+            job_archive.write_table_file()
+            job_archive = archive_class(**kwargs)
+        assert job_archive.is_up_to_date(job, fingerprint)
+
+        job.job_config['opt'] = 2
+        assert not job_archive.is_up_to_date(job, job.make_fingerprint())
+        with open(infile, 'w') as fout:
+            fout.write('2')
+        assert make_job().make_fingerprint() != fingerprint
+
+        # A failed run invalidates the fingerprint
+        job_archive.register_job(make_job(status=JobStatus.failed))
+        assert not job_archive.is_up_to_date(job, fingerprint)
+        with open(infile, 'w') as fout:
+            fout.write('1')
+
+
 if __name__ == '__main__':
     test_job_details()
     test_job_archive()
@@ -0,0 +1,79 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+
+import os
+
+from fermipy.jobs.file_archive import FileDict, FileFlags
+from fermipy.jobs.job_archive import JobStatus, JobDetails
+from fermipy.jobs.job_graph import JobNode, JobGraph
+from fermipy.jobs.native_impl import NativeInterface
+
+
+class ShellLink(object):
+    """ Minimal stand-in for a `Link` that runs shell commands """
+
+    def __init__(self):
+        self.jobs = {}
+
+    def add_job(self, key, cmd, logdir, infiles=(), outfiles=()):
+        file_dict = FileDict()
+        for path in infiles:
+            file_dict.file_dict[path] = FileFlags.input_mask
+        for path in outfiles:
+            file_dict.file_dict[path] = FileFlags.output_mask
+        self.jobs[key] = JobDetails(jobname='shell', jobkey=key,
+                                    logfile=os.path.join(logdir, '%s.log' % key),
+                                    job_config=dict(cmd=cmd),
+                                    file_dict=file_dict,
+                                    status=JobStatus.not_ready)
+
+    def command_template(self):
+        return '{cmd}'
+
+    def update_args(self, override_args):
+        pass
+
+
+def test_job_graph(tmpdir):
+    """ Test running jobs in the order given by their input and output files """
+
+    def path(name):
+        return str(tmpdir.join(name))
+
+    link = ShellLink()
+    link.add_job('a0', 'echo a0 > %s' % path('a0.txt'), str(tmpdir),
+                 outfiles=[path('a0.txt')])
+    link.add_job('a1', 'sleep 1; echo a1 > %s' % path('a1.txt'), str(tmpdir),
+                 outfiles=[path('a1.txt')])
+    link.add_job('b0', 'cat %s > %s; test -e %s || touch %s' %
+                 (path('a0.txt'), path('b0.txt'), path('a1.txt'), path('early')),
+                 str(tmpdir), infiles=[path('a0.txt')], outfiles=[path('b0.txt')])
+    link.add_job('b1', 'cat %s > %s' % (path('a1.txt'), path('b1.txt')),
+                 str(tmpdir), infiles=[path('a1.txt')], outfiles=[path('b1.txt')])
+    link.add_job('c', 'cat %s %s > %s' % (path('b0.txt'), path('b1.txt'), path('c.txt')),
+                 str(tmpdir), infiles=[path('b0.txt'), path('b1.txt')],
+                 outfiles=[path('c.txt')])
+    link.add_job('f', 'exit 1', str(tmpdir), outfiles=[path('f.txt')])
+    link.add_job('g', 'cat %s' % path('f.txt'), str(tmpdir),
+                 infiles=[path('f.txt')])
+
+    interface = NativeInterface(max_jobs=4, poll_interval=0.05)
+    keys = ['a0', 'a1', 'b0', 'b1', 'c', 'f', 'g']
+    graph = JobGraph([JobNode(link, key, interface) for key in keys])
+
+    assert graph.nodes[2].depends == set([0])
+    assert graph.nodes[4].depends == set([2, 3])
+    assert graph.nodes[0].dependents == set([2])
+    assert not graph.nodes[5].depends
+
+    njobs = graph.run()
+    assert njobs[JobStatus.done] == 5
+    assert njobs[JobStatus.failed] == 1
+    assert njobs[JobStatus.not_ready] == 1
+
+    assert open(path('c.txt')).read() == 'a0\na1\n'
+    # b0 started before a1 was done
+    assert os.path.exists(path('early'))
+    assert link.jobs['c'].status == JobStatus.done
+    assert link.jobs['f'].status == JobStatus.failed
+    assert not os.path.exists(link.jobs['g'].logfile)
@@ -0,0 +1,54 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+
+import os
+
+from fermipy.jobs.job_archive import JobStatus, JobDetails
+from fermipy.jobs.native_impl import NativeInterface
+
+
+class ShellLink(object):
+    """ Minimal stand-in for a `Link` that runs a shell command """
+
+    def __init__(self, commands, logdir):
+        self.jobs = {}
+        for key, cmd in commands.items():
+            self.jobs[key] = JobDetails(jobname='shell', jobkey=key,
+                                        logfile=os.path.join(logdir, '%s.log' % key),
+                                        job_config=dict(cmd=cmd),
+                                        status=JobStatus.ready)
+
+    def command_template(self):
+        return '{cmd}'
+
+    def update_args(self, override_args):
+        pass
+
+
+def test_native_interface(tmpdir):
+    """ Test running jobs concurrently with `NativeInterface` """
+
+    counter = str(tmpdir.join('counter'))
+    commands = dict(ok='echo hello',
+                    fail='exit 3',
+                    retry='echo x >> %s; test $(wc -l < %s) -ge 2' % (counter, counter),
+                    timeout='sleep 30')
+    link = ShellLink(commands, str(tmpdir))
+    interface = NativeInterface(max_jobs=2, job_timeout=1.,
+                                max_retries=1, poll_interval=0.05)
+
+    assert interface.submit_jobs(link) == JobStatus.done
+    assert not interface._running
+
+    assert link.jobs['ok'].status == JobStatus.done
+    assert link.jobs['retry'].status == JobStatus.done
+    assert link.jobs['fail'].status == JobStatus.failed
+    assert link.jobs['timeout'].status == JobStatus.failed
+
+    assert interface.exit_codes[link.jobs['ok'].logfile] == 0
+    assert interface.exit_codes[link.jobs['fail'].logfile] == 3
+    assert interface.check_job(link.jobs['ok']) == JobStatus.done
+    assert interface.check_job(link.jobs['fail']) == JobStatus.failed
+    assert open(link.jobs['ok'].logfile).read().strip() == 'hello'
+    assert len(open(counter).readlines()) == 2
+    assert os.path.exists(link.jobs['ok'].logfile + '.status')
@@ -0,0 +1,100 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+
+from fermipy.jobs.job_archive import JobStatus, JobArchive
+from fermipy.jobs.file_archive import FileFlags, FileArchive
+from fermipy.jobs.sqlite_archive import SQLiteJobArchive, SQLiteFileArchive,\
+    convert_fits_archive
+from fermipy.jobs.chain import Link
+
+
+class DummyLink(Link):
+    """ Dummy class for this test """
+
+    appname = 'test_app'
+    linkname_default = 'test'
+    usage = '%s [options]' % (appname)
+    description = "Link to run %s" % (appname)
+
+    default_options = dict(infile1=(None, 'Input file 1', str),
+                           infile2=(None, 'Input file 2', str),
+                           outfile1=(None, 'Output file 1', str))
+    default_file_args = dict(infile1=FileFlags.input_mask,
+                             infile2=FileFlags.input_mask,
+                             outfile1=FileFlags.output_mask)
+
+
+def register_jobs(job_archive, njob=3):
+    link = DummyLink()
+    for i in range(njob):
+        link.update_args(dict(infile1='input%i_1.fits' % i,
+                              infile2='input_common.fits',
+                              outfile1='output%i.fits' % i))
+        job_archive.register_job_from_link(link, 'dummy%i' % i,
+                                           logfile='dummy%i.log' % i,
+                                           status=JobStatus.running)
+
+
+def check_archive(job_archive, njob=3):
+    for i in range(njob):
+        job = job_archive.get_details('test', 'dummy%i' % i)
+        assert job.logfile == 'dummy%i.log' % i
+        assert 'output%i.fits' % i in job.file_dict.file_dict
+        assert 'input_common.fits' in job.file_dict.file_dict
+        handle = job_archive.file_archive.get_handle('input%i_1.fits' % i)
+        assert handle.creator == job.dbkey
+
+
+def test_sqlite_job_archive(tmpdir):
+    """ Test that jobs can be registered, updated and read back """
+
+    dbfile = str(tmpdir.join('archive.db'))
+    SQLiteFileArchive._archive = None
+    job_archive = SQLiteJobArchive(job_archive_table=dbfile,
+                                   base_path=str(tmpdir))
+    register_jobs(job_archive)
+
+    job = job_archive.get_details('test', 'dummy1')
+    job.status = JobStatus.done
+    job_archive.update_job(job)
+
+    # Read the archive back from the database
+    SQLiteFileArchive._archive = None
+    job_archive = SQLiteJobArchive(job_archive_table=dbfile,
+                                   base_path=str(tmpdir))
+    assert len(job_archive.cache) == 0
+    check_archive(job_archive)
+    assert job_archive.get_details('test', 'dummy1').status == JobStatus.done
+    assert len(job_archive.table) == 3
+    assert len(job_archive.file_archive.table) == 7
+
+    running = job_archive.get_jobs_by_status(JobStatus.running)
+    assert sorted([j.jobkey for j in running]) == ['dummy0', 'dummy2']
+
+    job_archive.update_job_status(lambda logfile: JobStatus.failed)
+    status_vect = job_archive.count_jobs_by_status()
+    assert status_vect[JobStatus.failed] == 2
+    assert status_vect[JobStatus.done] == 1
+
+
+def test_convert_fits_archive(tmpdir):
+    """ Test the conversion of FITS archives to SQLite """
+
+    job_file = str(tmpdir.join('archive_jobs.fits'))
+    file_file = str(tmpdir.join('archive_files.fits'))
+    FileArchive._archive = None
+    job_archive = JobArchive(job_archive_table=job_file,
+                             file_archive_table=file_file,
+                             base_path=str(tmpdir))
+    register_jobs(job_archive)
+    job_archive.write_table_file()
+    FileArchive._archive = None
+
+    dbfile = str(tmpdir.join('converted.db'))
+    convert_fits_archive(job_file, file_file, dbfile)
+
+    SQLiteFileArchive._archive = None
+    job_archive = SQLiteJobArchive(job_archive_table=dbfile,
+                                   base_path=str(tmpdir))
+    check_archive(job_archive)
+    assert job_archive.count_jobs_by_status()[JobStatus.running] == 3
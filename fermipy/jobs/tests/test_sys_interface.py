@@ -0,0 +1,69 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+
+import os
+
+from fermipy.jobs.job_archive import JobStatus
+from fermipy.jobs.sys_interface import check_log, clean_job,\
+    status_marker_path, write_status_marker
+
+
+def test_check_log(tmpdir):
+    """ Test incremental checking of a logfile """
+
+    logfile = str(tmpdir.join('job.log'))
+    assert check_log(logfile) == JobStatus.ready
+
+    with open(logfile, 'w') as fout:
+        fout.write('Starting job\n' * 1000)
+    assert check_log(logfile) == JobStatus.running
+
+    with open(logfile, 'a') as fout:
+        fout.write('Successfully ')
+    assert check_log(logfile) == JobStatus.running
+    with open(logfile, 'a') as fout:
+        fout.write('completed\n')
+    assert check_log(logfile) == JobStatus.done
+    assert check_log(logfile) == JobStatus.done
+
+    # A rewritten logfile is scanned from the start
+    os.remove(logfile)
+    with open(logfile, 'w') as fout:
+        fout.write('Exited with exit code 1\n')
+    assert check_log(logfile) == JobStatus.failed
+
+
+def test_status_marker(tmpdir):
+    """ Test that status markers take precedence over the logfile """
+
+    logfile = str(tmpdir.join('job.log'))
+    with open(logfile, 'w') as fout:
+        fout.write('Starting job\n')
+    assert check_log(logfile) == JobStatus.running
+
+    write_status_marker(logfile, 0)
+    assert os.path.exists(status_marker_path(logfile))
+    assert check_log(logfile) == JobStatus.done
+    write_status_marker(logfile, 2)
+    assert check_log(logfile) == JobStatus.failed
+
+    clean_job(logfile, {})
+    assert not os.path.exists(status_marker_path(logfile))
+    assert check_log(logfile) == JobStatus.ready
+
+
+def test_check_log_after_clean(tmpdir):
+    """ Test that a cleaned job is not reported with its old status """
+
+    logfile = str(tmpdir.join('job.log'))
+    with open(logfile, 'w') as fout:
+        fout.write('Exited with exit code 1\n')
+    assert check_log(logfile) == JobStatus.failed
+
+    # The new logfile may reuse the inode of the old one and is
+    # longer than it, such that it would look like an appended file
+    clean_job(logfile, {})
+    with open(logfile, 'w') as fout:
+        fout.write('Starting job\n' * 10)
+        fout.write('Successfully completed\n')
+    assert check_log(logfile) == JobStatus.done
@@ -0,0 +1,219 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Bank of PSF-convolved source kernels that are reused across calls
+to residmap, tsmap, extension and sourcefind.
+"""
+from __future__ import absolute_import, division, print_function
+from collections import OrderedDict
+import numpy as np
+from fermipy import srcmap_utils
+from fermipy.file_cache import make_cache_key
+
+
+class KernelBank(object):
+    """Bank of PSF-convolved kernels for a given PSF model.
+
+    Kernels are generated with `~fermipy.srcmap_utils.make_kernel`
+    and are identified by the PSF model, spatial model, spatial width
+    and pixel geometry.  Kernels are kept in memory in a
+    least-recently-used cache bounded by ``max_size`` and optionally
+    stored in a persistent `~fermipy.file_cache.FileCache`.
+
+    If a grid of ``widths`` is given the kernels of extended sources
+    are computed only at the grid points.  The kernel of a width that
+    lies between two grid points is obtained by linear interpolation
+    in the logarithm of the width.
+
+    Source positions are snapped to a grid with ``subpix`` steps per
+    pixel.  Kernels are keyed on the sub-pixel offset of the snapped
+    position and are computed on a window twice as large as the
+    requested one with the source at its center.  The kernel of a
+    source at any pixel within the requested window is extracted from
+    this window such that sources with the same sub-pixel offset share
+    the same kernel.
+
+    Parameters
+    ----------
+    psf : `~fermipy.irfs.PSFModel`
+        PSF model.
+    max_size : float
+        Maximum size in bytes of the kernels kept in memory.  If None
+        the size of the memory cache is not limited and if 0 kernels
+        are not kept in memory.
+    file_cache : `~fermipy.file_cache.FileCache`
+        Persistent cache in which kernels are stored.  If None kernels
+        are only kept in memory.
+    widths : array_like
+        Grid of spatial widths in degrees on which the kernels of
+        extended sources are evaluated.  If None kernels are evaluated
+        at the width of every request.
+    subpix : int
+        Number of steps per pixel of the grid on which source
+        positions are snapped.  If None kernels are computed at the
+        exact source position and are only reused for identical
+        positions.
+    """
+
+    def __init__(self, psf, max_size=None, file_cache=None, widths=None,
+                 subpix=10):
+        self._psf = psf
+        self._psf_key = make_cache_key(psf.dtheta, psf.energies, psf.val)
+        self._max_size = max_size
+        self._file_cache = file_cache
+        self._widths = None
+        if widths is not None:
+            self._widths = np.unique(np.array(widths, ndmin=1, dtype=float))
+        self._subpix = subpix
+        self._kernels = OrderedDict()
+        self._size = 0
+
+    @property
+    def psf(self):
+        return self._psf
+
+    @property
+    def subpix(self):
+        return self._subpix
+
+    @property
+    def widths(self):
+        return self._widths
+
+    @property
+    def size(self):
+        """Total size in bytes of the kernels kept in memory."""
+        return self._size
+
+    def __len__(self):
+        return len(self._kernels)
+
+    def get(self, spatial_model, sigma, npix=(500, 500), xpix=0.0, ypix=0.0,
+            cdelt=0.01, klims=None, sparse=False):
+        """Return the PSF-convolved kernel of a spatial model.  See
+        `~fermipy.srcmap_utils.make_srcmap` for a description of the
+        parameters.  The source position is snapped to the grid set
+        by ``subpix``.  The returned array is a copy that can be
+        modified by the caller."""
+
+        kw = dict(npix=npix, xpix=xpix, ypix=ypix, cdelt=cdelt,
+                  klims=klims, sparse=sparse)
+        # Kernels of a rescaled PSF are not stored
+        if self._psf.scale_fn is not None:
+            return srcmap_utils.make_kernel(self._psf, spatial_model, sigma,
+                                            **kw)
+
+        bounds = self._find_bounds(spatial_model, sigma)
+        if bounds is None:
+            return self._get(spatial_model, sigma, **kw).copy()
+
+        w0, w1 = bounds
+        f = np.log(sigma / w0) / np.log(w1 / w0)
+        k0 = self._get(spatial_model, w0, **kw)
+        k1 = self._get(spatial_model, w1, **kw)
+        return (1.0 - f) * k0 + f * k1
+
+    def precompute(self, spatial_model, npix=(500, 500), xpix=0.0, ypix=0.0,
+                   cdelt=0.01, klims=None, sparse=False):
+        """Generate the kernels of a spatial model at all points of
+        the width grid.  The pixel geometry is set with the same
+        parameters as for `get`."""
+        if self._widths is None:
+            return
+        for w in self._widths:
+            self._get(spatial_model, w, npix=npix, xpix=xpix, ypix=ypix,
+                      cdelt=cdelt, klims=klims, sparse=sparse)
+
+    def clear(self):
+        """Delete all kernels kept in memory."""
+        self._kernels.clear()
+        self._size = 0
+
+    def _find_bounds(self, spatial_model, sigma):
+        """Return the grid widths that bracket ``sigma`` or None if
+        the kernel should be evaluated at ``sigma``."""
+        if (self._widths is None or spatial_model == 'PointSource' or
+                sigma is None):
+            return None
+        widths = self._widths
+        if sigma <= widths[0] or sigma >= widths[-1]:
+            return None
+        i = np.searchsorted(widths, sigma)
+        if np.isclose(sigma, widths[i - 1], rtol=1E-6, atol=0.0):
+            return None
+        elif np.isclose(sigma, widths[i], rtol=1E-6, atol=0.0):
+            return None
+        return widths[i - 1], widths[i]
+
+    def _make_key(self, spatial_model, sigma, npix, xpix, ypix, cdelt,
+                  klims, sparse):
+        if spatial_model == 'PointSource' or sigma is None:
+            sigma = None
+        else:
+            sigma = float(sigma)
+        npix = [int(t) for t in np.array(npix, ndmin=1)]
+        if klims is not None:
+            klims = [int(t) for t in klims]
+        return make_cache_key('kernel', self._psf_key, spatial_model, sigma,
+                              npix, float(xpix), float(ypix), float(cdelt),
+                              klims, bool(sparse))
+
+    def _snap(self, pix):
+        """Snap a pixel coordinate to the sub-pixel grid and return
+        its integer part and its sub-pixel offset."""
+        n = int(np.round(pix * self._subpix))
+        return n // self._subpix, (n % self._subpix) / float(self._subpix)
+
+    def _get(self, spatial_model, sigma, npix, xpix, ypix, **kwargs):
+
+        if self._subpix is None:
+            return self._get_kernel(spatial_model, sigma, npix=npix,
+                                    xpix=xpix, ypix=ypix, **kwargs)
+
+        nx, ny = [int(t) for t in np.resize(np.array(npix, ndmin=1), 2)]
+        ix, dx = self._snap(xpix)
+        iy, dy = self._snap(ypix)
+
+        # Sources outside of the window are evaluated at the snapped
+        # position
+        if ix < 0 or ix >= nx or iy < 0 or iy >= ny:
+            return self._get_kernel(spatial_model, sigma, npix=npix,
+                                    xpix=ix + dx, ypix=iy + dy, **kwargs)
+
+        k = self._get_kernel(spatial_model, sigma,
+                             npix=(2 * nx - 1, 2 * ny - 1),
+                             xpix=nx - 1 + dx, ypix=ny - 1 + dy, **kwargs)
+        return k[:, ny - 1 - iy:2 * ny - 1 - iy, nx - 1 - ix:2 * nx - 1 - ix]
+
+    def _get_kernel(self, spatial_model, sigma, **kwargs):
+
+        key = self._make_key(spatial_model, sigma, **kwargs)
+        k = self._kernels.get(key, None)
+        if k is not None:
+            self._kernels.move_to_end(key)
+            return k
+
+        if self._file_cache is not None:
+            k = self._file_cache.load_array(key)
+
+        if k is None:
+            k = srcmap_utils.make_kernel(self._psf, spatial_model, sigma,
+                                         **kwargs)
+            if self._file_cache is not None:
+                self._file_cache.save_array(key, k)
+
+        self._add(key, k)
+        return k
+
+    def _add(self, key, k):
+        if self._max_size is None:
+            self._kernels[key] = k
+            self._size += k.nbytes
+            return
+        # Kernels larger than the memory cache are not kept
+        if k.nbytes > self._max_size:
+            return
+        self._kernels[key] = k
+        self._size += k.nbytes
+        while self._size > self._max_size:
+            _, v = self._kernels.popitem(last=False)
+            self._size -= v.nbytes
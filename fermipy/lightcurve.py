@@ -2,15 +2,18 @@
 from __future__ import absolute_import, division, print_function
 
 import os
+import sys
 import copy
+import time
+import pickle
 import shutil
 import logging
+import hashlib
 import yaml
 import json
 from collections import OrderedDict
 from multiprocessing import Pool
 from functools import partial
-import sys
 
 import numpy as np
 
@@ -169,11 +172,12 @@ def _process_lc_bin(itime, name, config, basedir, workdir, diff_sources, const_s
         print('Analysis failed in time range %i %i' %
               (time[0], time[1]))
         print(sys.exc_info())
-        return {'fit_success': False}
+        return {'fit_success': False, 'config': config}
 
     gta._lck_params = lck_params
     # Recompute source map for source of interest and sources within 3 deg
-    if gta.config['gtlike']['use_scaled_srcmap']:
+    if (gta.config['gtlike']['use_scaled_srcmap'] and
+            not kwargs.get('reuse_parent_srcmap', False)):
         names = [s.name for s in
                  gta.roi.get_sources(distance=3.0, skydir=gta.roi[name].skydir)
                  if not s.diffuse]
@@ -243,6 +247,118 @@ def _process_lc_bin(itime, name, config, basedir, workdir, diff_sources, const_s
     return o
 
 
+def _proc_status_mb(key):
+    """Return a memory value (e.g. VmRSS or VmHWM) of the current
+    process in MB from /proc/self/status or None if it is not
+    available on this system."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(key + ':'):
+                    return float(line.split()[1]) / 1024.
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Reset the peak resident memory (VmHWM) of the current process
+    to its current resident memory.  Returns False if this is not
+    supported on this system."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        return False
+    return _proc_status_mb('VmHWM') is not None
+
+
+def _process_lc_bin_timed(itime, **kwargs):
+    """Wrapper of `_process_lc_bin` that returns the index of the
+    time bin together with its results and records the wall time, CPU
+    time and peak memory usage of the bin.  The peak memory is
+    measured by resetting the high-water mark of the process at the
+    start of the bin and is NaN where this is not supported."""
+    peak_reset = _reset_peak_rss()
+    t0, c0 = time.time(), time.process_time()
+    o = _process_lc_bin(itime, **kwargs)
+    o['wall_time'] = time.time() - t0
+    o['cpu_time'] = time.process_time() - c0
+    o['max_rss'] = _proc_status_mb('VmHWM') if peak_reset else np.nan
+    return itime[0], o
+
+
+def _json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
+
+
+def _make_lc_key(*args):
+    """Return a hash of the inputs of a lightcurve calculation that is
+    used to check that a stream file was created with the same
+    configuration."""
+    return hashlib.sha1(json.dumps(args, sort_keys=True,
+                                   default=_json_default).encode()).hexdigest()
+
+
+def _load_lc_bins(filename, name, times, key=None, keep_failed=True):
+    """Load the results of the time bins that were streamed to
+    ``filename`` by a previous call to `LightCurve.lightcurve`.  The
+    file is a sequence of pickled records starting with a header that
+    identifies the lightcurve.  A truncated record at the end of the
+    file (e.g. from a crashed process) is ignored.  Returns an empty
+    dictionary if the file does not exist or was created for a
+    different source, set of time bins or configuration (``key``).
+    Bins whose fit failed are dropped if ``keep_failed`` is False."""
+    bins = {}
+    if filename is None or not os.path.isfile(filename):
+        return bins
+
+    with open(filename, 'rb') as f:
+        try:
+            hdr = pickle.load(f)
+        except Exception:
+            return bins
+        if (hdr.get('name') != name or
+                not np.array_equal(hdr.get('times'), times) or
+                hdr.get('key') != key):
+            return bins
+        while True:
+            try:
+                i, o = pickle.load(f)
+            except Exception:
+                break
+            bins[i] = o
+
+    if not keep_failed:
+        bins = {i: o for i, o in bins.items() if o['fit_success']}
+
+    return bins
+
+
+def _write_lc_bins(filename, name, times, bins, key=None):
+    """Rewrite the stream file of a lightcurve with the header and
+    the given results."""
+    tmpfile = filename + '.tmp'
+    with open(tmpfile, 'wb') as f:
+        pickle.dump({'name': name, 'times': np.array(times), 'key': key}, f)
+        for i in sorted(bins.keys()):
+            pickle.dump((i, bins[i]), f)
+    os.replace(tmpfile, filename)
+
+
+def _append_lc_bin(filename, i, o):
+    """Append the results of time bin ``i`` to the stream file of a
+    lightcurve."""
+    with open(filename, 'ab') as f:
+        pickle.dump((i, o), f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
 def calcTS_var(loglike, loglike_const, flux_err, flux_const, systematic, fit_success):
     # calculates variability according to Eq. 4 in 2FGL
     # including correction using non-numbered Eq. following Eq. 4
@@ -296,10 +412,11 @@ class LightCurve(object):
 
         self.logger.info('Computing Lightcurve for %s' % name)
 
-        o = self._make_lc(name, **config)
         filename = utils.format_filename(self.workdir, 'lightcurve',
                                          prefix=[config['prefix'],
                                                  name.lower().replace(' ', '_')])
+        o = self._make_lc(name, stream_file=filename + '_bins.pkl',
+                          **config)
 
         o['file'] = None
         if config['write_fits']:
@@ -309,6 +426,9 @@ class LightCurve(object):
         if config['write_npy']:
             np.save(filename + '.npy', o)
 
+        if os.path.isfile(filename + '_bins.pkl'):
+            os.remove(filename + '_bins.pkl')
+
         self.logger.info('Finished Lightcurve')
 
         return o
@@ -357,6 +477,9 @@ class LightCurve(object):
         o['fit_status'] = np.zeros(o['tmin'].shape, dtype=int)
         o['fit_quality'] = np.zeros(o['tmin'].shape, dtype=int)
         o['num_free_params'] = np.zeros(o['tmin'].shape, dtype=int)
+        o['wall_time'] = np.nan * np.ones(o['tmin'].shape)
+        o['cpu_time'] = np.nan * np.ones(o['tmin'].shape)
+        o['max_rss'] = np.nan * np.ones(o['tmin'].shape)
 
         for k, v in defaults.source_flux_output.items():
 
@@ -377,7 +500,7 @@ class LightCurve(object):
 
         return o
 
-    def _make_lc(self, name, **kwargs):
+    def _make_lc(self, name, stream_file=None, **kwargs):
 
         # make array of time values in MET
         if kwargs['time_bins']:
@@ -411,7 +534,8 @@ class LightCurve(object):
         lck_params = copy.deepcopy(self._lck_params)
         config = copy.deepcopy(self.config)
         config['ltcube']['use_local_ltcube'] = kwargs['use_local_ltcube']
-        config['gtlike']['use_scaled_srcmap'] = kwargs['use_scaled_srcmap']
+        config['gtlike']['use_scaled_srcmap'] = (kwargs['use_scaled_srcmap'] or
+                                                 kwargs['reuse_parent_srcmap'])
         config['model']['diffuse_dir'] = [self.workdir]
         config['selection']['filter'] = None
         if config['components'] is None:
@@ -429,6 +553,8 @@ class LightCurve(object):
                 gtlike_cfg['bexpmap_base'] = c.files['bexpmap']
                 gtlike_cfg['bexpmap_roi_base'] = c.files['bexpmap_roi']
                 gtlike_cfg['srcmap_base'] = c.files['srcmap']
+            if kwargs['reuse_parent_srcmap']:
+                gtlike_cfg['ltcube_base'] = c.files['ltcube']
 
             config['components'][j] = \
                 utils.merge_dict(config['components'][j],
@@ -440,28 +566,69 @@ class LightCurve(object):
 
         outdir = kwargs.get('outdir', None)
         basedir = outdir + '/' if outdir is not None else ''
-        wrap = partial(_process_lc_bin, name=name, config=config,
+        wrap = partial(_process_lc_bin_timed, name=name, config=config,
                        basedir=basedir, workdir=self.workdir, diff_sources=diff_sources,
                        const_spectrum=const_spectrum, roi=self.roi, lck_params=lck_params, **kwargs)
-        itimes = enumerate(zip(times[:-1], times[1:]))
+
+        # Options that do not change the results of a bin
+        exec_opts = ['unordered', 'resume', 'retry_failed', 'multithread',
+                     'nthread', 'save_bin_data', 'make_plots', 'write_fits',
+                     'write_npy', 'prefix']
+        key = _make_lc_key(name, times, config, const_spectrum,
+                           {k: v for k, v in kwargs.items()
+                            if k not in exec_opts})
+
+        # Results of completed bins keyed by bin index
+        bins = {}
+        if kwargs.get('resume', False):
+            # Failed bins are processed again unless retry_failed is False
+            retry_failed = kwargs.get('retry_failed', True)
+            bins = _load_lc_bins(stream_file, name, times, key,
+                                 keep_failed=not retry_failed)
+            if bins:
+                self.logger.info('Resuming lightcurve with %i of %i bins '
+                                 'completed.', len(bins), len(times) - 1)
+        if stream_file is not None:
+            _write_lc_bins(stream_file, name, times, bins, key)
+
+        itimes = [t for t in enumerate(zip(times[:-1], times[1:]))
+                  if t[0] not in bins]
         if kwargs.get('multithread', False):
             p = Pool(processes=kwargs.get('nthread', None))
-            mapo = p.imap(wrap, itimes)
+            if kwargs.get('unordered', False):
+                mapo = p.imap_unordered(wrap, itimes, chunksize=1)
+            else:
+                mapo = p.imap(wrap, itimes)
             p.close()
         else:
             mapo = map(wrap, itimes)
 
+        for i, next_fit in mapo:
+
+            if stream_file is not None:
+                _append_lc_bin(stream_file, i, next_fit)
+            bins[i] = next_fit
+
+            self.logger.info('Finished bin %i in range %i %i '
+                             '(wall time %.1f s, cpu time %.1f s, '
+                             'peak memory %.0f MB).', i, times[i], times[i + 1],
+                             next_fit['wall_time'], next_fit['cpu_time'],
+                             next_fit['max_rss'])
+
+            # delete temporary data products
+            if not kwargs.get('save_bin_data', False):
+                shutil.rmtree(next_fit['config']['fileio']['outdir'],
+                              ignore_errors=True)
+
         o = self._create_lc_dict(name, times)
         o['config'] = kwargs
 
         flux_const = None
         for i, time in enumerate(zip(times[:-1], times[1:])):
 
-            next_fit = next(mapo)
-            
-            #delete temporary data products
-            if not kwargs.get('save_bin_data', False):
-                shutil.rmtree(next_fit['config']['fileio']['outdir'])
+            next_fit = bins[i]
+            for k in ['wall_time', 'cpu_time', 'max_rss']:
+                o[k][i] = next_fit.get(k, np.nan)
 
             if not next_fit['fit_success']:
                 self.logger.error(
@@ -7,7 +7,7 @@ import numpy as np
 import healpy as hp
 from astropy.io import fits
 from astropy.coordinates import SkyCoord
-from astropy.table import Table, Column
+from astropy.table import Table, Column, vstack
 
 from fermipy import utils
 from fermipy.utils import edge_to_center
@@ -15,9 +15,122 @@ from fermipy.utils import edge_to_width
 from fermipy.utils import angle_to_cartesian
 from fermipy.skymap import HpxMap
 from fermipy.hpx_utils import HPX
+from fermipy.worker_pool import WorkerPool
+
+
+class _BinLookup(object):
+    """Fast replacement for `~numpy.digitize` with a fixed set of
+    monotonically increasing bin edges.  Values are first assigned to
+    the cells of a uniform grid that is fine enough that every cell
+    contains at most one bin edge and the bin index is then corrected
+    with a comparison against the neighboring edges.  The result is
+    identical to `~numpy.digitize`."""
+
+    def __init__(self, edges):
+        self._lo = edges[0]
+        ncell = int(np.ceil(2.0 * (edges[-1] - edges[0]) /
+                            np.min(np.diff(edges)))) + 1
+        self._scale = ncell / (edges[-1] - edges[0])
+        self._lut = np.searchsorted(edges, self._lo +
+                                    np.arange(ncell) / self._scale,
+                                    side='right')
+        self._edges = np.concatenate(([-np.inf], edges, [np.inf]))
 
+    @property
+    def edges(self):
+        """Bin edges padded with -inf and +inf."""
+        return self._edges
+
+    def digitize(self, x):
+        g = (x - self._lo) * self._scale
+        np.clip(g, 0, len(self._lut) - 1, out=g)
+        idx = self._lut[g.astype(np.intp)]
+        idx += x >= self._edges[idx + 1]
+        idx -= x < self._edges[idx]
+        return idx
+
+
+def _dot_prod_pairs(xyz0, xyz1, idx0, idx1):
+    """Compute the dot products of selected pairs of cartesian vectors
+    with the same operations as `~fermipy.utils.dot_prod`."""
+    return (xyz0[idx0, 0] * xyz1[idx1, 0] + xyz0[idx0, 1] * xyz1[idx1, 1] +
+            xyz0[idx0, 2] * xyz1[idx1, 2])
+
+
+def _fill_livetime_block(dslice, xyz, sc_xyz, zn_xyz, sc_live, sc_lfrac,
+                         cos_zmax, costh_edges, max_elements=2**22):
+    """Accumulate the livetime histograms for a block of sky
+    directions.  The SC rows are processed in chunks such that no
+    more than ``max_elements`` direction/row pairs are evaluated at
+    once.
+
+    The angles between sky directions and the SC and zenith
+    directions are computed with matrix products.  Pairs for which
+    the result is within rounding errors of the zenith cut or of an
+    incidence angle bin edge are recomputed with the operations of
+    `~fermipy.utils.dot_prod`.  Livetimes are added to the histograms
+    in the order of the SC rows so that the result is identical to a
+    `~numpy.bincount` over all rows of a single sky direction.
+
+    Parameters
+    ----------
+    dslice : slice
+        Slice of sky directions in ``xyz``.
+
+    xyz : `~numpy.ndarray`
+        Cartesian unit vectors of the sky directions.
+
+    Returns
+    -------
+    lt : `~numpy.ndarray`
+        Array of livetime histograms for the block.
+
+    lt_wt : `~numpy.ndarray`
+        Array of weighted livetime histograms for the block.
+    """
+    eps = 1E-12
+    xyz = xyz[dslice]
+    ndir = len(xyz)
+    nbin = len(costh_edges) - 1
+    lookup = _BinLookup(costh_edges)
+    lt = np.zeros((ndir, nbin))
+    lt_wt = np.zeros((ndir, nbin))
+    lt_flat = lt.reshape(-1)
+    lt_wt_flat = lt_wt.reshape(-1)
+
+    nrow = max(max_elements // max(ndir, 1), 1)
+    for i in range(0, len(sc_live), nrow):
+        rslice = slice(i, i + nrow)
+        cos_sep = np.dot(xyz, sc_xyz[rslice].T)
+        cos_zn = np.dot(xyz, zn_xyz[rslice].T)
+        idx = np.flatnonzero((cos_zn > cos_zmax - eps) & (cos_sep > -eps))
+        idir, irow = np.divmod(idx, cos_sep.shape[1])
+        irow += i
+        cos_sep = cos_sep.ravel().take(idx)
+        cos_zn = cos_zn.ravel().take(idx)
+        bins = lookup.digitize(cos_sep)
+
+        # Recompute pairs close to a cut or bin edge
+        m = (np.abs(cos_zn - cos_zmax) < eps) | (np.abs(cos_sep) < eps)
+        m |= np.abs(cos_sep - lookup.edges[bins]) < eps
+        m |= np.abs(cos_sep - lookup.edges[bins + 1]) < eps
+        if np.any(m):
+            cos_sep[m] = _dot_prod_pairs(xyz, sc_xyz, idir[m], irow[m])
+            cos_zn[m] = _dot_prod_pairs(xyz, zn_xyz, idir[m], irow[m])
+            bins[m] = lookup.digitize(cos_sep[m])
+
+        m = (cos_zn > cos_zmax) & (cos_sep > 0.0)
+        bins = np.clip(bins[m] - 1, 0, nbin - 1)
+        idx = idir[m] * nbin + bins
+        irow = irow[m]
+        np.add.at(lt_flat, idx, sc_live[irow])
+        np.add.at(lt_wt_flat, idx, sc_live[irow] * sc_lfrac[irow])
 
-def fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, costh_edges):
+    return lt, lt_wt
+
+
+def fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, costh_edges,
+                       max_elements=2**22, nthread=1):
     """Generate a sequence of livetime distributions at the sky
     positions given by ``skydir``.  The output of the method are two
     NxM arrays containing a sequence of histograms for N sky positions
@@ -26,6 +139,11 @@ def fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, costh_edges):
     `gtltcube` with the exception that SC time intervals are assumed
     to be aligned with GTIs.
 
+    The histograms are accumulated for blocks of sky directions and
+    chunks of SC rows such that the memory footprint is bounded by
+    ``max_elements``.  Blocks of sky directions can optionally be
+    distributed over several processes.
+
     Parameters
     ----------
     skydir : `~astropy.coordinates.SkyCoord`    
@@ -45,6 +163,14 @@ def fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, costh_edges):
     costh_edges : `~numpy.ndarray`
         Incidence angle bin edges in cos(angle).
 
+    max_elements : int
+        Maximum number of sky direction and SC row pairs that are
+        evaluated at once.
+
+    nthread : int
+        Number of processes.  If None one process will be created for
+        each available core.
+
     Returns
     -------
     lt : `~numpy.ndarray`
@@ -88,24 +214,101 @@ def fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, costh_edges):
 
     nbin = len(costh_edges) - 1
 
-    lt = np.zeros((nbin,) + skydir.shape)
-    lt_wt = np.zeros((nbin,) + skydir.shape)
-
+    # Only SC rows contained in a GTI contribute
     m0 = (idx >= 0) & (sc_t0 >= gti_t0) & (sc_t1 <= gti_t1)
+    arrays = dict(sc_xyz=np.ascontiguousarray(sc_xyz[m0]),
+                  zn_xyz=np.ascontiguousarray(zn_xyz[m0]),
+                  sc_live=sc_live[m0], sc_lfrac=sc_lfrac[m0])
 
     xyz = angle_to_cartesian(skydir.ra.rad, skydir.dec.rad)
+    xyz = xyz.reshape((-1, 3))
+    ndir = len(xyz)
+    shape = (nbin,) + skydir.shape
+    if ndir == 0:
+        return (np.zeros(shape), np.zeros(shape))
 
-    for i, t in enumerate(xyz):
-        cos_sep = utils.dot_prod(t, sc_xyz)
-        cos_zn = utils.dot_prod(t, zn_xyz)
-        m = m0 & (cos_zn > cos_zmax) & (cos_sep > 0.0)
-        bins = np.digitize(cos_sep[m], bins=costh_edges) - 1
-        bins = np.clip(bins, 0, nbin - 1)
-        lt[:, i] = np.bincount(bins, weights=sc_live[m], minlength=nbin)
-        lt_wt[:, i] = np.bincount(bins, weights=sc_live[m] * sc_lfrac[m],
-                                  minlength=nbin)
+    # Use blocks of sky directions that span at least a few thousand
+    # SC rows per chunk
+    nrow = max(len(arrays['sc_live']), 1)
+    dblock = int(np.clip(max_elements // min(nrow, 4096), 1, ndir))
+    if nthread is None or nthread > 1:
+        pool = WorkerPool(nthread)
+        dblock = max(min(dblock, int(np.ceil(ndir / (4. * pool.nthread)))),
+                     1)
+    else:
+        pool = None
+    blocks = [slice(i, i + dblock) for i in range(0, ndir, dblock)]
+
+    kw = dict(cos_zmax=cos_zmax, costh_edges=costh_edges,
+              max_elements=max_elements)
+    if pool is not None:
+        try:
+            shared = {k: pool.share(v) for k, v in arrays.items()}
+            results = pool.map(_fill_livetime_block, blocks,
+                               xyz=pool.share(xyz), **dict(shared, **kw))
+        finally:
+            pool.close()
+    else:
+        results = [_fill_livetime_block(b, xyz, **dict(arrays, **kw))
+                   for b in blocks]
+
+    lt = np.concatenate([r[0] for r in results]).T
+    lt_wt = np.concatenate([r[1] for r in results]).T
+    return lt.reshape(shape), lt_wt.reshape(shape)
+
+
+def fill_livetime_map(hpx, skydir, tab_sc, tab_gti, zmax, costh_edges,
+                      radius=180.0, nthread=1):
+    """Generate maps of the livetime and weighted livetime
+    distributions for the pixels of a HEALPix geometry.  The
+    histograms are computed with `fill_livetime_hist` on an nside=16
+    grid and interpolated to the pixels of ``hpx``.
 
-    return lt, lt_wt
+    Parameters
+    ----------
+    hpx : `~fermipy.hpx_utils.HPX`
+        Geometry of the output maps.
+
+    skydir : `~astropy.coordinates.SkyCoord`
+        Center of the region in which the livetime is computed.
+
+    radius : float
+        Radius in degrees around ``skydir`` in which the livetime is
+        computed.  Pixels outside of this radius are set to zero.
+
+    Returns
+    -------
+    lt : `~numpy.ndarray`
+        Livetime map with the incidence angle bins as first dimension.
+
+    lt_wt : `~numpy.ndarray`
+        Weighted livetime map.
+    """
+    nbin = len(costh_edges) - 1
+    hpx_lt = HPX(2**4, True, 'CEL', ebins=costh_edges)
+    hpx_skydir = hpx_lt.get_sky_dirs()
+
+    m = skydir.separation(hpx_skydir).deg < radius
+    map_lt = HpxMap(np.zeros((nbin, hpx_lt.npix)), hpx_lt)
+    map_lt_wt = HpxMap(np.zeros((nbin, hpx_lt.npix)), hpx_lt)
+
+    lt, lt_wt = fill_livetime_hist(hpx_skydir[m], tab_sc, tab_gti, zmax,
+                                   costh_edges, nthread=nthread)
+    map_lt.data[:, m] = lt
+    map_lt_wt.data[:, m] = lt_wt
+
+    pix_skydir = hpx.get_sky_dirs()
+    m = skydir.separation(pix_skydir).deg < radius
+
+    data = np.zeros((nbin, hpx.npix))
+    data_wt = np.zeros((nbin, hpx.npix))
+    data[:, m] = map_lt.interpolate(pix_skydir[m].ra.deg,
+                                    pix_skydir[m].dec.deg,
+                                    interp_log=False)
+    data_wt[:, m] = map_lt_wt.interpolate(pix_skydir[m].ra.deg,
+                                          pix_skydir[m].dec.deg,
+                                          interp_log=False)
+    return data, data_wt
 
 
 class LTCube(HpxMap):
@@ -267,32 +470,89 @@ class LTCube(HpxMap):
             cth_edges = 1.0 - np.linspace(0, 1.0, 41)**2
             cth_edges = cth_edges[::-1]
 
-        hpx = HPX(2**4, True, 'CEL', ebins=cth_edges)
+        hpx = HPX(2**6, True, 'CEL', ebins=cth_edges)
+        data, data_wt = fill_livetime_map(hpx, skydir, tab_sc, tab_gti, zmax,
+                                          cth_edges, radius=radius,
+                                          nthread=kwargs.get('nthread', 1))
+
+        kw = {}
+        if len(tab_gti):
+            kw = dict(tstart=float(tab_gti['START'][0]),
+                      tstop=float(tab_gti['STOP'][-1]),
+                      tab_gti=Table([tab_gti['START'], tab_gti['STOP']]))
+        return cls(data, hpx, cth_edges, zmax=zmax, data_wt=data_wt, **kw)
+
+    def update_from_gti(self, skydir, tab_sc, tab_gti, zmax, **kwargs):
+        """Add the livetime accumulated in GTIs after the stop time of
+        this livetime cube.  Only the SC rows and GTIs that were
+        appended since the cube was created are processed.  The
+        livetime is computed with the same method as
+        `~fermipy.ltcube.LTCube.create_from_gti` such that updating a
+        cube gives the same result as recreating it from the full
+        SC and GTI tables.
 
-        hpx_skydir = hpx.get_sky_dirs()
+        Parameters
+        ----------
+        skydir : `~astropy.coordinates.SkyCoord`
+            Center of the region in which the livetime is computed.
 
-        m = skydir.separation(hpx_skydir).deg < radius
-        map_lt = HpxMap(np.zeros((40, hpx.npix)), hpx)
-        map_lt_wt = HpxMap(np.zeros((40, hpx.npix)), hpx)
+        tab_sc : `~astropy.table.Table`
+            Spacecraft table.  Rows before the stop time of the cube
+            are ignored.
 
-        lt, lt_wt = fill_livetime_hist(
-            hpx_skydir[m], tab_sc, tab_gti, zmax, cth_edges)
-        map_lt.data[:, m] = lt
-        map_lt_wt.data[:, m] = lt_wt
+        tab_gti : `~astropy.table.Table`
+            Table of GTIs.  GTIs before the stop time of the cube are
+            ignored.
 
-        hpx2 = HPX(2**6, True, 'CEL', ebins=cth_edges)
+        zmax : float
+            Zenith cut.  Must be the same as the one used to create
+            the cube.
 
-        ltc = cls(np.zeros((len(cth_edges) - 1, hpx2.npix)), hpx2, cth_edges)
-        ltc_skydir = ltc.hpx.get_sky_dirs()
-        m = skydir.separation(ltc_skydir).deg < radius
+        radius : float
+            Radius in degrees around ``skydir`` in which the livetime
+            is computed.
 
-        ltc.data[:, m] = map_lt.interpolate(ltc_skydir[m].ra.deg,
-                                            ltc_skydir[m].dec.deg,
-                                            interp_log=False)
-        ltc.data_wt[:, m] = map_lt_wt.interpolate(ltc_skydir[m].ra.deg,
-                                                  ltc_skydir[m].dec.deg,
-                                                  interp_log=False)
-        return ltc
+        nthread : int
+            Number of processes (see `fill_livetime_hist`).
+
+        outfile : str
+            Write the updated cube to this file with
+            `~fermipy.ltcube.LTCube.write`.
+        """
+        if not np.isclose(self.zmax, zmax):
+            raise ValueError('Zenith cut of livetime cube (%.2f) does not '
+                             'match the zenith cut of the update (%.2f).'
+                             % (self.zmax, zmax))
+
+        tab_gti = Table([tab_gti['START'], tab_gti['STOP']])
+        if self.tstop is not None:
+            tab_gti = tab_gti[tab_gti['STOP'] > self.tstop]
+            tab_gti['START'] = np.maximum(tab_gti['START'], self.tstop)
+            tab_sc = tab_sc[tab_sc['STOP'] > self.tstop]
+
+        if len(tab_gti):
+            data, data_wt = fill_livetime_map(self.hpx, skydir, tab_sc,
+                                              tab_gti, zmax,
+                                              self.costh_edges,
+                                              radius=kwargs.get('radius',
+                                                                180.0),
+                                              nthread=kwargs.get('nthread',
+                                                                 1))
+            self._counts += data
+            self._data_wt += data_wt
+            self._tab_gti = vstack([Table([self._tab_gti['START'],
+                                           self._tab_gti['STOP']]),
+                                    tab_gti])
+
+            tstart = float(tab_gti['START'][0])
+            tstop = float(tab_gti['STOP'][-1])
+            self._tstart = (tstart if self.tstart is None
+                            else min(self.tstart, tstart))
+            self._tstop = (tstop if self.tstop is None
+                           else max(self.tstop, tstop))
+
+        if kwargs.get('outfile', None) is not None:
+            self.write(kwargs['outfile'])
 
     def load_ltfile(self, ltfile):
 
@@ -3,12 +3,17 @@
 
 from __future__ import absolute_import, division, print_function
 
+import os
 import sys
+import shutil
+import tempfile
 import argparse
 import numpy as np
 from astropy.io import fits
-from fermipy.hpx_utils import HPX
+from fermipy import fits_utils
+from fermipy.hpx_utils import HPX, HPX_FITS_CONVENTIONS
 from fermipy.skymap import HpxMap
+from fermipy.worker_pool import WorkerPool
 
 def update_null_primary(hdu_in, hdu=None):
     """ 'Update' a null primary HDU
@@ -150,7 +155,7 @@ def update_hpx_skymap_allsky(map_in, map_out):
     if map_out is None:
         in_hpx = map_in.hpx
         out_hpx = HPX.create_hpx(in_hpx.nside, in_hpx.nest, in_hpx.coordsys,
-                                 None, in_hpx.ebins, None, in_hpx.conv, None)
+                                 -1, in_hpx.ebins, None, in_hpx.conv, None)
         data_out = map_in.expanded_counts_map()
         print(data_out.shape, data_out.sum())
         map_out = HpxMap(data_out, out_hpx)
@@ -159,113 +164,443 @@ def update_hpx_skymap_allsky(map_in, map_out):
     return map_out
 
 
-def merge_wcs_counts_cubes(filelist):
-    """ Merge all the files in filelist, assuming that they WCS counts cubes
+# Numpy type codes of the FITS image BITPIX values
+_BITPIX = {'u1': 8, 'i2': 16, 'i4': 32, 'i8': 64, 'f4': -32, 'f8': -64}
+
+
+def read_hpx_planes(hdulist):
+    """ Get the energy planes of a HEALPix counts cube
+
+    The table is memory-mapped, such that the planes are read lazily
+    from the file and only one energy plane needs to be in memory at a
+    time.  Compressed files are read into memory.
+
+    Parameters
+    ----------
+    hdulist : `astropy.io.fits.HDUList`
+        The counts cube file, the map is in the first extension
+
+    Returns
+    -------
+    shape : tuple
+        Shape (nebin, npix) of the corresponding all-sky cube
+
+    planes : list of tuple
+        For each energy plane, the array of global pixel indices (None
+        for all-sky maps) and the plane data
     """
-    out_prim = None
-    out_ebounds = None
+    hdu = hdulist[1]
+    ebins = fits_utils.find_and_read_ebins(hdulist)
+    conv = HPX_FITS_CONVENTIONS[HPX.identify_HPX_convention(hdu.header)]
+    if conv.convname == 'FGST_SRCMAP_SPARSE':
+        hpx = HPX.create_from_hdu(hdu, ebins)
+        counts = HpxMap.create_from_hdu(hdu, ebins).counts
+        planes = [(hpx._ipix, counts[i]) for i in range(counts.shape[0])]
+    else:
+        data = _map_table_data(hdulist, 1)
+        pixels = None
+        if conv.idxstring in hdu.columns.names:
+            pixels = data[conv.idxstring]
+        hpx = HPX.create_from_header(hdu.header, ebins, pixels)
+        cnames = [c for c in hdu.columns.names
+                  if c.find(conv.colstring) == 0]
+        planes = [(hpx._ipix, data[c]) for c in cnames]
+    return (len(planes), 12 * hpx.nside * hpx.nside), planes
+
+
+# Leading bytes of the compressed file formats read by astropy
+_COMPRESSION_MAGIC = [b'\x1f\x8b', b'BZh', b'PK\x03\x04', b'\xfd7zXZ']
+
+
+def _is_compressed(hdulist, filename):
+    """ Check whether a FITS file is compressed (e.g. gzip), in which
+    case the byte offsets of the HDUs refer to the uncompressed data
+    and the file cannot be memory-mapped """
+    if getattr(getattr(hdulist, '_file', None), 'compression', None):
+        return True
+    with open(filename, 'rb') as f:
+        magic = f.read(6)
+    return any(magic.startswith(m) for m in _COMPRESSION_MAGIC)
+
+
+def _map_table_data(hdulist, ihdu):
+    """ Memory-map the rows of a binary table
+
+    Unlike ``hdu.data`` opened with ``memmap=True`` the columns are
+    not copied into memory when the file is closed.  Tables that are
+    not in a regular uncompressed file or that have scaled or
+    variable-length columns are read with astropy.
+    """
+    hdu = hdulist[ihdu]
+    fileinfo = hdulist.fileinfo(ihdu)
+    filename = None if fileinfo is None else fileinfo['filename']
+    scaled = any(c.bzero not in (None, 0) or c.bscale not in (None, 1)
+                 for c in hdu.columns)
+    if filename is None or not os.path.isfile(filename) or scaled or \
+            hdu.header.get('PCOUNT', 0) > 0 or \
+            _is_compressed(hdulist, filename):
+        return hdu.data
+    dtype = hdu.columns.dtype.newbyteorder('>')
+    return np.memmap(filename, dtype=dtype, mode='r',
+                     offset=fileinfo['datLoc'], shape=(hdu.header['NAXIS2'],))
+
+
+def read_wcs_planes(hdulist):
+    """ Get the energy planes of a WCS counts cube
+
+    The planes are read with `astropy.io.fits.ImageHDU.section`, such
+    that only one energy plane is loaded at a time even if the file
+    is not memory-mapped.
 
-    datalist_gti = []
-    exposure_sum = 0.
-    nfiles = len(filelist)
-    ngti = np.zeros(nfiles, int)
+    Parameters
+    ----------
+    hdulist : `astropy.io.fits.HDUList`
+        The counts cube file, the map is in the primary HDU
+
+    Returns
+    -------
+    shape : tuple
+        Shape (nebin, ny, nx) of the cube
+
+    planes : iterator
+        Iterator over the energy planes, yields None and the plane data
+    """
+    hdu = hdulist[0]
+    shape = hdu.shape
+    if len(shape) == 2:
+        return (1,) + shape, iter([(None, hdu.section[:, :])])
+    return shape, ((None, hdu.section[i]) for i in range(shape[0]))
 
-    for i, filename in enumerate(filelist):
-        fin = fits.open(filename)
+
+# Functions used to read the energy planes of the counts cubes
+_PLANE_READERS = dict(hpx=read_hpx_planes,
+                      wcs=read_wcs_planes)
+
+
+def _make_accumulator(shape, accfile=None):
+    """ Allocate a zero-filled array to sum counts cubes, either in
+    memory or, if accfile is given, memory-mapped to a file """
+    if accfile is None:
+        return np.zeros(shape)
+    return np.lib.format.open_memmap(accfile, mode='w+', dtype=np.float64,
+                                     shape=shape)
+
+
+def _add_planes(acc, planes):
+    """ Add energy planes to the accumulated cube """
+    for acc_plane, (pixels, plane) in zip(acc, planes):
+        if pixels is None:
+            acc_plane += plane
+        else:
+            acc_plane[pixels] += plane
+
+
+def _merge_gti_info(info0, info1):
+    """ Combine the GTI related data of two consecutive sets of files """
+    gti = [g for g in [info0['gti'], info1['gti']] if g is not None]
+    info = dict(info0)
+    info['gti'] = np.concatenate(gti) if gti else None
+    info['exposure'] = info0['exposure'] + info1['exposure']
+    if info1['tstop'] is not None:
+        info['tstop'] = info1['tstop']
+    if info1['date_end'] is not None:
+        info['date_end'] = info1['date_end']
+    return info
+
+
+def _merge_file_group(task, kind):
+    """ Sum a group of counts cubes, one energy plane at a time
+
+    Parameters
+    ----------
+    task : tuple
+        The list of files and the file in which the sum is accumulated
+        (None to accumulate in memory)
+
+    kind : str
+        'hpx' or 'wcs'
+
+    Returns
+    -------
+    info : dict
+        The accumulated GTIs, exposure, TSTOP and DATE-END and either
+        the summed data ('data') or the name of the file with the sum
+        ('accfile')
+    """
+    filelist, accfile = task
+    read_planes = _PLANE_READERS[kind]
+    info = dict(gti=None, exposure=0., tstop=None, date_end=None,
+                accfile=accfile, data=None)
+    acc = None
+    for filename in filelist:
+        with fits.open(filename, memmap=False) as fin:
+            shape, planes = read_planes(fin)
+            if acc is None:
+                acc = _make_accumulator(shape, accfile)
+            elif acc.shape != shape:
+                raise ValueError("Shape of counts cube %s does not match: "
+                                 "%s %s" % (filename, shape, acc.shape))
+            _add_planes(acc, planes)
+
+            file_info = dict(gti=None, exposure=0., tstop=None,
+                             date_end=fin[0].header.get('DATE-END', None))
+            if 'GTI' in fin:
+                (gti_data, exposure, tstop) = extract_gti_data(fin["GTI"])
+                file_info.update(gti=np.array(gti_data), exposure=exposure,
+                                 tstop=tstop)
+            info = _merge_gti_info(info, file_info)
         sys.stdout.write('.')
         sys.stdout.flush()
-        if i == 0:
-            out_prim = update_primary(fin[0], out_prim)
-            out_ebounds = update_ebounds(fin["EBOUNDS"], out_ebounds)
-        (gti_data, exposure, tstop) = extract_gti_data(fin["GTI"])
-        datalist_gti.append(gti_data)
-        exposure_sum += exposure
-        ngti[i] = len(gti_data)
-        if i == 0:
-            first = fin
-        elif i == nfiles - 1:
-            date_end = fin[0].header['DATE-END']
-        else:
-            fin.close()
 
-    out_gti = merge_all_gti_data(datalist_gti, ngti, first['GTI'])
-    out_gti.header['EXPOSURE'] = exposure_sum
-    out_gti.header['TSTOP'] = tstop
+    if accfile is None:
+        info['data'] = acc
+    else:
+        acc.flush()
+    return info
+
+
+def _reduce_pair(infos):
+    """ Add the sum of the second group of files to the first one """
+    if len(infos) == 1:
+        return infos[0]
+    info0, info1 = infos
+    acc0 = np.load(info0['accfile'], mmap_mode='r+')
+    acc1 = np.load(info1['accfile'], mmap_mode='r')
+    for plane0, plane1 in zip(acc0, acc1):
+        plane0 += plane1
+    acc0.flush()
+    del acc0, acc1
+    os.remove(info1['accfile'])
+    return _merge_gti_info(info0, info1)
+
+
+def _write_empty_hdu(fout, header, nbytes):
+    """ Write a header followed by a zero-filled data unit of nbytes
+    without allocating the data in memory """
+    fout.write(header.tostring().encode('ascii'))
+    nbytes = int(np.ceil(nbytes / 2880.)) * 2880
+    if nbytes > 0:
+        fout.seek(nbytes - 1, 1)
+        fout.write(b'\0')
+
+
+def _write_merged_file(outfile, hdulist, ihdu, header, dtype, shape, acc):
+    """ Write a file with the merged counts cube
+
+    The data unit of HDU ihdu, with the given header, is created on
+    disk and filled one energy plane at a time through a
+    memory-mapping of the file.  The other HDUs in hdulist are written
+    as they are.
+    """
+    with open(outfile, 'wb') as fout:
+        if ihdu > 0:
+            fout.write(hdulist[0].header.tostring().encode('ascii'))
+        _write_empty_hdu(fout, header,
+                         np.dtype(dtype).itemsize * int(np.prod(shape)))
+    for hdu in hdulist[ihdu + 1:]:
+        fits.append(outfile, hdu.data, hdu.header)
+
+    with fits.open(outfile) as hdul:
+        offset = hdul.fileinfo(ihdu)['datLoc']
+    data = np.memmap(outfile, dtype=dtype, mode='r+', offset=offset,
+                     shape=shape)
+    if data.dtype.names is None:
+        for i, plane in enumerate(acc):
+            data[i] = plane
+    else:
+        for name, plane in zip(data.dtype.names, acc):
+            data[name] = plane
+    data.flush()
+    del data
+
+
+def _make_gti_hdus(first, info):
+    """ Build the list of merged GTI HDUs (empty if there are no GTIs) """
+    if info['gti'] is None or 'GTI' not in first:
+        return []
+    gti_data = info['gti']
+    out_gti = merge_all_gti_data([gti_data], np.array([len(gti_data)]),
+                                 first['GTI'])
+    out_gti.header['EXPOSURE'] = info['exposure']
+    out_gti.header['TSTOP'] = info['tstop']
+    return [out_gti]
+
+
+def _finish_hpx_counts_cube(first, info, acc, outfile=None):
+    """ Build the HDUs of a merged HEALPix counts cube """
+    out_prim = update_null_primary(first[0], None)
+    in_hpx = HPX.create_from_header(first[1].header,
+                                    fits_utils.find_and_read_ebins(first))
+    out_hpx = HPX.create_hpx(in_hpx.nside, in_hpx.nest, in_hpx.coordsys,
+                             -1, in_hpx.ebins, None, in_hpx.conv, None)
+    try:
+        out_ebounds = update_ebounds(first["EBOUNDS"], None)
+    except KeyError:
+        out_ebounds = update_energies(first["ENERGIES"], None)
+
+    if outfile is None:
+        out_skymap = HpxMap(np.asarray(acc), out_hpx).create_image_hdu(
+            "SKYMAP")
+    else:
+        cols = [fits.Column(out_hpx.conv.colname(
+            indx=i + out_hpx.conv.firstcol), "E") for i in range(acc.shape[0])]
+        out_skymap = fits.BinTableHDU.from_columns(
+            cols, header=out_hpx.make_header(), nrows=0, name="SKYMAP")
+        out_skymap.header['NAXIS2'] = acc.shape[1]
+
+    hdulist = [out_prim, out_skymap, out_ebounds] + \
+        _make_gti_hdus(first, info)
+    for hdu in hdulist:
+        if info['date_end']:
+            hdu.header['DATE-END'] = info['date_end']
+    out_prim.update_header()
+
+    if outfile is None:
+        return fits.HDUList(hdulist)
+    dtype = np.dtype([(c.name, '>f4') for c in cols])
+    _write_merged_file(outfile, hdulist, 1, out_skymap.header, dtype,
+                       (acc.shape[1],), acc)
+    return fits.open(outfile, memmap=True)
+
+
+def _finish_wcs_counts_cube(first, info, acc, outfile=None):
+    """ Build the HDUs of a merged WCS counts cube """
+    header = first[0].header.copy()
+    if 'BSCALE' in header or 'BZERO' in header:
+        dtype = np.dtype(np.float32)
+        header.remove('BSCALE', ignore_missing=True)
+        header.remove('BZERO', ignore_missing=True)
+        header['BITPIX'] = -32
+    else:
+        dtype = np.dtype({v: k for k, v in _BITPIX.items()}[header['BITPIX']])
+
+    if info['date_end']:
+        header['DATE-END'] = info['date_end']
 
-    hdulist = [out_prim, out_ebounds, out_gti]
+    if outfile is None:
+        out_prim = fits.PrimaryHDU(data=np.asarray(acc, dtype=dtype).reshape(
+            first[0].shape), header=header)
+    else:
+        out_prim = fits.PrimaryHDU(header=header)
+    out_ebounds = update_ebounds(first["EBOUNDS"], None)
+
+    hdulist = [out_prim, out_ebounds] + _make_gti_hdus(first, info)
     for hdu in hdulist:
-        hdu.header['DATE-END'] = date_end
+        if info['date_end']:
+            hdu.header['DATE-END'] = info['date_end']
+
+    if outfile is None:
+        out_prim.update_header()
+        return fits.HDUList(hdulist)
+    _write_merged_file(outfile, hdulist, 0, header, dtype.newbyteorder('>'),
+                       acc.shape, acc)
+    return fits.open(outfile, memmap=True)
+
+
+_FINISHERS = dict(hpx=_finish_hpx_counts_cube, wcs=_finish_wcs_counts_cube)
+
+
+def _merge_counts_cubes(filelist, kind, outfile=None, clobber=True,
+                        nthread=1, tmpdir=None):
+    """ Merge counts cubes with a streaming reduction, see
+    `merge_hpx_counts_cubes` and `merge_wcs_counts_cubes` """
+    if not filelist:
+        raise ValueError("No input files to merge")
+    if outfile is not None and os.path.exists(outfile) and not clobber:
+        raise OSError("File %s already exists." % outfile)
+
+    nfiles = len(filelist)
+    ngroup = max(1, min(nthread, nfiles))
+    use_memmap = outfile is not None or ngroup > 1
+    if use_memmap:
+        if tmpdir is None and outfile is not None:
+            tmpdir = os.path.dirname(os.path.abspath(outfile))
+        workdir = tempfile.mkdtemp(prefix='merge_', dir=tmpdir)
+
+    # Contiguous groups of files are summed in parallel and the partial
+    # sums are then added pairwise
+    tasks = []
+    for i, group in enumerate(np.array_split(np.arange(nfiles), ngroup)):
+        accfile = None
+        if use_memmap:
+            accfile = os.path.join(workdir, 'merge_%04i.npy' % i)
+        tasks += [([filelist[j] for j in group], accfile)]
+
+    pool = WorkerPool(ngroup)
+    try:
+        infos = pool.map(_merge_file_group, tasks, kind=kind)
+        while len(infos) > 1:
+            infos = pool.map(_reduce_pair, [infos[i:i + 2] for i in
+                                            range(0, len(infos), 2)])
+        info = infos[0]
+        if use_memmap:
+            acc = np.load(info['accfile'], mmap_mode='r')
+        else:
+            acc = info['data']
+
+        with fits.open(filelist[0], memmap=False) as first:
+            hdulist = _FINISHERS[kind](first, info, acc, outfile)
+        del acc
+    finally:
+        pool.close()
+        if use_memmap:
+            shutil.rmtree(workdir, ignore_errors=True)
 
-    out_prim.update_header()
     sys.stdout.write("!\n")
-    return fits.HDUList(hdulist)
+    return hdulist
 
 
-def merge_hpx_counts_cubes(filelist):
-    """ Merge all the files in filelist, assuming that they HEALPix counts cubes
+def merge_wcs_counts_cubes(filelist, outfile=None, clobber=True, nthread=1,
+                           tmpdir=None):
+    """ Merge all the files in filelist, assuming that they WCS counts cubes
+
+    The files are read one energy plane at a time.  See
+    `merge_hpx_counts_cubes` for a description of the parameters.
     """
-    out_prim = None
-    out_skymap = None
-    out_ebounds = None
+    return _merge_counts_cubes(filelist, 'wcs', outfile=outfile,
+                               clobber=clobber, nthread=nthread,
+                               tmpdir=tmpdir)
 
-    datalist_gti = []
-    exposure_sum = 0.
-    nfiles = len(filelist)
-    ngti = np.zeros(nfiles, int)
 
-    out_name = None
+def merge_hpx_counts_cubes(filelist, outfile=None, clobber=True, nthread=1,
+                           tmpdir=None):
+    """ Merge all the files in filelist, assuming that they HEALPix counts cubes
 
-    for i, filename in enumerate(filelist):
-        fin = fits.open(filename)
-        sys.stdout.write('.')
-        sys.stdout.flush()
-        if i == 0:
-            out_prim = update_null_primary(fin[0], out_prim)
-            out_name = fin[1].name
-
-        map_in = HpxMap.create_from_hdulist(fin)
-        out_skymap = update_hpx_skymap_allsky(map_in, out_skymap)
-        if i == 0:
-            try:
-                out_ebounds = update_ebounds(fin["EBOUNDS"], out_ebounds)
-            except KeyError:
-                out_ebounds = update_energies(fin["ENERGIES"], out_ebounds)
-        try:
-            (gti_data, exposure, tstop) = extract_gti_data(fin["GTI"])
-            datalist_gti.append(gti_data)
-            exposure_sum += exposure
-            ngti[i] = len(gti_data)
-        except KeyError:
-            pass
-
-        if i == 0:
-            first = fin
-        elif i == nfiles - 1:
-            try:
-                date_end = fin[0].header['DATE-END']
-            except KeyError:
-                date_end = None
-        else:
-            fin.close()
+    The files are memory-mapped and summed one energy plane at a time
+    into an all-sky map.  With several processes the files are split
+    into contiguous groups that are summed in parallel and the partial
+    sums are then added pairwise.  The GTIs are merged in the order of
+    filelist.
 
-    out_skymap_hdu = out_skymap.create_image_hdu("SKYMAP")
+    Parameters
+    ----------
+    filelist : list of str
+        The input files
 
-    hdulist = [out_prim, out_skymap_hdu, out_ebounds]
+    outfile : str
+        If given the merged cube is written to this file, which is
+        filled one energy plane at a time, and the file is returned
+        opened with memory-mapping.  Otherwise the merged cube is
+        built in memory.
 
-    if len(datalist_gti) > 0:
-        out_gti = merge_all_gti_data(datalist_gti, ngti, first['GTI'])
-        out_gti.header['EXPOSURE'] = exposure_sum
-        out_gti.header['TSTOP'] = tstop
-        hdulist.append(out_gti)
+    clobber : bool
+        Overwrite outfile if it exists
 
-    for hdu in hdulist:
-        if date_end:
-            hdu.header['DATE-END'] = date_end
+    nthread : int
+        Number of processes used to sum the files
 
-    out_prim.update_header()
-    sys.stdout.write("!\n")
+    tmpdir : str
+        Directory for the memory-mapped partial sums, by default the
+        directory of outfile
 
-    return fits.HDUList(hdulist)
+    Returns
+    -------
+    hdulist : `astropy.io.fits.HDUList`
+        The merged counts cube
+    """
+    return _merge_counts_cubes(filelist, 'hpx', outfile=outfile,
+                               clobber=clobber, nthread=nthread,
+                               tmpdir=tmpdir)
 
 
 def stack_energy_planes_hpx(filelist, **kwargs):
@@ -116,6 +116,16 @@ def convolve_map(m, k, cpix, threshold=0.001, imin=0, imax=None, wmap=None, optp
 
     return o
 
+def _convolve_map_task(task, maps, kernels, wmaps, cpix):
+    """Convolve a single energy plane of one of the input maps with
+    `convolve_map`.  ``task`` is a tuple of (map index, kernel index,
+    energy index, optpower2)."""
+    imap, ikernel, iplane, optpower2 = task
+    return convolve_map(maps[imap], kernels[ikernel], cpix, imin=iplane,
+                        imax=iplane + 1, wmap=wmaps[ikernel],
+                        optpower2=optpower2)[0]
+
+
 def convolve_map_hpx(m, k, cpix, threshold=0.001, imin=0, imax=None, wmap=None):
     """
     Perform an energy-dependent convolution on a sequence of 2-D spatial maps.
@@ -329,6 +339,7 @@ class ResidMapGenerator(object):
         exclude = kwargs.setdefault('exclude', None)
         loge_bounds = kwargs.setdefault('loge_bounds', None)
         use_weights = kwargs.setdefault('use_weights', False)
+        multithread = kwargs.setdefault('multithread', False)
 
         if loge_bounds:
             if len(loge_bounds) != 2:
@@ -384,6 +395,9 @@ class ResidMapGenerator(object):
 
         self.delete_source('residmap_testsource')
 
+        maps = []
+        wmaps = []
+        tasks = []
         for i, c in enumerate(self.components):
 
             imin = utils.val_to_edge(c.log_energies, loge_bounds[0])[0]
@@ -400,14 +414,59 @@ class ResidMapGenerator(object):
                 wmap = None
                 mask = None
 
-            ccs = convolve_map(
-                cc, sm[i], cpix, imin=imin, imax=imax, wmap=wmap)
-            mcs = convolve_map(
-                mc, sm[i], cpix, imin=imin, imax=imax, wmap=wmap)
-            ecs = convolve_map(
-                ec, sm[i], cpix, imin=imin, imax=imax, wmap=wmap)
-            mcs2 = convolve_map(
-                mc, sm[i], cpix, imin=imin, imax=imax, wmap=wmap, optpower2=True)
+            maps += [cc, mc, ec]
+            wmaps += [wmap]
+            for j in range(mc[imin:imax].shape[0]):
+                tasks += [(3 * i, i, imin + j, False),
+                          (3 * i + 1, i, imin + j, False),
+                          (3 * i + 2, i, imin + j, False),
+                          (3 * i + 1, i, imin + j, True)]
+
+        # Convolve the energy planes of all components in the
+        # persistent worker pool of the analysis
+        convolved = {}
+        if multithread:
+            pool = self.get_worker_pool(kwargs.get('nthread'))
+            if pool.nthread > 1:
+                arrays = dict(maps=[pool.share(m) for m in maps],
+                              kernels=[pool.share(k) for k in sm],
+                              wmaps=[pool.share(w) if w is not None else None
+                                     for w in wmaps])
+            else:
+                arrays = dict(maps=maps, kernels=sm, wmaps=wmaps)
+            try:
+                results = pool.map(_convolve_map_task, tasks, cpix=cpix,
+                                   **arrays)
+            finally:
+                if pool.nthread > 1:
+                    pool.release(arrays['maps'] + arrays['kernels'] +
+                                 [w for w in arrays['wmaps']
+                                  if w is not None])
+            for t, r in zip(tasks, results):
+                convolved.setdefault(t[0] * 2 + t[3], []).append(r)
+
+        for i, c in enumerate(self.components):
+
+            imin = utils.val_to_edge(c.log_energies, loge_bounds[0])[0]
+            imax = utils.val_to_edge(c.log_energies, loge_bounds[1])[0]
+            cc, mc, ec = maps[3 * i:3 * i + 3]
+            wmap = wmaps[i]
+
+            if multithread:
+                ccs = convolved.get(6 * i, [])
+                mcs = convolved.get(6 * i + 2, [])
+                ecs = convolved.get(6 * i + 4, [])
+                mcs2 = convolved.get(6 * i + 3, [])
+            else:
+                ccs = convolve_map(
+                    cc, sm[i], cpix, imin=imin, imax=imax, wmap=wmap)
+                mcs = convolve_map(
+                    mc, sm[i], cpix, imin=imin, imax=imax, wmap=wmap)
+                ecs = convolve_map(
+                    ec, sm[i], cpix, imin=imin, imax=imax, wmap=wmap)
+                mcs2 = convolve_map(
+                    mc, sm[i], cpix, imin=imin, imax=imax, wmap=wmap,
+                    optpower2=True)
 
             cms = np.sum(ccs, axis=0)
             mms = np.sum(mcs, axis=0)
@@ -5,8 +5,8 @@ import argparse
 import yaml
 import numpy as np
 from scipy.sparse import csgraph
-from scipy.sparse.csr import csr_matrix
-from astropy.extern import six
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
 from astropy.table import Table, Column
 
 
@@ -51,6 +51,127 @@ def make_cos_vects(lon_vect, lat_vect):
     return cvects
 
 
+def _chord_length(angle):
+    """ Convert an angular separation in degrees to the distance
+    between the corresponding unit vectors
+    """
+    angle = np.clip(angle, 0., 180.)
+    return 2. * np.sin(np.radians(angle) / 2.)
+
+
+def _make_kdtree(cos_vects):
+    """ Build a KD-tree of the directional cosines of the sources
+    """
+    return cKDTree(np.ascontiguousarray(cos_vects.T))
+
+
+def _pair_cos_vals(cos_vects, idx0, idx1):
+    """ Compute the cosine of the angle between pairs of sources
+    """
+    cos_t_vect = (cos_vects[:, idx0] * cos_vects[:, idx1]).sum(0)
+    return np.clip(cos_t_vect, -1.0, 1.0)
+
+
+def find_pairs_by_distance(cos_vects, cut_dist):
+    """Find all the pairs of sources within a given distance of each
+    other.
+
+    The candidate pairs are found with a KD-tree of the directional
+    cosines, so the runtime scales with the number of sources times
+    the number of neighbours of each source.
+
+    Parameters
+    ----------
+    cos_vects : np.ndarray(3,nsrc)
+        Directional cosines (i.e., x,y,z component) values of all the
+        sources
+
+    cut_dist : float
+        Angular cut in degrees that will be used to select pairs by
+        their separation.
+
+    Returns
+    -------
+    idx0, idx1 : np.ndarray(npair)
+        Indices of the sources in each pair, with idx0 < idx1
+
+    dist_vect : np.ndarray(npair)
+        Separation of the pairs in degrees
+    """
+    cos_t_cut = np.cos(np.radians(cut_dist))
+    tree = _make_kdtree(cos_vects)
+    # Inflate the search radius slightly, the exact cut is applied below
+    pairs = tree.query_pairs(_chord_length(cut_dist) * (1. + 1E-6) + 1E-12,
+                             output_type='ndarray')
+    pairs = pairs[np.lexsort((pairs[:, 0], pairs[:, 1]))]
+    idx0, idx1 = pairs[:, 0], pairs[:, 1]
+    cos_t_vect = _pair_cos_vals(cos_vects, idx0, idx1)
+    mask = cos_t_vect > cos_t_cut
+    # The 1e-6 is here b/c we use 0.0 for sources that failed the cut elsewhere.
+    # We should maybe do this better, but it works for now.
+    dist_vect = np.degrees(np.arccos(cos_t_vect[mask])) + 1e-6
+    return idx0[mask], idx1[mask], dist_vect
+
+
+def find_pairs_by_sigma(cos_vects, unc_vect, cut_sigma):
+    """Find all the pairs of sources within a given number of
+    positional errors of each other.
+
+    A pair can only pass the cut if its separation is smaller than
+    sqrt(2) * cut_sigma times the larger of the two uncertainties, so
+    each source is used to look up the neighbours within that radius
+    in a KD-tree of the directional cosines.
+
+    Parameters
+    ----------
+    cos_vects : np.ndarray(3,nsrc)
+        Directional cosines (i.e., x,y,z component) values of all the sources
+
+    unc_vect : np.ndarray(nsrc)
+        Uncertainties on the source positions
+
+    cut_sigma : float
+        Angular cut in positional errors standard deviations that will
+        be used to select pairs by their separation.
+
+    Returns
+    -------
+    idx0, idx1 : np.ndarray(npair)
+        Indices of the sources in each pair, with idx0 < idx1
+
+    sigma_vect : np.ndarray(npair)
+        Separation of the pairs in units of their combined uncertainty
+    """
+    unc_vect = np.asarray(unc_vect, dtype=float)
+    nsrc = cos_vects.shape[1]
+    sig_2_vect = unc_vect * unc_vect
+    tree = _make_kdtree(cos_vects)
+    radii = _chord_length(np.sqrt(2.) * cut_sigma * unc_vect)
+    radii = radii * (1. + 1E-6) + 1E-12
+    neighbours = tree.query_ball_point(cos_vects.T, radii,
+                                       return_sorted=False)
+    nmatch = np.array([len(v) for v in neighbours], dtype=int)
+    idx_a = np.repeat(np.arange(nsrc), nmatch)
+    idx_b = np.concatenate([np.asarray(v, dtype=int) for v in neighbours] +
+                           [np.zeros(0, dtype=int)])
+
+    # Each pair can be found from either side, keep every pair once
+    idx0 = np.minimum(idx_a, idx_b)
+    idx1 = np.maximum(idx_a, idx_b)
+    pair_ids = np.unique(idx1[idx0 != idx1].astype(np.int64) * nsrc +
+                         idx0[idx0 != idx1])
+    idx0 = (pair_ids % nsrc).astype(int)
+    idx1 = (pair_ids // nsrc).astype(int)
+
+    cos_t_vect = _pair_cos_vals(cos_vects, idx0, idx1)
+    acos_t_vect = np.degrees(np.arccos(cos_t_vect))
+    total_unc = np.sqrt(sig_2_vect[idx0] + sig_2_vect[idx1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma_vect = acos_t_vect / total_unc
+    mask = sigma_vect < cut_sigma
+    return idx0[mask], idx1[mask], sigma_vect[mask]
+
+
 def find_matches_by_distance(cos_vects, cut_dist):
     """Find all the pairs of sources within a given distance of each
     other.
@@ -71,23 +192,8 @@ def find_matches_by_distance(cos_vects, cut_dist):
        Each entry gives a pair of source indices, and the
        corresponding distance
     """
-    dist_rad = np.radians(cut_dist)
-    cos_t_cut = np.cos(dist_rad)
-    nsrc = cos_vects.shape[1]
-    match_dict = {}
-    for i, v1 in enumerate(cos_vects.T):
-        cos_t_vect = (v1 * cos_vects.T).sum(1)
-        cos_t_vect[cos_t_vect < -1.0] = -1.0
-        cos_t_vect[cos_t_vect > 1.0] = 1.0
-        mask = cos_t_vect > cos_t_cut
-        acos_t_vect = np.ndarray(nsrc)
-        # The 1e-6 is here b/c we use 0.0 for sources that failed the cut elsewhere.
-        # We should maybe do this better, but it works for now.
-        acos_t_vect[mask] = np.degrees(np.arccos(cos_t_vect[mask])) + 1e-6
-        for j in np.where(mask[:i])[0]:
-            match_dict[(j, i)] = acos_t_vect[j]
-
-    return match_dict
+    idx0, idx1, dist_vect = find_pairs_by_distance(cos_vects, cut_dist)
+    return make_match_dict(idx0, idx1, dist_vect)
 
 
 def find_matches_by_sigma(cos_vects, unc_vect, cut_sigma):
@@ -112,21 +218,59 @@ def find_matches_by_sigma(cos_vects, unc_vect, cut_sigma):
         Each entry gives a pair of source indices, and the
         corresponding sigma
     """
-    match_dict = {}
-    sig_2_vect = unc_vect * unc_vect
-    for i, v1 in enumerate(cos_vects.T):
-        cos_t_vect = (v1 * cos_vects.T).sum(1)
-        cos_t_vect[cos_t_vect < -1.0] = -1.0
-        cos_t_vect[cos_t_vect > 1.0] = 1.0
-        sig_2_i = sig_2_vect[i]
-        acos_t_vect = np.degrees(np.arccos(cos_t_vect))
-        total_unc = np.sqrt(sig_2_i + sig_2_vect)
-        sigma_vect = acos_t_vect / total_unc
-        mask = sigma_vect < cut_sigma
-        for j in np.where(mask[:i])[0]:
-            match_dict[(j, i)] = sigma_vect[j]
+    idx0, idx1, sigma_vect = find_pairs_by_sigma(cos_vects, unc_vect,
+                                                 cut_sigma)
+    return make_match_dict(idx0, idx1, sigma_vect)
 
-    return match_dict
+
+def make_match_dict(idx0, idx1, vals):
+    """ Convert arrays of source pairs to a dictionary of matches
+
+    Parameters
+    ----------
+    idx0, idx1 : np.ndarray(npair)
+        Indices of the sources in each pair
+
+    vals : np.ndarray(npair)
+        Edge measures (either distances or sigmas)
+
+    Returns
+    -------
+    match_dict : dict((int,int):float)
+        Each entry gives a pair of source indices, and the
+        corresponding measure
+    """
+    return {(int(i0), int(i1)): v for i0, i1, v in zip(idx0, idx1, vals)}
+
+
+def make_edge_graph(nsrcs, idx0, idx1, vals):
+    """ Create a sparse matrix with the graph 'edges' between sources.
+
+    This is the sparse equivalent of `fill_edge_matrix` and can be
+    passed directly to the `scipy.sparse.csgraph` routines.
+
+    Parameters
+    ----------
+    nsrcs  : int
+        number of sources (used to set the size of the matrix)
+
+    idx0, idx1 : np.ndarray(npair)
+        Indices of the sources in each pair
+
+    vals : np.ndarray(npair)
+        Edge measures (either distances or sigmas)
+
+    Returns
+    -------
+    e_graph : `~scipy.sparse.csr_matrix`
+        nsrcs x nsrcs matrix with the edge measures of the matches
+    """
+    e_graph = csr_matrix((np.asarray(vals, dtype=float),
+                          (np.asarray(idx0, dtype=int),
+                           np.asarray(idx1, dtype=int))),
+                         shape=(nsrcs, nsrcs))
+    e_graph.eliminate_zeros()
+    return e_graph
 
 
 def fill_edge_matrix(nsrcs, match_dict):
@@ -222,15 +366,13 @@ def make_clusters(span_tree, cut_value):
 
         working = False
         rev_dict = make_rev_dict_unique(match_dict)
-        k_sort = rev_dict.keys()
-        k_sort.sort()
+        k_sort = sorted(rev_dict.keys())
         for k in k_sort:
             v = rev_dict[k]
             # Multiple mappings
             if len(v) > 1:
                 working = True
-                v_sort = v.keys()
-                v_sort.sort()
+                v_sort = sorted(v.keys())
                 cluster_idx = v_sort[0]
                 for vv in v_sort[1:]:
                     try:
@@ -251,7 +393,7 @@ def make_clusters(span_tree, cut_value):
     # Convert to a int:list dictionary
     cdict = {}
     for k, v in match_dict.items():
-        cdict[k] = v.keys()
+        cdict[k] = list(v.keys())
 
     # make the reverse dictionary
     rdict = make_reverse_dict(cdict)
@@ -536,10 +678,13 @@ def filter_and_copy_table(tab, to_remove):
     return out_tab
 
 
-def make_match_hist(match_dict, match_cut, nbins=50):
+def make_match_hist(match_vals, match_cut, nbins=50):
+    """ Make a histogram of the match measures, either from a match
+    dictionary or from an array of measures
     """
-    """
-    hist = np.histogram(match_dict.values(), nbins, (0., match_cut))
+    if isinstance(match_vals, dict):
+        match_vals = list(match_vals.values())
+    hist = np.histogram(match_vals, nbins, (0., match_cut))
     return hist
 
 
@@ -610,23 +755,20 @@ def main():
     # Convert everything to directional cosines
     cvects = make_cos_vects(glon_vect, glat_vect)
 
-    # Find matches
+    # Find matches.  Edges above the cut never end up in a cluster, so
+    # the spanning tree only needs the matches that pass the cut.
     if use_dist:
-        if use_full:
-            dict_match_cut = match_cut
-        else:
-            dict_match_cut = 180.
-        matchDict = find_matches_by_distance(cvects, dict_match_cut)
+        idx0, idx1, match_vals = find_pairs_by_distance(cvects, match_cut)
     else:
         sigma_vect = tab['loc_err'].data
-        matchDict = find_matches_by_sigma(cvects, match_cut)
+        idx0, idx1, match_vals = find_pairs_by_sigma(cvects, sigma_vect,
+                                                     match_cut)
 
     # Make a histogram of the match measure
-    matchHist = make_match_hist(matchDict, match_cut)
+    matchHist = make_match_hist(match_vals, match_cut)
 
-    # Build a matrix of the edes and apply the MST algorithm
-    e_matrix = fill_edge_matrix(len(glon_vect), matchDict)
-    full_tree = csr_matrix(e_matrix)
+    # Build a sparse matrix of the edges and apply the MST algorithm
+    full_tree = make_edge_graph(len(glon_vect), idx0, idx1, match_vals)
 
     # Apply the spanning tree
     span_tree = csgraph.minimum_spanning_tree(full_tree)
@@ -650,7 +792,7 @@ def main():
     rename_dict = make_rename_dict(rev_dict, src_names)
 
     # Copy the table, filtering out the duplicates
-    to_remove = rev_dict.keys()
+    to_remove = list(rev_dict.keys())
     if args.remove_duplicates:
         out_tab = filter_and_copy_table(tab, to_remove)
     else:
@@ -5,7 +5,6 @@ import argparse
 from fermipy import merge_utils
 from fermipy import fits_utils
 from astropy.wcs import WCS
-from astropy.io.fits.verify import VerifyError
 from fermipy.hpx_utils import HPX
 
 
@@ -19,6 +18,10 @@ def main():
                         help='Output file.')
     parser.add_argument('--clobber', default=False, action='store_true',
                         help='Overwrite output file.')
+    parser.add_argument('--nthread', default=1, type=int,
+                        help='Number of processes used to merge the files.')
+    parser.add_argument('--tmpdir', default=None, type=str,
+                        help='Directory for temporary files.')
     parser.add_argument('files', nargs='+', default=None,
                         help='List of input files.')
 
@@ -26,15 +29,19 @@ def main():
 
     proj, f, hdu = fits_utils.read_projection_from_fits(args.files[0])
     if isinstance(proj, WCS):
-        hdulist = merge_utils.merge_wcs_counts_cubes(args.files)
+        merge_func = merge_utils.merge_wcs_counts_cubes
     elif isinstance(proj, HPX):
-        hdulist = merge_utils.merge_hpx_counts_cubes(args.files)
+        merge_func = merge_utils.merge_hpx_counts_cubes
     else:
         raise TypeError("Could not read projection from file %s" %
                         args.files[0])
 
-    if args.output:
-        hdulist.writeto(args.output, overwrite=args.clobber, output_verify='silentfix')
+    # The merged cube is written directly to the output file, one
+    # energy plane at a time
+    hdulist = merge_func(args.files, outfile=args.output,
+                         clobber=args.clobber, nthread=args.nthread,
+                         tmpdir=args.tmpdir)
+    hdulist.close()
 
 if __name__ == '__main__':
     main()
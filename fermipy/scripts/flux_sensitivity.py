@@ -98,6 +98,11 @@ def main(args=None):
     parser.add_argument('--spatial_size', default=1.0, type=float,
                         help='Set the intrinsic 68-percent containment radius in degrees for '
                         'extended spatial models (RadialDisk, RadialGaussian).')
+    parser.add_argument('--psf_dec_step', default=None, type=float,
+                        help='Evaluate the PSF in declination bands of this width in degrees.  If none then '
+                        'a single PSF will be used for all sky positions.')
+    parser.add_argument('--nthread', default=1, type=int,
+                        help='Number of processes used to compute the sensitivity map.')
     parser.add_argument('--output', default='output.fits', type=str,
                         help='Output filename.')
     parser.add_argument('--obs_time_yr', default=None, type=float,
@@ -139,6 +144,8 @@ def run_flux_sensitivity(**kwargs):
     min_counts = kwargs.get('min_counts', 3.0)
     ts_thresh = kwargs.get('ts_thresh', 25.0)
     nside = kwargs.get('hpx_nside', 16)
+    psf_dec_step = kwargs.get('psf_dec_step', None)
+    nthread = kwargs.get('nthread', 1)
     output = kwargs.get('output', None)
 
     event_types = [['FRONT', 'BACK']]
@@ -192,7 +199,8 @@ def run_flux_sensitivity(**kwargs):
     scalc = SensitivityCalc(gdiff, iso, ltc, ebins,
                             event_class, event_types, gdiff_fit=gdiff_fit,
                             iso_fit=iso_fit, spatial_model=spatial_model,
-                            spatial_size=spatial_size)
+                            spatial_size=spatial_size,
+                            psf_dec_step=psf_dec_step)
 
     # Compute Maps
     map_diff_flux = None
@@ -200,7 +208,7 @@ def run_flux_sensitivity(**kwargs):
     map_int_flux = None
     map_int_npred = None
 
-    map_nstep = 500
+    map_kw = dict(chunk_size=500, nthread=nthread)
 
     if map_type == 'hpx':
 
@@ -209,29 +217,26 @@ def run_flux_sensitivity(**kwargs):
         map_diff_npred = HpxMap(np.zeros((nbin, hpx.npix)), hpx)
         map_skydir = map_diff_flux.hpx.get_sky_dirs()
 
-        for i in range(0, len(map_skydir), map_nstep):
-            s = slice(i, i + map_nstep)
-            o = scalc.diff_flux_threshold(
-                map_skydir[s], fn, ts_thresh, min_counts)
-            map_diff_flux.data[:, s] = o['flux'].T
-            map_diff_npred.data[:, s] = o['npred'].T
+        o = scalc.diff_flux_threshold_map(map_skydir, fn, ts_thresh,
+                                          min_counts, **map_kw)
+        map_diff_flux.data[...] = o['flux'].T
+        map_diff_npred.data[...] = o['npred'].T
 
         hpx = HPX(nside, True, 'GAL')
         map_int_flux = HpxMap(np.zeros((hpx.npix)), hpx)
         map_int_npred = HpxMap(np.zeros((hpx.npix)), hpx)
         map_skydir = map_int_flux.hpx.get_sky_dirs()
 
-        for i in range(0, len(map_skydir), map_nstep):
-            s = slice(i, i + map_nstep)
-            o = scalc.int_flux_threshold(
-                map_skydir[s], fn, ts_thresh, min_counts)
-            map_int_flux.data[s] = o['flux']
-            map_int_npred.data[s] = o['npred']
+        o = scalc.int_flux_threshold_map(map_skydir, fn, ts_thresh,
+                                         min_counts, **map_kw)
+        map_int_flux.data[...] = o['flux']
+        map_int_npred.data[...] = o['npred']
 
     elif map_type == 'wcs':
 
         wcs_shape = [wcs_npix, wcs_npix]
         wcs_size = wcs_npix * wcs_npix
+        idx = np.unravel_index(np.arange(wcs_size), wcs_shape)
 
         map_diff_flux = Map.create(
             c, wcs_cdelt, wcs_shape, 'GAL', wcs_proj, ebins=ebins)
@@ -239,27 +244,23 @@ def run_flux_sensitivity(**kwargs):
             c, wcs_cdelt, wcs_shape, 'GAL', wcs_proj, ebins=ebins)
         map_skydir = map_diff_flux.get_pixel_skydirs()
 
-        for i in range(0, len(map_skydir), map_nstep):
-            idx = np.unravel_index(
-                np.arange(i, min(i + map_nstep, wcs_size)), wcs_shape)
-            s = (slice(None), idx[1], idx[0])
-            o = scalc.diff_flux_threshold(
-                map_skydir[slice(i, i + map_nstep)], fn, ts_thresh, min_counts)
-            map_diff_flux.data[s] = o['flux'].T
-            map_diff_npred.data[s] = o['npred'].T
+        s = (slice(None), idx[1], idx[0])
+        o = scalc.diff_flux_threshold_map(map_skydir, fn, ts_thresh,
+                                          min_counts, **map_kw)
+        map_diff_flux.data[s] = o['flux'].T
+        map_diff_npred.data[s] = o['npred'].T
 
         map_int_flux = Map.create(c, wcs_cdelt, wcs_shape, 'GAL', wcs_proj)
         map_int_npred = Map.create(c, wcs_cdelt, wcs_shape, 'GAL', wcs_proj)
         map_skydir = map_int_flux.get_pixel_skydirs()
 
-        for i in range(0, len(map_skydir), map_nstep):
-            idx = np.unravel_index(
-                np.arange(i, min(i + map_nstep, wcs_size)), wcs_shape)
-            s = (idx[1], idx[0])
-            o = scalc.int_flux_threshold(
-                map_skydir[slice(i, i + map_nstep)], fn, ts_thresh, min_counts)
-            map_int_flux.data[s] = o['flux']
-            map_int_npred.data[s] = o['npred']
+        s = (idx[1], idx[0])
+        o = scalc.int_flux_threshold_map(map_skydir, fn, ts_thresh,
+                                         min_counts, **map_kw)
+        map_int_flux.data[s] = o['flux']
+        map_int_npred.data[s] = o['npred']
+
+    scalc.close_worker_pool()
 
     o = scalc.diff_flux_threshold(c, fn, ts_thresh, min_counts)
 
@@ -1,5 +1,6 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from __future__ import absolute_import, division, print_function
+import copy
 
 import pyLikelihood as pyLike
 
@@ -13,6 +14,54 @@ from fermipy import spectrum
 from fermipy import irfs
 from fermipy import skymap
 from fermipy.ltcube import LTCube
+from fermipy.worker_pool import WorkerPool, resolve_shared
+
+# Data arrays of the map objects that are passed to the worker
+# processes through shared memory
+_SHARED_MAP_ATTRS = ['_counts', '_data_wt']
+
+
+def _share_map(pool, m):
+    """Return a shallow copy of a map object in which the data arrays
+    are replaced by `~fermipy.worker_pool.SharedArray` handles."""
+    if m is None:
+        return None
+    m = copy.copy(m)
+    for k in _SHARED_MAP_ATTRS:
+        v = getattr(m, k, None)
+        if isinstance(v, np.ndarray):
+            setattr(m, k, pool.share(v))
+    return m
+
+
+def _resolve_map(m):
+    """Replace the shared array handles of a map object created with
+    `_share_map` with numpy arrays."""
+    if m is None:
+        return
+    for k in _SHARED_MAP_ATTRS:
+        if hasattr(m, k):
+            setattr(m, k, resolve_shared(getattr(m, k)))
+
+
+def _flux_threshold_tile(tile, scalc, method, spec_fn, ts_thresh,
+                         min_counts, chunk_size):
+    """Evaluate a flux threshold method of a `SensitivityCalc` for a
+    tile of sky directions given as arrays of RA and DEC in degrees.
+    The directions of the tile are processed in blocks of
+    ``chunk_size``."""
+    scalc._resolve_shared()
+    ra, dec = tile
+    skydir = SkyCoord(ra, dec, unit='deg', frame='icrs')
+    o = {}
+    for i in range(0, len(ra), chunk_size):
+        oc = getattr(scalc, method)(skydir[i:i + chunk_size], spec_fn,
+                                    ts_thresh, min_counts)
+        nc = len(ra[i:i + chunk_size])
+        for k in ['npred', 'flux', 'eflux', 'dnde', 'e2dnde']:
+            o.setdefault(k, [])
+            o[k] += [np.reshape(oc[k], (nc, -1))]
+    return {k: np.concatenate(v) for k, v in o.items()}
 
 
 class SensitivityCalc(object):
@@ -41,11 +90,16 @@ class SensitivityCalc(object):
         [['FRONT','BACK']].  A selection for joint FRONT/BACK analysis
         is defined with [['FRONT'],['BACK']].
 
+    psf_dec_step : float
+        Width in degrees of the declination bands in which the PSF is
+        evaluated.  If None the PSF evaluated at the celestial
+        equator is used for all sky positions.
+
     """
 
     def __init__(self, gdiff, iso, ltc, ebins, event_class, event_types=None,
                  gdiff_fit=None, iso_fit=None, spatial_model='PointSource',
-                 spatial_size=None):
+                 spatial_size=None, psf_dec_step=None):
 
         self._gdiff = gdiff
         self._gdiff_fit = gdiff_fit
@@ -63,10 +117,16 @@ class SensitivityCalc(object):
         else:
             self._event_types = event_types
 
+        self._psf_dec_step = psf_dec_step
+        self._psf_table = {}
+        self._worker_pool = None
+        self._shared = None
+
         self._psf = []
         self._exp = []
 
         ebins = 10**np.linspace(1.0, 6.0, 5 * 8 + 1)
+        self._psf_egy = ebins
         skydir = SkyCoord(0.0, 0.0, unit='deg')
         for et in self._event_types:
             self._psf += [irfs.PSFModel.create(skydir.icrs, self._ltc,
@@ -92,6 +152,130 @@ class SensitivityCalc(object):
     def spatial_size(self):
         return self._spatial_size
 
+    @property
+    def psf_dec_step(self):
+        return self._psf_dec_step
+
+    def get_worker_pool(self, nthread=None):
+        """Return the persistent worker pool used by
+        `diff_flux_threshold_map` and `int_flux_threshold_map`.  The
+        pool is created on the first call and reused by subsequent
+        calls.
+
+        Parameters
+        ----------
+        nthread : int
+            Number of worker processes.  If None one process will be
+            created for each available core.  The pool is recreated
+            if the number of processes changes.
+
+        Returns
+        -------
+        pool : `~fermipy.worker_pool.WorkerPool`
+        """
+        pool = self._worker_pool
+        if pool is not None and nthread is not None and \
+                pool.nthread != nthread:
+            self.close_worker_pool()
+            pool = None
+
+        if pool is None:
+            pool = WorkerPool(nthread)
+            self._worker_pool = pool
+        return pool
+
+    def close_worker_pool(self):
+        """Shut down the worker pool created by `get_worker_pool` and
+        free its shared memory."""
+        if self._worker_pool is not None:
+            self._worker_pool.close()
+        self._worker_pool = None
+        self._shared = None
+
+    def _get_shared(self, pool):
+        """Return a shallow copy of this object in which the data of
+        the diffuse, livetime and exposure maps are replaced by shared
+        arrays of ``pool``.  Only the copy is pickled for the worker
+        processes.  The maps are shared once and reused until the pool
+        is closed."""
+        if self._shared is not None:
+            return self._shared
+
+        scalc = copy.copy(self)
+        scalc._worker_pool = None
+        scalc._shared = None
+        scalc._psf_table = {}
+        scalc._gdiff = _share_map(pool, self._gdiff)
+        scalc._gdiff_fit = _share_map(pool, self._gdiff_fit)
+        scalc._ltc = _share_map(pool, self._ltc)
+        scalc._exp = [_share_map(pool, m) for m in self._exp]
+        self._shared = scalc
+        return scalc
+
+    def _resolve_shared(self):
+        for m in [self._gdiff, self._gdiff_fit, self._ltc] + self._exp:
+            _resolve_map(m)
+
+    def get_psf(self, idx, dec):
+        """Return the PSF models of event type selection ``idx`` for
+        an array of declinations.
+
+        Parameters
+        ----------
+        idx : int
+            Index of the event type selection.
+
+        dec : `~numpy.ndarray`
+            Array of declinations in degrees.
+
+        Returns
+        -------
+        psfs : list
+            List of tuples of a `~fermipy.irfs.PSFModel` and the
+            boolean mask of the elements of ``dec`` to which it
+            applies.
+        """
+        dec = np.ravel(dec)
+        if self._psf_dec_step is None:
+            return [(self._psf[idx], np.ones(dec.shape, dtype=bool))]
+
+        nband = int(np.ceil(180. / self._psf_dec_step))
+        iband = np.floor((dec + 90.) / self._psf_dec_step).astype(int)
+        iband = np.clip(iband, 0, nband - 1)
+        psfs = []
+        for i in np.unique(iband):
+            key = (idx, i)
+            if key not in self._psf_table:
+                dec_ctr = min(-90. + (i + 0.5) * self._psf_dec_step, 90.)
+                skydir = SkyCoord(0.0, dec_ctr, unit='deg')
+                self._psf_table[key] = irfs.PSFModel.create(
+                    skydir, self._ltc, self._event_class,
+                    self._event_types[idx], self._psf_egy)
+            psfs += [(self._psf_table[key], iband == i)]
+        return psfs
+
+    def _compute_ps_counts(self, idx, dec, ebins, expv, bkgv, fn):
+        """Compute signal and background counts for arrays of exposure
+        and background intensity with the pixel and energy dimensions
+        using the PSF at the declination of each pixel."""
+        kw = dict(egy_dim=1, spatial_model=self.spatial_model,
+                  spatial_size=self.spatial_size)
+        psfs = self.get_psf(idx, dec)
+        if len(psfs) == 1:
+            return irfs.compute_ps_counts(ebins, expv, psfs[0][0], bkgv,
+                                          fn, **kw)
+        sig = None
+        bkg = None
+        for psf, m in psfs:
+            s0, b0 = irfs.compute_ps_counts(ebins, expv[m], psf, bkgv[m],
+                                            fn, **kw)
+            if sig is None:
+                sig = np.zeros(expv.shape + s0.shape[-1:])
+                bkg = np.zeros(expv.shape + b0.shape[-1:])
+            sig[m] = s0
+            bkg[m] = b0
+        return sig, bkg
+
     def compute_counts(self, skydir, fn, ebins=None):
         """Compute signal and background counts for a point source at
         position ``skydir`` with spectral parameterization ``fn``.
@@ -129,8 +313,9 @@ class SensitivityCalc(object):
         if self._gdiff_fit is not None:
             bkg_fit = []
 
+        dec = np.ravel(skydir_cel.dec.deg)
 
-        for psf, exp in zip(self._psf, self._exp):
+        for i, exp in enumerate(self._exp):
 
             coords0 = np.meshgrid(*[skydir_cel.ra.deg, ectr], indexing='ij')
             coords1 = np.meshgrid(*[skydir_cel.dec.deg, ectr], indexing='ij')
@@ -157,11 +342,7 @@ class SensitivityCalc(object):
                                     np.log(self._iso[1])))
             bkgv += isov
 
-            
-            s0, b0 = irfs.compute_ps_counts(ebins, expv, psf, bkgv, fn,
-                                            egy_dim=1,
-                                            spatial_model=self.spatial_model,
-                                            spatial_size=self.spatial_size)
+            s0, b0 = self._compute_ps_counts(i, dec, ebins, expv, bkgv, fn)
 
             sig += [s0]
             bkg += [b0]
@@ -178,10 +359,8 @@ class SensitivityCalc(object):
                                                        np.ravel(coords0[1]))
                 bkgv_fit = bkgv_fit.reshape(expv.shape)
                 bkgv_fit += isov_fit
-                s0, b0 = irfs.compute_ps_counts(ebins, expv, psf,
-                                                bkgv_fit, fn, egy_dim=1,
-                                                spatial_model=self.spatial_model,
-                                                spatial_size=self.spatial_size)
+                s0, b0 = self._compute_ps_counts(i, dec, ebins, expv,
+                                                 bkgv_fit, fn)
                 bkg_fit += [b0]
 
         sig = np.concatenate([np.expand_dims(t, -1) for t in sig])
@@ -277,3 +456,92 @@ class SensitivityCalc(object):
                          e_ref=self.ectr)
 
         return o
+
+    def diff_flux_threshold_map(self, skydir, fn, ts_thresh, min_counts,
+                                chunk_size=500, nthread=1):
+        """Compute the differential flux threshold for a point source
+        at every position of an array of sky coordinates.  The
+        exposure, background and PSF of a block of ``chunk_size``
+        positions are evaluated at once and the flux thresholds of all
+        positions in the block are solved simultaneously.
+
+        Parameters
+        ----------
+        skydir : `~astropy.coordinates.SkyCoord`
+            Array of sky coordinates.
+
+        fn : `~fermipy.spectrum.SpectralFunction`
+
+        ts_thresh : float
+            Threshold on the detection test statistic (TS).
+
+        min_counts : float
+            Threshold on the minimum number of counts.
+
+        chunk_size : int
+            Number of positions that are evaluated at once.
+
+        nthread : int
+            Number of processes over which the positions are
+            distributed.  If None one process is created for each
+            available core.  The worker processes are kept for
+            subsequent calls (see `get_worker_pool`).
+
+        Returns
+        -------
+        o : dict
+            Dictionary with the same keys as the output of
+            `diff_flux_threshold`.  Arrays have the dimensions of
+            position and energy.
+        """
+        o = self._flux_threshold_map('diff_flux_threshold', skydir, fn,
+                                     ts_thresh, min_counts, chunk_size,
+                                     nthread)
+        o.update(e_min=self.ebins[:-1], e_max=self.ebins[1:],
+                 e_ref=self.ectr)
+        return o
+
+    def int_flux_threshold_map(self, skydir, fn, ts_thresh, min_counts,
+                               chunk_size=500, nthread=1):
+        """Compute the integral flux threshold for a point source at
+        every position of an array of sky coordinates.  See
+        `diff_flux_threshold_map` for a description of the parameters.
+
+        Returns
+        -------
+        o : dict
+            Dictionary with the integral quantities of the output of
+            `int_flux_threshold`.  Arrays have the dimension of
+            position.
+        """
+        o = self._flux_threshold_map('int_flux_threshold', skydir, fn,
+                                     ts_thresh, min_counts, chunk_size,
+                                     nthread)
+        o = {k: v[:, 0] for k, v in o.items()}
+        o.update(e_min=self.ebins[0], e_max=self.ebins[-1],
+                 e_ref=np.sqrt(self.ebins[0] * self.ebins[-1]))
+        return o
+
+    def _flux_threshold_map(self, method, skydir, fn, ts_thresh, min_counts,
+                            chunk_size, nthread):
+
+        skydir = skydir.transform_to('icrs')
+        ra = np.ravel(skydir.ra.deg)
+        dec = np.ravel(skydir.dec.deg)
+
+        pool = self.get_worker_pool(nthread)
+        ntile = max(min(pool.nthread, len(ra)), 1)
+        tiles = [(ra[i::ntile], dec[i::ntile]) for i in range(ntile)]
+        scalc = self._get_shared(pool) if pool.nthread > 1 else self
+        results = pool.map(_flux_threshold_tile, tiles, scalc=scalc,
+                           method=method, spec_fn=fn,
+                           ts_thresh=ts_thresh, min_counts=min_counts,
+                           chunk_size=chunk_size)
+
+        o = {}
+        for k in results[0].keys():
+            v = np.zeros((len(ra),) + results[0][k].shape[1:])
+            for i, r in enumerate(results):
+                v[i::ntile] = r[k]
+            o[k] = v
+        return o
@@ -476,12 +476,13 @@ class HpxMap(Map_Base):
         return self.hpx.make_hdu(self.counts, **kwargs)
 
     def make_wcs_from_hpx(self, sum_ebins=False, proj='CAR', oversample=2,
-                          normalize=True):
+                          normalize=True, file_cache=None, use_cache=True):
         """Make a WCS object and convert HEALPix data into WCS projection
 
-        NOTE: this re-calculates the mapping, if you have already
-        calculated the mapping it is much faster to use
-        convert_to_cached_wcs() instead
+        NOTE: the mapping between the two projections is reused if it
+        was already calculated for the same HEALPix and WCS geometry.
+        Once the mapping is set up it is faster to use
+        convert_to_cached_wcs() to convert other data
 
         Parameters
         ----------
@@ -497,13 +498,22 @@ class HpxMap(Map_Base):
         normalize  : bool
            True -> perserve integral by splitting HEALPix values between bins
 
+        file_cache : `~fermipy.file_cache.FileCache`
+           Persistent cache used to store the mapping between the
+           two projections
+
+        use_cache  : bool
+           Keep the mapping between the two projections in the
+           in-memory cache of `~fermipy.hpx_utils.HpxToWcsMapping`
+
         returns (WCS object, np.ndarray() with reprojected data)
 
         """
         self._wcs_proj = proj
         self._wcs_oversample = oversample
         self._wcs_2d = self.hpx.make_wcs(2, proj=proj, oversample=oversample)
-        self._hpx2wcs = HpxToWcsMapping(self.hpx, self._wcs_2d)
+        self._hpx2wcs = HpxToWcsMapping.create(self.hpx, self._wcs_2d,
+                                               file_cache, use_cache)
         wcs, wcs_data = self.convert_to_cached_wcs(self.counts, sum_ebins,
                                                    normalize)
         return wcs, wcs_data
@@ -335,6 +335,8 @@ class SourceFind(object):
         free_radius = kwargs.get('free_radius', None)
         fix_shape = kwargs.get('fix_shape', False)
         tsmap_fitter = kwargs.get('tsmap_fitter', 'tsmap')
+        multithread = kwargs.get('multithread', False)
+        nthread = kwargs.get('nthread', None)
 
         saved_state = LikelihoodState(self.like)
         loglike_init = -self.like()
@@ -362,7 +364,9 @@ class SourceFind(object):
                                         dtheta_max=dtheta_max,
                                         zmin=-3.0,
                                         use_pylike=False,
-                                        tsmap_fitter=tsmap_fitter)
+                                        tsmap_fitter=tsmap_fitter,
+                                        multithread=multithread,
+                                        nthread=nthread)
 
         self.logger.debug('Completed localization with TS Map.\n'
                           '(ra,dec) = (%10.4f,%10.4f) '
@@ -524,6 +528,8 @@ class SourceFind(object):
               'write_fits':  kwargs.get('write_fits', False),
               'write_npy':  kwargs.get('write_npy', False),
               'max_kernel_radius': self.config['tsmap']['max_kernel_radius'],
+              'multithread': kwargs.get('multithread', False),
+              'nthread': kwargs.get('nthread', None),
               'loglevel': logging.DEBUG}
 
         src = self.roi.copy_source(name)
@@ -143,7 +143,7 @@ class SourceMapCache(object):
 
     @classmethod
     def create(cls, psf, exp, spatial_model, spatial_width, shape_out, cdelt,
-               rebin=4):
+               rebin=4, kernel_bank=None):
 
         npix = shape_out[1]
         pad_pix = npix // 2
@@ -155,7 +155,7 @@ class SourceMapCache(object):
         k0 = make_srcmap(psf, exp, spatial_model, spatial_width,
                          npix=npix + pad_pix,
                          xpix=xpix, ypix=ypix,
-                         cdelt=cdelt)
+                         cdelt=cdelt, kernel_bank=kernel_bank)
 
         m0 = MapInterpolator(k0, pix_ref, shape_out, 1)
 
@@ -167,7 +167,7 @@ class SourceMapCache(object):
         k1 = make_srcmap(psf, exp, spatial_model, spatial_width,
                          npix=npix1,
                          xpix=xpix1, ypix=ypix1,
-                         cdelt=cdelt / rebin)
+                         cdelt=cdelt / rebin, kernel_bank=kernel_bank)
 
         m1 = MapInterpolator(k1, pix_ref, shape_out, rebin)
 
@@ -222,8 +222,34 @@ def make_srcmap_old(psf, spatial_model, sigma, npix=500, xpix=0.0, ypix=0.0,
     return k
 
 
-def make_srcmap(psf, exp, spatial_model, sigma, npix=(500,500), xpix=0.0, ypix=0.0,
+def make_kernel(psf, spatial_model, sigma, npix=(500,500), xpix=0.0, ypix=0.0,
                 cdelt=0.01, psf_scale_fn=None, klims=None, sparse=False):
+    """Compute the PSF-convolved kernel of a spatial model.  This is
+    the source map of `make_srcmap` without the exposure scaling.
+    See `make_srcmap` for a description of the parameters."""
+    if spatial_model == 'RadialGaussian':
+        k = utils.make_radial_kernel(psf, utils.convolve2d_gauss,
+                                     sigma / 1.5095921854516636, npix, cdelt,
+                                     xpix, ypix, psf_scale_fn, klims=klims,
+                                     sparse=sparse)
+    elif spatial_model == 'RadialDisk':
+        k = utils.make_radial_kernel(psf, utils.convolve2d_disk,
+                                     sigma / 0.8246211251235321, npix, cdelt,
+                                     xpix, ypix, psf_scale_fn, klims=klims,
+                                     sparse=sparse)
+    elif spatial_model == 'PointSource':
+        k = utils.make_radial_kernel(psf, None, None, npix, cdelt,
+                                     xpix, ypix, psf_scale_fn, klims=klims,
+                                     sparse=sparse)
+    else:
+        raise Exception('Unsupported spatial model: %s', spatial_model)
+
+    return k
+
+
+def make_srcmap(psf, exp, spatial_model, sigma, npix=(500,500), xpix=0.0, ypix=0.0,
+                cdelt=0.01, psf_scale_fn=None, klims=None, sparse=False,
+                kernel_bank=None):
     """Compute the source map for a given spatial model.
 
     Parameters
@@ -258,23 +284,19 @@ def make_srcmap(psf, exp, spatial_model, sigma, npix=(500,500), xpix=0.0, ypix=0
     sparse : bool    
         Skip pixels in which the source amplitude is small.
 
+    kernel_bank : `~fermipy.kernel_bank.KernelBank`
+        Bank from which the PSF-convolved kernel will be retrieved.
+        If None the kernel will be computed.
+
     """
-    if spatial_model == 'RadialGaussian':
-        k = utils.make_radial_kernel(psf, utils.convolve2d_gauss,
-                                     sigma / 1.5095921854516636, npix, cdelt,
-                                     xpix, ypix, psf_scale_fn, klims=klims,
-                                     sparse=sparse)
-    elif spatial_model == 'RadialDisk':
-        k = utils.make_radial_kernel(psf, utils.convolve2d_disk,
-                                     sigma / 0.8246211251235321, npix, cdelt,
-                                     xpix, ypix, psf_scale_fn, klims=klims,
-                                     sparse=sparse)
-    elif spatial_model == 'PointSource':
-        k = utils.make_radial_kernel(psf, None, None, npix, cdelt,
-                                     xpix, ypix, psf_scale_fn, klims=klims,
-                                     sparse=sparse)
+    if kernel_bank is not None and psf_scale_fn is None:
+        k = kernel_bank.get(spatial_model, sigma, npix=npix, xpix=xpix,
+                            ypix=ypix, cdelt=cdelt, klims=klims,
+                            sparse=sparse)
     else:
-        raise Exception('Unsupported spatial model: %s', spatial_model)
+        k = make_kernel(psf, spatial_model, sigma, npix=npix, xpix=xpix,
+                        ypix=ypix, cdelt=cdelt, psf_scale_fn=psf_scale_fn,
+                        klims=klims, sparse=sparse)
 
     if klims is not None:
         exp = exp[klims[0]:klims[1] + 1, ...]
@@ -1,5 +1,7 @@
 """Utilities for stacking analysis"""
 
+# NameFactory is imported by the other modules of this package
+from .name_policy import NameFactory
 from .stack_collect import CollectLimits, CollectLimits_SG, CollectStackedLimits_SG
 from .stack_plotting import PlotStackSpectra, PlotLimits, PlotStack, PlotLimits_SG, PlotStackedLimits_SG,\
      PlotStack_SG, PlotStackedStack_SG, PlotControlLimits_SG, PlotFinalLimits_SG
@@ -8,5 +10,4 @@ from .stack_spectral import ConvertCastro, SpecTable, StackLikelihood, ConvertCa
 from .stack_spec_table import StackSpecTable
 from .stack_castro import StackCastroData
 from .lnl_norm_prior import LnLFn_norm_prior
-from .name_policy import NameFactory
 from .pipeline import PipelineData, PipelineSim, PipelineRandom, Pipeline
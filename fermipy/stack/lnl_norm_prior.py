@@ -4,15 +4,23 @@ Utilities to fit dark matter spectra to castro data
 """
 from __future__ import absolute_import, division, print_function
 
-from functools import partial
 import numpy as np
 
 import scipy.optimize as opt
-from scipy.interpolate import splrep, splev
+from scipy.interpolate import splrep, BSpline
 
 from fermipy import castro
 
 
+def _interp_rows(xp, fp, x):
+    """Linearly interpolate each row of ``fp``, sampled at the
+    points ``xp``, at the corresponding element of ``x``."""
+    i = np.clip(np.searchsorted(xp, x, side='right'), 1, len(xp) - 1)
+    w = (x - xp[i - 1]) / (xp[i] - xp[i - 1])
+    irow = np.arange(len(x))
+    return fp[irow, i - 1] * (1. - w) + fp[irow, i] * w
+
+
 class LnLFn_norm_prior(castro.LnLFn):
     """ A class to add a prior on normalization of a LnLFn object
 
@@ -111,7 +119,6 @@ class LnLFn_norm_prior(castro.LnLFn):
             ret_val = self._lnlfn.interp
         if ret_type == "profile":
             self._profile_loglike_spline(self._lnlfn.interp.x)
-            #self._profile_loglike(self._lnlfn.interp.x)
             ret_val = self._prof_interp
         elif ret_type == "marginal":
             self._marginal_loglike(self._lnlfn.interp.x)
@@ -186,7 +193,7 @@ class LnLFn_norm_prior(castro.LnLFn):
         """
         if self._prof_interp is None:
             # This calculates values and caches the spline
-            return self._profile_loglike(x)[1]
+            return self._profile_loglike_spline(x)[1]
 
         x = np.array(x, ndmin=1)
         return self._prof_interp(x)
@@ -219,58 +226,68 @@ class LnLFn_norm_prior(castro.LnLFn):
         x = np.array(x, ndmin=1)
         return self._post_interp(x)
 
-    def _profile_loglike(self, x):
-        """Internal function to calculate and cache the profile likelihood
-        """
-        x = np.array(x, ndmin=1)
-
-        z = []
-        y = []
-
-        for xtmp in x:
-            #def fn(t):
-            #    """Functor to return profile likelihood"""
-            #    return -self.loglike(xtmp, t)
-            fn = partial(LnLFn_norm_prior.nll_static, self, xtmp)
-            ytmp = opt.fmin(fn, 1.0, disp=False)[0]
-            ztmp = self.loglike(xtmp, ytmp)
-            z.append(ztmp)
-            y.append(ytmp)
-
-        prof_y = np.array(y)
-        prof_z = np.array(z)
-        prof_z = prof_z.max() - prof_z
-        self._prof_interp = castro.Interpolator(x, prof_z)
-        return prof_y, prof_z
-
     def _profile_loglike_spline(self, x):
         """Internal function to calculate and cache the profile likelihood
+
+        For each value of x the log-likelihood is sampled on the grid
+        of nuisance parameter values given by ``profile_bins()`` and
+        interpolated with a quadratic spline.  The maximum of the
+        spline is found near the maximum on the grid.  Since the knots
+        of the spline only depend on the grid, the splines for all x
+        values are built and evaluated together.
         """
-        z = []
-        y = []
+        x = np.array(x, ndmin=1)
 
         yv = self._nuis_pdf.profile_bins()
-        nuis_vals = self._nuis_pdf.log_value(yv) - self._nuis_log_norm
-        for xtmp in x:
-            zv = -1. * self._lnlfn.interp(xtmp * yv) + nuis_vals
-            sp = splrep(yv, zv, k=2, s=0)
-
-            #def rf(t):
-            #    """Functor for spline evaluation"""
-            #    return splev(t, sp, der=1)
-            rf = partial(splev, sp=sp, der=1)
-            ix = np.argmax(splev(yv, sp))
-            imin, imax = max(0, ix - 3), min(len(yv) - 1, ix + 3)
-            try:
-                y0 = opt.brentq(rf, yv[imin], yv[imax], xtol=1e-10)
-            except ValueError:
-                y0 = yv[ix]
-            z0 = self.loglike(xtmp, y0)
-            z.append(z0)
-            y.append(y0)
-
-        prof_y = np.array(y)
-        prof_z = np.array(z)
+        with np.errstate(divide='ignore'):
+            nuis_vals = self._nuis_pdf.log_value(yv)
+        # Use the same floor for the prior as in loglike()
+        nuis_vals = np.where(np.isfinite(nuis_vals), nuis_vals, -1e2)
+        nuis_vals -= self._nuis_log_norm
+        zv = -1. * self._lnlfn.interp(x[:, np.newaxis] * yv) + nuis_vals
+
+        # Quadratic interpolating splines for all values of x
+        t = splrep(yv, zv[0], k=2, s=0)[0]
+        coeffs = np.linalg.solve(BSpline.design_matrix(yv, t, 2).toarray(),
+                                 zv.T)
+        dsp = BSpline(t, coeffs, 2, extrapolate=False).derivative()
+
+        # Bracket the maximum with the grid points around the maximum
+        # of the spline
+        ix = np.argmax(zv, axis=1)
+        ylo = yv[np.maximum(0, ix - 3)]
+        yhi = yv[np.minimum(len(yv) - 1, ix + 3)]
+
+        # The derivative of the spline is linear between knots.
+        # Evaluate it at the bracket edges and at all knots inside the
+        # bracket and locate the first sign change.
+        knots = np.unique(t)
+        dknots = dsp(knots).T
+        irow = np.arange(len(x))
+        dlo = _interp_rows(knots, dknots, ylo)
+        dhi = _interp_rows(knots, dknots, yhi)
+        yp = np.clip(knots, ylo[:, np.newaxis], yhi[:, np.newaxis])
+        dp = np.where(knots < ylo[:, np.newaxis], dlo[:, np.newaxis],
+                      np.where(knots > yhi[:, np.newaxis], dhi[:, np.newaxis],
+                               dknots))
+        yp = np.hstack((ylo[:, np.newaxis], yp, yhi[:, np.newaxis]))
+        dp = np.hstack((dlo[:, np.newaxis], dp, dhi[:, np.newaxis]))
+
+        icross = np.argmax(np.sign(dp) != np.sign(dp[:, :1]), axis=1)
+        icross = np.maximum(icross, 1)
+        y0, y1 = yp[irow, icross - 1], yp[irow, icross]
+        d0, d1 = dp[irow, icross - 1], dp[irow, icross]
+
+        # A single Newton step is exact on a linear segment
+        with np.errstate(invalid='ignore', divide='ignore'):
+            yroot = y0 - d0 * (y1 - y0) / (d1 - d0)
+        yroot = np.where(d1 == d0, y0, yroot)
+
+        # Fall back to the grid point when the derivative does not
+        # change sign over the bracket
+        prof_y = np.where(dlo * dhi < 0, yroot, yv[ix])
+        prof_y = np.where(dlo == 0, ylo, np.where(dhi == 0, yhi, prof_y))
+        prof_z = self.loglike(x, prof_y)
         prof_z = prof_z.max() - prof_z
 
         self._prof_interp = castro.Interpolator(x, prof_z)
@@ -6,6 +6,8 @@ Interface to Dark Matter spectra
 """
 from __future__ import absolute_import, division, print_function
 
+import itertools
+
 import numpy as np
 
 from astropy.table import Table, Column
@@ -444,8 +446,9 @@ class StackCastroData(castro.CastroData_Base):
 
         Parameters
         ----------
-        components : list
-           List of `StackCastroData` objects we are stacking
+        components : iterable
+           `StackCastroData` objects we are stacking.  This can be a
+           generator that loads the components one at a time.
 
         Keyword Arguments
         -----------------
@@ -471,19 +474,22 @@ class StackCastroData(castro.CastroData_Base):
             Object with the stacking variable-space likelihoods
 
         """
-        if not components:
+        components = iter(components)
+        first = next(components, None)
+        if first is None:
             return None
+        components = itertools.chain([first], components)
 
         ysteps = kwargs.pop('ysteps')
         weights = kwargs.pop('weights', None)
-        shape = (components[0].nx, len(ysteps))
+        shape = (first.nx, len(ysteps))
         norm_vals, nll_vals, nll_offsets = castro.CastroData_Base.stack_nll(shape, components, ysteps, weights)
 
         kwcopy = kwargs.copy()
         # copy stuff from component 0
         for attr_name in ['spec_name', 'xscan_name', 'xscan_vals',
                           'other_pars', 'astro_prior', 'ref_astro', 'ref_stack']:
-            kwcopy[attr_name] = components[0].__dict__[attr_name]
+            kwcopy[attr_name] = first.__dict__[attr_name]
 
         kwcopy['astro_value'] = None
         kwcopy['prior_applied'] = True
@@ -361,6 +361,37 @@ class StackLikelihood(Link):
     __doc__ += Link.construct_docstring(default_options)
 
 
+    @staticmethod
+    def iter_components(stack_like_paths, spec, norm_type='norm'):
+        """ Iterate over the StackCastroData of one spec in a set of files
+
+        Parameters
+        ----------
+
+        stack_like_paths : list
+            List of the likelihood files of the targets
+
+        spec : str
+            Name of the spec (i.e., the HDU to read)
+
+        norm_type : str
+            Type of normalization
+
+        Returns
+        -------
+
+        output : generator
+            Generator that reads one `StackCastroData` at a time.
+            Files that do not contain ``spec`` are skipped.
+
+        """
+        for stack_like_path in stack_like_paths:
+            try:
+                tab_s = Table.read(stack_like_path, hdu=spec)
+            except KeyError:
+                continue
+            yield StackCastroData.create_from_tables(tab_s, norm_type)
+
     @staticmethod
     def stack_roster(rost, ttype,
                      specs, astro_prior_key, sim, seed):
@@ -394,11 +425,7 @@ class StackLikelihood(Link):
             Dictionary of `StackCastroData` objects, keyed by spec
 
         """
-        component_dict = {}
-        out_dict = {}
-        for spec in specs:
-            component_dict[spec] = []
-
+        stack_like_paths = []
         for target_key in rost:
             tokens = target_key.split(':')
             name_keys = dict(target_type=ttype,
@@ -410,23 +437,17 @@ class StackLikelihood(Link):
                              astro_prior=astro_prior_key)
 
             if is_not_null(sim):
-                stack_like_path = NAME_FACTORY.sim_stack_likefile(**name_keys)
+                stack_like_paths.append(NAME_FACTORY.sim_stack_likefile(**name_keys))
             else:
-                stack_like_path = NAME_FACTORY.stack_likefile(**name_keys)
-
-            for spec in specs:
-                norm_type = 'norm'
-                try:
-                    tab_s = Table.read(stack_like_path, hdu=spec)
-                except KeyError:
-                    continue
-                stack_castro = StackCastroData.create_from_tables(tab_s, norm_type)
-                component_dict[spec].append(stack_castro)
-
-        for spec, comps in component_dict.items():
-            if not comps:
-                continue
+                stack_like_paths.append(NAME_FACTORY.stack_likefile(**name_keys))
+
+        out_dict = {}
+        for spec in specs:
+            # The components are read one at a time while stacking
+            comps = StackLikelihood.iter_components(stack_like_paths, spec)
             stacked = StackCastroData.create_from_stack(comps)
+            if stacked is None:
+                continue
             out_dict[spec] = stacked
 
         return out_dict
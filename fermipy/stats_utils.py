@@ -73,7 +73,7 @@ def lgauss(x, mu, sigma=1.0, logpdf=False):
     if not logpdf:
         v /= (x * np.log(10.))
 
-    v[x <= 0] = -np.inf
+    v = np.where(x <= 0, -np.inf, v)
 
     return v
 
@@ -98,7 +98,7 @@ def lnlgauss(x, mu, sigma=1.0, logpdf=False):
         v -= 2.302585 * lx + np.log(np.log(10.))
 
     if inv_mask.any():
-        v[inv_mask] = -np.inf
+        v = np.where(inv_mask, -np.inf, v)
 
     return v
 
@@ -119,3 +119,106 @@ def test_fit_dmfitfunction(sedfile):
     assert_allclose(fit_out['params'][0], 2.98000000e-25, rtol=0.05)
 
 
+
+
+def test_castro_interpolator_array():
+
+    np.random.seed(1)
+    norm_vals = np.sort(np.random.uniform(0.0, 10.0, size=(6, 20)), axis=1)
+    norm_vals[:, 0] = 0.0
+    nll_vals = 0.5 * (norm_vals - np.arange(1., 7.)[:, None])**2
+    nll_vals[2, 5] = np.nan
+    cd = castro.CastroData_Base(norm_vals, nll_vals, np.zeros(6), 'norm')
+
+    # Values inside and outside of the tabulated range and at the
+    # tabulated points
+    x = np.stack([np.linspace(-1.0, 12.0, 53)] * 6)
+    x[:, 0] = norm_vals[:, 3]
+    y = cd.interp(x)
+    dydx = cd.interp.derivative(x)
+    for i in range(6):
+        assert_allclose(y[i], cd[i].interp(x[i]), rtol=1E-12, atol=1E-12)
+        assert_allclose(dydx[i], cd[i].interp.derivative(x[i]),
+                        rtol=1E-12, atol=1E-12)
+
+    spec = np.linspace(0.5, 1.5, 6)
+    norm = np.linspace(0.1, 3.0, 7)
+    nll = np.sum([cd[i].interp(spec[i] * norm) for i in range(6)], axis=0)
+    assert_allclose(cd(spec[:, None] * norm[None, :]), nll, rtol=1E-12)
+    assert_allclose(cd(spec), np.sum([cd[i].interp(spec[i])
+                                      for i in range(6)]), rtol=1E-12)
+
+    der = np.sum([cd[i].interp.derivative(spec[i] * norm) * spec[i]
+                  for i in range(6)], axis=0)
+    assert_allclose(cd.norm_derivative(spec, norm), der, rtol=1E-12)
+    der = np.sum([cd[i].interp.derivative(2.0 * spec[i]) * spec[i]
+                  for i in range(6)])
+    assert_allclose(cd.norm_derivative(spec, 2.0), der, rtol=1E-12)
+
+
+def test_tscube_fit_spectra():
+
+    from gammapy.maps import WcsGeom, Map
+    from fermipy.spectrum import PowerLaw
+
+    ebins = np.logspace(2, 5, 7)
+    flux = PowerLaw([1E-12, -2.2], scale=1E3).flux(ebins[:-1], ebins[1:])
+    ref_spec = castro.ReferenceSpec(ebins[:-1], ebins[1:], np.ones(6), flux,
+                                    np.ones(6), np.ones(6))
+    tsmap = Map.from_geom(WcsGeom.create(npix=(4, 3), binsz=0.1))
+
+    np.random.seed(3)
+    amp = np.random.uniform(0.5, 2.0, 12)
+    norm_vals = np.ones((12, 6, 1)) * np.linspace(0, 5, 30) * flux[:, None]
+    nll_vals = 0.5 * ((norm_vals - amp[:, None, None] * flux[:, None]) /
+                      (0.3 * flux[:, None]))**2
+    tscube = castro.TSCube(tsmap, None, None, None, norm_vals, nll_vals,
+                           ref_spec, 'flux')
+
+    mask = np.ones(tsmap.data.shape, dtype=bool)
+    mask[0, 0] = False
+    o = tscube.fit_spectra('PowerLaw', mask=mask, chunk_size=5)
+    assert o['param_names'] == ['Prefactor', 'Index']
+    assert o['fit_status'].data[0, 0] == -1
+    assert np.isnan(o['ts'].data[0, 0])
+
+    for ipix in range(1, 12):
+        cd = tscube.castroData_from_ipix(ipix)
+        spec_func = cd.create_functor('PowerLaw')
+        fit_out = cd.fit_spectrum(spec_func, spec_func.params)
+        params = [m.data.flat[ipix] for m in o['params']]
+        assert o['fit_status'].data.flat[ipix] == 0
+        assert_allclose(params, fit_out['params'], rtol=1E-6)
+        assert_allclose(o['ts'].data.flat[ipix], fit_out['ts_spec'],
+                        rtol=1E-6)
+
+
+def test_castro_stack_nll():
+
+    np.random.seed(2)
+    components = []
+    for i in range(5):
+        norm_vals = np.sort(np.random.uniform(0.0, 10.0, size=(4, 20)), axis=1)
+        norm_vals[:, 0] = 0.0
+        mu = np.random.uniform(0.5, 5.0, size=(4, 1))
+        nll_vals = 0.5 * (norm_vals - mu)**2
+        components += [castro.CastroData_Base(norm_vals, nll_vals,
+                                              np.random.uniform(size=4),
+                                              'norm')]
+    weights = np.random.uniform(0.5, 2.0, size=5)
+    shape = (4, 30)
+    ylims = (1E-2, 1E1)
+
+    norm_vals, nll_vals, nll_offsets = castro.CastroData_Base.stack_nll(
+        shape, (c for c in components), ylims, weights)
+
+    norm_ref = np.zeros(shape[1])
+    norm_ref[1:] = np.logspace(-2, 1, shape[1] - 1)
+    for i in range(shape[0]):
+        nll_ref = np.sum([w * c[i].interp(norm_ref) - c.nll_offsets[i]
+                          for c, w in zip(components, weights)], axis=0)
+        offset = castro.LnLFn(norm_ref, nll_ref).fn_mle()
+        assert_allclose(norm_vals[i], norm_ref)
+        assert_allclose(nll_vals[i], nll_ref - offset, rtol=1E-10,
+                        atol=1E-10)
+        assert_allclose(nll_offsets[i], -offset)
@@ -0,0 +1,81 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+from scipy.sparse import csgraph
+from fermipy.scripts import cluster_sources as cs
+
+
+def _make_cvects(nsrc):
+
+    rng = np.random.RandomState(1)
+    lon = rng.uniform(0.0, 360.0, nsrc)
+    lat = np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, nsrc)))
+    # Add some close pairs and a duplicate position
+    lon[:20] = lon[20:40] + rng.uniform(-0.5, 0.5, 20)
+    lat[:20] = lat[20:40] + rng.uniform(-0.5, 0.5, 20)
+    lon[40], lat[40] = lon[41], lat[41]
+    return cs.make_cos_vects(lon, lat)
+
+
+def test_find_pairs_by_distance():
+
+    cvects = _make_cvects(500)
+    cut = 5.0
+    idx0, idx1, dist = cs.find_pairs_by_distance(cvects, cut)
+    assert np.all(idx0 < idx1)
+
+    cos_t = np.clip(np.dot(cvects.T, cvects), -1.0, 1.0)
+    i1, i0 = np.nonzero(np.tril(cos_t > np.cos(np.radians(cut)), -1))
+    order = np.lexsort((i0, i1))
+    assert_array_equal(idx0, i0[order])
+    assert_array_equal(idx1, i1[order])
+    assert_allclose(dist, np.degrees(np.arccos(cos_t[idx0, idx1])) + 1e-6)
+
+    match_dict = cs.find_matches_by_distance(cvects, cut)
+    e_matrix = cs.fill_edge_matrix(cvects.shape[1], match_dict)
+    e_graph = cs.make_edge_graph(cvects.shape[1], idx0, idx1, dist)
+    assert_allclose(e_graph.toarray(), e_matrix)
+
+
+def test_find_pairs_by_sigma():
+
+    cvects = _make_cvects(500)
+    rng = np.random.RandomState(2)
+    unc = rng.uniform(0.1, 2.0, cvects.shape[1])
+    cut = 2.0
+    idx0, idx1, sigma = cs.find_pairs_by_sigma(cvects, unc, cut)
+
+    cos_t = np.clip(np.dot(cvects.T, cvects), -1.0, 1.0)
+    sigma_all = np.degrees(np.arccos(cos_t)) / \
+        np.sqrt(unc[:, None]**2 + unc[None, :]**2)
+    i1, i0 = np.nonzero(np.tril(sigma_all < cut, -1))
+    order = np.lexsort((i0, i1))
+    assert_array_equal(idx0, i0[order])
+    assert_array_equal(idx1, i1[order])
+    assert_allclose(sigma, sigma_all[idx0, idx1])
+
+
+def test_spanning_tree_clusters():
+
+    cvects = _make_cvects(300)
+    cut = 3.0
+    nsrc = cvects.shape[1]
+
+    # Clusters from the spanning tree of all the pairs
+    match_dict = cs.find_matches_by_distance(cvects, 180.)
+    span_tree = csgraph.minimum_spanning_tree(
+        cs.fill_edge_matrix(nsrc, match_dict))
+    cdict0, rdict0 = cs.make_clusters(span_tree, cut)
+
+    # Clusters from the spanning tree of the pairs that pass the cut
+    idx0, idx1, dist = cs.find_pairs_by_distance(cvects, cut)
+    span_tree = csgraph.minimum_spanning_tree(
+        cs.make_edge_graph(nsrc, idx0, idx1, dist))
+    cdict1, rdict1 = cs.make_clusters(span_tree, cut)
+
+    assert len(cdict1) > 0
+    assert rdict0 == rdict1
+    assert set(cdict0.keys()) == set(cdict1.keys())
+    for k, v in cdict0.items():
+        assert sorted(v) == sorted(cdict1[k])
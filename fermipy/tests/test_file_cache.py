@@ -0,0 +1,56 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import os
+import time
+import numpy as np
+from numpy.testing import assert_array_equal
+from fermipy.file_cache import FileCache, file_checksum, make_cache_key
+
+
+def test_make_cache_key(tmpdir):
+
+    x = np.arange(10.)
+    key = make_cache_key('PointSource', 0.1, x, {'a': 1, 'b': [1, 2]})
+    assert key == make_cache_key('PointSource', 0.1, x.copy(),
+                                 {'b': [1, 2], 'a': 1})
+    assert key != make_cache_key('PointSource', 0.1, x + 1.0,
+                                 {'a': 1, 'b': [1, 2]})
+
+    path = str(tmpdir.join('test.txt'))
+    with open(path, 'w') as f:
+        f.write('test')
+    chk = file_checksum(path)
+    time.sleep(0.01)
+    with open(path, 'w') as f:
+        f.write('test2')
+    assert chk != file_checksum(path)
+
+
+def test_file_cache(tmpdir):
+
+    cache = FileCache(str(tmpdir.join('cache')), max_size=2500)
+    for i in range(3):
+        cache.save_array('key%i' % i, np.ones(100) * i)
+        time.sleep(0.01)
+
+    # The first entry is evicted
+    assert cache.load_array('key0') is None
+    assert_array_equal(cache.load_array('key1'), np.ones(100))
+    assert cache.size() <= 2500
+
+    # Accessing an entry makes it the most recently used one
+    time.sleep(0.01)
+    cache.load_array('key1')
+    cache.save_array('key3', np.ones(100) * 3)
+    assert cache.load_array('key2') is None
+    assert cache.load_array('key1') is not None
+
+    infile = str(tmpdir.join('in.txt'))
+    outfile = str(tmpdir.join('out.txt'))
+    with open(infile, 'w') as f:
+        f.write('test')
+    assert not cache.get('file', outfile, ext='.txt')
+    cache.put('file', infile, ext='.txt')
+    assert cache.get('file', outfile, ext='.txt')
+    assert open(outfile).read() == 'test'
+    assert os.path.isfile(cache.entry_path('file', '.txt'))
@@ -164,6 +164,40 @@ def test_gtanalysis_tsmap(create_diffuse_dir, create_draco_analysis):
     gta.load_roi('fit1')
     gta.tsmap(model={}, make_plots=True)
 
+
+def test_gtanalysis_tsmap_engine(create_diffuse_dir, create_draco_analysis):
+    gta = create_draco_analysis
+    gta.load_roi('fit1')
+    o0 = gta.tsmap(model={}, engine='scalar', write_fits=False,
+                   write_npy=False)
+    o1 = gta.tsmap(model={}, engine='batch', write_fits=False,
+                   write_npy=False)
+    assert_allclose(o0['ts'].data, o1['ts'].data, rtol=1E-6, atol=1E-6)
+    assert_allclose(o0['amplitude'].data, o1['amplitude'].data,
+                    rtol=1E-6, atol=1E-20)
+
+
+def test_gtanalysis_tsmap_tiled(create_diffuse_dir, create_draco_analysis):
+    gta = create_draco_analysis
+    gta.load_roi('fit1')
+    o0 = gta.tsmap('tiled', model={}, write_fits=False, write_npy=False)
+    o1 = gta.tsmap('tiled', model={}, tile_size=16, write_fits=False,
+                   write_npy=False)
+    assert_allclose(o0['ts'].data, o1['ts'].data, rtol=1E-6, atol=1E-6)
+    # The default checkpoint is removed once the map is complete
+    assert not [f for f in os.listdir(gta.outdir) if 'tsmap_tiles' in f]
+
+    # Resume from the checkpoint of the previous call
+    checkpoint_dir = os.path.join(gta.outdir, 'tsmap_checkpoint')
+    o2 = gta.tsmap('tiled', model={}, tile_size=16, write_fits=False,
+                   write_npy=False, checkpoint_dir=checkpoint_dir)
+    assert len(os.listdir(checkpoint_dir)) == 1
+    o3 = gta.tsmap('tiled', model={}, tile_size=16, write_fits=False,
+                   write_npy=False, checkpoint_dir=checkpoint_dir)
+    assert_allclose(o1['ts'].data, o2['ts'].data)
+    assert_allclose(o2['ts'].data, o3['ts'].data)
+
+
 def test_gtanalysis_psmap(create_diffuse_dir, create_draco_analysis):
     gta = create_draco_analysis
     gta.load_roi('fit1')
@@ -356,3 +390,26 @@ def test_gtanalysis_lightcurve(create_diffuse_dir, create_pg1553_analysis):
     assert_allclose(tab['flux'], flux, rtol=rtol)
     assert_allclose(tab['flux_err'], flux_err, rtol=rtol)
     assert_allclose(tab['ts'], ts, rtol=rtol)
+
+
+def test_gtanalysis_lightcurve_reuse_srcmap(create_diffuse_dir,
+                                            create_pg1553_analysis):
+    gta = create_pg1553_analysis
+    gta.load_roi('fit1')
+    o0 = gta.lightcurve('4FGL J1555.7+1111', nbins=2,
+                        free_radius=3.0, reuse_parent_srcmap=False,
+                        outdir='lc_srcmap')
+    o1 = gta.lightcurve('4FGL J1555.7+1111', nbins=2,
+                        free_radius=3.0, reuse_parent_srcmap=True,
+                        outdir='lc_reuse_srcmap')
+
+    # No exposure maps are computed for the time bins
+    for t0, t1 in zip(o1['tmin'], o1['tmax']):
+        bindir = os.path.join(gta.workdir, 'lc_reuse_srcmap',
+                              'lightcurve_%.0f_%.0f' % (t0, t1))
+        assert os.path.isfile(os.path.join(bindir, 'srcmap_00.fits'))
+        assert not os.path.isfile(os.path.join(bindir, 'bexpmap_roi_00.fits'))
+
+    rtol = 0.05
+    assert_allclose(o1['flux'], o0['flux'], rtol=rtol)
+    assert_allclose(o1['ts'], o0['ts'], rtol=rtol)
@@ -0,0 +1,119 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose
+from astropy.io import fits
+from astropy.table import Table
+from fermipy import gtpsmap
+
+
+def _write_cube(filename, data, ebins):
+
+    hdu = fits.PrimaryHDU(data.astype('f4'))
+    hdr = hdu.header
+    hdr['CTYPE1'] = 'GLON-CAR'
+    hdr['CTYPE2'] = 'GLAT-CAR'
+    hdr['CRPIX1'] = 8.5
+    hdr['CRPIX2'] = 8.5
+    hdr['CDELT1'] = -0.2
+    hdr['CDELT2'] = 0.2
+    hdr['CRVAL1'] = 0.0
+    hdr['CRVAL2'] = 0.0
+    hdr['CTYPE3'] = 'Energy'
+    hdr['CRPIX3'] = 1
+    hdr['CRVAL3'] = ebins[0]
+    hdr['CDELT3'] = ebins[1] - ebins[0]
+    tab = Table([np.arange(len(ebins) - 1), ebins[:-1] * 1E3, ebins[1:] * 1E3],
+                names=['CHANNEL', 'E_MIN', 'E_MAX'])
+    tab['E_MIN'].unit = 'keV'
+    tab['E_MAX'].unit = 'keV'
+    hdu_energies = fits.table_to_hdu(tab)
+    hdu_energies.name = 'EBOUNDS'
+    fits.HDUList([hdu, hdu_energies]).writeto(filename, overwrite=True)
+
+
+def _make_args(tmpdir, ncomp):
+
+    rng = np.random.RandomState(1)
+    ebins = 10**np.linspace(2.0, 5.0, 13)
+    cmaps = []
+    mmaps = []
+    for i in range(ncomp):
+        mod = rng.uniform(0.01, 3.0, (12, 16, 16))
+        dat = rng.poisson(1.1 * mod)
+        cmaps += [str(tmpdir.join('ccube_%02i.fits' % i))]
+        mmaps += [str(tmpdir.join('mcube_%02i.fits' % i))]
+        _write_cube(cmaps[-1], dat, ebins)
+        _write_cube(mmaps[-1], mod, ebins)
+
+    return dict(cmap=':'.join(cmaps), mmap=':'.join(mmaps), wmap='',
+                psfpar0lst='', emin=100., emax=1E5, nbinloge=12, outfile='',
+                fixedradius=-1.0, psfpar0=4.0, psfpar1=100.0, psfpar2=0.9,
+                psfpar3=0.1, chatter=0, ipix=-1, jpix=-1, dpix=-1,
+                maxpoissoncount=100., prob_epsilon=1E-7, nbinpdf=50,
+                scaleaxis=20.)
+
+
+def test_rebin_spectrum():
+
+    rng = np.random.RandomState(1)
+    loge = np.linspace(2.1, 4.9, 8)
+    hlogebin = np.linspace(2.0, 5.0, 4)
+    dat = rng.poisson(5.0, (8, 6)).astype(float)
+    mod = rng.uniform(1.0, 5.0, (8, 6))
+    wgt = rng.uniform(0.5, 1.0, (8, 6))
+
+    o = gtpsmap.rebin_spectrum(loge, dat, mod, wgt, hlogebin)
+    for i in range(6):
+        oi = gtpsmap.rebin_spectrum(loge, dat[:, i], mod[:, i], wgt[:, i],
+                                    hlogebin)
+        for v, vi in zip(o, oi):
+            assert_allclose(v[:, i], vi)
+    assert_allclose(o[0], np.array([np.histogram(loge, bins=hlogebin,
+                                                 weights=dat[:, i])[0]
+                                    for i in range(6)]).T)
+
+
+def test_deviation_probability_cache():
+
+    rng = np.random.RandomState(1)
+    llcache = {}
+    for i in range(5):
+        mod = np.array([0.5, 2.0, 8.0, 30.0, 150.0])
+        dat = rng.poisson(mod)
+        wgt = np.ones(5)
+        p0 = gtpsmap.getDeviationProbability(dat, mod, wgt, 100., 1E-7, 50,
+                                             20.)
+        p1 = gtpsmap.getDeviationProbability(dat, mod, wgt, 100., 1E-7, 50,
+                                             20., llcache=llcache)
+        assert_allclose(p0, p1)
+    assert len(llcache) > 0
+
+
+def test_convolve_ll_histograms():
+
+    rng = np.random.RandomState(1)
+    hists = [rng.uniform(0.0, 1.0, 40) for i in range(6)]
+    hists[1][::3] = 0.0
+    hists = [h / np.sum(h) for h in hists]
+    expected = hists[0]
+    for h in hists[1:]:
+        expected = np.convolve(expected, h)[:150]
+
+    # The tail of the distribution is computed with full relative precision
+    for ibin in [0, 20, 80, 120, 149]:
+        assert_allclose(gtpsmap.convolveLLHistograms(hists, ibin, 150),
+                        np.sum(expected[ibin:]), rtol=1E-10)
+
+
+def test_psmap_components(tmpdir):
+
+    args = _make_args(tmpdir, 5)
+    o = gtpsmap.run(args)
+    assert o['psmap'].shape == (16, 16)
+    assert np.all(np.isfinite(o['psmap']))
+
+    o_mt = gtpsmap.run(dict(args, multithread=True, nthread=2))
+    assert_allclose(o_mt['psmap'], o['psmap'])
+    assert o_mt['ipix'] == o['ipix']
+    assert o_mt['jpix'] == o['jpix']
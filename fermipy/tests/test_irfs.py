@@ -37,6 +37,21 @@ def test_calc_exp():
                     rtol=1E-3)
 
 
+def test_calc_exp_skydirs():
+
+    ltc = irfs.LTCube.create_from_obs_time(3.1536E8)
+    c = SkyCoord([10.0, 120.0, 250.0], [10.0, -45.0, 80.0], unit='deg')
+    egy = 10**np.linspace(2.0, 6.0, 5)
+
+    exp = irfs.calc_exp_skydirs(c, ltc, 'P8R2_SOURCE_V6', ['FRONT', 'BACK'],
+                                egy)
+    assert exp.shape == (5, 3)
+    for i in range(3):
+        exp_i = irfs.calc_exp(c[i], ltc, 'P8R2_SOURCE_V6', ['FRONT', 'BACK'],
+                              egy, np.array([0.2, 1.0]))
+        assert_allclose(exp[:, i], np.sum(exp_i, axis=1), rtol=5E-2)
+
+
 def test_create_avg_psf():
 
     ltc = irfs.LTCube.create_from_obs_time(3.1536E8)
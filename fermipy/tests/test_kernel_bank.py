@@ -0,0 +1,108 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose
+from fermipy.tests.utils import requires_dependency
+from fermipy.file_cache import FileCache
+
+# irfs imports pyIrfLoader at module level
+pytestmark = requires_dependency('Fermi ST')
+
+
+def create_psf():
+    from fermipy.irfs import PSFModel
+
+    dtheta = np.linspace(0.0, 3.0, 301)
+    energies = np.array([1E3, 1E4])
+    sigma = np.array([0.5, 0.1])
+    val = np.exp(-dtheta[:, None]**2 / (2 * sigma[None, :]**2))
+    val /= 2 * np.pi * np.radians(sigma[None, :])**2
+    return PSFModel(dtheta, energies, np.array([0.2, 1.0]),
+                    np.ones(2), val, np.ones(2))
+
+
+def test_kernel_bank(tmpdir):
+    from fermipy import srcmap_utils
+    from fermipy.kernel_bank import KernelBank
+
+    psf = create_psf()
+    kw = dict(npix=(21, 21), xpix=10.0, ypix=10.0, cdelt=0.1)
+    k0 = srcmap_utils.make_kernel(psf, 'RadialGaussian', 0.3, **kw)
+
+    # Kernels are extracted from a larger window which changes the
+    # radial interpolation grid
+    tol = dict(rtol=1E-3, atol=1E-4 * np.max(k0))
+    cache = FileCache(str(tmpdir.join('cache')))
+    bank = KernelBank(psf, file_cache=cache)
+    k = bank.get('RadialGaussian', 0.3, **kw)
+    assert_allclose(k, k0, **tol)
+
+    # Returned kernels are copies of the stored kernels
+    k *= 2.0
+    assert_allclose(bank.get('RadialGaussian', 0.3, **kw), k0, **tol)
+    assert len(bank) == 1
+
+    # Kernels are reloaded from the persistent cache
+    bank = KernelBank(psf, file_cache=cache)
+    assert_allclose(bank.get('RadialGaussian', 0.3, **kw), k0, **tol)
+
+    # Memory size limit
+    bank = KernelBank(psf, max_size=1.5 * k0.nbytes, subpix=None)
+    bank.get('RadialGaussian', 0.3, **kw)
+    bank.get('RadialDisk', 0.3, **kw)
+    assert len(bank) == 1
+    assert bank.size == k0.nbytes
+
+    # Kernels are only stored in the persistent cache
+    bank = KernelBank(psf, max_size=0, file_cache=cache, subpix=None)
+    assert_allclose(bank.get('RadialGaussian', 0.3, **kw), k0)
+    bank.get('RadialDisk', 0.3, **kw)
+    assert len(bank) == 0
+    assert bank.size == 0
+    assert cache.load_array(bank._make_key('RadialDisk', 0.3, klims=None,
+                                           sparse=False, **kw)) is not None
+
+
+def test_kernel_bank_subpix():
+    from fermipy import srcmap_utils
+    from fermipy.kernel_bank import KernelBank
+
+    psf = create_psf()
+    kw = dict(npix=(21, 25), cdelt=0.1, sparse=True)
+    bank = KernelBank(psf)
+
+    # Positions with the same snapped sub-pixel offset share a kernel
+    for xpix, ypix in [(10.0, 10.0), (3.02, 17.0), (15.98, 0.0),
+                       (20.0, 24.0)]:
+        k0 = srcmap_utils.make_kernel(psf, 'PointSource', None,
+                                      xpix=np.round(xpix, 1),
+                                      ypix=np.round(ypix, 1), **kw)
+        k = bank.get('PointSource', None, xpix=xpix, ypix=ypix, **kw)
+        assert_allclose(k, k0)
+        assert len(bank) == 1
+
+    bank.get('PointSource', None, xpix=10.5, ypix=10.0, **kw)
+    assert len(bank) == 2
+
+    # Sources outside of the window
+    k0 = srcmap_utils.make_kernel(psf, 'PointSource', None,
+                                  xpix=-2.0, ypix=5.0, **kw)
+    k = bank.get('PointSource', None, xpix=-2.01, ypix=5.0, **kw)
+    assert_allclose(k, k0)
+    assert len(bank) == 3
+
+
+def test_kernel_bank_interp():
+    from fermipy import srcmap_utils
+    from fermipy.kernel_bank import KernelBank
+
+    psf = create_psf()
+    kw = dict(npix=(21, 21), xpix=10.0, ypix=10.0, cdelt=0.1)
+    bank = KernelBank(psf, widths=np.logspace(-1, 0, 21))
+    bank.precompute('RadialGaussian', **kw)
+    assert len(bank) == 21
+
+    k0 = srcmap_utils.make_kernel(psf, 'RadialGaussian', 0.3, **kw)
+    k = bank.get('RadialGaussian', 0.3, **kw)
+    assert len(bank) == 21
+    assert_allclose(k, k0, rtol=0.02, atol=1E-3 * np.max(k0))
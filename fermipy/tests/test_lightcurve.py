@@ -0,0 +1,65 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from fermipy.tests.utils import requires_dependency
+
+# lightcurve imports pyLikelihood at module level
+pytestmark = requires_dependency('Fermi ST')
+
+
+def test_lightcurve_stream_file(tmpdir):
+    # gtanalysis has to be imported before lightcurve
+    from fermipy import gtanalysis
+    from fermipy import lightcurve
+
+    filename = str(tmpdir.join('lightcurve_bins.pkl'))
+    times = np.linspace(0., 4., 5)
+    lightcurve._write_lc_bins(filename, 'src', times, {})
+    lightcurve._append_lc_bin(filename, 2, {'fit_success': True})
+    lightcurve._append_lc_bin(filename, 0, {'fit_success': False})
+
+    # Truncated record from an interrupted process is ignored
+    with open(filename, 'ab') as f:
+        f.write(b'\x80\x04\x95')
+
+    bins = lightcurve._load_lc_bins(filename, 'src', times)
+    assert sorted(bins.keys()) == [0, 2]
+    assert bins[2]['fit_success']
+
+    # Failed bins are dropped to be processed again
+    assert sorted(lightcurve._load_lc_bins(filename, 'src', times,
+                                           keep_failed=False)) == [2]
+
+    # Stream file of a different lightcurve is ignored
+    assert lightcurve._load_lc_bins(filename, 'src', times[:-1]) == {}
+    assert lightcurve._load_lc_bins(filename, 'other', times) == {}
+
+    lightcurve._write_lc_bins(filename, 'src', times, bins)
+    assert sorted(lightcurve._load_lc_bins(filename, 'src', times)) == [0, 2]
+
+    # Stream file created with a different configuration is ignored
+    key0 = lightcurve._make_lc_key('src', times, {'binsz': 1.0})
+    key1 = lightcurve._make_lc_key('src', times, {'binsz': 2.0})
+    assert key0 == lightcurve._make_lc_key('src', times, {'binsz': 1.0})
+    assert key0 != key1
+    lightcurve._write_lc_bins(filename, 'src', times, bins, key0)
+    assert sorted(lightcurve._load_lc_bins(filename, 'src', times,
+                                           key0)) == [0, 2]
+    assert lightcurve._load_lc_bins(filename, 'src', times, key1) == {}
+
+
+def test_lightcurve_peak_rss():
+    from fermipy import gtanalysis
+    from fermipy import lightcurve
+
+    if not lightcurve._reset_peak_rss():
+        return
+    peak0 = lightcurve._proc_status_mb('VmHWM')
+    x = np.ones(2**25)
+    peak1 = lightcurve._proc_status_mb('VmHWM')
+    del x
+    assert peak1 - peak0 > 200.
+
+    # The peak of the previous allocation is forgotten
+    assert lightcurve._reset_peak_rss()
+    assert lightcurve._proc_status_mb('VmHWM') < peak1 - 200.
@@ -0,0 +1,35 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose
+import scipy.optimize as opt
+import pytest
+from fermipy import castro
+from fermipy import stats_utils
+from fermipy.stack.lnl_norm_prior import LnLFn_norm_prior
+
+
+def _profile_loglike_fmin(lnl, x):
+    """Profile likelihood from a separate fit of the nuisance
+    parameter for every value of x"""
+    z = []
+    for xtmp in x:
+        ytmp = opt.fmin(lambda t: -lnl.loglike(xtmp, t), 1.0, disp=False)[0]
+        z += [float(np.squeeze(lnl.loglike(xtmp, ytmp)))]
+    z = np.array(z)
+    return z.max() - z
+
+
+@pytest.mark.parametrize('functype', ['lognorm', 'norm', 'lgauss',
+                                      'lgauss_like'])
+def test_profile_loglike(functype):
+
+    xv = np.linspace(0.0, 5.0, 101)
+    lnlfn = castro.LnLFn(xv, 0.5 * ((xv - 1.5) / 0.4)**2)
+    prior = stats_utils.create_prior_functor(dict(functype=functype,
+                                                  mu=1.0, sigma=0.2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lnl = LnLFn_norm_prior(lnlfn, prior, 'profile')
+        expected = _profile_loglike_fmin(lnl, xv)
+    assert_allclose(lnl.profile_loglike(xv), expected, atol=2E-3)
+    assert_allclose(lnl(xv), expected, atol=2E-3)
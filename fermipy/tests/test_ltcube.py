@@ -0,0 +1,98 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_array_equal, assert_allclose
+from astropy.table import Table
+from astropy.coordinates import SkyCoord
+from fermipy import utils
+from fermipy.ltcube import LTCube, fill_livetime_hist
+from fermipy.hpx_utils import HPX
+
+
+def make_sc_table(nrow, seed=1):
+    rng = np.random.RandomState(seed)
+    t0 = 239557417.0 + 30. * np.arange(nrow)
+    tab_sc = Table(dict(START=t0, STOP=t0 + 30.,
+                        LIVETIME=rng.uniform(20., 30., nrow),
+                        RA_SCZ=rng.uniform(0., 360., nrow),
+                        DEC_SCZ=np.degrees(np.arcsin(
+                            rng.uniform(-1., 1., nrow))),
+                        RA_ZENITH=rng.uniform(0., 360., nrow),
+                        DEC_ZENITH=np.degrees(np.arcsin(
+                            rng.uniform(-1., 1., nrow)))))
+    gti_t0 = t0[::50][:-1] + np.where(rng.uniform(size=len(t0[::50]) - 1)
+                                      > 0.5, 0.0, 7.0)
+    tab_gti = Table(dict(START=gti_t0, STOP=gti_t0 + 1200.))
+    return tab_sc, tab_gti
+
+
+def fill_livetime_hist_loop(skydir, tab_sc, tab_gti, zmax, costh_edges):
+    """Reference implementation with a loop over sky directions."""
+    cos_zmax = np.cos(np.radians(zmax))
+    sc_t0 = np.array(tab_sc['START'].data)
+    sc_t1 = np.array(tab_sc['STOP'].data)
+    sc_live = np.array(tab_sc['LIVETIME'].data)
+    sc_lfrac = sc_live / (sc_t1 - sc_t0)
+    sc_xyz = utils.angle_to_cartesian(np.radians(tab_sc['RA_SCZ'].data),
+                                      np.radians(tab_sc['DEC_SCZ'].data))
+    zn_xyz = utils.angle_to_cartesian(np.radians(tab_sc['RA_ZENITH'].data),
+                                      np.radians(tab_sc['DEC_ZENITH'].data))
+    idx = np.digitize(sc_t0, tab_gti['START'].data) - 1
+    gti_t0 = np.array(tab_gti['START'].data)[idx]
+    gti_t1 = np.array(tab_gti['STOP'].data)[idx]
+    m0 = (idx >= 0) & (sc_t0 >= gti_t0) & (sc_t1 <= gti_t1)
+
+    nbin = len(costh_edges) - 1
+    lt = np.zeros((nbin,) + skydir.shape)
+    lt_wt = np.zeros((nbin,) + skydir.shape)
+    xyz = utils.angle_to_cartesian(skydir.ra.rad, skydir.dec.rad)
+    for i, t in enumerate(xyz):
+        cos_sep = utils.dot_prod(t, sc_xyz)
+        cos_zn = utils.dot_prod(t, zn_xyz)
+        m = m0 & (cos_zn > cos_zmax) & (cos_sep > 0.0)
+        bins = np.digitize(cos_sep[m], bins=costh_edges) - 1
+        bins = np.clip(bins, 0, nbin - 1)
+        lt[:, i] = np.bincount(bins, weights=sc_live[m], minlength=nbin)
+        lt_wt[:, i] = np.bincount(bins, weights=sc_live[m] * sc_lfrac[m],
+                                  minlength=nbin)
+    return lt, lt_wt
+
+
+def test_fill_livetime_hist():
+
+    tab_sc, tab_gti = make_sc_table(5000)
+    cth_edges = (1.0 - np.linspace(0, 1.0, 41)**2)[::-1]
+    skydir = HPX(4, True, 'CEL').get_sky_dirs()
+
+    lt0, lt_wt0 = fill_livetime_hist_loop(skydir, tab_sc, tab_gti, 100.,
+                                          cth_edges)
+    for kw in [{}, {'max_elements': 1000}, {'nthread': 2}]:
+        lt, lt_wt = fill_livetime_hist(skydir, tab_sc, tab_gti, 100.,
+                                       cth_edges, **kw)
+        assert_array_equal(lt, lt0)
+        assert_array_equal(lt_wt, lt_wt0)
+
+
+def test_ltcube_update_from_gti(tmpdir):
+
+    tab_sc, tab_gti = make_sc_table(4000)
+    skydir = SkyCoord(30.0, 40.0, unit='deg')
+    ltc0 = LTCube.create_from_gti(skydir, tab_sc, tab_gti, 100.,
+                                  radius=30.)
+
+    ngti = len(tab_gti) // 2
+    tmax = tab_gti['STOP'][ngti - 1]
+    ltc = LTCube.create_from_gti(skydir, tab_sc[tab_sc['STOP'] <= tmax],
+                                 tab_gti[:ngti], 100., radius=30.)
+    outfile = str(tmpdir.join('ltcube.fits'))
+    ltc.update_from_gti(skydir, tab_sc, tab_gti, 100., radius=30.,
+                        outfile=outfile)
+
+    assert_allclose(ltc.data, ltc0.data, rtol=1E-10)
+    assert_allclose(ltc.data_wt, ltc0.data_wt, rtol=1E-10)
+    assert_allclose(ltc.tstart, ltc0.tstart)
+    assert_allclose(ltc.tstop, ltc0.tstop)
+
+    ltc1 = LTCube.create_from_fits(outfile)
+    assert_allclose(ltc1.tstop, ltc0.tstop)
+    assert_allclose(ltc1.data, ltc0.data, rtol=1E-5)
@@ -0,0 +1,104 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import os
+import numpy as np
+from numpy.testing import assert_allclose
+from astropy.io import fits
+import pytest
+from fermipy import merge_utils
+from fermipy.hpx_utils import HPX
+from fermipy.skymap import HpxMap
+
+
+def _make_gti_hdu(tstart, ngti):
+
+    start = tstart + 10. * np.arange(ngti)
+    cols = [fits.Column('START', 'D', array=start),
+            fits.Column('STOP', 'D', array=start + 5.)]
+    hdu = fits.BinTableHDU.from_columns(cols, name='GTI')
+    hdu.header['EXPOSURE'] = 5. * ngti
+    hdu.header['TSTOP'] = tstart + 10. * ngti
+    return hdu
+
+
+def _check_gti(hdulist, ngti, exposure):
+
+    assert len(hdulist['GTI'].data) == ngti
+    assert hdulist['GTI'].header['EXPOSURE'] == exposure
+
+
+def test_merge_hpx_counts_cubes(tmpdir):
+
+    rng = np.random.RandomState(1)
+    ebins = np.logspace(2.0, 5.0, 5)
+    files = []
+    expected = np.zeros((4, 12 * 16 * 16))
+    for i in range(5):
+        # Mix all-sky and partial-sky maps
+        region = 'DISK(110.,75.,%i.)' % (10 + i) if i % 2 else None
+        hpx = HPX(16, False, 'GAL', region=region, ebins=ebins)
+        data = rng.poisson(2.0, (4, hpx.npix)).astype(float)
+        hdu_prim = fits.PrimaryHDU()
+        hdu_prim.header['DATE-END'] = '2020-01-%02i' % (i + 1)
+        # Compressed inputs cannot be memory-mapped
+        ext = '.fits.gz' if i == 3 else '.fits'
+        files += [str(tmpdir.join('ccube_%02i%s' % (i, ext)))]
+        fits.HDUList([hdu_prim, hpx.make_hdu(data, extname='SKYMAP'),
+                      hpx.make_energy_bounds_hdu(),
+                      _make_gti_hdu(100. * i, i + 1)]).writeto(files[-1])
+        expected += HpxMap.create_from_fits(files[-1]).expanded_counts_map()
+
+    outfile = str(tmpdir.join('ccube.fits'))
+    for kwargs in [dict(), dict(nthread=3), dict(outfile=outfile),
+                   dict(outfile=outfile, nthread=2)]:
+        hdulist = merge_utils.merge_hpx_counts_cubes(files, **kwargs)
+        m = HpxMap.create_from_hdulist(hdulist)
+        assert_allclose(m.counts, expected)
+        _check_gti(hdulist, 15, 75.)
+        assert hdulist['GTI'].header['TSTOP'] == 450.
+        assert hdulist[0].header['DATE-END'] == '2020-01-05'
+        hdulist.close()
+
+    fits.open(outfile).verify('exception')
+    # Temporary files are removed
+    assert sorted(os.listdir(str(tmpdir))) == sorted(
+        [os.path.basename(f) for f in files + [outfile]])
+
+
+@pytest.mark.parametrize('shape,dtype,bzero', [((4, 10, 12), 'f4', None),
+                                               ((10, 12), 'i4', None),
+                                               ((4, 10, 12), 'i2', 10)])
+def test_merge_wcs_counts_cubes(tmpdir, shape, dtype, bzero):
+
+    rng = np.random.RandomState(1)
+    cols = [fits.Column('CHANNEL', 'I', array=np.arange(1, 5)),
+            fits.Column('E_MIN', 'E', array=np.arange(4.)),
+            fits.Column('E_MAX', 'E', array=np.arange(1., 5.))]
+    hdu_ebounds = fits.BinTableHDU.from_columns(cols, name='EBOUNDS')
+    files = []
+    expected = np.zeros(shape)
+    for i in range(4):
+        hdu = fits.PrimaryHDU(rng.poisson(3.0, shape).astype(dtype))
+        hdu.header['CTYPE1'] = 'GLON-CAR'
+        hdu.header['DATE-END'] = '2020-01-%02i' % (i + 1)
+        if bzero is not None:
+            hdu.scale('int16', bzero=bzero)
+        files += [str(tmpdir.join('ccube_%02i.fits' % i))]
+        fits.HDUList([hdu, hdu_ebounds,
+                      _make_gti_hdu(100. * i, i + 1)]).writeto(files[-1])
+        expected += fits.getdata(files[-1])
+
+    outfile = str(tmpdir.join('ccube.fits'))
+    for kwargs in [dict(), dict(nthread=3), dict(outfile=outfile),
+                   dict(outfile=outfile, nthread=2)]:
+        hdulist = merge_utils.merge_wcs_counts_cubes(files, **kwargs)
+        assert_allclose(hdulist[0].data, expected)
+        assert hdulist[0].header['CTYPE1'] == 'GLON-CAR'
+        assert hdulist[0].header['DATE-END'] == '2020-01-04'
+        _check_gti(hdulist, 10, 50.)
+        hdulist.close()
+
+    fits.open(outfile).verify('exception')
+    with pytest.raises(OSError):
+        merge_utils.merge_wcs_counts_cubes(files, outfile=outfile,
+                                           clobber=False)
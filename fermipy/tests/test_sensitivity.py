@@ -92,6 +92,78 @@ def test_calc_int_flux_sensitivity(create_diffuse_dir):
 
 
 
+@requires_file(galdiff_path)
+def test_calc_flux_sensitivity_map(create_diffuse_dir):
+
+    ltc = LTCube.create_from_obs_time(3.1536E8)
+    c = SkyCoord([10.0, 10.0, 120.0], [10.0, -30.0, 60.0],
+                 unit='deg', frame='galactic')
+    ebins = 10**np.linspace(2.0, 5.0, 8 * 3 + 1)
+
+    gdiff = Map.create_from_fits(galdiff_path)
+    iso = np.loadtxt(os.path.expandvars('$FERMI_DIFFUSE_DIR/iso_P8R3_SOURCE_V3_v1.txt'),
+                     unpack=True)
+    scalc = SensitivityCalc(gdiff, iso, ltc, ebins,
+                            'P8R3_SOURCE_V3', [['FRONT', 'BACK']])
+
+    fn = spectrum.PowerLaw([1E-13, -2.0], scale=1E3)
+    o = scalc.diff_flux_threshold_map(c, fn, 25.0, 3.0, chunk_size=2)
+    assert o['flux'].shape == (3, 24)
+    for i in range(3):
+        oi = scalc.diff_flux_threshold(c[i], fn, 25.0, 3.0)
+        assert_allclose(o['flux'][i], oi['flux'], rtol=1E-6)
+        assert_allclose(o['npred'][i], oi['npred'], rtol=1E-6)
+
+    o = scalc.int_flux_threshold_map(c, fn, 25.0, 3.0, nthread=2)
+    assert o['flux'].shape == (3,)
+    for i in range(3):
+        oi = scalc.int_flux_threshold(c[i], fn, 25.0, 3.0)
+        assert_allclose(o['flux'][i], oi['flux'], rtol=1E-6)
+
+
+def test_calc_flux_sensitivity_map_synthetic():
+
+    # Small synthetic diffuse model and livetime cube such that no
+    # diffuse model files are needed
+    ltc = LTCube.create_from_obs_time(3.1536E8, nside=8)
+    ebins = 10**np.linspace(2.0, 5.0, 4 * 3 + 1)
+    gdiff_ebins = 10**np.linspace(1.5, 5.5, 9)
+    gdiff = Map.create(SkyCoord(0.0, 0.0, unit='deg', frame='galactic'),
+                       10.0, (36, 18), 'GAL', 'CAR', ebins=gdiff_ebins)
+    lat = np.linspace(-85., 85., 18)
+    gdiff.data[...] = (1E-3 * (gdiff._ectr / 100.)**-2.7)[:, None, None] * \
+        (1.0 + 10.0 * np.exp(-lat**2 / 50.))[None, :, None]
+    iso = np.vstack((gdiff_ebins, 1E-5 * (gdiff_ebins / 100.)**-2.3))
+    c = SkyCoord([10.0, 10.0, 120.0, 250.0], [1.0, -30.0, 60.0, -75.0],
+                 unit='deg', frame='galactic')
+
+    scalc = SensitivityCalc(gdiff, iso, ltc, ebins,
+                            'P8R3_SOURCE_V3', [['FRONT', 'BACK']],
+                            psf_dec_step=30.0)
+    assert scalc.psf_dec_step == 30.0
+
+    fn = spectrum.PowerLaw([1E-13, -2.0], scale=1E3)
+    for nthread in [1, 2]:
+        o = scalc.diff_flux_threshold_map(c, fn, 25.0, 3.0, chunk_size=3,
+                                          nthread=nthread)
+        assert o['flux'].shape == (4, 12)
+        assert np.all(np.isfinite(o['flux']) & (o['flux'] > 0))
+        for i in range(4):
+            oi = scalc.diff_flux_threshold(c[i], fn, 25.0, 3.0)
+            assert_allclose(o['flux'][i], oi['flux'], rtol=1E-6)
+            assert_allclose(o['npred'][i], oi['npred'], rtol=1E-6)
+
+    # The worker pool and the shared maps are reused between calls
+    pool = scalc.get_worker_pool()
+    o = scalc.int_flux_threshold_map(c, fn, 25.0, 3.0, nthread=2)
+    assert scalc.get_worker_pool() is pool
+    assert o['flux'].shape == (4,)
+    for i in range(4):
+        oi = scalc.int_flux_threshold(c[i], fn, 25.0, 3.0)
+        assert_allclose(o['flux'][i], oi['flux'], rtol=1E-6)
+    scalc.close_worker_pool()
+
+
 @requires_file(galdiff_path)
 def test_flux_sensitivity_script(create_diffuse_dir, tmpdir):
 
@@ -2,7 +2,11 @@
 from __future__ import absolute_import, division, print_function
 import numpy as np
 from numpy.testing import assert_allclose
-from fermipy.hpx_utils import HPX
+from fermipy import hpx_utils
+from fermipy.hpx_utils import HPX, HpxToWcsMapping, HPX_TO_WCS_MAPPINGS
+from fermipy.hpx_utils import make_hpx_to_wcs_mapping
+from fermipy.hpx_utils import make_hpx_to_wcs_mapping_centers
+from fermipy.file_cache import FileCache
 from fermipy.fits_utils import write_fits_image
 from fermipy.skymap import HpxMap
 
@@ -43,3 +47,80 @@ def test_hpx():
     ebins = np.logspace(2, 5, 8)
     hpx1 = HPX(2**3, False, 'GAL', region='DISK(110.,75.,10.)', ebins=ebins)
     assert_allclose(hpx1[hpx1._ipix], np.arange(len(hpx1._ipix)))
+
+
+def test_hpx_to_wcs_mapping(tmpdir):
+
+    hpx = HPX(2**4, False, 'GAL', region='DISK(110.,75.,20.)')
+    wcs = hpx.make_wcs(2)
+    ipixs, mult_val, npix = make_hpx_to_wcs_mapping(hpx, wcs.wcs,
+                                                    chunk_size=100)
+    assert len(ipixs) == npix[0] * npix[1]
+    for ipix in np.unique(ipixs):
+        m = ipixs == ipix
+        assert_allclose(mult_val[m], 1. / np.sum(m))
+
+    ipixs_c, mult_val_c, npix_c = make_hpx_to_wcs_mapping_centers(hpx, wcs.wcs)
+    assert npix_c == npix
+    assert_allclose(np.sort(ipixs_c[ipixs_c >= 0]), hpx._ipix)
+
+    file_cache = FileCache(str(tmpdir / 'cache'))
+    HPX_TO_WCS_MAPPINGS.clear()
+    mapping = HpxToWcsMapping.create(hpx, wcs, file_cache)
+    assert_allclose(mapping.ipixs, ipixs)
+    assert_allclose(mapping.mult_val, mult_val)
+    assert HpxToWcsMapping.create(hpx, wcs, file_cache) is mapping
+
+    # Reload the mapping from disk
+    HPX_TO_WCS_MAPPINGS.clear()
+    mapping2 = HpxToWcsMapping.create(hpx, wcs, file_cache)
+    assert mapping2 is not mapping
+    assert_allclose(mapping2.ipixs, mapping.ipixs)
+    assert_allclose(mapping2.mult_val, mapping.mult_val)
+    assert_allclose(mapping2.lmap, mapping.lmap)
+
+    filename = str(tmpdir / 'mapping.fits')
+    mapping.write_to_fitsfile(filename)
+    mapping3 = HpxToWcsMapping.create_from_fitsfile(filename)
+    assert mapping3.hpx.region == hpx.region
+    assert tuple(mapping3.npix) == tuple(mapping.npix)
+    assert_allclose(mapping3.lmap, mapping.lmap)
+    assert_allclose(mapping3.mult_val, mapping.mult_val)
+
+
+def test_hpx_to_wcs_mapping_cache(monkeypatch):
+
+    hpxs = [HPX(2**4, False, 'GAL', region='DISK(110.,75.,%i.)' % r)
+            for r in [10, 15, 20]]
+    wcss = [hpx.make_wcs(2) for hpx in hpxs]
+
+    # Mappings are not cached if the cache is disabled
+    HPX_TO_WCS_MAPPINGS.clear()
+    mapping = HpxToWcsMapping.create(hpxs[0], wcss[0], use_cache=False)
+    assert len(HPX_TO_WCS_MAPPINGS) == 0
+    assert HpxToWcsMapping.create(hpxs[0], wcss[0],
+                                  use_cache=False) is not mapping
+    hpx_map = HpxMap(np.ones(hpxs[0].npix), hpxs[0])
+    hpx_map.make_wcs_from_hpx(use_cache=False)
+    assert len(HPX_TO_WCS_MAPPINGS) == 0
+
+    # The least recently used mappings are dropped when the cache
+    # exceeds its size
+    mappings = [HpxToWcsMapping.create(hpx, wcs)
+                for hpx, wcs in zip(hpxs, wcss)]
+    assert len(HPX_TO_WCS_MAPPINGS) == 3
+    HPX_TO_WCS_MAPPINGS.clear()
+    maxsize = mappings[1].nbytes + mappings[2].nbytes
+    monkeypatch.setattr(hpx_utils, 'HPX_TO_WCS_MAPPINGS_MAXSIZE', maxsize)
+    for hpx, wcs in zip(hpxs, wcss):
+        HpxToWcsMapping.create(hpx, wcs)
+    assert list(HPX_TO_WCS_MAPPINGS.keys()) == [
+        hpx_utils.make_hpx_to_wcs_mapping_key(hpx, wcs)
+        for hpx, wcs in zip(hpxs[1:], wcss[1:])]
+    assert sum(m.nbytes for m in HPX_TO_WCS_MAPPINGS.values()) <= maxsize
+
+    # Mappings larger than the cache are not stored
+    monkeypatch.setattr(hpx_utils, 'HPX_TO_WCS_MAPPINGS_MAXSIZE', 0)
+    HPX_TO_WCS_MAPPINGS.clear()
+    HpxToWcsMapping.create(hpxs[0], wcss[0])
+    assert len(HPX_TO_WCS_MAPPINGS) == 0
@@ -0,0 +1,27 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose
+from fermipy.worker_pool import WorkerPool
+
+
+def _sum_rows(rows, data, scale=1.0):
+    return scale * np.sum(data[rows])
+
+
+def test_worker_pool():
+
+    data = np.random.uniform(size=(40, 10))
+    tasks = [slice(i, i + 4) for i in range(0, 40, 4)]
+    expected = [np.sum(data[t]) for t in tasks]
+
+    for nthread in [1, 2]:
+        pool = WorkerPool(nthread)
+        handle = pool.share(data) if nthread > 1 else data
+        assert_allclose(pool.map(_sum_rows, tasks, data=handle), expected)
+
+        # Pool is reused for a second call with a new shared array
+        handle = pool.share(2.0 * data) if nthread > 1 else 2.0 * data
+        assert_allclose(pool.map(_sum_rows, tasks, data=handle, scale=0.5),
+                        expected)
+        pool.close()
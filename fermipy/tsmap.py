@@ -6,6 +6,9 @@ import logging
 import itertools
 import functools
 import json
+import hashlib
+import shutil
+import socket
 from multiprocessing import Pool
 import numpy as np
 import warnings
@@ -642,6 +645,501 @@ def _ts_value_newton(position, counts, bkg, model, C_0_map):
     return (C_0 - C_1) * np.sign(amplitude), amplitude, niter
 
 
+def _fit_amplitude_newton_batch(counts, bkg, model, index, msum,
+                                tol=1E-4):
+    """Vectorized version of `_fit_amplitude_newton` that fits the
+    amplitude of the test source for a batch of pixels at once.  The
+    input arrays contain the elements with nonzero counts of the
+    kernel windows of all pixels in the batch.  Pixels are iterated
+    until they individually satisfy the convergence criterion.
+
+    Parameters
+    ----------
+    counts : `~numpy.ndarray`
+        Counts of each window element.
+    bkg : `~numpy.ndarray`
+        Background of each window element.
+    model : `~numpy.ndarray`
+        Test source model of each window element.
+    index : `~numpy.ndarray`
+        Index of the pixel to which each window element belongs.
+    msum : `~numpy.ndarray`
+        Sum of the test source model over the window of each pixel
+        (including elements with zero counts).
+
+    Returns
+    -------
+    norm : `~numpy.ndarray`
+        Best-fit amplitude for each pixel.
+    niter : `~numpy.ndarray`
+        Number of iterations for each pixel.
+    """
+    npix = len(msum)
+    norm = np.zeros(npix)
+    niter = np.zeros(npix, dtype=int)
+    active = np.ones(npix, dtype=bool)
+
+    for iiter in range(1, MAX_NITER):
+
+        r = model / (bkg + norm[index] * model)
+        w = counts * r
+        grad = msum - np.bincount(index, w, minlength=npix)
+        hess = np.bincount(index, w * r, minlength=npix)
+        niter[active] = iiter
+
+        if iiter == 1:
+            active &= (grad <= 0) & (hess > 0)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = grad / hess
+        edm = delta * grad
+        norm[active] = np.maximum(0, norm[active] - delta[active])
+        active &= (edm >= tol)
+
+        if not np.any(active):
+            break
+
+        m = active[index]
+        if np.count_nonzero(m) < 0.5 * len(m):
+            counts = counts[m]
+            bkg = bkg[m]
+            model = model[m]
+            index = index[m]
+
+    return norm, niter
+
+
+def _pad_kernel_cube(data, kernel_shape):
+    """Zero-pad the spatial dimensions of a map cube such that the
+    kernel window of every map pixel is contained inside the padded
+    cube (see `~fermipy.utils.overlap_slices`)."""
+    pad = [(0, 0)] + [(s // 2, s - s // 2 - 1) for s in kernel_shape[1:]]
+    return np.pad(data, pad, mode='constant')
+
+
+def _kernel_window_sum(image, kernel_shape):
+    """Sum a 2D map over the kernel window of every pixel with a
+    summed-area table."""
+    ny, nx = kernel_shape[1:]
+    s = np.zeros((image.shape[0] + ny, image.shape[1] + nx))
+    s[1:, 1:] = np.cumsum(np.cumsum(_pad_kernel_cube(image[None, ...],
+                                                     kernel_shape)[0],
+                                    axis=0), axis=1)
+    return s[ny:, nx:] - s[:-ny, nx:] - s[ny:, :-nx] + s[:-ny, :-nx]
+
+
+def _kernel_overlap_sum(kernel, shape):
+    """Sum a kernel over the part that overlaps with a map of the
+    given spatial shape when it is centered on every pixel of the
+    map."""
+    ny, nx = kernel.shape[1:]
+    s = np.zeros((ny + 1, nx + 1))
+    s[1:, 1:] = np.cumsum(np.cumsum(np.sum(kernel, axis=0), axis=0), axis=1)
+    y = np.arange(shape[0])
+    x = np.arange(shape[1])
+    ylo = np.clip(ny // 2 - y, 0, ny)[:, None]
+    yhi = np.clip(shape[0] - y + ny // 2, 0, ny)[:, None]
+    xlo = np.clip(nx // 2 - x, 0, nx)[None, :]
+    xhi = np.clip(shape[1] - x + nx // 2, 0, nx)[None, :]
+    return s[yhi, xhi] - s[ylo, xhi] - s[yhi, xlo] + s[ylo, xlo]
+
+
+def _make_pixel_blocks(xyrange, nelem, max_elements=2**22):
+    """Split a rectangular pixel range into blocks of pixel rows such
+    that no block contains more than ``max_elements`` kernel elements.
+
+    Parameters
+    ----------
+    xyrange : list
+        List of x and y pixel ranges.
+    nelem : int
+        Number of kernel elements per pixel.
+    max_elements : int
+        Maximum number of kernel elements per block.
+
+    Returns
+    -------
+    blocks : list
+        List of (yslice, xslice) tuples.
+    """
+    xmin, xmax = xyrange[0][0], xyrange[0][-1] + 1
+    ymin, ymax = xyrange[1][0], xyrange[1][-1] + 1
+    npix_max = max(max_elements // max(nelem, 1), 1)
+    dx = min(xmax - xmin, npix_max)
+    dy = max(npix_max // dx, 1)
+
+    blocks = []
+    for y in range(ymin, ymax, dy):
+        for x in range(xmin, xmax, dx):
+            blocks += [(slice(y, min(y + dy, ymax)),
+                        slice(x, min(x + dx, xmax)))]
+    return blocks
+
+
+def _ts_values_newton_batch(block, counts, bkg, model, C_0, bkg_sum,
+                            model_sum):
+    """
+    Compute TS values for a block of pixels with the batched newton
+    solver.  This gives the same result as calling `_ts_value_newton`
+    for every pixel of the block.  Only the elements of the kernel
+    windows with nonzero counts are used in the fit.
+
+    Parameters
+    ----------
+    block : tuple
+        Tuple of (yslice, xslice) defining the pixel block.
+
+    counts : list
+        List of count cubes padded with `_pad_kernel_cube`.
+
+    bkg : list
+        List of padded background cubes.
+
+    model : list
+        List of source model kernels.
+
+    C_0 : `~numpy.ndarray`
+        Null-hypothesis cash statistic summed over the kernel window
+        of every pixel.
+
+    bkg_sum : `~numpy.ndarray`
+        Background summed over the kernel window of every pixel.
+
+    model_sum : `~numpy.ndarray`
+        Source model summed over the part of the kernel overlapping
+        with the map for every pixel.
+
+    Returns
+    -------
+    ts : `~numpy.ndarray`
+        TS values for the pixels in the block.
+
+    amp : `~numpy.ndarray`
+        Best-fit amplitude of the test source.
+
+    niter : `~numpy.ndarray`
+        Number of fit iterations.
+    """
+    yslice, xslice = block
+    shape = (yslice.stop - yslice.start, xslice.stop - xslice.start)
+
+    # Map from pixels of the block extended by the kernel size to
+    # pixel indices in the block
+    ky = max([m.shape[1] for m in model])
+    kx = max([m.shape[2] for m in model])
+    ext_shape = (shape[0] + 2 * (ky - 1), shape[1] + 2 * (kx - 1))
+    lut = np.full(ext_shape, -1)
+    lut[ky - 1:ky - 1 + shape[0], kx - 1:kx - 1 + shape[1]] = \
+        np.arange(shape[0] * shape[1]).reshape(shape)
+    lut = lut.ravel()
+
+    index = []
+    counts_ = []
+    bkg_ = []
+    model_ = []
+    for c, b, m in zip(counts, bkg, model):
+
+        # Pair each element with nonzero counts with all pixels whose
+        # kernel window contains it
+        ne, ny, nx = m.shape
+        c = c[:, yslice.start:yslice.stop + ny - 1,
+              xslice.start:xslice.stop + nx - 1]
+        ie, iy, ix = np.nonzero(c)
+        dy, dx = np.divmod(np.arange(ny * nx), nx)
+        idx = ((iy + ky - 1) * ext_shape[1] + ix + kx - 1)[:, None] - \
+            (dy * ext_shape[1] + dx)[None, :]
+        idx = lut[idx.ravel()]
+        keep = idx >= 0
+
+        b = b[:, yslice.start:yslice.stop + ny - 1,
+              xslice.start:xslice.stop + nx - 1]
+        index += [idx[keep]]
+        counts_ += [np.repeat(c[ie, iy, ix], ny * nx)[keep]]
+        bkg_ += [np.repeat(b[ie, iy, ix], ny * nx)[keep]]
+        model_ += [m.reshape((ne, -1))[ie].ravel()[keep]]
+
+    index = np.concatenate(index)
+    counts_ = np.concatenate(counts_)
+    bkg_ = np.concatenate(bkg_)
+    model_ = np.concatenate(model_)
+    C_0 = C_0[block]
+    bkg_sum = bkg_sum[block]
+    model_sum = model_sum[block]
+
+    amplitude, niter = _fit_amplitude_newton_batch(counts_, bkg_, model_,
+                                                   index, model_sum.ravel())
+    amplitude = amplitude.reshape(shape)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mu = bkg_ + amplitude.flat[index] * model_
+        C_1 = 2.0 * (bkg_sum + amplitude * model_sum)
+        C_1 -= 2.0 * np.bincount(index, counts_ * np.log(mu),
+                                 minlength=C_1.size).reshape(shape)
+
+    ts = (C_0 - C_1) * np.sign(amplitude)
+    return ts, amplitude, niter.reshape(shape)
+
+
+def _make_tiles(xyrange, tile_size):
+    """Split a rectangular pixel range into square tiles.
+
+    Parameters
+    ----------
+    xyrange : list
+        List of x and y pixel ranges.
+    tile_size : int
+        Width of the tiles in pixels.
+
+    Returns
+    -------
+    tiles : list
+        List of x and y pixel ranges for every tile.
+    """
+    xmin, xmax = xyrange[0][0], xyrange[0][-1] + 1
+    ymin, ymax = xyrange[1][0], xyrange[1][-1] + 1
+
+    tiles = []
+    for y in range(ymin, ymax, tile_size):
+        for x in range(xmin, xmax, tile_size):
+            tiles += [[range(x, min(x + tile_size, xmax)),
+                       range(y, min(y + tile_size, ymax))]]
+    return tiles
+
+
+class TSMapCheckpoint(object):
+    """On-disk checkpoint of a TS map that is computed in spatial
+    tiles.  The TS and amplitude values of every finished tile are
+    written to a separate numpy file that is renamed into place once
+    it is complete, such that processes (or batch jobs on different
+    hosts) sharing the checkpoint directory never write to the same
+    file.  Tiles are claimed by creating a lock file.  The tiles of a
+    calculation are stored in a subdirectory named after ``key`` and
+    the tiling, such that calculations with different inputs never
+    share or delete each other's tiles.
+
+    Parameters
+    ----------
+    path : str
+        Checkpoint directory.
+    shape : tuple
+        Spatial shape of the map.
+    tiles : list
+        List of tiles (see `_make_tiles`).
+    key : str
+        Hash of the inputs of the TS map calculation.
+    """
+
+    def __init__(self, path, shape, tiles, key):
+
+        self._shape = tuple(shape)
+        self._tiles = tiles
+
+        meta = {'key': key, 'shape': list(shape),
+                'tiles': [[t[0][0], t[0][-1] + 1, t[1][0], t[1][-1] + 1]
+                          for t in tiles]}
+        h = hashlib.sha1(json.dumps(meta, sort_keys=True).encode())
+        self._path = os.path.join(path, h.hexdigest()[:16])
+        utils.mkdir(self._path)
+
+        metafile = os.path.join(self._path, 'tiles.json')
+        if not os.path.isfile(metafile):
+            tmpfile = self._tmp_name(metafile)
+            with open(tmpfile, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmpfile, metafile)
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def tiles(self):
+        return self._tiles
+
+    @property
+    def ntiles_done(self):
+        return len([i for i in range(len(self._tiles)) if self.is_done(i)])
+
+    def _tile_file(self, itile, ext):
+        return os.path.join(self._path, 'tile_%05i.%s' % (itile, ext))
+
+    @staticmethod
+    def _tmp_name(filename):
+        return '%s.%s.%i.tmp' % (filename, socket.gethostname(), os.getpid())
+
+    def _tile_slice(self, itile):
+        xr, yr = self._tiles[itile]
+        return (slice(yr[0], yr[-1] + 1), slice(xr[0], xr[-1] + 1))
+
+    def is_done(self, itile):
+        return os.path.isfile(self._tile_file(itile, 'npz'))
+
+    def claim(self, itile):
+        """Claim a tile.  Returns False if the tile was already
+        claimed by another process."""
+        try:
+            os.close(os.open(self._tile_file(itile, 'lock'),
+                             os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return False
+        return True
+
+    def write(self, itile, ts, amp):
+        """Write the pixels of a tile from the TS and amplitude maps
+        to the tile file, which marks the tile as finished."""
+        tslice = self._tile_slice(itile)
+        filename = self._tile_file(itile, 'npz')
+        tmpfile = self._tmp_name(filename)
+        with open(tmpfile, 'wb') as f:
+            np.savez(f, ts=ts[tslice], amp=amp[tslice])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpfile, filename)
+
+    def read(self):
+        """Assemble the TS and amplitude maps from the finished tiles.
+        Pixels of unfinished tiles are set to zero.
+
+        Returns
+        -------
+        ts : `~numpy.ndarray`
+            TS map.
+        amp : `~numpy.ndarray`
+            Amplitude map.
+        """
+        ts = np.zeros(self._shape)
+        amp = np.zeros(self._shape)
+        for i in range(len(self._tiles)):
+            if not self.is_done(i):
+                continue
+            tslice = self._tile_slice(i)
+            with np.load(self._tile_file(i, 'npz')) as f:
+                ts[tslice] = f['ts']
+                amp[tslice] = f['amp']
+        return ts, amp
+
+    def remove(self):
+        """Delete the tiles of this calculation.  The checkpoint
+        directory is deleted as well if it is then empty."""
+        shutil.rmtree(self._path, ignore_errors=True)
+        try:
+            os.rmdir(os.path.dirname(self._path))
+        except OSError:
+            pass
+
+
+def _make_ts_values_batch(counts, bkg, model, C_0_map, xyrange, nthread=1,
+                          pool=None, checkpoint=None):
+    """Compute the TS and amplitude maps over a rectangular pixel
+    range with the batched newton solver.
+
+    Parameters
+    ----------
+    counts : list
+        List of count cubes (one per analysis component).
+    bkg : list
+        List of background cubes.
+    model : list
+        List of source model kernels.
+    C_0_map : list
+        List of null-hypothesis cash statistic cubes.
+    xyrange : list
+        List of x and y pixel ranges.
+    nthread : int
+        Number of processes.  If None one process will be created for
+        each available core.
+    pool : `~fermipy.worker_pool.WorkerPool`
+        Persistent worker pool.  If given the input cubes are passed
+        to the worker processes through shared memory and ``nthread``
+        is ignored.
+    checkpoint : `TSMapCheckpoint`
+        Compute the map tile by tile and store every finished tile in
+        this checkpoint.  Tiles that are already finished are
+        skipped.  Unclaimed tiles are processed first followed by
+        unfinished tiles claimed by other processes.
+
+    Returns
+    -------
+    ts_values : `~numpy.ndarray`
+        TS map with the spatial shape of the count cubes.  Pixels
+        outside of ``xyrange`` are set to zero.
+    amp_values : `~numpy.ndarray`
+        Amplitude map.
+    """
+    shape = counts[0].shape[1:]
+    ts_values = np.zeros(shape)
+    amp_values = np.zeros(shape)
+
+    C_0 = np.zeros(shape)
+    bkg_sum = np.zeros(shape)
+    model_sum = np.zeros(shape)
+    for c, b, m, c0 in zip(counts, bkg, model, C_0_map):
+        C_0 += _kernel_window_sum(np.sum(c0, axis=0), m.shape)
+        bkg_sum += _kernel_window_sum(np.sum(b, axis=0), m.shape)
+        model_sum += _kernel_overlap_sum(m, shape)
+
+    arrays = dict(counts=[_pad_kernel_cube(c, m.shape)
+                          for c, m in zip(counts, model)],
+                  bkg=[_pad_kernel_cube(b, m.shape)
+                       for b, m in zip(bkg, model)],
+                  C_0=C_0, bkg_sum=bkg_sum, model_sum=model_sum)
+
+    nelem = sum([m.size for m in model])
+    mp_pool = None
+    if pool is None and (nthread is None or nthread > 1):
+        mp_pool = Pool(processes=nthread)
+    elif pool is not None and pool.nthread > 1:
+        arrays = {k: ([pool.share(t) for t in v] if isinstance(v, list)
+                      else pool.share(v)) for k, v in arrays.items()}
+
+    def fill(xyrange):
+        if pool is not None and pool.nthread > 1:
+            # Use several blocks per process for load balancing
+            npix = len(xyrange[0]) * len(xyrange[1])
+            max_elements = min(2**22,
+                               max(npix * nelem // (4 * pool.nthread), 1))
+            blocks = _make_pixel_blocks(xyrange, nelem, max_elements)
+        else:
+            blocks = _make_pixel_blocks(xyrange, nelem)
+
+        if pool is not None:
+            results = pool.map(_ts_values_newton_batch, blocks, model=model,
+                               **arrays)
+        else:
+            wrap = functools.partial(_ts_values_newton_batch, model=model,
+                                     **arrays)
+            if mp_pool is not None:
+                results = mp_pool.map(wrap, blocks)
+            else:
+                results = map(wrap, blocks)
+
+        for block, r in zip(blocks, results):
+            ts_values[block] = r[0]
+            amp_values[block] = r[1]
+
+    try:
+        if checkpoint is None:
+            fill(xyrange)
+        else:
+            for steal in [False, True]:
+                for i, tile in enumerate(checkpoint.tiles):
+                    if checkpoint.is_done(i):
+                        continue
+                    if not steal and not checkpoint.claim(i):
+                        continue
+                    fill(tile)
+                    checkpoint.write(i, ts_values, amp_values)
+            ts_values, amp_values = checkpoint.read()
+    finally:
+        if mp_pool is not None:
+            mp_pool.close()
+            mp_pool.join()
+        if pool is not None and pool.nthread > 1:
+            pool.release(list(arrays.values()))
+
+    return ts_values, amp_values
+
+
 class TSMapGenerator(object):
     """Mixin class for `~fermipy.gtanalysis.GTAnalysis` that
     generates TS maps."""
@@ -751,6 +1249,34 @@ class TSMapGenerator(object):
         hdus[1].header['CONFIG'] = json.dumps(data['config'])
         fits_utils.write_hdus(hdus, filename)
 
+    def _make_tsmap_checkpoint(self, name, counts, bkg, model, xyrange,
+                               engine, **kwargs):
+        """Create the checkpoint of a tiled TS map.  The checkpoint is
+        identified by a hash of the count, background and test source
+        cubes as well as the pixel range and engine such that a
+        restarted (or concurrent) call with the same inputs resumes
+        from the finished tiles.  If ``checkpoint_dir`` is None the
+        checkpoint is created in the output directory and removed once
+        the map is complete."""
+        tiles = _make_tiles(xyrange, kwargs['tile_size'])
+
+        h = hashlib.sha1()
+        for x in counts + bkg + model:
+            h.update(str(x.shape).encode())
+            h.update(np.ascontiguousarray(x).tobytes())
+        h.update(engine.encode())
+
+        path = kwargs.get('checkpoint_dir', None)
+        if path is None:
+            path = utils.format_filename(self.outdir, 'tsmap_tiles',
+                                         prefix=[name])
+
+        checkpoint = TSMapCheckpoint(path, counts[0].shape[1:], tiles,
+                                     h.hexdigest())
+        self.logger.info('TS map checkpoint %s: %i of %i tiles finished.',
+                         path, checkpoint.ntiles_done, len(tiles))
+        return checkpoint
+
     def _make_tsmap_fast(self, prefix, **kwargs):
         """
         Make a TS map from a GTAnalysis instance.  This is a
@@ -778,6 +1304,12 @@ class TSMapGenerator(object):
         max_kernel_radius = kwargs.get('max_kernel_radius')
         loge_bounds = kwargs.setdefault('loge_bounds', None)
         use_pylike = kwargs.setdefault('use_pylike', True)
+        engine = kwargs.setdefault('engine', 'batch')
+        tile_size = kwargs.setdefault('tile_size', None)
+
+        if tile_size is not None and engine != 'batch':
+            raise ValueError('Tiled TS maps are not supported by the %s '
+                             'engine.' % engine)
 
         if loge_bounds:
             if len(loge_bounds) != 2:
@@ -872,10 +1404,6 @@ class TSMapGenerator(object):
         ts_values = np.zeros(self.npix[::-1])
         amp_values = np.zeros(self.npix[::-1])
 
-        wrap = functools.partial(_ts_value_newton, counts=counts,
-                                 bkg=bkg, model=model,
-                                 C_0_map=c0_map)
-
         if kwargs['map_skydir'] is not None:
 
             map_offset = wcs_utils.skydir_to_pix(kwargs['map_skydir'],
@@ -906,25 +1434,48 @@ class TSMapGenerator(object):
             xslice = slice(0, self.npix[0])
             yslice = slice(0, self.npix[1])
 
-        positions = []
-        for j, i in itertools.product(xyrange[1], xyrange[0]):
-            p = [[k // 2, j, i] for k in enumbins]
-            positions += [p]
-
         self.logger.log(loglevel, 'Fitting test source.')
-        if multithread:
-            pool = Pool()
-            results = pool.map(wrap, positions)
-            pool.close()
-            pool.join()
-        else:
-            results = map(wrap, positions)
+        if engine == 'batch':
+            pool = (self.get_worker_pool(kwargs.get('nthread'))
+                    if multithread else None)
+            checkpoint = None
+            if tile_size is not None:
+                checkpoint = self._make_tsmap_checkpoint(
+                    utils.join_strings([prefix, modelname]), counts, bkg,
+                    model, xyrange, engine, **kwargs)
+            ts_values, amp_values = _make_ts_values_batch(
+                counts, bkg, model, c0_map, xyrange,
+                pool=pool, checkpoint=checkpoint)
+            # The default checkpoint is only kept to resume an
+            # interrupted calculation
+            if checkpoint is not None and kwargs.get('checkpoint_dir') is None:
+                checkpoint.remove()
+        elif engine == 'scalar':
+
+            wrap = functools.partial(_ts_value_newton, counts=counts,
+                                     bkg=bkg, model=model,
+                                     C_0_map=c0_map)
+
+            positions = []
+            for j, i in itertools.product(xyrange[1], xyrange[0]):
+                p = [[k // 2, j, i] for k in enumbins]
+                positions += [p]
+
+            if multithread:
+                pool = Pool(processes=kwargs.get('nthread'))
+                results = pool.map(wrap, positions)
+                pool.close()
+                pool.join()
+            else:
+                results = map(wrap, positions)
 
-        for i, r in enumerate(results):
-            ix = positions[i][0][2]
-            iy = positions[i][0][1]
-            ts_values[iy, ix] = r[0]
-            amp_values[iy, ix] = r[1]
+            for i, r in enumerate(results):
+                ix = positions[i][0][2]
+                iy = positions[i][0][1]
+                ts_values[iy, ix] = r[0]
+                amp_values[iy, ix] = r[1]
+        else:
+            raise ValueError('Unrecognized TS map engine: %s' % engine)
 
         ts_values = ts_values[yslice, xslice]
         amp_values = amp_values[yslice, xslice]
@@ -0,0 +1,191 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Persistent pool of worker processes that exchanges large input
+arrays through shared memory instead of pickling them for every task.
+"""
+from __future__ import absolute_import, division, print_function
+import os
+import functools
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+# Shared memory blocks attached in the current process (keyed by name)
+_ATTACHED = {}
+# Names of the shared memory blocks created by the current process
+_OWNED = set()
+
+
+def _attach_shared_memory(name):
+    """Attach to an existing shared memory block.  The block is owned
+    and unlinked by the process that created it.  Worker processes
+    share the resource tracker of the parent process so registering
+    the block again in older python versions is harmless."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _detach(keep):
+    """Close all attached shared memory blocks that are not owned by
+    this process and not in ``keep``."""
+    for name in list(_ATTACHED.keys()):
+        if name in keep or name in _OWNED:
+            continue
+        try:
+            _ATTACHED.pop(name).close()
+        except BufferError:
+            pass
+
+
+class SharedArray(object):
+    """Picklable handle to a numpy array stored in a shared memory
+    block.  Use `~fermipy.worker_pool.WorkerPool.share` to create
+    one."""
+
+    def __init__(self, name, shape, dtype):
+        self._name = name
+        self._shape = tuple(shape)
+        self._dtype = np.dtype(dtype).str
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def shape(self):
+        return self._shape
+
+    def array(self):
+        """Return a numpy view of the shared array.  The shared memory
+        block is attached on first access in every process."""
+        shm = _ATTACHED.get(self._name)
+        if shm is None:
+            shm = _attach_shared_memory(self._name)
+            _ATTACHED[self._name] = shm
+        return np.ndarray(self._shape, dtype=self._dtype, buffer=shm.buf)
+
+
+def resolve_shared(value):
+    """Replace `SharedArray` handles in ``value`` (which can also be a
+    list or tuple of handles) with numpy views of the shared arrays."""
+    if isinstance(value, SharedArray):
+        return value.array()
+    elif isinstance(value, (list, tuple)):
+        return type(value)([resolve_shared(v) for v in value])
+    return value
+
+
+def _shared_names(value):
+    if isinstance(value, SharedArray):
+        return set([value.name])
+    elif isinstance(value, (list, tuple)):
+        return set().union(*[_shared_names(v) for v in value])
+    return set()
+
+
+def _run_task(task, fn, kwargs):
+    _detach(_shared_names(list(kwargs.values())))
+    kwargs = {k: resolve_shared(v) for k, v in kwargs.items()}
+    return fn(task, **kwargs)
+
+
+class WorkerPool(object):
+    """Persistent pool of worker processes.
+
+    The pool is created on the first call to `map` and reused by
+    subsequent calls.  Large arrays should be registered with `share`
+    which copies them into shared memory.  The returned `SharedArray`
+    handles can be passed as keyword arguments to `map` and are
+    resolved to numpy arrays in the worker processes without copying
+    the data.
+
+    Parameters
+    ----------
+    nthread : int
+        Number of worker processes.  If None one process will be
+        created for each available core.
+    """
+
+    def __init__(self, nthread=None):
+        self._nthread = nthread if nthread is not None else os.cpu_count()
+        self._pool = None
+        self._shm = {}
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def nthread(self):
+        return self._nthread
+
+    def share(self, data):
+        """Copy an array into shared memory.
+
+        Parameters
+        ----------
+        data : `~numpy.ndarray`
+            Input array.
+
+        Returns
+        -------
+        handle : `SharedArray`
+            Picklable handle to the shared array.
+        """
+        data = np.ascontiguousarray(data)
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=max(data.nbytes, 1))
+        np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)[...] = data
+        self._shm[shm.name] = shm
+        _ATTACHED[shm.name] = shm
+        _OWNED.add(shm.name)
+        return SharedArray(shm.name, data.shape, data.dtype)
+
+    def release(self, handles=None):
+        """Free shared arrays.
+
+        Parameters
+        ----------
+        handles : list
+            List of `SharedArray` handles.  If None all arrays shared
+            through this pool will be freed.
+        """
+        if handles is None:
+            names = list(self._shm.keys())
+        else:
+            names = _shared_names(list(handles))
+
+        for name in names:
+            shm = self._shm.pop(name, None)
+            if shm is None:
+                continue
+            _ATTACHED.pop(name, None)
+            _OWNED.discard(name)
+            try:
+                shm.close()
+            except BufferError:
+                pass
+            shm.unlink()
+
+    def map(self, fn, tasks, **kwargs):
+        """Evaluate ``fn(task, **kwargs)`` for every element of
+        ``tasks`` and return the results in order.  `SharedArray`
+        handles in ``kwargs`` are resolved to numpy arrays before
+        calling ``fn``."""
+        wrap = functools.partial(_run_task, fn=fn, kwargs=kwargs)
+        if self._nthread <= 1:
+            return list(map(wrap, tasks))
+
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(processes=self._nthread)
+        return self._pool.map(wrap, tasks, chunksize=1)
+
+    def close(self):
+        """Free all shared arrays and shut down the worker
+        processes."""
+        self.release()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
@@ -89,6 +89,7 @@ setup(
         'fermipy-fit-diffuse-sg = fermipy.diffuse.fitting:FitDiffuse_SG.main',
         'fermipy-job-archive = fermipy.jobs.job_archive:main_browse',
         'fermipy-file-archive = fermipy.jobs.file_archive:main_browse',
+        'fermipy-convert-archive = fermipy.jobs.sqlite_archive:main_convert',
         'fermipy-prepare-targets = fermipy.jobs.prepare_targets:PrepareTargets.main',
         'fermipy-analyze-roi = fermipy.jobs.target_analysis:AnalyzeROI.main',
         'fermipy-analyze-roi-sg = fermipy.jobs.target_analysis:AnalyzeROI_SG.main',